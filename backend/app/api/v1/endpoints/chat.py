@@ -1,18 +1,65 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect, HTTPConnection
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
 from uuid import UUID
-from app.schemas.chat import ChatRequest, ChatResponse, ChatMessage
-from app.services.conversation import handle_chat_request, get_conversation, create_conversation, get_all_conversation_ids
+import asyncio
+import json
+import os
+from app.core.config import settings
+from app.schemas.chat import ChatRequest, ChatResponse, ChatMessage, ConversationCacheStats, ConversationPage, ResponseCacheStats, SemanticCacheStats, CoalescingStats, ModelTierStats, ModelTieringStats, TierLatencyStats
+from app.services.admission import FORWARDED_FOR_HEADER, AdmissionRejected, admission_key, get_admission_controller, retry_after_header
+from app.services.batch import BatchCheckpoint, run_batch
+from app.services.conversation import handle_chat_request, get_conversation, get_conversation_messages as fetch_conversation_messages, create_conversation, export_conversations, get_all_conversation_ids, list_conversations, stream_chat_request
+from app.services.model_tiering import all_tier_stats
+from app.services.response_cache import get_response_cache
+from app.services.semantic_cache import get_semantic_cache
+from app.services.single_flight import get_single_flight
+from app.services.store import get_conversation_cache_stats
+from app.services.streaming import DuplexStreamingResponse, iter_lines, relay_until_disconnected
 
 router = APIRouter()
 
 
+def _admission_key(connection: HTTPConnection) -> str:
+    """リクエストの利用者のキー（受付制御の単位）。本文の値やクライアントが選べるヘッダーは使わない"""
+    return admission_key(
+        connection.client.host if connection.client else None,
+        connection.headers.get(FORWARDED_FOR_HEADER),
+        connection.headers.get(settings.ADMISSION_USER_HEADER) if settings.ADMISSION_USER_HEADER else None,
+        settings.ADMISSION_TRUSTED_PROXY_HOPS,
+    )
+
+
+async def _admit(request: ChatRequest, connection: HTTPConnection) -> None:
+    """
+    受付制御を通す。上限に達している場合は AdmissionRejected を送出する
+    """
+    controller = get_admission_controller()
+    if controller is None:
+        return
+    cost = await controller.estimate_tokens(request.message, request.conversation_id is not None)
+    await controller.admit(_admission_key(connection), cost)
+
+
+def _too_many_requests(message: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=429, detail=message, headers=retry_after_header(retry_after))
+
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest) -> ChatResponse:
+async def chat(request: ChatRequest, http_request: Request) -> ChatResponse:
     """
     チャットメッセージを処理し、AIの応答と会話履歴を返す
     会話IDが提供されていない場合は新しい会話を自動的に作成する
+    混雑時は 429（Retry-After 付き）を返す
     """
+    try:
+        await _admit(request, http_request)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e.message, e.retry_after)
+
     try:
         # メッセージ処理
         response = await handle_chat_request(
@@ -20,37 +67,351 @@ async def chat(request: ChatRequest) -> ChatResponse:
             conversation_id=request.conversation_id,
             metadata=request.metadata
         )
+        if response.get("retry_after") is not None:
+            # LLMの混雑・上流のレート制限
+            raise _too_many_requests(response["message"], response["retry_after"])
         
-        # 会話の取得（最新の状態）
-        conversation = await get_conversation(response["conversation_id"])
+        # レスポンスに含めるメッセージの決定
+        new_messages = response["new_messages"]
+        if request.since_message_id:
+            # 指定されたメッセージ以降の差分のみを返す
+            messages = await fetch_conversation_messages(
+                response["conversation_id"], after=request.since_message_id
+            )
+        elif not request.include_history:
+            messages = new_messages
+        else:
+            # 会話の取得（最新の状態）
+            conversation = await get_conversation(response["conversation_id"])
+            messages = conversation.messages
         
         return ChatResponse(
             message=response["message"],
             conversation_id=response["conversation_id"],
-            messages=conversation.messages,
-            metadata=response.get("metadata")
+            messages=messages,
+            metadata=response.get("metadata"),
+            cursor=new_messages[-1].id
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"チャット処理中にエラーが発生しました: {str(e)}")
 
 
+def _format_sse(event: Dict[str, Any]) -> str:
+    """イベントをServer-Sent Events形式に変換する"""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request) -> StreamingResponse:
+    """
+    チャットメッセージを処理し、AIの応答をServer-Sent Eventsでトークン単位に返す
+    クライアントが切断した場合はLLMの呼び出しを中断する
+    混雑時はストリームを開始せずに 429（Retry-After 付き）を返す
+    """
+    try:
+        await _admit(request, http_request)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e.message, e.retry_after)
+
+    async def wait_for_disconnect() -> None:
+        while True:
+            message = await http_request.receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def event_stream():
+        events = stream_chat_request(
+            message=request.message,
+            conversation_id=request.conversation_id,
+            metadata=request.metadata
+        )
+        async for event in relay_until_disconnected(events, wait_for_disconnect):
+            yield _format_sse(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/chat/batch")
+async def chat_batch(
+    http_request: Request,
+    concurrency: Optional[int] = Query(None, ge=1, description="同時に処理するリクエスト数"),
+    job_id: Optional[str] = Query(
+        None, pattern=r"^[A-Za-z0-9_-]{1,64}$", description="ジョブID。同じIDで再実行すると完了済みのリクエストを飛ばす"
+    ),
+) -> StreamingResponse:
+    """
+    JSONL（1行に1リクエスト）のチャットリクエストをまとめて処理し、結果を完了した順にJSONLで返す
+    本文は届いた行から処理するため、アップロードの完了を待たずに結果を返し始める
+    最終行には件数・スループットなどの統計情報を返す
+    レート制限はバッチ全体で1リクエストとして数え、各リクエストはトークン予算の空きを待って処理する
+    """
+    controller = get_admission_controller()
+    key = _admission_key(http_request)
+    if controller is not None:
+        try:
+            controller.check_rate(key)
+        except AdmissionRejected as e:
+            raise _too_many_requests(e.message, e.retry_after)
+    concurrency = min(concurrency or settings.BATCH_DEFAULT_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY)
+    checkpoint = (
+        BatchCheckpoint(os.path.join(settings.BATCH_CHECKPOINT_DIR, f"{job_id}.checkpoint")) if job_id else None
+    )
+    # 本文は届いた行から処理し、全体をメモリに読み込まない
+    body_read = asyncio.Event()
+    body_disconnected = False
+
+    async def read_lines():
+        nonlocal body_disconnected
+        try:
+            async for line in iter_lines(http_request.stream()):
+                yield line
+        except ClientDisconnect:
+            body_disconnected = True
+        finally:
+            body_read.set()
+
+    async def wait_for_disconnect() -> None:
+        # 本文を読み終わるまでは receive() を本文の読み込みに使う（その間の切断は ClientDisconnect で分かる）
+        await body_read.wait()
+        if body_disconnected:
+            return
+        while True:
+            message = await http_request.receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def result_stream():
+        try:
+            rows = run_batch(read_lines(), concurrency, checkpoint, admission_key=key)
+            async for row in relay_until_disconnected(rows, wait_for_disconnect):
+                yield row.model_dump_json() + "\n"
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    return DuplexStreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
+@router.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket) -> None:
+    """
+    WebSocketでチャットメッセージを受け取り、AIの応答をトークン単位で返す
+    ストリーミング中に `{"type": "cancel"}` を受け取るか切断された場合はLLMの呼び出しを中断する
+    ストリーミング中に届いたそれ以外のメッセージは、現在の応答の end の後に届いた順に処理する
+    混雑時は retry_after（秒）を含む error イベントを返す
+    """
+    await websocket.accept()
+    # ストリーミング中に届いた cancel 以外のメッセージ（現在の応答の後に届いた順に処理する）
+    queued: Deque[str] = deque()
+    try:
+        while True:
+            text = queued.popleft() if queued else await websocket.receive_text()
+            try:
+                request = ChatRequest(**json.loads(text))
+            except (ValueError, TypeError) as e:
+                await websocket.send_json({"type": "error", "message": f"リクエストが不正です: {str(e)}"})
+                continue
+
+            try:
+                await _admit(request, websocket)
+            except AdmissionRejected as e:
+                await websocket.send_json({"type": "error", "message": e.message, "retry_after": e.retry_after})
+                continue
+
+            disconnected = False
+
+            async def wait_for_cancel() -> None:
+                nonlocal disconnected
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        disconnected = True
+                        return
+                    text = message.get("text")
+                    if text is None:
+                        continue
+                    try:
+                        is_cancel = json.loads(text).get("type") == "cancel"
+                    except (ValueError, AttributeError):
+                        is_cancel = False
+                    if is_cancel:
+                        return
+                    queued.append(text)
+
+            events = stream_chat_request(
+                message=request.message,
+                conversation_id=request.conversation_id,
+                metadata=request.metadata
+            )
+            async for event in relay_until_disconnected(events, wait_for_cancel):
+                await websocket.send_json(event)
+
+            if disconnected:
+                return
+    except WebSocketDisconnect:
+        return
+
+
 # 不要なエンドポイント（get_conversation_by_id）を削除
 
 
 @router.get("/conversations/{conversation_id}/messages", response_model=List[ChatMessage])
-async def get_conversation_messages(conversation_id: UUID) -> List[ChatMessage]:
+async def get_conversation_messages(
+    conversation_id: UUID,
+    after: Optional[UUID] = Query(None, description="このメッセージIDより後のメッセージのみを返す"),
+    before: Optional[UUID] = Query(None, description="このメッセージIDより前のメッセージのみを返す"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="取得する最大件数（beforeのみ指定時は新しい側から数える）"),
+) -> List[ChatMessage]:
     """
     指定された会話のメッセージを取得する
     """
-    conversation = await get_conversation(conversation_id)
-    if not conversation:
+    messages = await fetch_conversation_messages(conversation_id, after=after, limit=limit, before=before)
+    if messages is None:
         raise HTTPException(status_code=404, detail=f"ID {conversation_id} の会話が見つかりません")
-    return conversation.messages
+    return messages
 
 
 @router.get("/conversations", response_model=List[UUID])
 async def get_all_conversations() -> List[UUID]:
     """
-    メモリに保存されている全ての会話IDを取得する
+    保存されている全ての会話IDを取得する（ページ単位で取得する場合は /conversations/page）
     """
     return await get_all_conversation_ids()
+
+
+@router.get("/conversations/page", response_model=ConversationPage)
+async def get_conversation_page(
+    limit: int = Query(50, ge=1, le=1000, description="1ページの最大件数"),
+    cursor: Optional[str] = Query(None, description="前のページの next_cursor。省略した場合は最新の会話から返す"),
+    updated_since: Optional[datetime] = Query(None, description="この日時以降に更新された会話のみを返す"),
+    updated_until: Optional[datetime] = Query(None, description="この日時より前に更新された会話のみを返す"),
+) -> ConversationPage:
+    """
+    会話を更新日時の新しい順にページ単位で取得する
+    次のページは同じ条件で cursor に next_cursor を指定して取得する
+    """
+    try:
+        return await list_conversations(limit, cursor, updated_since, updated_until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/conversations/export")
+async def export_all_conversations(
+    updated_since: Optional[datetime] = Query(None, description="この日時以降に更新された会話のみを書き出す"),
+    updated_until: Optional[datetime] = Query(None, description="この日時より前に更新された会話のみを書き出す"),
+) -> StreamingResponse:
+    """
+    会話とメッセージをNDJSONで書き出す
+    各会話の行（type=conversation）の後に、その会話のメッセージの行（type=message）が古い順に続く
+    """
+    return StreamingResponse(
+        export_conversations(updated_since, updated_until),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'},
+    )
+
+
+@router.get("/conversations/cache/stats", response_model=ConversationCacheStats)
+async def get_conversation_cache_statistics() -> ConversationCacheStats:
+    """
+    会話キャッシュのヒット・ミス・追い出し件数とメモリ使用量を取得する
+    """
+    stats = get_conversation_cache_stats()
+    if stats is None:
+        return ConversationCacheStats(enabled=False)
+    return ConversationCacheStats(enabled=True, **vars(stats))
+
+
+@router.get("/cache/stats", response_model=ResponseCacheStats)
+async def get_response_cache_statistics() -> ResponseCacheStats:
+    """
+    LLM応答キャッシュのヒット率と、ヒットにより省けたLLM呼び出し時間の推定値を取得する
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return ResponseCacheStats(enabled=False)
+    stats = response_cache.stats
+    return ResponseCacheStats(
+        enabled=True,
+        hits=stats.hits,
+        misses=stats.misses,
+        stores=stats.stores,
+        hit_rate=stats.hit_rate,
+        estimated_saved_seconds=stats.estimated_saved_seconds,
+    )
+
+
+@router.get("/cache/semantic/stats", response_model=SemanticCacheStats)
+async def get_semantic_cache_statistics() -> SemanticCacheStats:
+    """
+    セマンティック応答キャッシュのヒット率と登録件数を取得する
+    """
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is None:
+        return SemanticCacheStats(enabled=False)
+    stats = semantic_cache.stats
+    return SemanticCacheStats(
+        enabled=True,
+        hits=stats.hits,
+        misses=stats.misses,
+        inserts=stats.inserts,
+        expirations=stats.expirations,
+        entries=len(semantic_cache.index),
+        hit_rate=stats.hit_rate,
+    )
+
+
+@router.get("/coalescing/stats", response_model=CoalescingStats)
+async def get_coalescing_statistics() -> CoalescingStats:
+    """
+    実行中の同じ質問に合流したLLM呼び出しの件数を取得する
+    """
+    stats = get_single_flight().snapshot()
+    return CoalescingStats(
+        enabled=settings.SINGLE_FLIGHT_ENABLED,
+        leaders=stats.leaders,
+        coalesced=stats.coalesced,
+        errors=stats.errors,
+        cancelled=stats.cancelled,
+        in_flight=stats.in_flight,
+        coalesce_rate=stats.coalesce_rate,
+    )
+
+
+@router.get("/tiers/stats", response_model=ModelTieringStats)
+async def get_model_tiering_statistics() -> ModelTieringStats:
+    """
+    ロールごとの主モデル・予備モデルの勝率、ヘッジ要求の割合、最初のトークンまでの時間を取得する
+    """
+    return ModelTieringStats(
+        enabled=bool(settings.LLM_MODEL_TIERS or settings.LLM_FALLBACK_MODEL),
+        tiers=[
+            ModelTierStats(
+                role=stats.tier.role,
+                primary=stats.tier.primary,
+                fallback=stats.tier.fallback,
+                first_token_budget_ms=stats.tier.first_token_budget * 1000,
+                requests=stats.requests,
+                hedged=stats.hedged,
+                hedges_skipped=stats.hedges_skipped,
+                failovers=stats.failovers,
+                primary_wins=stats.primary_wins,
+                fallback_wins=stats.fallback_wins,
+                failures=stats.failures,
+                primary_errors=stats.primary_errors,
+                fallback_errors=stats.fallback_errors,
+                hedge_rate=stats.hedge_rate,
+                primary_win_rate=stats.primary_win_rate,
+                fallback_win_rate=stats.fallback_win_rate,
+                latency={winner: TierLatencyStats(**latency.summary()) for winner, latency in stats.latency.items()},
+            )
+            for stats in all_tier_stats()
+        ],
+    )
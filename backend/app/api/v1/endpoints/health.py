@@ -1,12 +1,34 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from app.schemas.health import HealthResponse
+from app.services.agent import is_agent_graph_ready
+from app.services.history import is_token_counter_ready
 
 router = APIRouter()
 
 
-@router.get("", response_model=HealthResponse)
+@router.get("", response_model=HealthResponse, response_model_exclude_none=True)
 async def health_check() -> dict:
     """
     Health check endpoint to verify API is running
     """
     return {"status": "ok"}
+
+
+@router.get("/live", response_model=HealthResponse, response_model_exclude_none=True)
+async def liveness() -> dict:
+    """
+    プロセスがリクエストに応答できるかどうか（起動中の準備を待たずに200を返す）
+    """
+    return {"status": "ok"}
+
+
+@router.get("/ready", response_model=HealthResponse, responses={503: {"model": HealthResponse}})
+async def readiness():
+    """
+    リクエストを処理する準備ができているかどうか（エージェントグラフの作成とトークンカウンターの読み込みが終わるまでは503を返す）
+    """
+    checks = {"agent_graph": is_agent_graph_ready(), "token_counter": is_token_counter_ready()}
+    if not all(checks.values()):
+        return JSONResponse(status_code=503, content={"status": "starting", "checks": checks})
+    return {"status": "ready", "checks": checks}
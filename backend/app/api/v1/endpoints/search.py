@@ -0,0 +1,25 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from app.schemas.search import SearchResponse
+from app.services.search import get_conversation_search
+
+router = APIRouter()
+
+
+@router.get("", response_model=SearchResponse)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200, description="検索語。空白で区切った語をすべて含むメッセージを返す"),
+    since: Optional[datetime] = Query(None, description="この日時以降のメッセージのみを対象とする"),
+    until: Optional[datetime] = Query(None, description="この日時より前のメッセージのみを対象とする"),
+    role: Optional[str] = Query(None, description="user / assistant のいずれかのメッセージのみを対象とする"),
+    limit: int = Query(20, ge=1, le=100, description="返す最大件数"),
+    group_by_conversation: bool = Query(False, description="Trueの場合、会話ごとに最もスコアの高いメッセージのみを返す"),
+) -> SearchResponse:
+    """
+    会話のメッセージを全文検索し、BM25のスコアの高い順に返す
+    """
+    search = get_conversation_search()
+    if search is None:
+        raise HTTPException(status_code=404, detail="全文検索は無効です（SEARCH_ENABLED=false）")
+    return await search.search(q, limit, since, until, role, group_by_conversation)
@@ -1,8 +1,9 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import health, chat
+from app.api.v1.endpoints import health, chat, search
 
 api_router = APIRouter()
 
 # Include routers from different endpoints
 api_router.include_router(health.router, prefix="/health", tags=["health"])
 api_router.include_router(chat.router, prefix="/chat", tags=["chat"])
+api_router.include_router(search.router, prefix="/search", tags=["search"])
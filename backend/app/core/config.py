@@ -1,5 +1,6 @@
 from pydantic import Field
 from pydantic_settings import BaseSettings
+from typing import Any, Dict, Optional
 import os
 from dotenv import load_dotenv
 
@@ -19,6 +20,149 @@ class Settings(BaseSettings):
     # OpenAI設定
     OPENAI_API_KEY: str = Field(default="", env="OPENAI_API_KEY")
     OPENAI_MODEL_NAME: str = "gpt-4o"
+    # OpenAI互換APIのエンドポイント（ローカルのスタブサーバー等を使う場合に指定）
+    OPENAI_API_BASE: Optional[str] = None
+    
+    # LLM呼び出しの同時実行制御（モデルごと）
+    LLM_MAX_CONCURRENCY: int = 32
+    LLM_MAX_QUEUE_SIZE: int = 256
+    LLM_QUEUE_TIMEOUT: float = 30.0
+    
+    # LLMに渡す会話履歴の設定
+    HISTORY_TOKEN_BUDGET: int = 2000
+    HISTORY_MAX_MESSAGES: int = 50
+    HISTORY_TOKEN_CACHE_SIZE: int = 100_000
+    HISTORY_SUMMARY_ENABLED: bool = True
+    
+    # 会話要約のバックグラウンド処理の設定
+    SUMMARY_WORKERS: int = 2
+    SUMMARY_QUEUE_SIZE: int = 1000
+    SUMMARY_TRIGGER_MESSAGES: int = 20
+    SUMMARY_KEEP_RECENT: int = 10
+    
+    # LLMクライアントの設定（接続プール・タイムアウト・リトライ）
+    LLM_HTTP_MAX_CONNECTIONS: int = 100
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    LLM_HTTP2: bool = False
+    LLM_REQUEST_TIMEOUT: float = 60.0
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_MAX_RETRIES: int = 2
+    LLM_RETRY_BACKOFF_INITIAL: float = 0.5
+    LLM_RETRY_BACKOFF_MAX: float = 8.0
+    # ロールごとのモデル名（未指定のロールは OPENAI_MODEL_NAME）
+    LLM_ROLE_MODELS: Dict[str, str] = {}
+    
+    # モデルの階層化（ロールごとの主モデル・予備モデルと、最初のトークンまでの時間の予算）
+    # 例: {"response_generation": {"primary": "gpt-4o", "fallback": "gpt-4o-mini", "first_token_budget_ms": 1500}}
+    # 主モデルが予算内に最初のトークンを返さない場合は予備モデルにも同じ要求を送り、先に返した方を使う
+    LLM_MODEL_TIERS: Dict[str, Dict[str, Any]] = {}
+    # LLM_MODEL_TIERS に無いロールにも使う予備モデル（未指定の場合、LLM_MODEL_TIERS に無いロールは階層化しない）
+    LLM_FALLBACK_MODEL: Optional[str] = None
+    # first_token_budget_ms を省略した場合の予算（ミリ秒）
+    LLM_FIRST_TOKEN_BUDGET_MS: float = 2000.0
+    
+    # ITスキル専門家とキャリアカウンセラーの判断を並列に実行するマルチエキスパート構成
+    AGENT_MULTI_EXPERT_ENABLED: bool = False
+    # 専門家のブランチのタイムアウト（秒）。超えた場合はその結果を使わずに回答する
+    AGENT_BRANCH_TIMEOUT: float = 10.0
+    
+    # 相談の要否をローカル分類器で判断し、確信度がこの値未満の場合のみLLMに判断させる
+    PRE_ROUTER_ENABLED: bool = True
+    PRE_ROUTER_CONFIDENCE: float = 0.7
+    
+    # 実行中の同じ質問のLLM呼び出しを合流させるかどうか
+    SINGLE_FLIGHT_ENABLED: bool = True
+    
+    # 受付制御（利用者ごとのレート制限と、全体のトークン予算の重み付き公平キューイング）
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_USER_RATE_PER_MINUTE: float = 60.0
+    ADMISSION_USER_BURST: int = 20
+    # 1分あたりのLLMトークン数の予算（0の場合は制限しない）
+    ADMISSION_TOKENS_PER_MINUTE: int = 0
+    # 1リクエストの応答に見込むトークン数
+    ADMISSION_COMPLETION_TOKENS: int = 500
+    ADMISSION_MAX_WAIT: float = 10.0
+    ADMISSION_MAX_QUEUE_SIZE: int = 1000
+    # 利用者は ADMISSION_USER_HEADER（認証を行うプロキシが設定するヘッダー。空の場合は使わない）の値か、
+    # クライアントのIPアドレスで識別する。前段のプロキシの段数を ADMISSION_TRUSTED_PROXY_HOPS に指定すると
+    # X-Forwarded-For からIPアドレスを取り出す（各プロキシが末尾にアドレスを追加する場合のみ指定する）
+    ADMISSION_USER_HEADER: str = ""
+    ADMISSION_TRUSTED_PROXY_HOPS: int = 0
+    # 利用者のキーごとの重み（例: {"user:nightly-qa": 0.2}）。既定は1.0
+    ADMISSION_USER_WEIGHTS: Dict[str, float] = {}
+    ADMISSION_MAX_TRACKED_USERS: int = 100_000
+    
+    # バッチ処理の設定
+    BATCH_DEFAULT_CONCURRENCY: int = 8
+    BATCH_MAX_CONCURRENCY: int = 32
+    BATCH_CHECKPOINT_DIR: str = "data/batch"
+    
+    # ログ設定（WARNING未満のログは LOG_SAMPLE_RATE の割合だけ出力する）
+    LOG_LEVEL: str = "INFO"
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_QUEUE_SIZE: int = 10000
+    
+    # メトリクス・トレースの設定（トレースには opentelemetry-api が必要）
+    METRICS_ENABLED: bool = True
+    TRACING_ENABLED: bool = False
+    
+    # ワーカープロセス数（2以上の場合は会話ストアをプロセス間で共有するため sqlite が必要）
+    WORKERS: int = 1
+    
+    # 会話ストア設定（memory / sqlite / jsonl）
+    CONVERSATION_STORE_BACKEND: str = "memory"
+    CONVERSATION_SQLITE_PATH: str = "data/conversations.db"
+    CONVERSATION_JSONL_DIR: str = "data/conversations"
+    CONVERSATION_JSONL_SEGMENT_MAX_BYTES: int = 64 * 1024 * 1024
+    CONVERSATION_STORE_BATCH_SIZE: int = 100
+    CONVERSATION_STORE_BATCH_INTERVAL: float = 0.01
+    
+    # 会話キャッシュ設定（LRU + TTL）
+    CONVERSATION_CACHE_ENABLED: bool = True
+    CONVERSATION_CACHE_MAX_ENTRIES: int = 10000
+    CONVERSATION_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    CONVERSATION_CACHE_TTL_SECONDS: float = 24 * 60 * 60
+    # Trueの場合、永続ストアへの書き込みを追い出し時・終了時にまとめて行う
+    CONVERSATION_CACHE_WRITE_BACK: bool = False
+    
+    # エージェントのチェックポイント設定（none / memory / sqlite）
+    # 会話ごとのグラフの状態を保存し、次のターンは保存した状態から再開する
+    AGENT_CHECKPOINT_BACKEND: str = "none"
+    AGENT_CHECKPOINT_SQLITE_PATH: str = "data/checkpoints.db"
+    # 会話ごとに残すチェックポイント数（古いものから削除する）
+    AGENT_CHECKPOINT_KEEP: int = 1
+    # 最後の更新からこの秒数が経過した会話のチェックポイントを削除する（0の場合は削除しない）
+    AGENT_CHECKPOINT_TTL_SECONDS: float = 7 * 24 * 60 * 60
+    # チェックポイントを保存する会話数の上限（超えた場合は更新の古い会話から削除する。0の場合は上限なし）
+    AGENT_CHECKPOINT_MAX_THREADS: int = 10000
+    # メッセージ列の差分をこの回数続けて保存したら、次は全体を保存する
+    AGENT_CHECKPOINT_MAX_DELTA_CHAIN: int = 32
+    
+    # 会話の全文検索の設定（文字bigramの転置インデックス + BM25）
+    # インデックスは全会話のメッセージをプロセス内に持つ（会話ストア・キャッシュの追い出しとは連動しない）ため、既定は無効
+    SEARCH_ENABLED: bool = False
+    SEARCH_BM25_K1: float = 1.2
+    SEARCH_BM25_B: float = 0.75
+    # WORKERS が2以上の場合、他のワーカーが追加したメッセージを検索の前にこの秒数ごとに取り込む
+    SEARCH_SYNC_INTERVAL_SECONDS: float = 5.0
+    
+    # LLM応答キャッシュ設定（memory / sqlite）
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_BACKEND: str = "memory"
+    RESPONSE_CACHE_SQLITE_PATH: str = "data/response_cache.db"
+    RESPONSE_CACHE_MAX_ENTRIES: int = 10000
+    RESPONSE_CACHE_TTL_SECONDS: float = 24 * 60 * 60
+    
+    # セマンティック応答キャッシュ設定（埋め込み: hashing / openai）
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_EMBEDDER: str = "hashing"
+    SEMANTIC_CACHE_DIM: int = 512
+    SEMANTIC_CACHE_THRESHOLD: float = 0.85
+    SEMANTIC_CACHE_CAPACITY: int = 10000
+    SEMANTIC_CACHE_TTL_SECONDS: float = 24 * 60 * 60
+    # 指定した場合はベクトルをメモリマップファイルに保存する
+    SEMANTIC_CACHE_PATH: Optional[str] = None
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,89 @@
+"""
+ログ設定
+
+アプリケーションのログ（"app" 以下のロガー）は QueueHandler でキューに積むだけにし、
+出力は別スレッドの QueueListener が行う。リクエストの処理中に標準エラー出力への書き込みを待たない。
+
+- WARNING未満のログは LOG_SAMPLE_RATE の割合だけ出力する（1.0で全件）
+- キューが LOG_QUEUE_SIZE 件を超えた場合は新しいログを捨て、捨てた件数を数える
+- アプリケーションの終了時に shutdown_logging() でキューに残ったログを書き出す
+"""
+import logging
+import logging.handlers
+import queue
+import random
+from typing import Optional
+from app.core.config import settings
+
+LOGGER_NAME = "app"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class SamplingFilter(logging.Filter):
+    """WARNING未満のログを一定の割合だけ通す"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """キューがいっぱいの場合は待たずにログを捨てる"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging() -> None:
+    """
+    "app" ロガーにキュー経由の非同期ハンドラーを設定する（2回目以降の呼び出しは何もしない）
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(settings.LOG_LEVEL.upper())
+    logger.handlers = [queue_handler]
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """
+    キューに残ったログを書き出し、出力スレッドを止める
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        logging.getLogger(LOGGER_NAME).handlers = []
+        logging.getLogger(LOGGER_NAME).propagate = True
+
+
+def dropped_log_count() -> int:
+    """キューがいっぱいで捨てたログの件数"""
+    handlers = logging.getLogger(LOGGER_NAME).handlers
+    return sum(getattr(handler, "dropped", 0) for handler in handlers)
@@ -1,6 +1,55 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from app.api.v1.router import api_router
 from app.core.config import settings
+from app.core.logging import setup_logging, shutdown_logging
+from app.services.admission import close_admission_controller
+from app.services.agent import start_agent_graph_build
+from app.services.checkpoint import close_checkpointer
+from app.services.history import start_token_counter_load
+from app.services.llm_registry import close_llm_registry
+from app.services.metrics import render_metrics
+from app.services.response_cache import close_response_cache
+from app.services.search import close_conversation_search, get_conversation_search
+from app.services.semantic_cache import close_semantic_cache
+from app.services.store import close_conversation_store, get_conversation_store
+from app.services.summary_worker import close_summary_worker, get_summary_worker
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """
+    アプリケーションの起動・終了時の処理
+    """
+    setup_logging()
+    await get_conversation_store().start()
+    get_summary_worker().start()
+    # 検索インデックスは会話ストアから別タスクで作成し、作成中も検索を受け付ける（結果の complete が false になる）
+    search = get_conversation_search()
+    if search is not None:
+        search.start()
+    # エージェントグラフは別スレッドで作成し、作成中もリクエストを受け付ける
+    # （作成が終わるまで /api/v1/health/ready は503を返し、チャットのリクエストは作成の完了を待つ）
+    start_agent_graph_build()
+    # tiktokenのエンコーディング（初回はダウンロード）も別スレッドで読み込む
+    start_token_counter_load()
+    yield
+    # 受付制御で待っているリクエストを中断する
+    await close_admission_controller()
+    # 要約ワーカーを止め、未書き込みの会話を永続化してからストアを閉じる
+    await close_summary_worker()
+    await close_conversation_search()
+    await close_conversation_store()
+    # 未書き込みのチェックポイントを書き込んでから閉じる
+    await close_checkpointer()
+    await close_response_cache()
+    await close_semantic_cache()
+    # LLM呼び出しの共有HTTPクライアントを閉じる
+    await close_llm_registry()
+    # キューに残ったログを書き出す
+    shutdown_logging()
+
 
 def create_application() -> FastAPI:
     """
@@ -13,6 +62,7 @@ def create_application() -> FastAPI:
         openapi_url=f"{settings.API_V1_STR}/openapi.json",
         docs_url=f"{settings.API_V1_STR}/docs",
         redoc_url=f"{settings.API_V1_STR}/redoc",
+        lifespan=lifespan,
     )
     
     # Include API router
@@ -28,3 +78,11 @@ async def root():
     Root endpoint that redirects to the API documentation
     """
     return {"message": "Welcome to the API. Visit /api/v1/docs for documentation"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus形式のメトリクス
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any
 from uuid import UUID, uuid4
 from datetime import datetime
 
@@ -21,6 +21,8 @@ class ChatRequest(BaseModel):
     message: str = Field(..., description="ユーザーからのメッセージ、空やデフォルト値は使用できません", example="キャリアについて相談したいです")
     conversation_id: Optional[UUID] = Field(None, description="会話ID、新規会話の場合はNull")
     metadata: Optional[Dict[str, Any]] = Field(default={}, description="追加メタデータ情報")
+    since_message_id: Optional[UUID] = Field(None, description="指定した場合、このメッセージIDより後のメッセージのみをレスポンスに含める")
+    include_history: bool = Field(True, description="Falseの場合、今回追加されたメッセージのみをレスポンスに含める")
 
 
 class ChatResponse(BaseModel):
@@ -31,6 +33,7 @@ class ChatResponse(BaseModel):
     conversation_id: UUID
     messages: Optional[List[ChatMessage]] = None
     metadata: Optional[Dict[str, Any]] = None
+    cursor: Optional[UUID] = Field(None, description="会話の最新メッセージID。次回の since_message_id に指定する")
 
 
 class Conversation(BaseModel):
@@ -42,3 +45,158 @@ class Conversation(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
+    summary: Optional[str] = Field(None, description="古いメッセージの要約")
+    summary_until: Optional[UUID] = Field(None, description="要約に含めた最後のメッセージID")
+
+
+class ConversationSummary(BaseModel):
+    """
+    会話一覧の1件（メッセージを含まない）
+    """
+    id: UUID
+    created_at: datetime
+    updated_at: datetime
+    message_count: int
+    metadata: Optional[Dict[str, Any]] = None
+
+
+class ConversationPage(BaseModel):
+    """
+    会話一覧の1ページ（更新日時順）
+    """
+    conversations: List[ConversationSummary]
+    next_cursor: Optional[str] = Field(None, description="次のページのカーソル。最後のページではNull")
+
+
+class ConversationCacheStats(BaseModel):
+    """
+    会話キャッシュの統計情報
+    """
+    enabled: bool
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+class ResponseCacheStats(BaseModel):
+    """
+    LLM応答キャッシュの統計情報
+    """
+    enabled: bool
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    hit_rate: float = 0.0
+    estimated_saved_seconds: float = 0.0
+
+
+class SemanticCacheStats(BaseModel):
+    """
+    セマンティック応答キャッシュの統計情報
+    """
+    enabled: bool
+    hits: int = 0
+    misses: int = 0
+    inserts: int = 0
+    expirations: int = 0
+    entries: int = 0
+    hit_rate: float = 0.0
+
+
+class CoalescingStats(BaseModel):
+    """
+    同じ質問のLLM呼び出しの合流（single-flight）の統計情報
+    """
+    enabled: bool
+    leaders: int = 0
+    coalesced: int = 0
+    errors: int = 0
+    cancelled: int = 0
+    in_flight: int = 0
+    coalesce_rate: float = 0.0
+
+
+class TierLatencyStats(BaseModel):
+    """
+    主モデル・予備モデルのどちらかの応答を使ったリクエストの直近のレイテンシ（ミリ秒）
+    """
+    count: int = 0
+    first_token_p50_ms: Optional[float] = None
+    first_token_p99_ms: Optional[float] = None
+    total_p50_ms: Optional[float] = None
+    total_p99_ms: Optional[float] = None
+
+
+class ModelTierStats(BaseModel):
+    """
+    ロールごとのモデルの階層化（ヘッジ要求）の統計情報
+    """
+    role: str
+    primary: str
+    fallback: str
+    first_token_budget_ms: float
+    requests: int = 0
+    hedged: int = Field(0, description="主モデルの最初のトークンが予算内に届かず、予備モデルにも要求を送った回数")
+    hedges_skipped: int = Field(0, description="予算を超えたが、予備モデルの実行枠に空きがなかったためヘッジ要求を送らなかった回数")
+    failovers: int = Field(0, description="主モデルが最初のトークンの前に失敗し、予備モデルに切り替えた回数")
+    primary_wins: int = 0
+    fallback_wins: int = 0
+    failures: int = Field(0, description="主モデル・予備モデルの両方が失敗した回数")
+    primary_errors: int = 0
+    fallback_errors: int = 0
+    hedge_rate: float = 0.0
+    primary_win_rate: float = 0.0
+    fallback_win_rate: float = 0.0
+    latency: Dict[str, TierLatencyStats] = Field(default_factory=dict, description="勝った側（primary / fallback）ごとのレイテンシ")
+
+
+class ModelTieringStats(BaseModel):
+    """
+    モデルの階層化の統計情報（これまでに使われたロールのみ）
+    """
+    enabled: bool
+    tiers: List[ModelTierStats] = Field(default_factory=list)
+
+
+class BatchChatItem(BaseModel):
+    """
+    バッチ処理の入力（JSONLの1行）
+    """
+    id: Optional[str] = Field(None, description="リクエストID。省略時は行番号。チェックポイントからの再開に使う")
+    message: str = Field(..., description="ユーザーからのメッセージ")
+    conversation_id: Optional[UUID] = Field(None, description="会話ID")
+    metadata: Optional[Dict[str, Any]] = Field(default={}, description="追加メタデータ情報（selected_role など）")
+
+
+class BatchChatResult(BaseModel):
+    """
+    バッチ処理の結果（JSONLの1行、完了した順に出力する）
+    """
+    type: Literal["result"] = "result"
+    id: str
+    line: int = Field(..., description="入力の行番号（1始まり）")
+    message: Optional[str] = None
+    conversation_id: Optional[UUID] = None
+    metadata: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    latency_ms: float = 0.0
+
+
+class BatchSummary(BaseModel):
+    """
+    バッチ処理の統計情報（JSONLの最終行）
+    """
+    type: Literal["summary"] = "summary"
+    total: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    invalid: int = 0
+    skipped: int = Field(0, description="チェックポイントで完了済みのため実行しなかった件数")
+    elapsed_seconds: float = 0.0
+    throughput: float = Field(0.0, description="1秒あたりの処理件数")
+    p50_latency_ms: float = 0.0
+    p99_latency_ms: float = 0.0
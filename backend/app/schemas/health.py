@@ -1,3 +1,4 @@
+from typing import Dict, Optional
 from pydantic import BaseModel
 
 
@@ -6,3 +7,5 @@ class HealthResponse(BaseModel):
     Schema for health check response
     """
     status: str
+    # 準備状況の確認項目ごとの結果（/health/ready のみ）
+    checks: Optional[Dict[str, bool]] = None
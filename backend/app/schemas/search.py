@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import List, Optional
+from uuid import UUID
+from pydantic import BaseModel, Field
+
+
+class SearchHit(BaseModel):
+    """
+    検索に一致したメッセージ
+    """
+    conversation_id: UUID
+    message_id: UUID
+    role: str
+    timestamp: datetime
+    score: float = Field(..., description="BM25のスコア")
+    snippet: Optional[str] = Field(None, description="一致した箇所の前後の本文")
+
+
+class SearchResponse(BaseModel):
+    """
+    会話の全文検索の結果
+    """
+    query: str
+    total: int = Field(..., description="一致したメッセージ数（group_by_conversation の場合は会話数）")
+    hits: List[SearchHit]
+    complete: bool = Field(..., description="Falseの場合、起動時のインデックス作成中のため一部の会話のみが対象")
@@ -0,0 +1,370 @@
+"""
+受付制御（アドミッションコントロール）
+
+エージェントを呼び出す前に、リクエストを受け付けるかどうかを決める。OpenAIのクォータを
+一部のクライアントが使い切って他の利用者が待たされることを防ぎ、上限を超えたリクエストは
+タイムアウトまで待たせずに 429（Retry-After 付き）ですぐに断る。
+
+- 利用者ごとのトークンバケット: 1分あたりのリクエスト数（ADMISSION_USER_RATE_PER_MINUTE）と
+  瞬間的に許すリクエスト数（ADMISSION_USER_BURST）を制限する
+- 全体のトークン予算: 1分あたりのLLMトークン数（ADMISSION_TOKENS_PER_MINUTE）を、プロンプトの長さ・
+  会話履歴の予算・応答の想定トークン数から見積もって消費する
+- 予算の空きを待つリクエストは重み付き公平キューイング（WFQ）で順番を決め、
+  大量に送る利用者がいても他の利用者のリクエストが先に進めるようにする
+- 待ち時間の見込みが ADMISSION_MAX_WAIT を超える場合は待たせずに断る
+
+利用者は信頼できる値のみで識別する。認証を行うプロキシが設定するヘッダー（ADMISSION_USER_HEADER）があればその利用者、
+なければクライアントのIPアドレス（信頼するプロキシの段数 ADMISSION_TRUSTED_PROXY_HOPS だけ X-Forwarded-For を遡る）を使う。
+クライアントが自由に選べる値（任意のヘッダー、メタデータ、会話ID）では識別しない（値を変えるだけで制限を回避できるため）。
+制限はプロセスごとに管理するため、複数ワーカーで起動した場合の全体の上限はワーカー数倍になる。
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional
+from app.core.config import settings
+from app.services.concurrency import LLMCapacityError
+from app.services.history import MESSAGE_OVERHEAD_TOKENS, load_token_counter
+from app.services.metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_REQUESTS_TOTAL, ADMISSION_WAIT_SECONDS
+
+# プロキシが追加するクライアントのIPアドレスのヘッダー
+FORWARDED_FOR_HEADER = "X-Forwarded-For"
+
+
+class AdmissionRejected(Exception):
+    """受付制御の上限に達したため、リクエストを受け付けない場合のエラー"""
+
+    def __init__(self, message: str, retry_after: float, reason: str):
+        super().__init__(message)
+        self.message = message
+        # 再試行までに待つべき秒数
+        self.retry_after = retry_after
+        # rate_limited / over_budget / queue_full
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    一定の速度でトークンが補充されるバケット
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        # 1秒あたりに補充するトークン数
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, amount: float) -> bool:
+        """amount だけトークンがあれば消費して True を返す"""
+        self._refill()
+        if self._tokens < amount:
+            return False
+        self._tokens -= amount
+        return True
+
+    def time_until(self, amount: float) -> float:
+        """amount のトークンが溜まるまでの秒数（容量を超える量は、その分を消費し終えるまでの時間）"""
+        self._refill()
+        if self._tokens >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (amount - self._tokens) / self.rate
+
+    def give_back(self, amount: float) -> None:
+        """消費したトークンを戻す"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+@dataclass
+class _UserState:
+    bucket: TokenBucket
+    # 最後にキューに入れたリクエストの仮想終了時刻（WFQ）
+    last_finish: float = 0.0
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish: float
+    seq: int
+    cost: float = field(compare=False)
+    future: "asyncio.Future[None]" = field(compare=False)
+
+
+class AdmissionController:
+    """
+    利用者ごとのレート制限と、全体のトークン予算の重み付き公平キューイングを行う
+    """
+
+    def __init__(
+        self,
+        user_rate_per_minute: float,
+        user_burst: int,
+        tokens_per_minute: int = 0,
+        max_wait: float = 10.0,
+        max_queue_size: int = 1000,
+        weights: Optional[Mapping[str, float]] = None,
+        max_tracked_users: int = 100_000,
+    ):
+        self.user_rate_per_minute = user_rate_per_minute
+        self.user_burst = user_burst
+        self.max_wait = max_wait
+        self.max_queue_size = max_queue_size
+        self.weights = dict(weights or {})
+        self.max_tracked_users = max_tracked_users
+        # トークン予算（0以下の場合は制限しない）。1分間の予算をまとめて使えるようにする
+        self.budget = (
+            TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute > 0 else None
+        )
+        self._users: "OrderedDict[str, _UserState]" = OrderedDict()
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        # WFQの仮想時刻（最後に受け付けたリクエストの仮想終了時刻）
+        self._virtual_time = 0.0
+        self._queued_cost = 0.0
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    @property
+    def queue_depth(self) -> int:
+        """予算の空きを待っているリクエスト数"""
+        return len(self._queue)
+
+    def _user(self, key: str) -> _UserState:
+        state = self._users.get(key)
+        if state is None:
+            state = _UserState(TokenBucket(self.user_rate_per_minute / 60.0, self.user_burst))
+            self._users[key] = state
+            if len(self._users) > self.max_tracked_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        return state
+
+    def check_rate(self, key: str) -> None:
+        """
+        利用者のレート制限を確認し、上限を超えている場合は AdmissionRejected を送出する
+        """
+        bucket = self._user(key).bucket
+        if not bucket.try_take(1):
+            ADMISSION_REQUESTS_TOTAL.inc(outcome="rate_limited")
+            raise AdmissionRejected(
+                "リクエストが多すぎます。しばらくしてから再度お試しください。",
+                retry_after=bucket.time_until(1),
+                reason="rate_limited",
+            )
+
+    async def acquire_budget(self, key: str, cost: float, fail_fast: bool = True) -> None:
+        """
+        全体のトークン予算から cost を確保する。空きがなければWFQの順番で待つ
+
+        fail_fast の場合、待ち行列が満杯か待ち時間の見込みが max_wait を超えるときは
+        待たずに AdmissionRejected を送出する
+        """
+        if self.budget is None:
+            ADMISSION_REQUESTS_TOTAL.inc(outcome="admitted")
+            return
+        # 1分間の予算を超える見積もりは予算いっぱいとして扱う
+        cost = min(cost, self.budget.capacity)
+        if not self._queue and self.budget.try_take(cost):
+            ADMISSION_REQUESTS_TOTAL.inc(outcome="admitted")
+            ADMISSION_WAIT_SECONDS.observe(0.0)
+            return
+
+        if fail_fast:
+            if len(self._queue) >= self.max_queue_size:
+                self._reject(key, "queue_full", self.budget.time_until(self._queued_cost + cost))
+            expected_wait = self.budget.time_until(self._queued_cost + cost)
+            if expected_wait > self.max_wait:
+                self._reject(key, "over_budget", expected_wait)
+
+        state = self._user(key)
+        weight = self.weights.get(key, 1.0)
+        state.last_finish = max(self._virtual_time, state.last_finish) + cost / weight
+        waiter = _Waiter(state.last_finish, next(self._seq), cost, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        self._queued_cost += cost
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        started = time.perf_counter()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 受け付けた直後に中断された場合は確保した予算を戻す
+                self.budget.give_back(cost)
+            raise
+        ADMISSION_REQUESTS_TOTAL.inc(outcome="admitted")
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+    def _reject(self, key: str, reason: str, retry_after: float) -> None:
+        # レート制限で消費した分は戻す（断ったリクエストで利用者の枠を減らさない）
+        state = self._users.get(key)
+        if state is not None:
+            state.bucket.give_back(1)
+        ADMISSION_REQUESTS_TOTAL.inc(outcome=reason)
+        raise AdmissionRejected(
+            "ただいま混雑しています。しばらくしてから再度お試しください。",
+            retry_after=retry_after,
+            reason=reason,
+        )
+
+    async def _dispatch(self) -> None:
+        """仮想終了時刻の早い順に、予算が空いたリクエストを受け付ける"""
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():
+                # 待っている間に中断されたリクエスト
+                self._pop()
+                continue
+            wait = self.budget.time_until(head.cost)
+            if wait > 0:
+                # 新しいリクエストが先頭に割り込む場合に備え、到着時にも起きて確認し直す
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._pop()
+            self.budget.try_take(head.cost)
+            self._virtual_time = head.finish
+            head.future.set_result(None)
+
+    def _pop(self) -> None:
+        waiter = heapq.heappop(self._queue)
+        self._queued_cost -= waiter.cost
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+
+    async def admit(self, key: str, cost: float) -> None:
+        """
+        利用者のレート制限を確認し、全体のトークン予算から cost を確保する
+        """
+        self.check_rate(key)
+        await self.acquire_budget(key, cost)
+
+    async def estimate_tokens(self, message: str, has_history: bool) -> int:
+        """
+        リクエストが使うLLMトークン数の見積もり（プロンプト + 会話履歴の予算 + 応答の想定トークン数）
+        """
+        tokens = (await load_token_counter()).count_text(message) + MESSAGE_OVERHEAD_TOKENS
+        if has_history:
+            tokens += settings.HISTORY_TOKEN_BUDGET
+        return tokens + settings.ADMISSION_COMPLETION_TOKENS
+
+    async def close(self) -> None:
+        if self._dispatcher is not None and not self._dispatcher.done():
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+        for waiter in self._queue:
+            waiter.future.cancel()
+        self._queue.clear()
+        self._queued_cost = 0.0
+        ADMISSION_QUEUE_DEPTH.set(0)
+
+
+def client_address(
+    client_host: Optional[str], forwarded_for: Optional[str] = None, trusted_hops: int = 0
+) -> Optional[str]:
+    """
+    クライアントのIPアドレス
+
+    trusted_hops が1以上の場合は、信頼するプロキシが X-Forwarded-For の末尾に追加したアドレスのうち
+    最も手前（右から trusted_hops 番目）を使う。それより左の値はクライアントが書き換えられるため使わない
+    """
+    if trusted_hops <= 0 or not forwarded_for:
+        return client_host
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    if not hops:
+        return client_host
+    # 信頼するプロキシの段数より少ない場合は、すべて信頼するプロキシが追加した値
+    return hops[-min(trusted_hops, len(hops))]
+
+
+def admission_key(
+    client_host: Optional[str] = None,
+    forwarded_for: Optional[str] = None,
+    user: Optional[str] = None,
+    trusted_hops: int = 0,
+) -> str:
+    """
+    レート制限の単位となる利用者のキー
+
+    user には認証済みの利用者（認証を行うプロキシが設定したヘッダーの値）のみを指定する
+    """
+    if user:
+        return f"user:{user}"
+    return f"client:{client_address(client_host, forwarded_for, trusted_hops) or 'unknown'}"
+
+
+def retry_after_for(error: BaseException) -> Optional[float]:
+    """
+    混雑・レート制限によるエラーであれば、再試行までに待つべき秒数を返す（それ以外はNone）
+    """
+    if isinstance(error, AdmissionRejected):
+        return error.retry_after
+    if isinstance(error, LLMCapacityError):
+        return 1.0
+    try:
+        import openai
+    except ImportError:
+        return None
+    if isinstance(error, openai.RateLimitError):
+        # 上流の Retry-After があればそれに従う
+        try:
+            return max(float(error.response.headers.get("retry-after", 1.0)), 0.0)
+        except (AttributeError, TypeError, ValueError):
+            return 1.0
+    return None
+
+
+def retry_after_header(retry_after: float) -> Dict[str, str]:
+    """Retry-After ヘッダー（秒単位の整数に切り上げる）"""
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """
+    受付制御を取得する（ADMISSION_ENABLED が無効の場合はNone）
+    """
+    global _admission_controller
+    if not settings.ADMISSION_ENABLED:
+        return None
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(
+            user_rate_per_minute=settings.ADMISSION_USER_RATE_PER_MINUTE,
+            user_burst=settings.ADMISSION_USER_BURST,
+            tokens_per_minute=settings.ADMISSION_TOKENS_PER_MINUTE,
+            max_wait=settings.ADMISSION_MAX_WAIT,
+            max_queue_size=settings.ADMISSION_MAX_QUEUE_SIZE,
+            weights=settings.ADMISSION_USER_WEIGHTS,
+            max_tracked_users=settings.ADMISSION_MAX_TRACKED_USERS,
+        )
+    return _admission_controller
+
+
+async def close_admission_controller() -> None:
+    """
+    待っているリクエストを中断し、受付制御を破棄する
+    """
+    global _admission_controller
+    if _admission_controller is not None:
+        await _admission_controller.close()
+        _admission_controller = None
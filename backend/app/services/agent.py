@@ -1,166 +1,297 @@
-from typing import Dict, List, Any, Annotated, Sequence, Literal, Optional
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langgraph.graph import END, StateGraph
+from typing import Dict, List, Any, Annotated, AsyncIterator, Sequence, Literal, Optional, Tuple
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage, RemoveMessage
 from pydantic import BaseModel, Field
+import asyncio
+import functools
 import json
+import logging
+import re
 import random
+import time
 from uuid import UUID
 from app.core.config import settings
-from app.services.prompts import CAREER_COUNSELOR_PROMPT, IT_SPECIALIST_PROMPT, RESPONSE_GENERATION_PROMPT
+from app.services.admission import retry_after_for
+from app.services.checkpoint import get_checkpointer
+from app.services.concurrency import LLMCapacityError, get_llm_limiter
+from app.services.llm_registry import get_llm_registry
+from app.services.metrics import (
+    AGENT_REQUEST_SECONDS,
+    AGENT_REQUESTS_TOTAL,
+    GRAPH_BUILD_SECONDS,
+    NODE_SECONDS,
+    stage,
+)
+from app.services.response_cache import get_response_cache, make_cache_key
+from app.services.semantic_cache import get_semantic_cache
+from app.services.single_flight import get_single_flight
+
+logger = logging.getLogger(__name__)
+
+
+def add_messages(left: List[BaseMessage], right: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    langgraph の add_messages（同じIDのメッセージは置き換え、それ以外は末尾に追加する）
+    langgraph は langchain_core のコールバック・トレース一式を読み込むため、グラフの作成時まで読み込まない
+    """
+    from langgraph.graph.message import add_messages as _add_messages
+
+    return _add_messages(left, right)
+
+
+def _branch_results(left: List[str], right: Optional[List[str]]) -> List[str]:
+    """並列ブランチの結果を連結する（Noneはターンの開始時のリセット）"""
+    if right is None:
+        return []
+    return left + right
 
 
 class AgentState(BaseModel):
     """エージェントの状態を表す型"""
-    messages: Sequence[BaseMessage] = Field(description="これまでの会話履歴")
+    # ノードは追加するメッセージだけを返し、add_messages で既存の履歴の末尾に追加する
+    messages: Annotated[List[BaseMessage], add_messages] = Field(description="これまでの会話履歴")
     context: Dict[str, Any] = Field(default_factory=dict, description="コンテキスト情報")
     it_consultation: bool = Field(default=False, description="ITスキル専門家への相談が必要かどうか")
     it_advice: str = Field(default="", description="ITスキル専門家からのアドバイス")
     next: Literal["career_counselor", "it_specialist", "response_generation"] = Field(
         default="career_counselor", description="次のノード"
     )
+    cache_hit: bool = Field(default=False, description="応答キャッシュから回答したかどうか")
+    routing_source: Optional[str] = Field(
+        default=None, description="相談の要否の判断元（keyword / model: ローカル分類器、llm: LLM）"
+    )
+    # 並列ブランチから同時に書き込まれるため、各ブランチの値を連結する
+    degraded: Annotated[List[str], _branch_results] = Field(
+        default_factory=list, description="タイムアウトやエラーで結果を使えなかったブランチ"
+    )
+
+
+# 回答を生成するLLMの温度
+LLM_TEMPERATURE = 0.7
+
+
+def _coalescing_key(message: str, role: str) -> str:
+    """同じ質問のLLM呼び出しを合流させるためのキー（正規化した質問・ロール・モデル・温度）"""
+    return make_cache_key(message, role, get_llm_registry().model_for(role), LLM_TEMPERATURE)
+
+
+def _coalescing_enabled() -> bool:
+    """
+    同じ最初の質問を合流させるかどうか
+    チェックポイントが有効な場合は、合流したリクエストの会話に状態が保存されず次のターンで再開できないため合流しない
+    """
+    return settings.SINGLE_FLIGHT_ENABLED and get_checkpointer() is None
+
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
 
 
-def create_agent_graph():
+def _parse_it_consultation(output: str) -> bool:
+    """
+    キャリアカウンセラーの判断（JSON）からITスキル専門家への相談が必要かどうかを取り出す
+    """
+    match = _JSON_OBJECT.search(output)
+    if match is None:
+        raise ValueError(f"判断結果のJSONがありません: {output[:100]}")
+    decision = json.loads(match.group(0))
+    return bool(decision["it_consultation"])
+
+
+def _split_last_user_message(messages: Sequence[BaseMessage]) -> Tuple[List[BaseMessage], str]:
+    """
+    最後のユーザーメッセージの本文と、それより前のメッセージ（会話履歴）に分ける
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            return list(messages[:index]), messages[index].content
+    return list(messages), ""
+
+
+def _timed_node(name: str, node):
+    """ノードの実行時間をメトリクスに記録するラッパー"""
+    @functools.wraps(node)
+    async def run(state: AgentState):
+        with stage(NODE_SECONDS, f"agent.node.{name}", node=name):
+            return await node(state)
+
+    return run
+
+
+def create_agent_graph(multi_expert: Optional[bool] = None, parallel_experts: bool = True):
     """
     LangGraphを使用したエージェントグラフを作成する
+
+    multi_expert が有効な場合（省略時は AGENT_MULTI_EXPERT_ENABLED）は、ITスキル専門家への
+    相談の要否の判断とITスキル専門家の回答を並列に実行し、その結果から回答を生成する。
+    parallel_experts=False の場合は判断の後、相談が必要な場合のみ専門家を呼び出してから回答を生成する（ベンチマークでの比較用）
     """
+    if multi_expert is None:
+        multi_expert = settings.AGENT_MULTI_EXPERT_ENABLED
+
     # OpenAIのAPIキーが設定されていることを確認
     if not settings.OPENAI_API_KEY or settings.OPENAI_API_KEY == "your_openai_api_key_here":
-        print("Warning: OPENAI_API_KEY is not set or is using default value. Using mock responses.")
+        logger.warning("OPENAI_API_KEY is not set or is using default value. Using mock responses.")
         return create_mock_agent_graph()
     
+    # LangGraph・プロンプトのテンプレート・出力パーサー（langchain_core のコールバック・トレース一式を読み込む）と
+    # ローカル分類器（numpy）は、アプリケーションのインポートを軽くするためグラフの作成時に読み込む
+    from langchain_core.output_parsers import StrOutputParser
+    from langgraph.graph import END, START, StateGraph
+    from app.services.pre_router import get_pre_router
+    from app.services.prompts import (
+        COUNSELOR_ROUTING_TEMPLATE,
+        DEFAULT_ROLE,
+        IT_SPECIALIST_TEMPLATE,
+        RESPONSE_GENERATION_TEMPLATE,
+        ROLE_PROMPT_TEMPLATES,
+    )
+
+    temperature = LLM_TEMPERATURE
+    # LLMはレジストリから取得する（共有の接続プールを使い、ロールごとにモデルを変えられる）
+    registry = get_llm_registry()
+    output_parser = StrOutputParser()
+
+    def build_chain(prompt, role: str):
+        return prompt | registry.get(role, temperature) | output_parser
+
     try:
-        # LLMの初期化
-        llm = ChatOpenAI(
-            model=settings.OPENAI_MODEL_NAME,
-            temperature=0.7,
-        )
+        # チェーンはグラフの作成時にロールごとに一度だけ組み立てる（プロンプトはprompts.pyのテンプレート）
+        role_chains = {role: build_chain(prompt, role) for role, prompt in ROLE_PROMPT_TEMPLATES.items()}
+        # 判断はJSONで返させるため温度0で呼び出す
+        routing_chain = COUNSELOR_ROUTING_TEMPLATE | registry.get("counselor_routing", 0) | output_parser
+        it_specialist_chain = build_chain(IT_SPECIALIST_TEMPLATE, "it_specialist")
+        response_generation_chain = build_chain(RESPONSE_GENERATION_TEMPLATE, "response_generation")
     except Exception as e:
-        print(f"Error initializing ChatOpenAI: {e}")
+        logger.error("Error initializing ChatOpenAI: %s", e)
         return create_mock_agent_graph()
-
-    # プロンプトはprompts.pyからインポート
+    
+    # 応答キャッシュ（RESPONSE_CACHE_ENABLED が無効な場合はNone）
+    response_cache = get_response_cache()
 
     # キャリアカウンセラーノードの定義
-    def career_counselor_node(state: AgentState) -> AgentState:
-        """キャリアカウンセラーの処理を行うノード"""
+    async def career_counselor_node(state: AgentState) -> Dict[str, Any]:
+        """キャリアカウンセラーの処理を行うノード（更新する項目だけを返す）"""
         messages = state.messages
         
-        # 最後のユーザーメッセージを取得
-        last_user_message = next((msg.content for msg in reversed(messages) if isinstance(msg, HumanMessage)), "")
+        # 最後のユーザーメッセージと、それより前の会話履歴を取得
+        prior_messages, last_user_message = _split_last_user_message(messages)
         
-        # コンテキストからロール情報を取得（デフォルトはキャリアカウンセラー）
-        role = state.context.get("selected_role", "career_counselor")
+        # コンテキストからロール情報を取得（未知のロールはキャリアカウンセラー）
+        role = state.context.get("selected_role", DEFAULT_ROLE)
+        if role not in role_chains:
+            role = DEFAULT_ROLE
+        model = registry.model_for(role)
         
-        # ロールに応じたプロンプトを選択
-        if role == "it_specialist":
-            system_prompt = f"""
-            あなたはITスキル専門家です。ユーザーのIT関連のキャリア相談に対して、
-            技術トレンド、必要なスキル、学習リソース、キャリアパスについて
-            具体的で実用的なアドバイスを提供してください。
-            
-            ユーザーの質問: {last_user_message}
-            """
-        else:  # デフォルトはキャリアカウンセラー
-            system_prompt = f"""
-            あなたはキャリアカウンセラーです。ユーザーのキャリア相談に対して、
-            親身に、かつ専門的な知識をもとにアドバイスを提供してください。
-            キャリア選択、転職、スキルアップ、職場の人間関係など、
-            幅広いキャリアに関する質問に対応してください。
-            
-            ユーザーの質問: {last_user_message}
-            """
+        # 応答キャッシュは会話履歴に依存しない最初の質問にのみ使う
+        use_response_cache = response_cache is not None and not prior_messages
         
-        # プロンプトの作成
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            ("human", last_user_message)
-        ])
+        # 同じ質問への応答がキャッシュされていればLLMを呼び出さずに返す
+        if use_response_cache:
+            cached = await response_cache.lookup(last_user_message, role, model, temperature)
+            if cached is not None:
+                return {"messages": [AIMessage(content=cached)], "cache_hit": True}
         
-        # LLMに質問を投げる
-        chain = prompt | llm | StrOutputParser()
-        response = chain.invoke({})
+        # LLMに質問を投げる（イベントループをブロックしないよう非同期で呼び出す）
+        chain = role_chains[role]
+        async with get_llm_limiter(model).acquire():
+            started = time.perf_counter()
+            response = await chain.ainvoke({"history": prior_messages, "input": last_user_message})
+            latency = time.perf_counter() - started
         
-        # AIメッセージを作成
-        ai_message = AIMessage(content=response)
+        if use_response_cache:
+            await response_cache.store(
+                last_user_message, role, model, temperature, response, latency
+            )
         
-        # 新しい状態を作成
-        new_state = state.model_copy()
-        new_state.messages = list(state.messages) + [ai_message]
-        new_state.next = None  # 処理終了
-        return new_state
+        # AIメッセージだけを返す（状態全体はコピーしない）
+        return {"messages": [AIMessage(content=response)]}
     
-    # # ITスキル専門家ノードの定義
-    # def it_specialist_node(state: AgentState) -> AgentState:
-    #     """ITスキル専門家の処理を行うノード"""
-    #     messages = state.messages
-        
-    #     # 最後のユーザーメッセージを取得
-    #     last_user_message = next((msg.co`ntent for msg in reversed(messages) if isinstance(msg, HumanMessage)), "")
-        
-    #     # ITスキル専門家のプロンプト作成
-    #     prompt = ChatPromptTemplate.from_messages([
-    #         ("system", IT_SPECIALIST_PROMPT),
-    #         ("human", "{input}")
-    #     ])
-        
-    #     # LLMに質問を投げる
-    #     chain = prompt | llm | StrOutputParser()
-    #     it_advice = chain.invoke({"input": last_user_message})
-        
-    #     # 新しい状態を作成
-    #     new_state = state.model_copy()
-    #     new_state.it_advice = it_advice
-    #     new_state.next = "response_generation"
-    #     return new_state
+    async def run_branch(role: str, chain, variables: Dict[str, Any]) -> str:
+        """専門家のブランチのLLM呼び出し（実行枠の待ち時間を含めて AGENT_BRANCH_TIMEOUT で打ち切る）"""
+        async def invoke() -> str:
+            async with get_llm_limiter(registry.model_for(role)).acquire():
+                return await chain.ainvoke(variables)
+
+        return await asyncio.wait_for(invoke(), timeout=settings.AGENT_BRANCH_TIMEOUT)
+    
+    # ローカル分類器（複数の専門家を使う場合のみ学習する。PRE_ROUTER_ENABLED が無効な場合はNone）
+    pre_router = get_pre_router() if multi_expert else None
+    
+    # ローカルで相談の要否を判断するノードの定義
+    async def pre_routing_node(state: AgentState) -> Dict[str, Any]:
+        """キーワード表と線形モデルで相談の要否を判断するノード（確信が持てない場合はLLMに任せる）"""
+        if pre_router is None:
+            return {"routing_source": "llm"}
+        _, last_user_message = _split_last_user_message(state.messages)
+        decision = pre_router.decide(last_user_message)
+        if decision.it_consultation is None:
+            return {"routing_source": "llm"}
+        return {"it_consultation": decision.it_consultation, "routing_source": decision.source}
+    
+    # 判断結果に応じて実行するノードを選ぶ
+    def select_branches(state: AgentState) -> List[str]:
+        if state.routing_source == "llm":
+            # LLMの判断と専門家を並列に実行する（順次実行の場合は判断から）
+            return ["counselor_routing", "it_specialist"] if parallel_experts else ["counselor_routing"]
+        return ["it_specialist"] if state.it_consultation else ["response_generation"]
+    
+    # ITスキル専門家への相談の要否を判断するノードの定義
+    async def counselor_routing_node(state: AgentState) -> Dict[str, Any]:
+        """キャリアカウンセラーがITスキル専門家への相談が必要かどうかを判断するノード"""
+        prior_messages, last_user_message = _split_last_user_message(state.messages)
+        try:
+            output = await run_branch(
+                "counselor_routing", routing_chain, {"history": prior_messages, "input": last_user_message}
+            )
+            it_consultation = _parse_it_consultation(output)
+            # 順次実行の場合は、相談が必要と判断したときだけ専門家に進む（router で選ぶ）
+            return {
+                "it_consultation": it_consultation,
+                "routing_source": "llm",
+                "next": "it_specialist" if it_consultation else "response_generation",
+            }
+        except Exception as e:
+            # 判断できなかった場合は専門家の回答があればそれを使う
+            logger.warning("相談の要否を判断できませんでした: %s: %s", type(e).__name__, e)
+            return {"degraded": ["counselor_routing"], "next": "it_specialist"}
+    
+    # ITスキル専門家ノードの定義
+    async def it_specialist_node(state: AgentState) -> Dict[str, Any]:
+        """ITスキル専門家の処理を行うノード（判断と並列に実行する）"""
+        prior_messages, last_user_message = _split_last_user_message(state.messages)
+        try:
+            it_advice = await run_branch(
+                "it_specialist", it_specialist_chain, {"history": prior_messages, "input": last_user_message}
+            )
+            return {"it_advice": it_advice}
+        except Exception as e:
+            # 専門家が遅い・失敗した場合はアドバイスなしで回答する
+            logger.warning("ITスキル専門家の回答を使えませんでした: %s: %s", type(e).__name__, e)
+            return {"degraded": ["it_specialist"]}
     
     # レスポンス生成ノードの定義
-    def response_generation_node(state: AgentState) -> AgentState:
-        """最終的な応答を生成するノード"""
+    async def response_generation_node(state: AgentState) -> Dict[str, Any]:
+        """各ブランチの結果を合わせて最終的な応答を生成するノード"""
         messages = state.messages
-        it_advice = state.it_advice
-        it_consultation = state.it_consultation
-        
-        # 最後のユーザーメッセージを取得
-        last_user_message = next((msg.content for msg in reversed(messages) if isinstance(msg, HumanMessage)), "")
-        
-        # レスポンス生成プロンプト作成
-        # システムプロンプトを直接作成
-        system_prompt = f"""
-        あなたはキャリアカウンセラーのAIアシスタントです。
-        ユーザーのキャリア相談に対して、親身に、かつ専門的な知識をもとにアドバイスを提供してください。
-        
-        ユーザーの質問: {last_user_message}
-        
-        IT専門家への相談が必要かどうか: {it_consultation}
-        
-        以下のITスキル専門家からのアドバイスも参考にして、総合的な回答を作成してください。
-        ITスキル専門家のアドバイス: {it_advice}
-        
-        ユーザーの状況を理解し、具体的で実用的なアドバイスを心がけてください。
-        ITスキル専門家からのアドバイスを自然に取り入れ、一責性のある回答を作成してください。
-        """
         
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            ("human", last_user_message)
-        ])
+        # 相談が必要と判断された場合（判断できなかった場合を含む）のみ専門家のアドバイスを使う
+        use_advice = bool(state.it_advice) and (
+            state.it_consultation or "counselor_routing" in state.degraded
+        )
         
-        # LLMに質問を投げる
-        chain = prompt | llm | StrOutputParser()
-        response = chain.invoke({})
+        # 最後のユーザーメッセージと、それより前の会話履歴を取得
+        prior_messages, last_user_message = _split_last_user_message(messages)
         
-        # AIMessageを作成
-        ai_message = AIMessage(content=response)
+        # LLMに質問を投げる（イベントループをブロックしないよう非同期で呼び出す）
+        async with get_llm_limiter(registry.model_for("response_generation")).acquire():
+            response = await response_generation_chain.ainvoke({
+                "history": prior_messages,
+                "input": last_user_message,
+                "it_consultation": use_advice,
+                "it_advice": state.it_advice if use_advice else "（なし）",
+            })
         
-        # 新しい状態を作成
-        new_state = state.model_copy()
-        new_state.messages = messages + [ai_message]
-        new_state.next = END
-        return new_state
+        # 更新する項目だけを返す（メッセージは add_messages で履歴の末尾に追加される）
+        return {"messages": [AIMessage(content=response)], "it_consultation": use_advice}
     
     # ルーターの定義
     def router(state: AgentState) -> Literal["career_counselor", "it_specialist", "response_generation"]:
@@ -169,8 +300,26 @@ def create_agent_graph():
     # グラフの構築
     workflow = StateGraph(AgentState)
     
+    if multi_expert:
+        workflow.add_node("pre_routing", _timed_node("pre_routing", pre_routing_node))
+        workflow.add_node("counselor_routing", _timed_node("counselor_routing", counselor_routing_node))
+        workflow.add_node("it_specialist", _timed_node("it_specialist", it_specialist_node))
+        workflow.add_node("response_generation", _timed_node("response_generation", response_generation_node))
+        workflow.add_edge(START, "pre_routing")
+        workflow.add_conditional_edges(
+            "pre_routing", select_branches, ["counselor_routing", "it_specialist", "response_generation"]
+        )
+        if parallel_experts:
+            # 並列に実行した判断と専門家は同じステップで完了し、その後に1回だけ回答を生成する
+            workflow.add_edge("counselor_routing", "response_generation")
+        else:
+            workflow.add_conditional_edges("counselor_routing", router, ["it_specialist", "response_generation"])
+        workflow.add_edge("it_specialist", "response_generation")
+        workflow.add_edge("response_generation", END)
+        return workflow.compile()
+    
     # ノードの追加 - キャリアカウンセラーノードのみ使用
-    workflow.add_node("career_counselor", career_counselor_node)
+    workflow.add_node("career_counselor", _timed_node("career_counselor", career_counselor_node))
     
     # エントリーポイントの設定
     workflow.set_entry_point("career_counselor")
@@ -200,23 +349,19 @@ def create_mock_agent_graph():
     ]
     
     # エージェントノードの定義
-    def mock_agent_node(state: AgentState) -> AgentState:
+    async def mock_agent_node(state: AgentState) -> Dict[str, Any]:
         """モックエージェントの処理を行うノード"""
-        messages = state.messages
-        context = state.context
-        
         # ランダムな応答を選択
         response_text = random.choice(mock_responses)
-        response = AIMessage(content=response_text)
         
-        # 新しい状態を返す
-        new_state = state.model_copy()
-        new_state.messages = list(messages) + [response]
-        return new_state
+        # 追加するメッセージだけを返す
+        return {"messages": [AIMessage(content=response_text)]}
 
     # グラフの構築
+    from langgraph.graph import END, StateGraph
+
     workflow = StateGraph(AgentState)
-    workflow.add_node("agent", mock_agent_node)
+    workflow.add_node("agent", _timed_node("agent", mock_agent_node))
     
     # エッジの定義
     workflow.set_entry_point("agent")
@@ -226,13 +371,166 @@ def create_mock_agent_graph():
     return workflow.compile()
 
 
-# グラフのインスタンスを作成
-agent_graph = create_agent_graph()
+# グラフはインポート時には作成せず、アプリケーションの起動時に別スレッドで作成する
+_agent_graph = None
+_agent_graph_build: Optional[asyncio.Future] = None
+_thread_graph = None
+
+
+def start_agent_graph_build() -> None:
+    """
+    エージェントグラフの作成を別スレッドで始める（作成中もイベントループは他のリクエストに応答できる）
+    """
+    global _agent_graph_build
+    if _agent_graph is None and _agent_graph_build is None:
+        _agent_graph_build = asyncio.ensure_future(_build_agent_graph())
+        _agent_graph_build.add_done_callback(_log_agent_graph_build)
+
+
+async def _build_agent_graph():
+    # 作成時間はスレッドの完了を待った後にイベントループ上で記録する
+    with stage(GRAPH_BUILD_SECONDS, "agent.graph_build"):
+        return await asyncio.to_thread(create_agent_graph)
+
+
+def _log_agent_graph_build(build: asyncio.Future) -> None:
+    if build.cancelled():
+        return
+    if build.exception() is not None:
+        logger.error("Failed to build agent graph: %s", build.exception())
+    else:
+        logger.info("Agent graph is ready")
+
+
+async def get_agent_graph():
+    """
+    エージェントグラフを取得する（作成中であれば完了を待ち、作成を始めていなければ始める）
+    """
+    global _agent_graph, _agent_graph_build
+    if _agent_graph is None:
+        start_agent_graph_build()
+        try:
+            _agent_graph = await asyncio.shield(_agent_graph_build)
+        except Exception:
+            # 次の呼び出しで作成し直す
+            _agent_graph_build = None
+            raise
+    return _agent_graph
+
+
+async def get_thread_graph():
+    """
+    会話ごとにチェックポイントを保存するエージェントグラフを取得する（AGENT_CHECKPOINT_BACKEND=none の場合はNone）
+    グラフの構成は get_agent_graph と同じで、チェックポイントの保存先だけを設定したコピー
+    """
+    global _thread_graph
+    checkpointer = get_checkpointer()
+    if checkpointer is None:
+        return None
+    if _thread_graph is None:
+        _thread_graph = (await get_agent_graph()).copy({"checkpointer": checkpointer})
+    return _thread_graph
+
+
+def _thread_config(conversation_id: UUID) -> Dict[str, Any]:
+    """会話のチェックポイントを読み書きする実行設定（会話IDをスレッドIDにする）"""
+    return {"configurable": {"thread_id": str(conversation_id)}}
+
+
+async def _graph_for(conversation_id: Optional[UUID]) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """
+    会話を実行するグラフと実行設定（チェックポイントが無効な場合は設定なし）
+    チェックポイントはターンの終了時の状態だけを保存する（実行時に checkpoint_during=False を指定する）
+    """
+    if conversation_id is not None:
+        thread_graph = await get_thread_graph()
+        if thread_graph is not None:
+            return thread_graph, _thread_config(conversation_id)
+    return await get_agent_graph(), None
+
+
+async def get_checkpointed_messages(conversation_id: UUID) -> Optional[List[BaseMessage]]:
+    """
+    会話の最新のチェックポイントに保存されているメッセージ（チェックポイントがない場合はNone）
+    """
+    checkpointer = get_checkpointer()
+    if checkpointer is None or conversation_id is None:
+        return None
+    saved = await checkpointer.aget_tuple(_thread_config(conversation_id))
+    if saved is None:
+        return None
+    return saved.checkpoint["channel_values"].get("messages")
+
+
+def _turn_input(
+    message: str,
+    message_id: Optional[UUID],
+    context: Dict[str, Any],
+    history: Optional[List[BaseMessage]],
+    resume: bool,
+) -> Dict[str, Any]:
+    """
+    グラフに渡す1ターン分の入力
+    resume=True の場合は保存した状態のメッセージの末尾に今回のメッセージを追加し、
+    それ以外は状態のメッセージを history と今回のメッセージで置き換える。
+    ターンごとの判断結果は、保存した状態に前のターンの値が残らないよう初期値に戻す
+    """
+    human_message = HumanMessage(content=message, id=str(message_id) if message_id is not None else None)
+    if resume:
+        messages: List[BaseMessage] = [human_message]
+    else:
+        from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+        messages = [RemoveMessage(id=REMOVE_ALL_MESSAGES), *(history or []), human_message]
+    return {
+        "messages": messages,
+        "context": context,
+        "it_consultation": False,
+        "it_advice": "",
+        "next": "career_counselor",
+        "cache_hit": False,
+        "routing_source": None,
+        "degraded": None,
+    }
+
+
+def is_agent_graph_ready() -> bool:
+    """エージェントグラフの作成が完了しているかどうか"""
+    if _agent_graph is not None:
+        return True
+    return (
+        _agent_graph_build is not None
+        and _agent_graph_build.done()
+        and not _agent_graph_build.cancelled()
+        and _agent_graph_build.exception() is None
+    )
+
+# トークンをストリーミングする（最終回答を生成する）ノード
+STREAMING_NODES = {"career_counselor", "response_generation"}
 
 
 async def process_message(message: str, conversation_id: UUID = None, 
-                         context: Dict[str, Any] = None) -> Dict[str, Any]:
-    """ユーザーメッセージを処理し、AIの応答を返す"""
+                         context: Dict[str, Any] = None,
+                         history: Optional[List[BaseMessage]] = None,
+                         message_id: Optional[UUID] = None,
+                         resume: bool = False) -> Dict[str, Any]:
+    """
+    ユーザーメッセージを処理し、AIの応答を返す
+    history にはLLMに渡す過去の会話（要約を含む）を古い順に指定する。
+    resume=True の場合は history を使わず、会話のチェックポイントに保存した状態から続ける
+    （チェックポイントが有効な場合のみ。message_id は今回のユーザーメッセージのID）
+    """
+    with stage(AGENT_REQUEST_SECONDS, "agent.process_message", mode="invoke"):
+        response = await _process_message(message, conversation_id, context, history, message_id, resume)
+    AGENT_REQUESTS_TOTAL.inc(mode="invoke", outcome="error" if response.get("error") else "ok")
+    return response
+
+
+async def _process_message(message: str, conversation_id: UUID = None,
+                           context: Dict[str, Any] = None,
+                           history: Optional[List[BaseMessage]] = None,
+                           message_id: Optional[UUID] = None,
+                           resume: bool = False) -> Dict[str, Any]:
     try:
         # 入力値のバリデーション
         if not message or message == "string":
@@ -244,38 +542,49 @@ async def process_message(message: str, conversation_id: UUID = None,
                 "error": "無効なメッセージ内容"
             }
             
-        # メッセージをHumanMessageに変換
-        human_message = HumanMessage(content=message)
-        
         # コンテキストがなければ空の辞書を使用
         if context is None:
             context = {}
         
-        # 会話履歴が空の場合は初期化
-        messages = [human_message]
+        # 会話の最初の質問かどうか（保存した状態から続ける場合は履歴がある）
+        first_turn = not history and not resume
         
-        print(f"\n[DEBUG] メッセージ処理開始: {message}")
-        print(f"[DEBUG] コンテキスト: {context}")
-        
-        # エージェントグラフを実行
-        agent_state = AgentState(
-            messages=messages, 
-            context=context,
-            it_consultation=False,
-            it_advice="",
-            next="career_counselor"
+        logger.debug(
+            "メッセージ処理開始: conversation_id=%s 文字数=%d 履歴=%s",
+            conversation_id, len(message), "チェックポイント" if resume else f"{len(history or [])}件",
         )
         
-        result = await agent_graph.ainvoke(agent_state)
+        # 意味的に近い質問への回答がキャッシュされていればグラフを実行せずに返す
+        semantic_cache = get_semantic_cache()
+        role = context.get("selected_role", "career_counselor")
+        # 会話履歴に依存しない最初の質問にのみ使う
+        if semantic_cache is not None and not first_turn:
+            semantic_cache = None
+        if semantic_cache is not None:
+            cached = await semantic_cache.lookup(message, role, get_llm_registry().model_for(role))
+            if cached is not None:
+                answer, similarity = cached
+                return {
+                    "message": answer,
+                    "conversation_id": conversation_id,
+                    "metadata": {**context, "cache_hit": True, "semantic_similarity": similarity}
+                }
         
-        print(f"[DEBUG] エージェントグラフ実行完了")
-        print(f"[DEBUG] 結果の型: {type(result)}")
-        print(f"[DEBUG] 結果の内容: {result}")
+        # エージェントグラフを実行（チェックポイントが有効な場合は会話の状態を保存する）
+        agent_state = _turn_input(message, message_id, context, history, resume)
+        agent_graph, config = await _graph_for(conversation_id)
+        if _coalescing_enabled() and first_turn:
+            # 同じ最初の質問を処理中であれば、その結果を待って共有する
+            result = await get_single_flight().do(
+                f"invoke:{_coalescing_key(message, role)}", lambda: agent_graph.ainvoke(agent_state, config, checkpoint_during=False)
+            )
+        else:
+            result = await agent_graph.ainvoke(agent_state, config, checkpoint_during=False)
         
         # AIの応答を取得
         # resultがNoneの場合のエラーハンドリング
         if result is None:
-            print(f"[ERROR] エージェント結果がNoneです")
+            logger.error("エージェント結果がNoneです")
             return {
                 "message": "申し訳ありません。応答を生成できませんでした。",
                 "conversation_id": conversation_id,
@@ -287,7 +596,7 @@ async def process_message(message: str, conversation_id: UUID = None,
                 # messagesキーがあればそこから取得
                 messages = result["messages"]
                 if messages is None:
-                    print(f"[ERROR] messagesがNoneです")
+                    logger.error("messagesがNoneです")
                     return {
                         "message": "申し訳ありません。応答を生成できませんでした。",
                         "conversation_id": conversation_id,
@@ -305,7 +614,7 @@ async def process_message(message: str, conversation_id: UUID = None,
             # AgentState型の場合
             # result.messagesがNoneの場合のエラーハンドリング
             if not hasattr(result, 'messages') or result.messages is None:
-                print(f"[ERROR] result.messagesが存在しないか、Noneです")
+                logger.error("result.messagesが存在しないか、Noneです")
                 return {
                     "message": "申し訳ありません。応答を生成できませんでした。",
                     "conversation_id": conversation_id,
@@ -315,10 +624,14 @@ async def process_message(message: str, conversation_id: UUID = None,
         
         if ai_messages:
             response_content = ai_messages[-1].content
+            # 応答キャッシュから回答したかどうかをメタデータで返す
+            cache_hit = result.get("cache_hit", False) if isinstance(result, dict) else getattr(result, "cache_hit", False)
+            if semantic_cache is not None:
+                await semantic_cache.insert(message, role, get_llm_registry().model_for(role), response_content)
             return {
                 "message": response_content,
                 "conversation_id": conversation_id,
-                "metadata": context
+                "metadata": {**context, "cache_hit": cache_hit}
             }
         else:
             return {
@@ -326,13 +639,107 @@ async def process_message(message: str, conversation_id: UUID = None,
                 "conversation_id": conversation_id,
                 "metadata": context
             }
+    except LLMCapacityError as e:
+        # 混雑時は待たせ続けずにすぐ応答する
+        logger.error("LLMの実行枠を確保できませんでした: %s", e)
+        return {
+            "message": "ただいま混雑しています。しばらくしてから再度お試しください。",
+            "conversation_id": conversation_id,
+            "metadata": context,
+            "error": str(e),
+            "retry_after": retry_after_for(e)
+        }
     except Exception as e:
-        print(f"[ERROR] メッセージ処理中にエラーが発生しました: {str(e)}")
-        import traceback
-        print(f"[ERROR] スタックトレース: {traceback.format_exc()}")
+        retry_after = retry_after_for(e)
+        if retry_after is not None:
+            # リトライしても上流のレート制限が解けなかった場合
+            logger.error("LLMのレート制限に達しました: %s", e)
+            return {
+                "message": "ただいま混雑しています。しばらくしてから再度お試しください。",
+                "conversation_id": conversation_id,
+                "metadata": context,
+                "error": str(e),
+                "retry_after": retry_after
+            }
+        logger.exception("メッセージ処理中にエラーが発生しました: %s", e)
         return {
             "message": f"申し訳ありません。メッセージ処理中にエラーが発生しました: {str(e)}",
             "conversation_id": conversation_id,
             "metadata": context,
             "error": str(e)
         }
+
+
+def _extract_ai_content(result: Any) -> Optional[str]:
+    """グラフの実行結果から最後のAIメッセージの内容を取り出す"""
+    if result is None:
+        return None
+    messages = result.get("messages") if isinstance(result, dict) else getattr(result, "messages", None)
+    if not messages:
+        return None
+    ai_messages = [msg for msg in messages if isinstance(msg, AIMessage)]
+    return ai_messages[-1].content if ai_messages else None
+
+
+async def stream_message(message: str, conversation_id: UUID = None,
+                         context: Dict[str, Any] = None,
+                         history: Optional[List[BaseMessage]] = None,
+                         message_id: Optional[UUID] = None,
+                         resume: bool = False) -> AsyncIterator[str]:
+    """
+    ユーザーメッセージを処理し、AIの応答をトークン単位で返す
+    history にはLLMに渡す過去の会話（要約を含む）を古い順に指定する。
+    resume=True の場合は history を使わず、会話のチェックポイントに保存した状態から続ける
+
+    呼び出し側でイテレーションがキャンセルされると、実行中のLLM呼び出しもキャンセルされる
+    """
+    if context is None:
+        context = {}
+
+    agent_state = _turn_input(message, message_id, context, history, resume)
+
+    if _coalescing_enabled() and not history and not resume:
+        # 同じ最初の質問を配信中であれば、そのトークン列に合流する
+        role = context.get("selected_role", "career_counselor")
+        tokens = get_single_flight().stream(
+            f"stream:{_coalescing_key(message, role)}", lambda: _stream_graph(agent_state, conversation_id)
+        )
+    else:
+        tokens = _stream_graph(agent_state, conversation_id)
+    outcome = "cancelled"
+    try:
+        with stage(AGENT_REQUEST_SECONDS, "agent.stream_message", mode="stream"):
+            async for token in tokens:
+                yield token
+        outcome = "ok"
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        AGENT_REQUESTS_TOTAL.inc(mode="stream", outcome=outcome)
+
+
+async def _stream_graph(agent_state: Dict[str, Any], conversation_id: Optional[UUID]) -> AsyncIterator[str]:
+    """エージェントグラフを実行し、回答のトークンを返す"""
+    streamed = False
+    final_state = None
+    agent_graph, config = await _graph_for(conversation_id)
+    async for event in agent_graph.astream_events(agent_state, config, version="v2", checkpoint_during=False):
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            # 回答を生成するノードのトークンのみを返す
+            if event.get("metadata", {}).get("langgraph_node") not in STREAMING_NODES:
+                continue
+            content = event["data"]["chunk"].content
+            if content:
+                streamed = True
+                yield content
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # グラフ全体の実行結果
+            final_state = event["data"].get("output")
+
+    if not streamed:
+        # モックグラフなどトークンを返さない場合は最終結果をまとめて返す
+        content = _extract_ai_content(final_state)
+        if content:
+            yield content
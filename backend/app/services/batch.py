@@ -0,0 +1,259 @@
+"""
+チャットのバッチ処理
+
+JSONL（1行に1リクエスト）のリクエストを同時実行数を制限して `process_message` で処理し、
+結果を完了した順にJSONLで返す。夜間のQAやプロンプトの回帰テストで大量の質問を再実行するためのもの。
+
+- チェックポイントを指定すると、成功したリクエストのIDを記録し、再実行時には完了済みのリクエストを飛ばす
+  （失敗したリクエストは記録しないため、再実行時に再試行される）
+- 最後に件数・スループット・レイテンシの統計を返す
+
+コマンドラインからも実行できる:
+    python -m app.services.batch requests.jsonl -o results.jsonl --checkpoint results.checkpoint --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional, Set, Tuple, Union
+from pydantic import ValidationError
+from app.core.logging import setup_logging, shutdown_logging
+from app.schemas.chat import BatchChatItem, BatchChatResult, BatchSummary
+from app.services.admission import get_admission_controller
+from app.services.agent import process_message
+
+_DONE = object()
+
+
+class BatchCheckpoint:
+    """
+    成功したリクエストのIDを1行ずつ追記するチェックポイントファイル
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.completed = {line.rstrip("\n") for line in f if line.strip()}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self.completed
+
+    def mark(self, item_id: str) -> None:
+        """リクエストの完了を記録する（途中で停止しても記録が残るよう都度書き出す）"""
+        self.completed.add(item_id)
+        self._file.write(f"{item_id}\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+@dataclass
+class _BatchStats:
+    started: float = field(default_factory=time.perf_counter)
+    latencies: List[float] = field(default_factory=list)
+    succeeded: int = 0
+    failed: int = 0
+    invalid: int = 0
+    skipped: int = 0
+
+    def summary(self) -> BatchSummary:
+        elapsed = time.perf_counter() - self.started
+        processed = self.succeeded + self.failed
+        ordered = sorted(self.latencies)
+
+        def percentile(q: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+        return BatchSummary(
+            total=processed + self.invalid + self.skipped,
+            succeeded=self.succeeded,
+            failed=self.failed,
+            invalid=self.invalid,
+            skipped=self.skipped,
+            elapsed_seconds=elapsed,
+            throughput=processed / elapsed if elapsed > 0 else 0.0,
+            p50_latency_ms=percentile(0.5),
+            p99_latency_ms=percentile(0.99),
+        )
+
+
+def parse_line(line_number: int, line: str) -> Tuple[Optional[BatchChatItem], Optional[BatchChatResult]]:
+    """
+    JSONLの1行を解析する。不正な行の場合はエラーの結果を返す
+    """
+    try:
+        item = BatchChatItem.model_validate_json(line)
+    except ValidationError as e:
+        return None, BatchChatResult(id=str(line_number), line=line_number, error=f"不正なリクエストです: {e}")
+    if item.id is None:
+        item.id = str(line_number)
+    return item, None
+
+
+async def _process(item: BatchChatItem, line_number: int, admission_key: Optional[str] = None) -> BatchChatResult:
+    started = time.perf_counter()
+    try:
+        controller = get_admission_controller() if admission_key is not None else None
+        if controller is not None:
+            # バッチは断らずにトークン予算の空きを待つ（公平キューイングにより対話のリクエストを待たせすぎない）
+            cost = await controller.estimate_tokens(item.message, item.conversation_id is not None)
+            await controller.acquire_budget(admission_key, cost, fail_fast=False)
+        response = await process_message(item.message, item.conversation_id, dict(item.metadata or {}))
+        error = response.get("error")
+        return BatchChatResult(
+            id=item.id,
+            line=line_number,
+            message=response.get("message"),
+            conversation_id=item.conversation_id,
+            metadata=response.get("metadata"),
+            error=str(error) if error else None,
+            latency_ms=(time.perf_counter() - started) * 1000,
+        )
+    except Exception as e:
+        return BatchChatResult(
+            id=item.id,
+            line=line_number,
+            conversation_id=item.conversation_id,
+            error=str(e),
+            latency_ms=(time.perf_counter() - started) * 1000,
+        )
+
+
+async def _numbered(lines: Union[Iterable[str], AsyncIterable[str]]) -> AsyncIterator[Tuple[int, str]]:
+    """(行番号, 行) を返す（ファイルなどの同期のイテラブルと、リクエストの本文などの非同期のイテラブルの両方に対応する）"""
+    if isinstance(lines, AsyncIterable):
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            yield line_number, line
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            yield line_number, line
+
+
+async def run_batch(
+    lines: Union[Iterable[str], AsyncIterable[str]],
+    concurrency: int = 8,
+    checkpoint: Optional[BatchCheckpoint] = None,
+    admission_key: Optional[str] = None,
+) -> AsyncIterator[Union[BatchChatResult, BatchSummary]]:
+    """
+    JSONLの各行のリクエストを最大 concurrency 件ずつ並行に処理し、結果を完了した順に返す
+    lines には非同期のイテラブルも指定でき、届いた行から処理する（未処理の行が溜まると読み込みを待たせる）
+    最後に統計情報（BatchSummary）を返す
+    admission_key を指定した場合は、各リクエストの前にその利用者としてトークン予算を確保する
+    """
+    stats = _BatchStats()
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def feed() -> None:
+        # 入力を少しずつキューに入れ、大きなファイルでも全件をメモリに展開しない
+        async for line_number, line in _numbered(lines):
+            if not line.strip():
+                continue
+            item, invalid = parse_line(line_number, line)
+            if invalid is not None:
+                stats.invalid += 1
+                await results.put(invalid)
+            elif checkpoint is not None and item.id in checkpoint:
+                stats.skipped += 1
+            else:
+                await pending.put((line_number, item))
+        for _ in range(concurrency):
+            await pending.put(_DONE)
+
+    async def work() -> None:
+        while True:
+            job = await pending.get()
+            if job is _DONE:
+                break
+            line_number, item = job
+            result = await _process(item, line_number, admission_key)
+            stats.latencies.append(result.latency_ms)
+            if result.error:
+                stats.failed += 1
+            else:
+                stats.succeeded += 1
+                if checkpoint is not None:
+                    checkpoint.mark(result.id)
+            await results.put(result)
+
+    async def run() -> None:
+        try:
+            await asyncio.gather(feed(), *(work() for _ in range(concurrency)))
+        finally:
+            await results.put(_DONE)
+
+    runner = asyncio.create_task(run())
+    try:
+        while True:
+            result = await results.get()
+            if result is _DONE:
+                break
+            yield result
+        # 入力の読み込みなどで発生した例外を呼び出し側に伝える
+        await runner
+        yield stats.summary()
+    finally:
+        if not runner.done():
+            # 呼び出し側が途中でやめた場合は実行中のリクエストを中断する
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+
+async def _main(args) -> None:
+    checkpoint = BatchCheckpoint(args.checkpoint) if args.checkpoint else None
+    # 再開する場合は既存の結果に追記する。失敗した行・不正な行は再実行のたびに出力されるため、
+    # 結果のファイルには成功した行だけを書き、それ以外は標準エラー出力に書く
+    mode = "a" if checkpoint is not None else "w"
+    output = open(args.output, mode, encoding="utf-8") if args.output else sys.stdout
+    try:
+        with open(args.input, encoding="utf-8") as lines:
+            async for row in run_batch(lines, args.concurrency, checkpoint):
+                if isinstance(row, BatchSummary):
+                    print(row.model_dump_json(indent=2), file=sys.stderr)
+                elif checkpoint is not None and row.error:
+                    print(row.model_dump_json(), file=sys.stderr)
+                else:
+                    output.write(row.model_dump_json() + "\n")
+                    output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="チャットのバッチ処理")
+    parser.add_argument("input", help="リクエストのJSONLファイル（1行に1リクエスト: id, message, conversation_id, metadata）")
+    parser.add_argument("-o", "--output", help="結果のJSONLファイル（省略時は標準出力）")
+    parser.add_argument(
+        "--checkpoint",
+        help="チェックポイントファイル（指定すると完了済みのリクエストを飛ばして再開し、結果には成功した行だけを追記する）",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    # ログは標準エラー出力に書き、標準出力には結果のみを書く
+    setup_logging()
+    try:
+        asyncio.run(_main(args))
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
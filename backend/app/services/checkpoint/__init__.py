@@ -0,0 +1,80 @@
+"""
+エージェントのチェックポイント
+
+AGENT_CHECKPOINT_BACKEND の設定に応じて保存先を選択する
+- none: 保存しない（毎ターン、会話ストアの履歴からグラフの状態を組み立てる）
+- memory: プロセス内の辞書（再起動で消える）
+- sqlite: WALモードのSQLiteファイル
+
+会話IDをスレッドIDとしてグラフの状態を保存し、次のターンは保存した状態に新しいメッセージを追加して実行する。
+保存した状態は会話ストアと照合してから使うため、再起動・他のワーカーでのターン・保存先からの削除があった場合は
+従来どおり会話ストアの履歴から組み立て直す
+"""
+from typing import TYPE_CHECKING, Optional
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    # langgraph のインポートは起動時間に響くため、保存先を作成するまで遅らせる
+    from app.services.checkpoint.base import CompactCheckpointSaver
+
+_checkpointer: "Optional[CompactCheckpointSaver]" = None
+_created = False
+
+
+def create_checkpointer(backend: Optional[str] = None) -> "Optional[CompactCheckpointSaver]":
+    """
+    設定に応じたチェックポイントの保存先を作成する（none の場合はNone）
+    """
+    backend = backend or settings.AGENT_CHECKPOINT_BACKEND
+    if backend == "none":
+        return None
+    options = dict(
+        keep=settings.AGENT_CHECKPOINT_KEEP,
+        ttl_seconds=settings.AGENT_CHECKPOINT_TTL_SECONDS,
+        max_threads=settings.AGENT_CHECKPOINT_MAX_THREADS,
+        max_delta_chain=settings.AGENT_CHECKPOINT_MAX_DELTA_CHAIN,
+    )
+    if backend == "memory":
+        from app.services.checkpoint.memory import MemoryCheckpointSaver
+
+        return MemoryCheckpointSaver(**options)
+    if backend == "sqlite":
+        from app.services.checkpoint.sqlite import SQLiteCheckpointSaver
+
+        return SQLiteCheckpointSaver(
+            settings.AGENT_CHECKPOINT_SQLITE_PATH,
+            batch_size=settings.CONVERSATION_STORE_BATCH_SIZE,
+            batch_interval=settings.CONVERSATION_STORE_BATCH_INTERVAL,
+            sync_writes=settings.WORKERS > 1,
+            **options,
+        )
+    raise ValueError(f"未対応のチェックポイントの保存先です: {backend}")
+
+
+def get_checkpointer() -> "Optional[CompactCheckpointSaver]":
+    """
+    アプリケーション全体で共有するチェックポイントの保存先を取得する（無効な場合はNone）
+    """
+    global _checkpointer, _created
+    if not _created:
+        _checkpointer = create_checkpointer()
+        _created = True
+    return _checkpointer
+
+
+async def close_checkpointer() -> None:
+    """
+    共有のチェックポイントの保存先を閉じる
+    """
+    global _checkpointer, _created
+    if _checkpointer is not None:
+        await _checkpointer.close()
+    _checkpointer = None
+    _created = False
+
+
+__all__ = [
+    "create_checkpointer",
+    "get_checkpointer",
+    "close_checkpointer",
+]
@@ -0,0 +1,464 @@
+"""
+チェックポイントの保存形式と共通の処理
+
+LangGraph の BaseCheckpointSaver を実装し、保存先ごとの読み書きだけをサブクラスに任せる。
+
+- チェックポイント本体（channel_values を除く）とメタデータは1行にまとめる
+- チャンネルの値は版ごとに保存し、そのステップで変更のあったチャンネルのみ書き込む
+- メッセージ列のように末尾に追加されていくリストは、親のチェックポイントの版に追加された部分（差分）だけを保存する。
+  差分が max_delta_chain 回続いたら全体を保存し、読み出し時に辿る数を抑える
+- 会話（スレッド）ごとに新しい keep 件のチェックポイントだけを残し、参照されなくなった値と書き込みを削除する
+- 最後の更新から ttl_seconds が経過した会話と、max_threads を超えた更新の古い会話は定期的に削除する
+- 会話ごとに最新のチェックポイントの値をプロセス内に保持し、次のターンの読み出しと差分の計算に使う。
+  他のプロセスも同じ保存先に書き込む場合（shared=True）は、最新のチェックポイントは保存先から読み出す
+
+グラフは ainvoke / astream_events で実行するため、非同期のAPIのみ実装する
+"""
+import copy
+import logging
+import random
+import time
+from abc import abstractmethod
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+logger = logging.getLogger(__name__)
+
+# 最新のチェックポイントの値を保持する会話数
+STATE_CACHE_SIZE = 10_000
+# 期限切れ・上限超過の会話を削除する間隔（秒）
+SWEEP_INTERVAL = 60.0
+
+# 値が無いチャンネル（チェックポイントの作成時点で空）の保存形式
+EMPTY_VALUE = ("empty", b"")
+
+# (チェックポイントの名前空間, チャンネル, 版)
+BlobKey = Tuple[str, str, str]
+
+
+class CheckpointRow(NamedTuple):
+    """保存するチェックポイント（channel_values を除く）"""
+    checkpoint_ns: str
+    checkpoint_id: str
+    parent_id: Optional[str]
+    checkpoint: Tuple[str, bytes]
+    metadata: Tuple[str, bytes]
+    # チャンネル → 版（参照している値の判定に使う）
+    channel_versions: Dict[str, str]
+
+
+class BlobRow(NamedTuple):
+    """チャンネルの値の1つの版"""
+    checkpoint_ns: str
+    channel: str
+    version: str
+    # 差分の場合は追加先の版（全体を保存した場合はNone）
+    base_version: Optional[str]
+    # 全体を保存した版から続いている差分の数
+    depth: int
+    value: Tuple[str, bytes]
+
+
+class WriteRow(NamedTuple):
+    """ノードの書き込み（次のステップに反映される前の pending writes）"""
+    checkpoint_ns: str
+    checkpoint_id: str
+    task_id: str
+    idx: int
+    channel: str
+    value: Tuple[str, bytes]
+    task_path: str
+
+
+class _LatestState(NamedTuple):
+    """会話の最新のチェックポイントと、そのチャンネルの値"""
+    row: CheckpointRow
+    # チャンネル → (版, 値, 全体を保存した版から続いている差分の数)。値のないチャンネルは含めない
+    values: Dict[str, Tuple[str, Any, int]]
+    # すべてのチャンネルの値を保持し、書き込み（pending writes）がないかどうか
+    complete: bool
+    saved_at: float
+
+
+class MissingBaseError(Exception):
+    """差分の追加先の版が削除されている"""
+
+
+def _extends(base: Any, value: Any) -> bool:
+    """value が base の末尾に要素を追加したリストかどうか"""
+    if not isinstance(base, list) or not isinstance(value, list) or len(value) < len(base):
+        return False
+    return all(old is new or old == new for old, new in zip(base, value))
+
+
+def reachable_blobs(
+    checkpoints: Iterable[Tuple[str, Dict[str, str]]], bases: Dict[BlobKey, Optional[str]]
+) -> Set[BlobKey]:
+    """
+    チェックポイント（名前空間, チャンネル → 版）が参照している値の版を、差分の追加先まで辿って返す
+    bases には保存されているすべての版と、その追加先の版（全体を保存した版はNone）を渡す
+    """
+    keep: Set[BlobKey] = set()
+    for checkpoint_ns, channel_versions in checkpoints:
+        for channel, version in channel_versions.items():
+            key: Optional[BlobKey] = (checkpoint_ns, channel, str(version))
+            while key is not None and key not in keep and key in bases:
+                keep.add(key)
+                base = bases[key]
+                key = (key[0], key[1], base) if base is not None else None
+    return keep
+
+
+class CompactCheckpointSaver(BaseCheckpointSaver[str]):
+    """
+    変更のあったチャンネルと、リストの差分だけを保存するチェックポイントの保存先
+    """
+
+    def __init__(
+        self,
+        keep: int = 1,
+        ttl_seconds: float = 0.0,
+        max_threads: int = 0,
+        max_delta_chain: int = 32,
+        shared: bool = False,
+    ):
+        super().__init__()
+        self.keep = max(1, keep)
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.max_delta_chain = max_delta_chain
+        self.shared = shared
+        # (会話ID, 名前空間) → 最新のチェックポイントの値（更新の古い順）
+        self._latest: "OrderedDict[Tuple[str, str], _LatestState]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+
+    # --- 保存先ごとの読み書き ---
+
+    @abstractmethod
+    async def _get_checkpoint(
+        self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]
+    ) -> Optional[CheckpointRow]:
+        """チェックポイントを取得する（checkpoint_id がNoneの場合は最新のもの）"""
+
+    @abstractmethod
+    async def _list_checkpoints(
+        self,
+        thread_id: Optional[str],
+        checkpoint_ns: Optional[str],
+        before: Optional[str],
+        limit: Optional[int],
+    ) -> List[Tuple[str, CheckpointRow]]:
+        """(会話ID, チェックポイント) を新しい順に返す（thread_id / checkpoint_ns がNoneの場合はすべて）"""
+
+    @abstractmethod
+    async def _get_blobs(
+        self, thread_id: str, checkpoint_ns: str, channels: Sequence[str]
+    ) -> Dict[Tuple[str, str], BlobRow]:
+        """チャンネルの保存されているすべての版を (チャンネル, 版) をキーにして返す"""
+
+    @abstractmethod
+    async def _get_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[WriteRow]:
+        """チェックポイントに対するノードの書き込み"""
+
+    @abstractmethod
+    async def _save(self, thread_id: str, checkpoint: CheckpointRow, blobs: List[BlobRow]) -> None:
+        """チェックポイントと値を保存し、会話の古いチェックポイントを削除する"""
+
+    @abstractmethod
+    async def _save_writes(self, thread_id: str, writes: List[WriteRow]) -> None:
+        """
+        ノードの書き込みを保存する
+        同じ (タスク, idx) の書き込みが既にある場合、idx が0以上であれば保存せず、負（エラー・割り込み等）であれば置き換える
+        """
+
+    @abstractmethod
+    async def _delete_thread(self, thread_id: str) -> None:
+        """会話のチェックポイント・値・書き込みをすべて削除する"""
+
+    @abstractmethod
+    async def _sweep(self, expire_before: Optional[float]) -> None:
+        """expire_before（time.time()）より前に更新された会話と、max_threads を超えた更新の古い会話を削除する"""
+
+    async def flush(self) -> None:
+        """未書き込みのチェックポイントを書き込む"""
+
+    async def close(self) -> None:
+        """保存先を閉じる"""
+
+    # --- LangGraph のチェックポイントのAPI ---
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        latest = self._latest.get((thread_id, checkpoint_ns))
+        if (
+            latest is not None
+            and latest.complete
+            and not self.shared
+            and checkpoint_id in (None, latest.row.checkpoint_id)
+        ):
+            # 自プロセスで保存した最新のチェックポイントは保存先から読み出さない
+            self._latest.move_to_end((thread_id, checkpoint_ns))
+            return self._cached_tuple(thread_id, latest)
+
+        row = await self._get_checkpoint(thread_id, checkpoint_ns, checkpoint_id)
+        if row is None:
+            return None
+        try:
+            return await self._to_tuple(thread_id, row, latest=checkpoint_id is None)
+        except MissingBaseError as e:
+            # 同じ会話の並行したターンが追加先の版を削除した場合。保存した状態は使わず、最初から実行させる
+            logger.warning("チェックポイントを復元できません（thread_id=%s）: %s", thread_id, e)
+            return None
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        configurable = config["configurable"] if config else {}
+        checkpoint_id = get_checkpoint_id(config) if config else None
+        rows = await self._list_checkpoints(
+            configurable.get("thread_id"),
+            configurable.get("checkpoint_ns"),
+            get_checkpoint_id(before) if before else None,
+            None if filter or checkpoint_id else limit,
+        )
+        count = 0
+        for thread_id, row in rows:
+            if checkpoint_id and row.checkpoint_id != checkpoint_id:
+                continue
+            if filter:
+                metadata = self.serde.loads_typed(row.metadata)
+                if not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+            if limit is not None and count >= limit:
+                break
+            count += 1
+            try:
+                yield await self._to_tuple(thread_id, row, latest=False)
+            except MissingBaseError as e:
+                logger.warning("チェックポイントを復元できません（thread_id=%s）: %s", thread_id, e)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        parent_id = configurable.get("checkpoint_id")
+        stored = checkpoint.copy()
+        values = stored.pop("channel_values")
+        row = CheckpointRow(
+            checkpoint_ns,
+            checkpoint["id"],
+            parent_id,
+            self.serde.dumps_typed(stored),
+            self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)),
+            {channel: str(version) for channel, version in checkpoint["channel_versions"].items()},
+        )
+
+        # 親のチェックポイントの値を保持していれば、リストは差分だけを保存し、変更のないチャンネルの値は引き継ぐ
+        parent = self._latest.get((thread_id, checkpoint_ns))
+        if parent is not None and parent.row.checkpoint_id != parent_id:
+            parent = None
+        blobs = []
+        latest_values: Dict[str, Tuple[str, Any, int]] = {}
+        complete = True
+        for channel, version in row.channel_versions.items():
+            if channel in new_versions:
+                blob = self._encode(checkpoint_ns, channel, version, values, parent)
+                blobs.append(blob)
+                if channel in values:
+                    latest_values[channel] = (version, _copy(values[channel]), blob.depth)
+            elif parent is not None and parent.complete and parent.row.channel_versions.get(channel) == version:
+                if channel in parent.values:
+                    latest_values[channel] = parent.values[channel]
+            else:
+                complete = False
+        self._remember(thread_id, _LatestState(row, latest_values, complete, time.time()))
+
+        await self._save(thread_id, row, blobs)
+        await self._maybe_sweep()
+        return self._config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        rows = [
+            WriteRow(
+                checkpoint_ns,
+                configurable["checkpoint_id"],
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                self.serde.dumps_typed(value),
+                task_path,
+            )
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        # 書き込みのあるチェックポイントは保存先から読み出す
+        latest = self._latest.get((thread_id, checkpoint_ns))
+        if latest is not None and latest.row.checkpoint_id == configurable["checkpoint_id"]:
+            self._latest[(thread_id, checkpoint_ns)] = latest._replace(complete=False)
+        await self._save_writes(thread_id, rows)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        for key in [key for key in self._latest if key[0] == thread_id]:
+            del self._latest[key]
+        await self._delete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # InMemorySaver と同じ形式（並行したターンが同じ版を作らないよう乱数を付ける）
+        if current is None:
+            current_version = 0
+        elif isinstance(current, int):
+            current_version = current
+        else:
+            current_version = int(current.split(".")[0])
+        return f"{current_version + 1:032}.{random.random():016}"
+
+    # --- 値の変換 ---
+
+    @staticmethod
+    def _config(thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> RunnableConfig:
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+    def _cached_tuple(self, thread_id: str, latest: _LatestState) -> CheckpointTuple:
+        checkpoint = self.serde.loads_typed(latest.row.checkpoint)
+        checkpoint["channel_values"] = {channel: _copy(value) for channel, (_, value, _) in latest.values.items()}
+        return self._tuple(thread_id, latest.row, checkpoint, [])
+
+    def _tuple(
+        self, thread_id: str, row: CheckpointRow, checkpoint: Checkpoint, writes: List[WriteRow]
+    ) -> CheckpointTuple:
+        return CheckpointTuple(
+            config=self._config(thread_id, row.checkpoint_ns, row.checkpoint_id),
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed(row.metadata),
+            parent_config=self._config(thread_id, row.checkpoint_ns, row.parent_id) if row.parent_id else None,
+            pending_writes=[
+                (write.task_id, write.channel, self.serde.loads_typed(write.value))
+                for write in sorted(writes, key=lambda write: (write.task_id, write.idx))
+            ],
+        )
+
+    async def _to_tuple(self, thread_id: str, row: CheckpointRow, latest: bool) -> CheckpointTuple:
+        """
+        保存先から読み出したチェックポイントを復元する
+        latest=True（会話の最新のチェックポイント）の場合は、次のターンで使うため値を保持する
+        """
+        checkpoint = self.serde.loads_typed(row.checkpoint)
+        values = await self._load_values(thread_id, row)
+        writes = await self._get_writes(thread_id, row.checkpoint_ns, row.checkpoint_id)
+        if latest:
+            self._remember(thread_id, _LatestState(row, values, not writes, time.time()))
+        checkpoint["channel_values"] = {channel: _copy(value) for channel, (_, value, _) in values.items()}
+        return self._tuple(thread_id, row, checkpoint, writes)
+
+    async def _load_values(self, thread_id: str, row: CheckpointRow) -> Dict[str, Tuple[str, Any, int]]:
+        """チェックポイントが参照しているチャンネルの値を (版, 値, 差分の数) で復元する"""
+        values: Dict[str, Tuple[str, Any, int]] = {}
+        blobs = await self._get_blobs(thread_id, row.checkpoint_ns, list(row.channel_versions))
+        for channel, version in row.channel_versions.items():
+            blob = blobs.get((channel, version))
+            if blob is None or blob.value == EMPTY_VALUE:
+                continue
+            values[channel] = (version, self._decode(blobs, blob), blob.depth)
+        return values
+
+    def _decode(self, blobs: Dict[Tuple[str, str], BlobRow], blob: BlobRow) -> Any:
+        """差分を追加先の版まで辿って値を復元する"""
+        deltas = []
+        while blob.base_version is not None:
+            deltas.append(blob)
+            base = blobs.get((blob.channel, blob.base_version))
+            if base is None:
+                raise MissingBaseError(f"{blob.channel} の版 {blob.base_version} がありません")
+            blob = base
+        value = self.serde.loads_typed(blob.value)
+        for delta in reversed(deltas):
+            value = value + self.serde.loads_typed(delta.value)
+        return value
+
+    def _encode(
+        self,
+        checkpoint_ns: str,
+        channel: str,
+        version: str,
+        values: Dict[str, Any],
+        parent: Optional[_LatestState],
+    ) -> BlobRow:
+        """
+        チャンネルの値を保存形式にする
+        親のチェックポイントの値の末尾に追加したリストであれば、追加した部分だけを保存する
+        """
+        if channel not in values:
+            return BlobRow(checkpoint_ns, channel, version, None, 0, EMPTY_VALUE)
+        value = values[channel]
+        base = parent.values.get(channel) if parent is not None else None
+        if (
+            base is not None
+            and isinstance(value, list)
+            and base[2] < self.max_delta_chain
+            and _extends(base[1], value)
+        ):
+            base_version, base_value, depth = base
+            return BlobRow(
+                checkpoint_ns, channel, version, base_version, depth + 1, self.serde.dumps_typed(value[len(base_value):])
+            )
+        return BlobRow(checkpoint_ns, channel, version, None, 0, self.serde.dumps_typed(value))
+
+    def _remember(self, thread_id: str, latest: _LatestState) -> None:
+        key = (thread_id, latest.row.checkpoint_ns)
+        self._latest[key] = latest
+        self._latest.move_to_end(key)
+        if len(self._latest) > STATE_CACHE_SIZE:
+            self._latest.popitem(last=False)
+
+    async def _maybe_sweep(self) -> None:
+        if not self.ttl_seconds and not self.max_threads:
+            return
+        now = time.monotonic()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        expire_before = time.time() - self.ttl_seconds if self.ttl_seconds else None
+        if expire_before is not None:
+            for key in [key for key, latest in self._latest.items() if latest.saved_at < expire_before]:
+                del self._latest[key]
+        await self._sweep(expire_before)
+
+
+def _copy(value: Any) -> Any:
+    """保持している値をグラフに渡す・グラフから受け取る際のコピー（リスト・辞書の入れ物のみ）"""
+    if isinstance(value, (list, dict)):
+        return copy.copy(value)
+    return value
@@ -0,0 +1,163 @@
+"""
+インメモリのチェックポイントの保存先
+
+プロセス内の辞書に会話ごとのチェックポイントを保存する。再起動すると失われる
+（次のターンは会話ストアから履歴を組み立てて実行する）。
+会話は更新の古い順に保持し、max_threads を超えた分は保存時にすぐ削除する。
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.services.checkpoint.base import BlobKey, BlobRow, CheckpointRow, CompactCheckpointSaver, WriteRow, reachable_blobs
+
+
+class _Thread:
+    """1つの会話のチェックポイント・値・書き込み"""
+
+    __slots__ = ("checkpoints", "blobs", "writes", "updated_at")
+
+    def __init__(self):
+        # 名前空間 → チェックポイントID → チェックポイント
+        self.checkpoints: Dict[str, Dict[str, CheckpointRow]] = {}
+        self.blobs: Dict[BlobKey, BlobRow] = {}
+        # (名前空間, チェックポイントID) → (タスクID, idx) → 書き込み
+        self.writes: Dict[Tuple[str, str], Dict[Tuple[str, int], WriteRow]] = {}
+        self.updated_at = time.time()
+
+
+class MemoryCheckpointSaver(CompactCheckpointSaver):
+    """
+    辞書を使ったチェックポイントの保存先
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        # 会話ID → 会話のデータ（更新の古い順）
+        self._threads: "OrderedDict[str, _Thread]" = OrderedDict()
+
+    async def _get_checkpoint(
+        self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]
+    ) -> Optional[CheckpointRow]:
+        thread = self._threads.get(thread_id)
+        checkpoints = thread.checkpoints.get(checkpoint_ns) if thread is not None else None
+        if not checkpoints:
+            return None
+        if checkpoint_id is None:
+            # チェックポイントIDは時刻順に並ぶ（uuid6）
+            checkpoint_id = max(checkpoints)
+        return checkpoints.get(checkpoint_id)
+
+    async def _list_checkpoints(
+        self,
+        thread_id: Optional[str],
+        checkpoint_ns: Optional[str],
+        before: Optional[str],
+        limit: Optional[int],
+    ) -> List[Tuple[str, CheckpointRow]]:
+        thread_ids = [thread_id] if thread_id is not None else list(self._threads)
+        rows = []
+        for current_thread_id in thread_ids:
+            thread = self._threads.get(current_thread_id)
+            if thread is None:
+                continue
+            for namespace, checkpoints in thread.checkpoints.items():
+                if checkpoint_ns is not None and namespace != checkpoint_ns:
+                    continue
+                rows += [
+                    (current_thread_id, row) for checkpoint_id, row in checkpoints.items()
+                    if before is None or checkpoint_id < before
+                ]
+        rows.sort(key=lambda item: item[1].checkpoint_id, reverse=True)
+        return rows[:limit] if limit is not None else rows
+
+    async def _get_blobs(
+        self, thread_id: str, checkpoint_ns: str, channels: Sequence[str]
+    ) -> Dict[Tuple[str, str], BlobRow]:
+        thread = self._threads.get(thread_id)
+        if thread is None:
+            return {}
+        channels = set(channels)
+        return {
+            (channel, version): blob for (namespace, channel, version), blob in thread.blobs.items()
+            if namespace == checkpoint_ns and channel in channels
+        }
+
+    async def _get_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[WriteRow]:
+        thread = self._threads.get(thread_id)
+        if thread is None:
+            return []
+        return list(thread.writes.get((checkpoint_ns, checkpoint_id), {}).values())
+
+    def _touch(self, thread_id: str) -> _Thread:
+        thread = self._threads.get(thread_id)
+        if thread is None:
+            thread = self._threads[thread_id] = _Thread()
+        else:
+            thread.updated_at = time.time()
+            self._threads.move_to_end(thread_id)
+        return thread
+
+    async def _save(self, thread_id: str, checkpoint: CheckpointRow, blobs: List[BlobRow]) -> None:
+        thread = self._touch(thread_id)
+        for blob in blobs:
+            thread.blobs[(blob.checkpoint_ns, blob.channel, blob.version)] = blob
+        thread.checkpoints.setdefault(checkpoint.checkpoint_ns, {})[checkpoint.checkpoint_id] = checkpoint
+        self._prune(thread)
+        if self.max_threads:
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+
+    def _prune(self, thread: _Thread) -> None:
+        """名前空間ごとに新しい keep 件のチェックポイントだけを残し、参照されなくなった値を削除する"""
+        pruned = False
+        for checkpoint_ns, checkpoints in thread.checkpoints.items():
+            for checkpoint_id in sorted(checkpoints)[:-self.keep]:
+                del checkpoints[checkpoint_id]
+                thread.writes.pop((checkpoint_ns, checkpoint_id), None)
+                pruned = True
+        if not pruned:
+            return
+        keep = reachable_blobs(
+            (
+                (row.checkpoint_ns, row.channel_versions)
+                for checkpoints in thread.checkpoints.values() for row in checkpoints.values()
+            ),
+            {key: blob.base_version for key, blob in thread.blobs.items()},
+        )
+        for key in [key for key in thread.blobs if key not in keep]:
+            del thread.blobs[key]
+
+    async def _save_writes(self, thread_id: str, writes: List[WriteRow]) -> None:
+        thread = self._touch(thread_id)
+        for write in writes:
+            saved = thread.writes.setdefault((write.checkpoint_ns, write.checkpoint_id), {})
+            key = (write.task_id, write.idx)
+            if write.idx >= 0 and key in saved:
+                continue
+            saved[key] = write
+
+    async def _delete_thread(self, thread_id: str) -> None:
+        self._threads.pop(thread_id, None)
+
+    async def _sweep(self, expire_before: Optional[float]) -> None:
+        while self._threads:
+            thread_id, thread = next(iter(self._threads.items()))
+            expired = expire_before is not None and thread.updated_at < expire_before
+            if not expired and not (self.max_threads and len(self._threads) > self.max_threads):
+                break
+            del self._threads[thread_id]
+
+    def thread_count(self) -> int:
+        """チェックポイントを保存している会話数"""
+        # __len__ にすると会話がない間は偽と評価され、LangGraph がチェックポイントを使わなくなる
+        return len(self._threads)
+
+    def stored_bytes(self) -> int:
+        """保存しているチェックポイント・値・書き込みのバイト数の合計"""
+        total = 0
+        for thread in self._threads.values():
+            for checkpoints in thread.checkpoints.values():
+                total += sum(len(row.checkpoint[1]) + len(row.metadata[1]) for row in checkpoints.values())
+            total += sum(len(blob.value[1]) for blob in thread.blobs.values())
+            total += sum(len(write.value[1]) for writes in thread.writes.values() for write in writes.values())
+        return total
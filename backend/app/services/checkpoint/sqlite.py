@@ -0,0 +1,346 @@
+"""
+SQLiteのチェックポイントの保存先
+
+aiosqliteを使い、WALモードのSQLiteファイルにチェックポイントを保存する。
+書き込み（チェックポイント・値・ノードの書き込み・古いチェックポイントの削除）は BatchWriter でまとめて
+1つのトランザクションで実行する。複数のワーカープロセスで共有する場合（sync_writes=True）は、
+書き込みがコミットされるまで待ってから返す。
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from app.services.checkpoint.base import BlobRow, CheckpointRow, CompactCheckpointSaver, WriteRow, reachable_blobs
+from app.services.store.batching import BatchWriter
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    parent_id TEXT,
+    type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    channel_versions TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    base_version TEXT,
+    depth INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS checkpoint_writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value BLOB NOT NULL,
+    task_path TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS checkpoint_threads (
+    thread_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_checkpoint_threads_updated_at ON checkpoint_threads (updated_at);
+"""
+
+_CHECKPOINT_COLUMNS = (
+    "thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata, channel_versions"
+)
+
+
+def _row_to_checkpoint(row: Any) -> CheckpointRow:
+    return CheckpointRow(row[1], row[2], row[3], (row[4], row[5]), (row[6], row[7]), json.loads(row[8]))
+
+
+class SQLiteCheckpointSaver(CompactCheckpointSaver):
+    """
+    SQLiteファイルを使ったチェックポイントの保存先
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 100,
+        batch_interval: float = 0.01,
+        sync_writes: bool = False,
+        **options,
+    ):
+        # 複数のワーカープロセスで共有する場合は、他のプロセスが保存したチェックポイントを読み出す
+        super().__init__(shared=sync_writes, **options)
+        self.path = path
+        self.sync_writes = sync_writes
+        self._connection = None
+        self._lock = asyncio.Lock()
+        self._writer = BatchWriter(self._write_batch, batch_size, batch_interval)
+
+    async def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        async with self._lock:
+            if self._connection is None:
+                import aiosqlite
+
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                connection = await aiosqlite.connect(self.path)
+                # 他のプロセスが書き込み中の場合はロックが外れるまで待つ
+                await connection.execute("PRAGMA busy_timeout=5000")
+                await connection.execute("PRAGMA journal_mode=WAL")
+                await connection.execute("PRAGMA synchronous=NORMAL")
+                await connection.executescript(_SCHEMA)
+                await connection.commit()
+                self._connection = connection
+        return self._connection
+
+    async def _read_connection(self):
+        # 自プロセスの未書き込みのチェックポイントを読めるよう、読み出し前に書き込みを反映する
+        connection = await self._connect()
+        if self._writer.pending:
+            await self._writer.flush()
+        return connection
+
+    async def _submit(self, operation: Any) -> None:
+        if self.sync_writes:
+            await self._writer.write(operation)
+        else:
+            self._writer.submit(operation)
+
+    async def flush(self) -> None:
+        await self._writer.flush()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    # --- 読み出し ---
+
+    async def _get_checkpoint(
+        self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]
+    ) -> Optional[CheckpointRow]:
+        connection = await self._read_connection()
+        query = f"SELECT {_CHECKPOINT_COLUMNS} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        params: List[Any] = [thread_id, checkpoint_ns]
+        if checkpoint_id is not None:
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        else:
+            # チェックポイントIDは時刻順に並ぶ（uuid6）
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        async with connection.execute(query, params) as cursor:
+            row = await cursor.fetchone()
+        return _row_to_checkpoint(row) if row is not None else None
+
+    async def _list_checkpoints(
+        self,
+        thread_id: Optional[str],
+        checkpoint_ns: Optional[str],
+        before: Optional[str],
+        limit: Optional[int],
+    ) -> List[Tuple[str, CheckpointRow]]:
+        connection = await self._read_connection()
+        conditions, params = [], []
+        for column, operator, value in (
+            ("thread_id", "=", thread_id), ("checkpoint_ns", "=", checkpoint_ns), ("checkpoint_id", "<", before)
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        query = f"SELECT {_CHECKPOINT_COLUMNS} FROM checkpoints"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY checkpoint_id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        async with connection.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+        return [(row[0], _row_to_checkpoint(row)) for row in rows]
+
+    async def _get_blobs(
+        self, thread_id: str, checkpoint_ns: str, channels: Sequence[str]
+    ) -> Dict[Tuple[str, str], BlobRow]:
+        connection = await self._read_connection()
+        placeholders = ", ".join("?" for _ in channels)
+        async with connection.execute(
+            "SELECT channel, version, base_version, depth, type, value FROM checkpoint_blobs"
+            f" WHERE thread_id = ? AND checkpoint_ns = ? AND channel IN ({placeholders})",
+            (thread_id, checkpoint_ns, *channels),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return {
+            (row[0], row[1]): BlobRow(checkpoint_ns, row[0], row[1], row[2], row[3], (row[4], row[5]))
+            for row in rows
+        }
+
+    async def _get_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[WriteRow]:
+        connection = await self._read_connection()
+        async with connection.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM checkpoint_writes"
+            " WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [
+            WriteRow(checkpoint_ns, checkpoint_id, row[0], row[1], row[2], (row[3], row[4]), row[5]) for row in rows
+        ]
+
+    # --- 書き込み ---
+
+    async def _save(self, thread_id: str, checkpoint: CheckpointRow, blobs: List[BlobRow]) -> None:
+        await self._submit(("checkpoint", thread_id, checkpoint, blobs, time.time()))
+
+    async def _save_writes(self, thread_id: str, writes: List[WriteRow]) -> None:
+        await self._submit(("writes", thread_id, writes))
+
+    async def _delete_thread(self, thread_id: str) -> None:
+        await self._submit(("delete", thread_id))
+
+    async def _sweep(self, expire_before: Optional[float]) -> None:
+        await self._submit(("sweep", expire_before))
+
+    async def _write_batch(self, batch: List[Any]) -> None:
+        connection = await self._connect()
+        checkpoint_rows: List[tuple] = []
+        blob_rows: List[tuple] = []
+        write_rows: List[tuple] = []
+        replace_rows: List[tuple] = []
+        updated: Dict[str, float] = {}
+
+        async def insert() -> None:
+            await connection.executemany(
+                f"INSERT OR REPLACE INTO checkpoints ({_CHECKPOINT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                checkpoint_rows,
+            )
+            await connection.executemany(
+                "INSERT OR REPLACE INTO checkpoint_blobs"
+                " (thread_id, checkpoint_ns, channel, version, base_version, depth, type, value)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                blob_rows,
+            )
+            for rows, conflict in ((write_rows, "IGNORE"), (replace_rows, "REPLACE")):
+                await connection.executemany(
+                    f"INSERT OR {conflict} INTO checkpoint_writes"
+                    " (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            await connection.executemany(
+                "INSERT INTO checkpoint_threads (thread_id, updated_at) VALUES (?, ?)"
+                " ON CONFLICT (thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                list(updated.items()),
+            )
+            for rows in (checkpoint_rows, blob_rows, write_rows, replace_rows):
+                rows.clear()
+
+        pruned = set()
+        for operation in batch:
+            kind = operation[0]
+            if kind == "checkpoint":
+                _, thread_id, checkpoint, blobs, updated_at = operation
+                checkpoint_rows.append((
+                    thread_id, checkpoint.checkpoint_ns, checkpoint.checkpoint_id, checkpoint.parent_id,
+                    *checkpoint.checkpoint, *checkpoint.metadata, json.dumps(checkpoint.channel_versions),
+                ))
+                blob_rows += [
+                    (thread_id, blob.checkpoint_ns, blob.channel, blob.version, blob.base_version, blob.depth, *blob.value)
+                    for blob in blobs
+                ]
+                updated[thread_id] = updated_at
+                pruned.add(thread_id)
+            elif kind == "writes":
+                _, thread_id, writes = operation
+                for write in writes:
+                    (replace_rows if write.idx < 0 else write_rows).append((
+                        thread_id, write.checkpoint_ns, write.checkpoint_id, write.task_id, write.idx,
+                        write.channel, *write.value, write.task_path,
+                    ))
+            else:
+                # 削除より前の書き込みを先に反映する
+                await insert()
+                updated.clear()
+                if kind == "delete":
+                    await self._delete_threads(connection, [operation[1]])
+                    pruned.discard(operation[1])
+                else:
+                    await self._delete_threads(connection, await self._expired_threads(connection, operation[1]))
+        await insert()
+        for thread_id in pruned:
+            await self._prune(connection, thread_id)
+        await connection.commit()
+
+    async def _prune(self, connection, thread_id: str) -> None:
+        """名前空間ごとに新しい keep 件のチェックポイントだけを残し、参照されなくなった値と書き込みを削除する"""
+        async with connection.execute(
+            "SELECT checkpoint_ns, checkpoint_id, channel_versions FROM checkpoints"
+            " WHERE thread_id = ? ORDER BY checkpoint_ns, checkpoint_id DESC",
+            (thread_id,),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        kept: List[Tuple[str, Dict[str, str]]] = []
+        dropped: List[Tuple[str, str, str]] = []
+        counts: Dict[str, int] = {}
+        for checkpoint_ns, checkpoint_id, channel_versions in rows:
+            counts[checkpoint_ns] = counts.get(checkpoint_ns, 0) + 1
+            if counts[checkpoint_ns] <= self.keep:
+                kept.append((checkpoint_ns, json.loads(channel_versions)))
+            else:
+                dropped.append((thread_id, checkpoint_ns, checkpoint_id))
+        if not dropped:
+            return
+
+        for table in ("checkpoints", "checkpoint_writes"):
+            await connection.executemany(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", dropped
+            )
+        async with connection.execute(
+            "SELECT checkpoint_ns, channel, version, base_version FROM checkpoint_blobs WHERE thread_id = ?",
+            (thread_id,),
+        ) as cursor:
+            bases = {(row[0], row[1], row[2]): row[3] for row in await cursor.fetchall()}
+        keep = reachable_blobs(kept, bases)
+        await connection.executemany(
+            "DELETE FROM checkpoint_blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+            [(thread_id, *key) for key in bases if key not in keep],
+        )
+
+    async def _expired_threads(self, connection, expire_before: Optional[float]) -> List[str]:
+        thread_ids = []
+        if expire_before is not None:
+            async with connection.execute(
+                "SELECT thread_id FROM checkpoint_threads WHERE updated_at < ?", (expire_before,)
+            ) as cursor:
+                thread_ids += [row[0] for row in await cursor.fetchall()]
+        if self.max_threads:
+            # 更新の新しい max_threads 件より後の会話
+            async with connection.execute(
+                "SELECT thread_id FROM checkpoint_threads ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                (self.max_threads,),
+            ) as cursor:
+                thread_ids += [row[0] for row in await cursor.fetchall()]
+        return list(dict.fromkeys(thread_ids))
+
+    @staticmethod
+    async def _delete_threads(connection, thread_ids: List[str]) -> None:
+        if not thread_ids:
+            return
+        for table in ("checkpoints", "checkpoint_blobs", "checkpoint_writes", "checkpoint_threads"):
+            await connection.executemany(
+                f"DELETE FROM {table} WHERE thread_id = ?", [(thread_id,) for thread_id in thread_ids]
+            )
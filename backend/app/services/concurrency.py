@@ -0,0 +1,100 @@
+"""
+LLM呼び出しの同時実行制御
+
+モデルごとにセマフォを持ち、同時に実行できるLLM呼び出しの数を制限する。
+セマフォの空きを待つリクエストの数にも上限を設け、上限を超えた場合や
+待ち時間がタイムアウトした場合は即座に LLMCapacityError を送出する。
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from app.core.config import settings
+
+
+class LLMCapacityError(Exception):
+    """LLMの同時実行数の上限に達し、待ち行列にも入れない場合のエラー"""
+
+
+class ConcurrencyLimiter:
+    """
+    同時実行数と待ち行列の長さを制限するリミッター
+    """
+
+    def __init__(self, max_concurrency: int, max_queue_size: int, queue_timeout: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._running = 0
+
+    @property
+    def waiting(self) -> int:
+        """セマフォの空きを待っているリクエスト数"""
+        return self._waiting
+
+    @property
+    def running(self) -> int:
+        """実行中のリクエスト数"""
+        return self._running
+
+    @property
+    def available(self) -> bool:
+        """待たずに実行枠を確保できるかどうか"""
+        return not self._semaphore.locked()
+
+    async def reserve(self) -> None:
+        """
+        実行枠を確保する（使い終わったら release() で返す）。
+        待ち行列が満杯、または待ち時間がタイムアウトした場合は LLMCapacityError を送出する
+        """
+        if self._semaphore.locked() and self._waiting >= self.max_queue_size:
+            raise LLMCapacityError(
+                f"LLMの待ち行列が上限（{self.max_queue_size}件）に達しています"
+            )
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise LLMCapacityError(
+                f"LLMの実行枠を{self.queue_timeout}秒以内に確保できませんでした"
+            )
+        finally:
+            self._waiting -= 1
+        self._running += 1
+
+    def release(self) -> None:
+        """reserve() で確保した実行枠を返す"""
+        self._running -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """
+        実行枠を確保する。待ち行列が満杯、または待ち時間がタイムアウトした場合は LLMCapacityError を送出する
+        """
+        await self.reserve()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# モデル名ごとのリミッター
+_limiters: Dict[str, ConcurrencyLimiter] = {}
+
+
+def get_llm_limiter(model_name: str) -> ConcurrencyLimiter:
+    """
+    指定されたモデルのリミッターを取得する（なければ設定値から作成する）
+    """
+    limiter = _limiters.get(model_name)
+    if limiter is None:
+        limiter = ConcurrencyLimiter(
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            max_queue_size=settings.LLM_MAX_QUEUE_SIZE,
+            queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+        )
+        _limiters[model_name] = limiter
+    return limiter
@@ -1,90 +1,313 @@
-from typing import Dict, List, Optional, Any
-from uuid import UUID
+import base64
+import json
+import logging
 from datetime import datetime
-from app.schemas.chat import ChatMessage, Conversation
-from app.services.agent import process_message
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple
+from uuid import UUID
+from langchain_core.messages import BaseMessage
+from app.core.config import settings
+from app.schemas.chat import ChatMessage, Conversation, ConversationPage
+from app.services.admission import retry_after_for
+from app.services.agent import get_checkpointed_messages, process_message, stream_message
+from app.services.checkpoint import get_checkpointer
+from app.services.concurrency import LLMCapacityError
+from app.services.history import build_history, can_resume
+from app.services.metrics import AGENT_CHECKPOINT_TURNS_TOTAL, STORE_SECONDS, stage
+from app.services.search import get_conversation_search
+from app.services.store import get_conversation_store
+from app.services.store.message_log import MessageRecord
+from app.services.store.ordering import ListCursor
+from app.services.summary_worker import get_summary_worker
+
+logger = logging.getLogger(__name__)
+
+# 会話の保存先は CONVERSATION_STORE_BACKEND で切り替える（app/services/store）
 
-# 会話を保存するためのインメモリストレージ
-# 実際のアプリケーションではデータベースを使用することを推奨
-conversations: Dict[UUID, Conversation] = {}
+# エクスポートで1回に読み出す会話数・メッセージ数と、まとめて送り出すバイト数の目安
+EXPORT_CONVERSATION_PAGE_SIZE = 100
+EXPORT_MESSAGE_PAGE_SIZE = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
 
 
 async def get_all_conversation_ids() -> List[UUID]:
     """
-    メモリに保存されている全ての会話IDを取得する
+    ストアに保存されている全ての会話IDを取得する
     """
-    return list(conversations.keys())
+    return await get_conversation_store().list_conversation_ids()
+
+
+def _local_datetime(value: Optional[datetime]) -> Optional[datetime]:
+    """ストアの日時（タイムゾーンなしのローカル時刻）と比較できる形にする"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def encode_cursor(cursor: ListCursor) -> str:
+    """会話一覧のカーソルをURLに含められる文字列にする"""
+    updated_at, conversation_id = cursor
+    raw = f"{updated_at.isoformat(timespec='microseconds')}|{conversation_id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(value: str) -> ListCursor:
+    """encode_cursor の結果を戻す。不正な値の場合は ValueError を送出する"""
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode("ascii")
+        updated_at, conversation_id = raw.split("|")
+        return datetime.fromisoformat(updated_at), UUID(conversation_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"不正なカーソルです: {value}") from e
+
+
+async def list_conversations(
+    limit: int,
+    cursor: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+    updated_until: Optional[datetime] = None,
+) -> ConversationPage:
+    """
+    会話を更新日時の新しい順に limit 件取得する
+    cursor には前のページの next_cursor を指定する（不正な値の場合は ValueError）
+    """
+    after = decode_cursor(cursor) if cursor else None
+    # 1件多く読み、次のページがあるかどうかを判定する
+    infos = await get_conversation_store().list_conversations(
+        limit + 1,
+        after=after,
+        updated_since=_local_datetime(updated_since),
+        updated_until=_local_datetime(updated_until),
+    )
+    next_cursor = encode_cursor(infos[limit - 1].cursor) if len(infos) > limit else None
+    return ConversationPage(conversations=[info.to_summary() for info in infos[:limit]], next_cursor=next_cursor)
+
+
+async def export_conversations(
+    updated_since: Optional[datetime] = None, updated_until: Optional[datetime] = None
+) -> AsyncIterator[str]:
+    """
+    会話とメッセージをNDJSONで書き出す
+
+    会話は更新日時の古い順に1ページずつ読み、各会話の行の後にそのメッセージの行を続ける。
+    読み出しも送り出しも一定量ずつ行うため、全体の大きさによらずメモリ使用量は一定になる。
+    書き出し中に更新された会話は末尾に移るため、重複して出力されることはあっても漏れることはない
+    """
+    store = get_conversation_store()
+    updated_since = _local_datetime(updated_since)
+    updated_until = _local_datetime(updated_until)
+    buffer: List[str] = []
+    size = 0
+    after: Optional[ListCursor] = None
+    while True:
+        infos = await store.list_conversations(
+            EXPORT_CONVERSATION_PAGE_SIZE,
+            after=after,
+            newest_first=False,
+            updated_since=updated_since,
+            updated_until=updated_until,
+        )
+        for info in infos:
+            line = json.dumps({"type": "conversation", **info.to_summary().model_dump(mode="json")}, ensure_ascii=False)
+            buffer.append(line + "\n")
+            size += len(line)
+            if size >= EXPORT_CHUNK_BYTES:
+                yield "".join(buffer)
+                buffer, size = [], 0
+            last_message: Optional[UUID] = None
+            while True:
+                messages = await store.get_messages(info.id, after=last_message, limit=EXPORT_MESSAGE_PAGE_SIZE)
+                for message in messages:
+                    line = json.dumps(
+                        {"type": "message", "conversation_id": str(info.id), **message.to_dict()}, ensure_ascii=False
+                    )
+                    buffer.append(line + "\n")
+                    size += len(line)
+                    if size >= EXPORT_CHUNK_BYTES:
+                        yield "".join(buffer)
+                        buffer, size = [], 0
+                if len(messages) < EXPORT_MESSAGE_PAGE_SIZE:
+                    break
+                last_message = messages[-1].id
+        if len(infos) < EXPORT_CONVERSATION_PAGE_SIZE:
+            break
+        after = infos[-1].cursor
+    if buffer:
+        yield "".join(buffer)
 
 
 async def get_conversation(conversation_id: UUID) -> Optional[Conversation]:
     """
     指定されたIDの会話を取得する
     """
-    return conversations.get(conversation_id)
+    return await get_conversation_store().get_conversation(conversation_id)
 
 
-async def create_conversation() -> Conversation:
+async def get_conversation_messages(
+    conversation_id: UUID,
+    after: Optional[UUID] = None,
+    limit: Optional[int] = None,
+    before: Optional[UUID] = None,
+) -> Optional[List[ChatMessage]]:
+    """
+    指定された会話のメッセージを古い順に取得する
+    after / before が指定された場合はそのメッセージより後 / 前のメッセージのみを返す
+    会話が存在しない場合はNoneを返す
+    """
+    store = get_conversation_store()
+    if not await store.has_conversation(conversation_id):
+        return None
+    messages = await store.get_messages(conversation_id, after=after, limit=limit, before=before)
+    return [message.to_chat_message() for message in messages]
+
+
+async def create_conversation(conversation_id: Optional[UUID] = None) -> Conversation:
     """
     新しい会話を作成する
     """
-    conversation = Conversation()
-    conversations[conversation.id] = conversation
+    conversation = Conversation(id=conversation_id) if conversation_id else Conversation()
+    with stage(STORE_SECONDS, "store.create_conversation", operation="create_conversation"):
+        await get_conversation_store().create_conversation(conversation)
     return conversation
 
 
 async def add_message_to_conversation(
     conversation_id: UUID, role: str, content: str
-) -> ChatMessage:
+) -> MessageRecord:
     """
-    会話にメッセージを追加する
+    会話にメッセージを追加する（会話がなければ作成する）
     """
-    conversation = await get_conversation(conversation_id)
-    if not conversation:
-        conversation = await create_conversation()
-        conversation.id = conversation_id
-    
-    message = ChatMessage(role=role, content=content)
-    conversation.messages.append(message)
-    conversation.updated_at = datetime.now()
-    
+    message = MessageRecord(role, content)
+    with stage(STORE_SECONDS, "store.append_message", operation="append_message"):
+        await get_conversation_store().append_message(conversation_id, message)
+    search = get_conversation_search()
+    if search is not None:
+        search.add_message(conversation_id, message)
+    if settings.HISTORY_SUMMARY_ENABLED:
+        # 未要約のメッセージが溜まったらバックグラウンドで要約する
+        get_summary_worker().notify(conversation_id)
     return message
 
 
-async def handle_chat_request(
+async def _prepare_chat(
     message: str, conversation_id: Optional[UUID] = None, metadata: Dict[str, Any] = None
-) -> Dict[str, Any]:
+) -> Tuple[UUID, MessageRecord, Dict[str, Any], Optional[List[BaseMessage]]]:
     """
-    チャットリクエストを処理し、AIの応答を返す
+    ユーザーメッセージを会話に追加し、エージェントに渡すコンテキストと会話履歴を準備する
+    会話のチェックポイントから続けられる場合、会話履歴はNone（組み立てない）
     """
+    store = get_conversation_store()
+    
     # 会話IDがない場合は新しい会話を作成
     if not conversation_id:
         conversation = await create_conversation()
         conversation_id = conversation.id
     else:
-        conversation = await get_conversation(conversation_id)
-        if not conversation:
-            conversation = await create_conversation()
-            conversation.id = conversation_id
+        with stage(STORE_SECONDS, "store.has_conversation", operation="has_conversation"):
+            exists = await store.has_conversation(conversation_id)
+        if not exists:
+            await create_conversation(conversation_id)
     
     # ユーザーメッセージを会話に追加
-    await add_message_to_conversation(conversation_id, "user", message)
+    user_message = await add_message_to_conversation(conversation_id, "user", message)
     
     # コンテキストの準備
     context = metadata or {}
     
-    # 過去の会話履歴をコンテキストに追加
-    if conversation and conversation.messages:
-        # 最新の5つのメッセージのみを使用（パフォーマンスのため）
-        recent_messages = conversation.messages[-5:]
-        context["history"] = [
-            {"role": msg.role, "content": msg.content} for msg in recent_messages
-        ]
+    # チェックポイントに保存した状態が会話ストアと一致していれば、履歴を組み立てずにそこから続ける
+    if get_checkpointer() is not None:
+        with stage(STORE_SECONDS, "store.resume_checkpoint", operation="resume_checkpoint"):
+            saved = await get_checkpointed_messages(conversation_id)
+            resumable = saved is not None and await can_resume(
+                store, conversation_id, saved, exclude_message_id=user_message.id
+            )
+        AGENT_CHECKPOINT_TURNS_TOTAL.inc(outcome="resumed" if resumable else "rebuilt")
+        if resumable:
+            return conversation_id, user_message, context, None
+    
+    # 過去の会話履歴をトークン数の予算内で取得（あふれた分は要約に畳み込む）
+    with stage(STORE_SECONDS, "store.build_history", operation="build_history"):
+        history = await build_history(store, conversation_id, exclude_message_id=user_message.id)
+    
+    return conversation_id, user_message, context, history.messages
+
+
+async def handle_chat_request(
+    message: str, conversation_id: Optional[UUID] = None, metadata: Dict[str, Any] = None
+) -> Dict[str, Any]:
+    """
+    チャットリクエストを処理し、AIの応答を返す
+    今回追加されたメッセージは new_messages に古い順で（APIのスキーマで）格納する
+    """
+    conversation_id, user_message, context, history = await _prepare_chat(message, conversation_id, metadata)
     
     # エージェントにメッセージを処理させる
-    response = await process_message(message, conversation_id, context)
+    response = await process_message(
+        message, conversation_id, context, history, message_id=user_message.id, resume=history is None
+    )
+    response["conversation_id"] = conversation_id
+    new_messages = [user_message]
     
     # AIの応答を会話に追加
     if not response.get("error"):
-        await add_message_to_conversation(conversation_id, "assistant", response["message"])
+        assistant_message = await add_message_to_conversation(conversation_id, "assistant", response["message"])
+        new_messages.append(assistant_message)
+    response["new_messages"] = [message.to_chat_message() for message in new_messages]
     
     return response
+
+
+async def stream_chat_request(
+    message: str, conversation_id: Optional[UUID] = None, metadata: Dict[str, Any] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    チャットリクエストを処理し、AIの応答をイベント単位で返す
+
+    イベントは `start` → `token`（複数） → `end` の順に返し、失敗時は `error` を返す。
+    AIの応答はストリームが最後まで完了した場合のみ会話に追加する
+    """
+    # 入力値のバリデーション
+    if not message or message == "string":
+        yield {"type": "error", "message": "有効なメッセージを入力してください。"}
+        return
+    
+    conversation_id, user_message, context, history = await _prepare_chat(message, conversation_id, metadata)
+    yield {"type": "start", "conversation_id": str(conversation_id), "user_message_id": str(user_message.id)}
+    
+    chunks: List[str] = []
+    try:
+        async for token in stream_message(
+            message, conversation_id, context, history, message_id=user_message.id, resume=history is None
+        ):
+            chunks.append(token)
+            yield {"type": "token", "content": token}
+    except LLMCapacityError as e:
+        logger.error("LLMの実行枠を確保できませんでした: %s", e)
+        yield {
+            "type": "error",
+            "message": "ただいま混雑しています。しばらくしてから再度お試しください。",
+            "retry_after": retry_after_for(e),
+        }
+        return
+    except Exception as e:
+        retry_after = retry_after_for(e)
+        if retry_after is not None:
+            logger.error("LLMのレート制限に達しました: %s", e)
+            yield {
+                "type": "error",
+                "message": "ただいま混雑しています。しばらくしてから再度お試しください。",
+                "retry_after": retry_after,
+            }
+            return
+        logger.error("ストリーミング中にエラーが発生しました: %s", e)
+        yield {"type": "error", "message": f"申し訳ありません。メッセージ処理中にエラーが発生しました: {str(e)}"}
+        return
+    
+    # 完成したAIの応答を会話に追加
+    content = "".join(chunks)
+    assistant_message = await add_message_to_conversation(conversation_id, "assistant", content)
+    yield {
+        "type": "end",
+        "conversation_id": str(conversation_id),
+        "message_id": str(assistant_message.id),
+        "message": content,
+    }
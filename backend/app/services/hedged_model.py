@@ -0,0 +1,223 @@
+"""
+ヘッジ要求を行うチャットモデル
+
+主モデルにストリーミングで要求を送り、最初のトークンが予算内に届かなければ予備モデルにも同じ要求を送る。
+先に内容のあるチャンクを返した方を勝ちとし、もう一方のストリームはキャンセルして閉じる（HTTPの接続も解放される）。
+最初のトークンの前に主モデルが失敗した場合は予算を待たずに予備モデルに切り替え、両方が失敗した場合は最後の例外を送出する。
+最初のトークンを返した後の失敗は切り替えない（返したトークンと矛盾する応答を混ぜないため）。
+
+主モデルの実行枠は呼び出し元が get_llm_limiter で確保している。予備モデルへの要求は予備モデルのリミッターの実行枠を
+確保してから送り、応答を読み終えるかキャンセルするまで保持する。ヘッジ要求は予備モデルの実行枠に空きがない場合は送らない
+（主モデルの応答を待つ。hedges_skipped に数える）。主モデルの失敗による切り替えは空きを待つ。
+
+同期の呼び出し（invoke など）はヘッジ要求を送らず、主モデルが失敗した場合のみ予備モデルに切り替える。
+リミッターはイベントループ上のセマフォのため、同期の呼び出しでは予備モデルの実行枠も確保しない。
+
+内側のモデルの呼び出しには呼び出し元のコールバックを渡さないため、astream_events には勝った応答のトークンだけが
+このモデルのイベントとして流れる。内側のモデル自身のコールバック（モデルごとのメトリクス）はそのまま記録される。
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import agenerate_from_stream
+from langchain_core.messages import BaseMessage, BaseMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+from app.services.concurrency import ConcurrencyLimiter, get_llm_limiter
+from app.services.model_tiering import FALLBACK, PRIMARY, ModelTier, TierStats
+
+logger = logging.getLogger(__name__)
+
+# 内側のモデルに呼び出し元のコールバックを引き継がせない設定
+_DETACHED = {"callbacks": []}
+
+
+class _Attempt:
+    """
+    1つのモデルへのストリーミング要求。最初の内容のあるチャンクまでをタスクで読む
+    limiter を指定した場合は、実行枠を確保してから要求を送り、cancel() まで保持する
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: BaseChatModel,
+        messages: List[BaseMessage],
+        stop,
+        kwargs,
+        limiter: Optional[ConcurrencyLimiter] = None,
+    ):
+        self.name = name
+        self.limiter = limiter
+        self.reserved = False
+        self.stream: Optional[AsyncIterator[BaseMessageChunk]] = None
+        # 最初の内容のあるチャンクまでに受け取ったチャンク
+        self.buffered: List[BaseMessageChunk] = []
+        self.finished = False
+        self.task = asyncio.create_task(self._first_token(model, messages, stop, kwargs))
+
+    async def _first_token(self, model: BaseChatModel, messages: List[BaseMessage], stop, kwargs) -> None:
+        if self.limiter is not None:
+            await self.limiter.reserve()
+            self.reserved = True
+        self.stream = model.astream(messages, _DETACHED, stop=stop, **kwargs)
+        while True:
+            try:
+                chunk = await self.stream.__anext__()
+            except StopAsyncIteration:
+                self.finished = True
+                return
+            self.buffered.append(chunk)
+            if chunk.content:
+                return
+
+    async def cancel(self) -> None:
+        """要求をキャンセルし、ストリームを閉じて実行枠を返す"""
+        if not self.task.done():
+            self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        if self.stream is not None:
+            try:
+                await self.stream.aclose()
+            except Exception as e:
+                logger.debug("キャンセルしたストリームを閉じる際にエラーが発生しました: %s", e)
+        if self.reserved:
+            self.reserved = False
+            self.limiter.release()
+
+
+def _generation_chunk(chunk: BaseMessageChunk) -> ChatGenerationChunk:
+    # IDは外側のモデルの呼び出しのものを付け直す
+    chunk.id = None
+    return ChatGenerationChunk(message=chunk)
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    主モデルの最初のトークンが first_token_budget 秒以内に届かない場合に、予備モデルへのヘッジ要求を送るチャットモデル
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    primary: BaseChatModel
+    fallback: BaseChatModel
+    tier: ModelTier
+    stats: TierStats
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-chat-model"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"primary": self.tier.primary, "fallback": self.tier.fallback}
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        stats = self.stats
+        stats.requests += 1
+        started = time.perf_counter()
+        attempts = [_Attempt(PRIMARY, self.primary, messages, stop, kwargs)]
+        pending = {attempts[0].task}
+        winner: Optional[_Attempt] = None
+        hedged = False
+        # 予備モデルへの要求を送ったか、予算を過ぎて送るかどうかを決めた
+        budget_spent = False
+        error: Optional[BaseException] = None
+        fallback_limiter = get_llm_limiter(self.tier.fallback)
+        try:
+            while winner is None:
+                # 予備モデルへの要求を送るかどうかを決めるまでは予算の残り時間だけ待つ
+                timeout = None
+                if not budget_spent:
+                    timeout = max(0.0, started + self.tier.first_token_budget - time.perf_counter())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    budget_spent = True
+                    if not fallback_limiter.available:
+                        # 予備モデルが混雑している場合はヘッジ要求で待ち行列を増やさず、主モデルの応答を待つ
+                        stats.hedges_skipped += 1
+                        continue
+                    hedged = True
+                    stats.hedged += 1
+                    attempts.append(_Attempt(FALLBACK, self.fallback, messages, stop, kwargs, fallback_limiter))
+                    pending.add(attempts[-1].task)
+                    continue
+                # 同時に終わった場合は主モデルを優先する
+                for attempt in attempts:
+                    if attempt.task not in done:
+                        continue
+                    if attempt.task.exception() is None:
+                        winner = attempt
+                        break
+                    error = attempt.task.exception()
+                    if attempt.name == PRIMARY:
+                        stats.primary_errors += 1
+                    else:
+                        stats.fallback_errors += 1
+                    logger.warning(
+                        "%s の%sモデル %s の呼び出しに失敗しました: %s: %s", self.tier.role,
+                        "主" if attempt.name == PRIMARY else "予備",
+                        self.tier.primary if attempt.name == PRIMARY else self.tier.fallback,
+                        type(error).__name__, error,
+                    )
+                if winner is None and not pending:
+                    if len(attempts) > 1:
+                        stats.record_failure(hedged)
+                        raise error
+                    # 主モデルが最初のトークンの前に失敗した場合はすぐに予備モデルに切り替える（実行枠の空きは待つ）
+                    budget_spent = True
+                    stats.failovers += 1
+                    attempts.append(_Attempt(FALLBACK, self.fallback, messages, stop, kwargs, fallback_limiter))
+                    pending = {attempts[-1].task}
+
+            for attempt in attempts:
+                if attempt is not winner:
+                    await attempt.cancel()
+            stats.record_first_token(winner.name, time.perf_counter() - started, hedged)
+
+            for chunk in winner.buffered:
+                yield _generation_chunk(chunk)
+            if not winner.finished:
+                async for chunk in winner.stream:
+                    yield _generation_chunk(chunk)
+            stats.record_total(winner.name, time.perf_counter() - started)
+        finally:
+            # 呼び出し元がキャンセルした場合や途中で失敗した場合も、すべてのストリームを閉じる
+            for attempt in attempts:
+                await attempt.cancel()
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # 最初のトークンの時刻で勝ち負けを決めるため、ストリーミングしない呼び出しも内部ではストリーミングで行う
+        return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # 同期の呼び出しはヘッジせず、主モデルが失敗した場合のみ予備モデルを使う（モジュールの説明を参照）
+        self.stats.requests += 1
+        try:
+            message = self.primary.invoke(messages, _DETACHED, stop=stop, **kwargs)
+        except Exception:
+            self.stats.primary_errors += 1
+            self.stats.failovers += 1
+            message = self.fallback.invoke(messages, _DETACHED, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
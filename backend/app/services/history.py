@@ -0,0 +1,229 @@
+"""
+LLMに渡す会話履歴の構築
+
+会話の要約と直近のメッセージだけを読み込み、最新のメッセージからトークン数の予算に
+収まるだけ遡って履歴に含める。要約は SystemMessage として先頭に渡す。
+要約の更新はリクエスト中には行わず、バックグラウンドの要約ワーカーに任せる（summary_worker.py）。
+メッセージごとのトークン数はメッセージIDをキーにキャッシュし、毎ターン数え直さない。
+tiktokenのエンコーディングの読み込み（初回はダウンロードを含む）はイベントループを止めないよう、
+アプリケーションの起動時に別スレッドで始める（start_token_counter_load）。
+エージェントのチェックポイントが有効な場合は、保存した状態が会話ストアと一致し予算に収まる間は
+履歴を組み立てず、保存した状態から続ける（can_resume）。
+"""
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Union
+from uuid import UUID
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from app.core.config import settings
+from app.services.store import ConversationStore
+from app.services.store.message_log import MessageRecord
+from app.services.summary_worker import get_summary_worker
+
+logger = logging.getLogger(__name__)
+
+# メッセージごとのロール等の付加トークン数（OpenAIのチャット形式の目安）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+class TokenCounter:
+    """
+    tiktokenでトークン数を数える。エンコーディングを読み込めない環境では文字数から概算する
+    """
+
+    def __init__(self, model_name: str, cache_size: int = 100_000):
+        self.cache_size = cache_size
+        # キーは会話ストアのメッセージID（UUID）か、チェックポイントのメッセージID（文字列）
+        self._cache: "OrderedDict[Union[UUID, str], int]" = OrderedDict()
+        self._encoding = None
+        try:
+            import tiktoken
+
+            try:
+                self._encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning("tiktokenのエンコーディングを読み込めないため、トークン数を概算します: %s", e)
+
+    def count_text(self, text: str) -> int:
+        """テキストのトークン数"""
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        # 日本語は1文字1トークン、それ以外は4文字1トークン程度で概算する
+        cjk = len(_CJK.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def count(self, message: Union[MessageRecord, BaseMessage]) -> int:
+        """メッセージのトークン数（メッセージIDごとにキャッシュする。IDのないメッセージは毎回数える）"""
+        if message.id is None:
+            return self.count_text(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+        tokens = self._cache.get(message.id)
+        if tokens is not None:
+            self._cache.move_to_end(message.id)
+            return tokens
+        tokens = self.count_text(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+        self._cache[message.id] = tokens
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return tokens
+
+
+def to_langchain_message(message: MessageRecord) -> BaseMessage:
+    """MessageRecord をLangChainのメッセージに変換する"""
+    if message.role == "assistant":
+        return AIMessage(content=message.content)
+    return HumanMessage(content=message.content)
+
+
+def summary_message(summary: str) -> SystemMessage:
+    """要約をLLMに渡すSystemMessageを作成する"""
+    return SystemMessage(content=f"これまでの会話の要約:\n{summary}")
+
+
+@dataclass
+class ConversationHistory:
+    """LLMに渡す会話履歴"""
+    messages: List[BaseMessage] = field(default_factory=list)
+    token_count: int = 0
+    # 予算に収まらず履歴から外したメッセージ数
+    dropped_count: int = 0
+
+
+_token_counter: Optional[TokenCounter] = None
+_token_counter_load: Optional[asyncio.Future] = None
+
+
+def _create_token_counter() -> TokenCounter:
+    return TokenCounter(settings.OPENAI_MODEL_NAME, settings.HISTORY_TOKEN_CACHE_SIZE)
+
+
+def start_token_counter_load() -> None:
+    """
+    トークンカウンター（tiktokenのエンコーディング）の読み込みを別スレッドで始める
+    """
+    global _token_counter_load
+    if _token_counter is None and _token_counter_load is None:
+        _token_counter_load = asyncio.ensure_future(asyncio.to_thread(_create_token_counter))
+        _token_counter_load.add_done_callback(_set_token_counter)
+
+
+def _set_token_counter(load: asyncio.Future) -> None:
+    global _token_counter
+    # TokenCounter は読み込みに失敗しても概算に切り替えるため、例外は送出しない
+    if not load.cancelled() and _token_counter is None:
+        _token_counter = load.result()
+
+
+def is_token_counter_ready() -> bool:
+    """トークンカウンターの読み込みが終わっているかどうか"""
+    return _token_counter is not None
+
+
+async def load_token_counter() -> TokenCounter:
+    """
+    共有のトークンカウンターを取得する（読み込み中であれば完了を待ち、読み込みを始めていなければ始める）
+    """
+    global _token_counter
+    if _token_counter is None:
+        start_token_counter_load()
+        counter = await asyncio.shield(_token_counter_load)
+        if _token_counter is None:
+            _token_counter = counter
+    return _token_counter
+
+
+def get_token_counter() -> TokenCounter:
+    """
+    共有のトークンカウンターを取得する（読み込んでいなければこのスレッドで読み込む。
+    イベントループ上では load_token_counter を使う）
+    """
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = _create_token_counter()
+    return _token_counter
+
+
+async def build_history(
+    store: ConversationStore,
+    conversation_id: UUID,
+    exclude_message_id: Optional[UUID] = None,
+    token_budget: Optional[int] = None,
+) -> ConversationHistory:
+    """
+    会話履歴をトークン数の予算内で構築する
+
+    exclude_message_id には今回のユーザーメッセージを指定する（履歴とは別にLLMに渡すため）
+    """
+    budget = settings.HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+    counter = await load_token_counter()
+
+    recent = await store.get_recent_messages(conversation_id, settings.HISTORY_MAX_MESSAGES + 1)
+    recent = [message for message in recent if message.id != exclude_message_id]
+    summary, summary_until = await store.get_summary(conversation_id)
+
+    # 要約済みのメッセージは履歴に含めない
+    if summary_until is not None:
+        for index, message in enumerate(recent):
+            if message.id == summary_until:
+                recent = recent[index + 1:]
+                break
+
+    # 新しいものから予算に収まるだけ含める
+    used = counter.count_text(summary) if summary else 0
+    kept: List[MessageRecord] = []
+    for message in reversed(recent):
+        tokens = counter.count(message)
+        if used + tokens > budget or len(kept) >= settings.HISTORY_MAX_MESSAGES:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+
+    dropped_count = len(recent) - len(kept)
+    if dropped_count and settings.HISTORY_SUMMARY_ENABLED:
+        # 予算からあふれたメッセージは次のリクエストまでに要約へ畳み込まれるようにする
+        get_summary_worker().schedule(conversation_id)
+
+    messages: List[BaseMessage] = [summary_message(summary)] if summary else []
+    messages += [to_langchain_message(message) for message in kept]
+    return ConversationHistory(messages=messages, token_count=used, dropped_count=dropped_count)
+
+
+async def can_resume(
+    store: ConversationStore,
+    conversation_id: UUID,
+    saved: Sequence[BaseMessage],
+    exclude_message_id: Optional[UUID] = None,
+) -> bool:
+    """
+    チェックポイントに保存したメッセージ（saved）から次のターンを続けられるかどうか
+
+    保存した状態の最後のやり取り（ユーザーメッセージとAIの応答）が会話ストアの直前のやり取りと一致し、
+    トークン数・メッセージ数が build_history と同じ上限に収まる場合のみ続けられる。
+    再起動・他のワーカーでのターン・応答の保存に失敗したターンがあった場合や、上限を超えた場合は
+    build_history で履歴を組み立て直す（あふれた分は要約に畳み込まれる）
+    """
+    if len(saved) < 2 or not isinstance(saved[-1], AIMessage) or not isinstance(saved[-2], HumanMessage):
+        return False
+
+    recent = await store.get_recent_messages(conversation_id, 3)
+    recent = [message for message in recent if message.id != exclude_message_id]
+    if len(recent) < 2:
+        return False
+    user, assistant = recent[-2:]
+    if user.role != "user" or assistant.role != "assistant":
+        return False
+    if saved[-2].id != str(user.id) or saved[-1].content != assistant.content:
+        return False
+
+    conversation = [message for message in saved if not isinstance(message, SystemMessage)]
+    if len(conversation) > settings.HISTORY_MAX_MESSAGES:
+        return False
+    counter = await load_token_counter()
+    return sum(counter.count(message) for message in saved) <= settings.HISTORY_TOKEN_BUDGET
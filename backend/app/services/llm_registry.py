@@ -0,0 +1,178 @@
+"""
+LLMインスタンスのレジストリ
+
+(モデル, 温度, ロール) ごとに ChatOpenAI を一度だけ作成して使い回す。
+すべてのインスタンスは接続プールの設定を調整した1つの httpx.AsyncClient を共有し、
+keep-alive の接続を再利用する。タイムアウトは呼び出しごと、リトライはジッター付きの指数バックオフで行う。
+
+- ロールごとのモデルは LLM_ROLE_MODELS で指定する（例: {"it_specialist": "gpt-4o"}）
+- LLM_MODEL_TIERS / LLM_FALLBACK_MODEL で予備モデルが決まるロールには、主モデルの最初のトークンが
+  予算内に届かない場合に予備モデルへヘッジ要求を送る HedgedChatModel を使う（model_tiering.py）
+- HTTP/2 は LLM_HTTP2=true で有効になる（h2 パッケージが必要。無い場合はHTTP/1.1で接続する）
+- 共有クライアントはアプリケーションの終了時に close_llm_registry() で閉じる
+- factory を指定すると ChatOpenAI の代わりにそのチャットモデルを使う（ベンチマークの偽のLLMなど）
+- METRICS_ENABLED が有効な場合は呼び出しの時間とトークン使用量をメトリクスに記録する
+"""
+import logging
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple
+import httpx
+from app.core.config import settings
+from app.services.metrics import LLMMetricsCallback
+from app.services.model_tiering import ModelTier, get_tier_stats, tier_for
+
+if TYPE_CHECKING:
+    # langchain_core.runnables はインポートに時間がかかるため、型注釈にのみ使う
+    from langchain_core.runnables import Runnable
+
+logger = logging.getLogger(__name__)
+
+
+def _retryable_exceptions() -> Tuple[type, ...]:
+    """リトライする例外（接続エラー・タイムアウト・レート制限・サーバーエラー）"""
+    import openai
+
+    return (
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    LLM呼び出し用の共有HTTPクライアントを作成する
+    """
+    limits = httpx.Limits(
+        max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+    http2 = settings.LLM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("h2 パッケージが無いため、HTTP/1.1で接続します（pip install 'httpx[http2]'）")
+            http2 = False
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+class LLMRegistry:
+    """
+    共有のHTTPクライアントを使うLLMインスタンスを (モデル, 温度, ロール) ごとに管理する
+    """
+
+    def __init__(self, factory: Optional[Callable[..., "Runnable"]] = None):
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._llms: Dict[Tuple[str, float, str], "Runnable"] = {}
+        # factory(model, temperature, callbacks) でチャットモデルを作る（省略時は ChatOpenAI）
+        self.factory = factory
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """共有のHTTPクライアント（最初に使うときに作成する）"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = create_http_client()
+            # 閉じたクライアントを参照しているインスタンスは作り直す
+            self._llms.clear()
+        return self._http_client
+
+    def model_for(self, role: str) -> str:
+        """ロールに割り当てられたモデル名（階層化している場合は主モデル）"""
+        tier = self.tier_for(role)
+        return tier.primary if tier is not None else settings.LLM_ROLE_MODELS.get(role, settings.OPENAI_MODEL_NAME)
+
+    def tier_for(self, role: str) -> Optional[ModelTier]:
+        """ロールの主モデル・予備モデルの階層（階層化していない場合はNone）"""
+        return tier_for(role, settings.LLM_ROLE_MODELS.get(role, settings.OPENAI_MODEL_NAME))
+
+    def get(self, role: str = "default", temperature: float = 0.7, model: Optional[str] = None) -> "Runnable":
+        """
+        ロール・温度に対応するLLMを取得する（リトライ付き）
+        model を省略した場合は model_for(role) のモデルを使い、ロールが階層化されていればヘッジ要求を行う
+        """
+        tier = self.tier_for(role) if model is None else None
+        model = model or self.model_for(role)
+        http_client = self.http_client
+        # 階層化したLLMは主モデルだけを指定した場合と区別する
+        key = (model if tier is None else f"{tier.primary}>{tier.fallback}", round(temperature, 2), role)
+        llm = self._llms.get(key)
+        if llm is None:
+            if tier is not None:
+                from app.services.hedged_model import HedgedChatModel
+
+                # 主モデル・予備モデルはリトライせず、両方が失敗した場合にヘッジ要求ごとリトライする
+                llm = HedgedChatModel(
+                    primary=self._create(tier.primary, temperature, http_client),
+                    fallback=self._create(tier.fallback, temperature, http_client),
+                    tier=tier,
+                    stats=get_tier_stats(tier),
+                )
+            else:
+                llm = self._create(model, temperature, http_client)
+            if settings.LLM_MAX_RETRIES > 0:
+                llm = llm.with_retry(
+                    retry_if_exception_type=_retryable_exceptions(),
+                    stop_after_attempt=settings.LLM_MAX_RETRIES + 1,
+                    wait_exponential_jitter=True,
+                    exponential_jitter_params={
+                        "initial": settings.LLM_RETRY_BACKOFF_INITIAL,
+                        "max": settings.LLM_RETRY_BACKOFF_MAX,
+                        "jitter": settings.LLM_RETRY_BACKOFF_INITIAL,
+                    },
+                )
+            self._llms[key] = llm
+        return llm
+
+    def _create(self, model: str, temperature: float, http_client: httpx.AsyncClient):
+        """モデルごとのメトリクスのコールバックを付けたチャットモデルを作成する"""
+        callbacks = [LLMMetricsCallback(model)] if settings.METRICS_ENABLED else None
+        if self.factory is not None:
+            return self.factory(model, temperature, callbacks)
+        return self._create_chat_openai(model, temperature, http_client, callbacks)
+
+    def _create_chat_openai(self, model: str, temperature: float, http_client: httpx.AsyncClient, callbacks):
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            base_url=settings.OPENAI_API_BASE,
+            http_async_client=http_client,
+            timeout=httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT),
+            # リトライはSDKではなく get() の with_retry で行う
+            max_retries=0,
+            callbacks=callbacks,
+        )
+
+    async def close(self) -> None:
+        """共有のHTTPクライアントを閉じる"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        self._llms.clear()
+
+
+_llm_registry: Optional[LLMRegistry] = None
+
+
+def get_llm_registry() -> LLMRegistry:
+    """
+    共有のLLMレジストリを取得する
+    """
+    global _llm_registry
+    if _llm_registry is None:
+        _llm_registry = LLMRegistry()
+    return _llm_registry
+
+
+async def close_llm_registry() -> None:
+    """
+    共有のLLMレジストリのHTTPクライアントを閉じる
+    """
+    global _llm_registry
+    if _llm_registry is not None:
+        await _llm_registry.close()
+        _llm_registry = None
@@ -0,0 +1,340 @@
+"""
+メトリクスとトレース
+
+処理の段階ごとの所要時間とLLMのトークン数をプロセス内で集計し、Prometheusのテキスト形式で返す
+（`GET /metrics`）。外部のクライアントライブラリは使わず、カウンター・ゲージ・ヒストグラムのみを実装する。
+
+- stage(): 段階の所要時間をヒストグラムに記録する。TRACING_ENABLED が有効な場合は同じ区間のスパンも作る
+- LLMMetricsCallback: LLM呼び出しの最初のトークンまでの時間・全体の時間・トークン数を記録する
+- 集計はイベントループ以外のスレッド（asyncio.to_thread やLLMの同期呼び出しのコールバック）からも行われるため、
+  メトリクスごとのロックで更新と出力を保護する
+"""
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+from langchain_core.callbacks.base import BaseCallbackHandler
+from app.core.config import settings
+from app.core.logging import dropped_log_count
+
+# レイテンシ用のバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """単調増加するカウンター"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge:
+    """増減する現在値"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class _HistogramValue:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """累積バケットのヒストグラム"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[LabelValues, _HistogramValue] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = _HistogramValue(len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry.counts[index] += 1
+                    break
+            entry.sum += value
+            entry.count += 1
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return entry.count if entry else 0
+
+    def render(self) -> List[str]:
+        # 出力中に更新されても _sum・_count とバケットが食い違わないよう、ロックを取って値を写す
+        with self._lock:
+            values = [(key, list(entry.counts), entry.sum, entry.count) for key, entry in self._values.items()]
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスを登録し、Prometheusのテキスト形式で出力する"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+GRAPH_BUILD_SECONDS = REGISTRY.register(Histogram(
+    "agent_graph_build_seconds", "エージェントグラフの作成にかかった時間",
+))
+AGENT_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "agent_request_seconds", "エージェントの1リクエストの処理時間", ["mode"],
+))
+AGENT_REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "agent_requests_total", "エージェントが処理したリクエスト数", ["mode", "outcome"],
+))
+NODE_SECONDS = REGISTRY.register(Histogram(
+    "agent_node_seconds", "グラフのノードごとの実行時間", ["node"],
+))
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.register(Histogram(
+    "llm_time_to_first_token_seconds", "LLM呼び出しの最初のトークンまでの時間（ストリーミング時のみ）", ["model"],
+))
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "llm_request_seconds", "LLM呼び出し全体の時間", ["model", "outcome"],
+))
+LLM_TOKENS_TOTAL = REGISTRY.register(Counter(
+    "llm_tokens_total", "LLMのトークン使用量", ["model", "type"],
+))
+LLM_TIER_FIRST_TOKEN_SECONDS = REGISTRY.register(Histogram(
+    "llm_tier_time_to_first_token_seconds",
+    "モデルの階層化でロールごとに最初のトークンを得るまでの時間（ヘッジ要求を含む）", ["tier", "winner"],
+))
+LLM_TIER_REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "llm_tier_requests_total",
+    "モデルの階層化で主モデル・予備モデルのどちらの応答を使ったか（none は両方失敗）", ["tier", "winner", "hedged"],
+))
+ADMISSION_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "admission_queue_depth", "トークン予算の空きを待っているリクエスト数",
+))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "admission_wait_seconds", "受け付けまでにトークン予算の空きを待った時間",
+))
+ADMISSION_REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "admission_requests_total", "受付制御の結果ごとのリクエスト数", ["outcome"],
+))
+AGENT_CHECKPOINT_TURNS_TOTAL = REGISTRY.register(Counter(
+    "agent_checkpoint_turns_total",
+    "チェックポイントから再開したターン数（resumed）と会話ストアの履歴から組み立てたターン数（rebuilt）", ["outcome"],
+))
+STORE_SECONDS = REGISTRY.register(Histogram(
+    "conversation_store_seconds", "会話ストアの操作ごとの時間", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+))
+SEARCH_SECONDS = REGISTRY.register(Histogram(
+    "search_query_seconds", "全文検索のインデックスの検索時間（本文の抜粋の読み出しを除く）",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+))
+LOG_RECORDS_DROPPED = REGISTRY.register(Gauge(
+    "log_records_dropped", "ログのキューがいっぱいで捨てたログの件数（プロセスの起動からの累計）",
+))
+
+
+_tracer: Any = None
+_tracer_loaded = False
+
+
+def get_tracer():
+    """
+    OpenTelemetryのトレーサーを取得する（TRACING_ENABLED が無効か opentelemetry-api が無い場合はNone）
+    """
+    global _tracer, _tracer_loaded
+    if not _tracer_loaded:
+        _tracer_loaded = True
+        if settings.TRACING_ENABLED:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                import logging
+
+                logging.getLogger(__name__).warning(
+                    "opentelemetry-api が無いため、トレースを無効にします（pip install opentelemetry-api）"
+                )
+            else:
+                _tracer = trace.get_tracer("app")
+    return _tracer
+
+
+@contextmanager
+def stage(histogram: Histogram, span_name: Optional[str] = None, **labels: str) -> Iterator[None]:
+    """
+    区間の所要時間を histogram に記録する（関数のデコレーターとしても使える）
+    トレースが有効な場合は span_name（省略時はメトリクス名）のスパンも作る
+    """
+    if not settings.METRICS_ENABLED:
+        yield
+        return
+    tracer = get_tracer()
+    span = (
+        tracer.start_as_current_span(span_name or histogram.name, attributes=labels)
+        if tracer is not None else nullcontext()
+    )
+    started = time.perf_counter()
+    try:
+        with span:
+            yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    LLM呼び出しの時間とトークン使用量を記録するコールバック
+    """
+
+    # イベントループ上でそのまま実行する（スレッドプールに回さない）
+    run_inline = True
+
+    def __init__(self, model: str):
+        self.model = model
+        # run_id ごとの (開始時刻, 最初のトークンを受け取ったか)
+        self._runs: Dict[UUID, List[Any]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._runs[run_id] = [time.perf_counter(), False]
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.get(run_id)
+        if run is not None and not run[1]:
+            run[1] = True
+            LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - run[0], model=self.model)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - run[0], model=self.model, outcome="ok")
+        prompt_tokens, completion_tokens = _token_usage(response)
+        if prompt_tokens:
+            LLM_TOKENS_TOTAL.inc(prompt_tokens, model=self.model, type="prompt")
+        if completion_tokens:
+            LLM_TOKENS_TOTAL.inc(completion_tokens, model=self.model, type="completion")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - run[0], model=self.model, outcome="error")
+
+
+def _token_usage(response) -> Tuple[int, int]:
+    """LLMの結果から (プロンプトのトークン数, 生成したトークン数) を取り出す"""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+def render_metrics() -> str:
+    """Prometheusのテキスト形式のメトリクス"""
+    # 捨てたログの件数はログのハンドラーが数えているため、出力のたびに読み取る
+    LOG_RECORDS_DROPPED.set(dropped_log_count())
+    return REGISTRY.render()
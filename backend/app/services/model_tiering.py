@@ -0,0 +1,155 @@
+"""
+モデルの階層化（レイテンシのSLOに基づく主モデル・予備モデルの切り替え）
+
+ロールごとに主モデル・予備モデルと、最初のトークンまでの時間の予算を決める。
+主モデルが予算内に最初のトークンを返さない場合は予備モデルにも同じ要求を送り（ヘッジ要求）、
+先に最初のトークンを返した方の応答を使ってもう一方はキャンセルする。主モデルが失敗した場合は予算を待たずに予備モデルに切り替える。
+
+- 階層は LLM_MODEL_TIERS（ロールごと）と LLM_FALLBACK_MODEL（全ロール共通の予備モデル）で指定する
+- 呼び出しは hedged_model.HedgedChatModel が行い、LLMレジストリがロールごとに作成する
+- 階層ごとの勝ち数・ヘッジ要求の割合・最初のトークンまでの時間を TierStats に集計する
+
+このモジュールは langchain を読み込まない（統計情報のAPIやレジストリのインポートを軽く保つ）
+"""
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+from app.core.config import settings
+from app.services.metrics import LLM_TIER_FIRST_TOKEN_SECONDS, LLM_TIER_REQUESTS_TOTAL
+
+# 勝った側の呼び出し
+PRIMARY = "primary"
+FALLBACK = "fallback"
+# パーセンタイルの計算に使う直近のサンプル数
+_LATENCY_SAMPLES = 1024
+_TIER_KEYS = {"primary", "fallback", "first_token_budget_ms"}
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    """ロールの主モデル・予備モデルと、予備モデルにヘッジ要求を送るまでの時間（秒）"""
+    role: str
+    primary: str
+    fallback: str
+    first_token_budget: float
+
+
+def tier_for(role: str, primary: str) -> Optional[ModelTier]:
+    """
+    ロールの階層を返す（予備モデルが指定されていない場合はNone）
+    primary には LLM_ROLE_MODELS などから決めた、LLM_MODEL_TIERS で主モデルを省略した場合のモデルを指定する
+    """
+    config = settings.LLM_MODEL_TIERS.get(role)
+    if config is None:
+        if not settings.LLM_FALLBACK_MODEL:
+            return None
+        config = {}
+    unknown = set(config) - _TIER_KEYS
+    if unknown:
+        raise ValueError(f"LLM_MODEL_TIERS[{role!r}] に不明な項目があります: {', '.join(sorted(unknown))}")
+    fallback = config.get("fallback") or settings.LLM_FALLBACK_MODEL
+    if not fallback:
+        raise ValueError(f"LLM_MODEL_TIERS[{role!r}] に予備モデル（fallback）がありません")
+    budget_ms = float(config.get("first_token_budget_ms", settings.LLM_FIRST_TOKEN_BUDGET_MS))
+    if budget_ms < 0:
+        raise ValueError(f"LLM_MODEL_TIERS[{role!r}] の first_token_budget_ms は0以上にしてください")
+    return ModelTier(role, config.get("primary") or primary, fallback, budget_ms / 1000)
+
+
+def _percentile_ms(samples: Deque[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    values = sorted(samples)
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 1)
+
+
+@dataclass
+class TierLatency:
+    """勝った側ごとの直近の最初のトークンまでの時間と応答全体の時間（秒）"""
+    first_token: Deque[float] = field(default_factory=lambda: deque(maxlen=_LATENCY_SAMPLES))
+    total: Deque[float] = field(default_factory=lambda: deque(maxlen=_LATENCY_SAMPLES))
+    count: int = 0
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            "count": self.count,
+            "first_token_p50_ms": _percentile_ms(self.first_token, 0.5),
+            "first_token_p99_ms": _percentile_ms(self.first_token, 0.99),
+            "total_p50_ms": _percentile_ms(self.total, 0.5),
+            "total_p99_ms": _percentile_ms(self.total, 0.99),
+        }
+
+
+@dataclass
+class TierStats:
+    """階層ごとの統計情報"""
+    tier: ModelTier
+    requests: int = 0
+    # 予算を超えたため予備モデルにも要求を送った回数
+    hedged: int = 0
+    # 予算を超えたが、予備モデルの実行枠に空きがなかったためヘッジ要求を送らなかった回数
+    hedges_skipped: int = 0
+    # 主モデルが最初のトークンの前に失敗したため予備モデルに切り替えた回数
+    failovers: int = 0
+    primary_wins: int = 0
+    fallback_wins: int = 0
+    # 主モデル・予備モデルの両方が失敗した回数
+    failures: int = 0
+    primary_errors: int = 0
+    fallback_errors: int = 0
+    latency: Dict[str, TierLatency] = field(
+        default_factory=lambda: {PRIMARY: TierLatency(), FALLBACK: TierLatency()}
+    )
+
+    def record_first_token(self, winner: str, seconds: float, hedged: bool) -> None:
+        if winner == PRIMARY:
+            self.primary_wins += 1
+        else:
+            self.fallback_wins += 1
+        latency = self.latency[winner]
+        latency.count += 1
+        latency.first_token.append(seconds)
+        LLM_TIER_FIRST_TOKEN_SECONDS.observe(seconds, tier=self.tier.role, winner=winner)
+        LLM_TIER_REQUESTS_TOTAL.inc(tier=self.tier.role, winner=winner, hedged=str(hedged).lower())
+
+    def record_total(self, winner: str, seconds: float) -> None:
+        self.latency[winner].total.append(seconds)
+
+    def record_failure(self, hedged: bool) -> None:
+        self.failures += 1
+        LLM_TIER_REQUESTS_TOTAL.inc(tier=self.tier.role, winner="none", hedged=str(hedged).lower())
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
+
+    @property
+    def primary_win_rate(self) -> float:
+        wins = self.primary_wins + self.fallback_wins
+        return self.primary_wins / wins if wins else 0.0
+
+    @property
+    def fallback_win_rate(self) -> float:
+        wins = self.primary_wins + self.fallback_wins
+        return self.fallback_wins / wins if wins else 0.0
+
+
+# ロールごとの統計情報
+_stats: Dict[str, TierStats] = {}
+
+
+def get_tier_stats(tier: ModelTier) -> TierStats:
+    """階層の統計情報を取得する（階層の設定が変わった場合は作り直す）"""
+    stats = _stats.get(tier.role)
+    if stats is None or stats.tier != tier:
+        stats = _stats[tier.role] = TierStats(tier)
+    return stats
+
+
+def all_tier_stats() -> List[TierStats]:
+    """これまでに使われた階層の統計情報（ロール名の順）"""
+    return [_stats[role] for role in sorted(_stats)]
+
+
+def reset_tier_stats() -> None:
+    _stats.clear()
@@ -0,0 +1,131 @@
+"""
+ITスキル専門家への相談の要否を判断するローカル分類器
+
+LLMに判断させる前に、プロセス内で以下の順に判断する。
+
+1. キーワード表: IT関連・一般的なキャリア相談の一方のキーワードだけを含む場合はそれで決める
+2. 線形モデル: 文字n-gramのハッシュ特徴量（単語分割が不要なため日本語でもそのまま使える）の
+   ロジスティック回帰。確率が閾値以上であれば決める
+3. どちらでも決まらない場合は判断せず、LLMに判断させる
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from app.core.config import settings
+from app.services.response_cache import normalize_prompt
+from app.services.routing_examples import TRAINING_EXAMPLES
+from app.services.semantic_cache import HashingEmbedder
+
+# IT関連の相談を示すキーワード
+_IT_KEYWORDS = re.compile(
+    r"プログラミング|プログラマ|エンジニア|コーディング|python|java|typescript|golang|c\+\+|ruby|php|sql|"
+    r"aws|azure|gcp|クラウド|インフラ|サーバー|ネットワーク|セキュリティ|データサイエン|データ分析|"
+    r"機械学習|生成ai|llm|react|vue|docker|kubernetes|linux|github|sier|社内se|it業界|itパスポート|"
+    r"基本情報技術者|応用情報技術者|アルゴリズム|フロントエンド|バックエンド|フルスタック|アプリ開発|"
+    r"ソフトウェア|web系|開発職|devops|sre|mlops|ノーコード|rpa",
+    re.IGNORECASE,
+)
+
+# 一般的なキャリア相談を示すキーワード
+_CAREER_KEYWORDS = re.compile(
+    r"人間関係|上司|部下|同僚|面接|履歴書|職務経歴書|自己pr|年収交渉|育休|産休|介護|ワークライフバランス|"
+    r"退職|パワハラ|残業|転勤|昇進|評価面談|モチベーション|自己分析|副業|内定|就職活動|就活|第二新卒|定年",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RoutingDecision:
+    """ローカル分類器の判断結果"""
+    # 判断できなかった場合はNone（LLMに判断させる）
+    it_consultation: Optional[bool]
+    confidence: float
+    # "keyword" / "model" / "undecided"
+    source: str
+
+
+@dataclass
+class PreRouterStats:
+    """ローカル分類器の統計情報"""
+    keyword: int = 0
+    model: int = 0
+    undecided: int = 0
+
+
+class PreRouter:
+    """
+    キーワード表と文字n-gramの線形モデルでITスキル専門家への相談の要否を判断する
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        examples: Sequence[Tuple[str, bool]] = TRAINING_EXAMPLES,
+        dim: int = 4096,
+    ):
+        self.threshold = threshold
+        self.embedder = HashingEmbedder(dim=dim, ngram_range=(1, 3))
+        self.weights = np.zeros(dim, dtype=np.float32)
+        self.bias = 0.0
+        self.stats = PreRouterStats()
+        if examples:
+            self.fit(examples)
+
+    def fit(
+        self,
+        examples: Sequence[Tuple[str, bool]],
+        epochs: int = 300,
+        learning_rate: float = 2.0,
+        l2: float = 1e-3,
+    ) -> None:
+        """ロジスティック回帰を勾配降下法で学習する"""
+        features = np.stack([self.embedder.embed_one(text) for text, _ in examples])
+        labels = np.array([1.0 if label else 0.0 for _, label in examples], dtype=np.float32)
+        weights = np.zeros(features.shape[1], dtype=np.float32)
+        bias = 0.0
+        for _ in range(epochs):
+            probabilities = 1.0 / (1.0 + np.exp(-(features @ weights + bias)))
+            error = probabilities - labels
+            weights -= learning_rate * (features.T @ error / len(labels) + l2 * weights)
+            bias -= learning_rate * float(error.mean())
+        self.weights = weights
+        self.bias = bias
+
+    def predict_proba(self, text: str) -> float:
+        """ITスキル専門家への相談が必要である確率"""
+        score = float(self.embedder.embed_one(text) @ self.weights) + self.bias
+        return 1.0 / (1.0 + np.exp(-score))
+
+    def decide(self, text: str) -> RoutingDecision:
+        """相談の要否を判断する。確信が持てない場合は it_consultation=None を返す"""
+        text = normalize_prompt(text)
+        it_hit = _IT_KEYWORDS.search(text) is not None
+        career_hit = _CAREER_KEYWORDS.search(text) is not None
+        if it_hit != career_hit:
+            self.stats.keyword += 1
+            return RoutingDecision(it_consultation=it_hit, confidence=1.0, source="keyword")
+
+        probability = self.predict_proba(text)
+        confidence = max(probability, 1.0 - probability)
+        if confidence >= self.threshold:
+            self.stats.model += 1
+            return RoutingDecision(it_consultation=probability >= 0.5, confidence=confidence, source="model")
+
+        self.stats.undecided += 1
+        return RoutingDecision(it_consultation=None, confidence=confidence, source="undecided")
+
+
+_pre_router: Optional[PreRouter] = None
+
+
+def get_pre_router() -> Optional[PreRouter]:
+    """
+    共有のローカル分類器を取得する（PRE_ROUTER_ENABLED が無効な場合はNone）
+    """
+    global _pre_router
+    if not settings.PRE_ROUTER_ENABLED:
+        return None
+    if _pre_router is None:
+        _pre_router = PreRouter(threshold=settings.PRE_ROUTER_CONFIDENCE)
+    return _pre_router
@@ -1,6 +1,11 @@
 """
 AIエージェントで使用するプロンプト定義
+
+システムプロンプトはリクエストごとに変わらない固定の文面とし、ユーザーの質問や
+専門家のアドバイスなどの可変部分はテンプレートの変数として末尾・別メッセージに置く。
+（先頭が共通になるため、プロバイダー側のプロンプトキャッシュが効く）
 """
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 # キャリアカウンセラーのシステムプロンプト
 CAREER_COUNSELOR_PROMPT = """
@@ -13,7 +18,7 @@ CAREER_COUNSELOR_PROMPT = """
 
 出力形式:
 ```json
-{"it_consultation": true/false, "reason": "ITスキル専門家に相談する理由または相談しない理由"}
+{{"it_consultation": true/false, "reason": "ITスキル専門家に相談する理由または相談しない理由"}}
 ```
 """
 
@@ -33,13 +38,59 @@ RESPONSE_GENERATION_PROMPT = """
 あなたはキャリアカウンセラーのAIアシスタントです。
 ユーザーのキャリア相談に対して、親身に、かつ専門的な知識をもとにアドバイスを提供してください。
 
-ユーザーの質問: {input}
+以下のITスキル専門家からのアドバイスも参考にして、総合的な回答を作成してください。
+ユーザーの状況を理解し、具体的で実用的なアドバイスを心がけてください。
+ITスキル専門家からのアドバイスを自然に取り入れ、一貫性のある回答を作成してください。
 
 IT専門家への相談が必要かどうか: {it_consultation}
-
-以下のITスキル専門家からのアドバイスも参考にして、総合的な回答を作成してください。
 ITスキル専門家のアドバイス: {it_advice}
+"""
 
-ユーザーの状況を理解し、具体的で実用的なアドバイスを心がけてください。
-ITスキル専門家からのアドバイスを自然に取り入れ、一貫性のある回答を作成してください。
+# ロールごとの回答のシステムプロンプト（selected_role で選択する）
+ROLE_SYSTEM_PROMPTS = {
+    "career_counselor": """
+あなたはキャリアカウンセラーです。ユーザーのキャリア相談に対して、
+親身に、かつ専門的な知識をもとにアドバイスを提供してください。
+キャリア選択、転職、スキルアップ、職場の人間関係など、
+幅広いキャリアに関する質問に対応してください。
+""",
+    "it_specialist": """
+あなたはITスキル専門家です。ユーザーのIT関連のキャリア相談に対して、
+技術トレンド、必要なスキル、学習リソース、キャリアパスについて
+具体的で実用的なアドバイスを提供してください。
+""",
+}
+
+DEFAULT_ROLE = "career_counselor"
+
+# 会話要約のシステムプロンプト
+SUMMARY_PROMPT = """
+あなたはキャリア相談の記録係です。
+これまでの要約と新しいやり取りをもとに、要約を更新してください。
+
+- ユーザーの状況（職種、経験、スキル、希望、悩み）と、これまでに提示したアドバイスを残してください
+- 重複や挨拶などの重要でない内容は省いてください
+- 400文字以内の日本語で、要約本文のみを出力してください
 """
+
+
+def _chat_template(system_prompt: str) -> ChatPromptTemplate:
+    """固定のシステムプロンプト・会話履歴・ユーザーの質問（{input}）からなるテンプレート"""
+    return ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder("history", optional=True),
+        ("human", "{input}"),
+    ])
+
+
+# ロールごとの回答テンプレート（変数: history, input）
+ROLE_PROMPT_TEMPLATES = {role: _chat_template(prompt) for role, prompt in ROLE_SYSTEM_PROMPTS.items()}
+
+# ITスキル専門家への相談が必要かを判断するテンプレート（変数: history, input）
+COUNSELOR_ROUTING_TEMPLATE = _chat_template(CAREER_COUNSELOR_PROMPT)
+
+# ITスキル専門家のテンプレート（変数: history, input）
+IT_SPECIALIST_TEMPLATE = _chat_template(IT_SPECIALIST_PROMPT)
+
+# レスポンス生成のテンプレート（変数: history, input, it_consultation, it_advice）
+RESPONSE_GENERATION_TEMPLATE = _chat_template(RESPONSE_GENERATION_PROMPT)
@@ -0,0 +1,246 @@
+"""
+LLM応答キャッシュ
+
+同じような質問に対するLLM呼び出しを省くためのキャッシュ。
+キーは正規化した最後のユーザーメッセージ・ロール・モデル名・温度（0.1刻み）から作る。
+バックエンドはメモリ（LRU）とSQLiteファイルを選べ、どちらもTTLと件数の上限を持つ。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from app.core.config import settings
+
+# 正規化時に末尾から取り除く記号
+_TRAILING_PUNCTUATION = re.compile(r"[\s。．、，,.!！?？～〜…]+$")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    質問文を正規化する（全角・半角の統一、小文字化、空白の圧縮、末尾の句読点の除去）
+    """
+    text = unicodedata.normalize("NFKC", text).lower().strip()
+    text = _WHITESPACE.sub(" ", text)
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def make_cache_key(prompt: str, role: str, model: str, temperature: float) -> str:
+    """キャッシュキーを作成する"""
+    payload = json.dumps(
+        [normalize_prompt(prompt), role, model, round(temperature, 1)], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCacheBackend(ABC):
+    """
+    応答キャッシュの保存先
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        """キーに対応する応答を取得する（期限切れまたは無い場合はNone）"""
+
+    @abstractmethod
+    async def set(self, key: str, value: str) -> None:
+        """応答を保存する"""
+
+    async def close(self) -> None:
+        """リソースを解放する"""
+
+
+class MemoryResponseCacheBackend(ResponseCacheBackend):
+    """
+    プロセス内のLRUキャッシュ
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SQLiteResponseCacheBackend(ResponseCacheBackend):
+    """
+    SQLiteファイルのキャッシュ。件数の上限を超えた場合は古く作成されたものから削除する
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._connection = None
+        self._lock = asyncio.Lock()
+        self._writes_since_prune = 0
+
+    async def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        async with self._lock:
+            if self._connection is None:
+                import aiosqlite
+
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                connection = await aiosqlite.connect(self.path)
+                # 複数のワーカープロセスで共有する場合は他のプロセスの書き込みが終わるまで待つ
+                await connection.execute("PRAGMA busy_timeout=5000")
+                await connection.execute("PRAGMA journal_mode=WAL")
+                await connection.execute("PRAGMA synchronous=NORMAL")
+                await connection.execute(
+                    "CREATE TABLE IF NOT EXISTS response_cache ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                await connection.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_response_cache_created_at ON response_cache (created_at)"
+                )
+                await connection.commit()
+                self._connection = connection
+        return self._connection
+
+    async def get(self, key: str) -> Optional[str]:
+        connection = await self._connect()
+        async with connection.execute(
+            "SELECT value FROM response_cache WHERE key = ? AND created_at >= ?",
+            (key, time.time() - self.ttl_seconds),
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def set(self, key: str, value: str) -> None:
+        connection = await self._connect()
+        await connection.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, created_at) VALUES (?, ?, ?)",
+            (key, value, time.time()),
+        )
+        self._writes_since_prune += 1
+        # 書き込みのたびに数えるのを避け、一定件数ごとに期限切れと上限超過分を削除する
+        if self._writes_since_prune >= max(1, self.max_entries // 100):
+            self._writes_since_prune = 0
+            await connection.execute(
+                "DELETE FROM response_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            await connection.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                " SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        await connection.commit()
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+@dataclass
+class ResponseCacheStats:
+    """応答キャッシュの統計情報"""
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    # キャッシュミス時のLLM呼び出し時間の合計（秒）
+    miss_latency_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def estimated_saved_seconds(self) -> float:
+        """ヒットしなければかかっていたLLM呼び出し時間の推定値"""
+        if not self.stores:
+            return 0.0
+        return self.hits * self.miss_latency_seconds / self.stores
+
+
+class ResponseCache:
+    """
+    キーの作成と統計を担う応答キャッシュ
+    """
+
+    def __init__(self, backend: ResponseCacheBackend):
+        self.backend = backend
+        self.stats = ResponseCacheStats()
+
+    async def lookup(self, prompt: str, role: str, model: str, temperature: float) -> Optional[str]:
+        """キャッシュされた応答を取得する"""
+        value = await self.backend.get(make_cache_key(prompt, role, model, temperature))
+        if value is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    async def store(
+        self, prompt: str, role: str, model: str, temperature: float, response: str, latency: float
+    ) -> None:
+        """応答を保存する。latency はLLM呼び出しにかかった時間（秒）"""
+        await self.backend.set(make_cache_key(prompt, role, model, temperature), response)
+        self.stats.stores += 1
+        self.stats.miss_latency_seconds += latency
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    共有の応答キャッシュを取得する（RESPONSE_CACHE_ENABLED が無効な場合はNone）
+    """
+    global _response_cache
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        if settings.RESPONSE_CACHE_BACKEND == "sqlite":
+            backend = SQLiteResponseCacheBackend(
+                settings.RESPONSE_CACHE_SQLITE_PATH,
+                max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+            )
+        elif settings.RESPONSE_CACHE_BACKEND == "memory":
+            backend = MemoryResponseCacheBackend(
+                max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+            )
+        else:
+            raise ValueError(f"未対応の応答キャッシュです: {settings.RESPONSE_CACHE_BACKEND}")
+        _response_cache = ResponseCache(backend)
+    return _response_cache
+
+
+async def close_response_cache() -> None:
+    """
+    共有の応答キャッシュを閉じる
+    """
+    global _response_cache
+    if _response_cache is not None:
+        await _response_cache.backend.close()
+        _response_cache = None
@@ -0,0 +1,98 @@
+"""
+ITスキル専門家への相談の要否を判断するローカル分類器の学習データ
+
+(質問, ITスキル専門家への相談が必要かどうか) の組。
+評価用のデータは学習に使わないよう benchmarks/data/routing_eval.jsonl に分けて置く。
+"""
+from typing import List, Tuple
+
+TRAINING_EXAMPLES: List[Tuple[str, bool]] = [
+    # ITスキル・技術キャリアに関する相談
+    ("Pythonを独学で勉強していますが、次に何を学べばいいですか？", True),
+    ("未経験からWebエンジニアに転職するにはどんなスキルが必要ですか", True),
+    ("JavaとGoのどちらを学ぶべきか迷っています", True),
+    ("AWSの資格は転職に有利になりますか？", True),
+    ("データサイエンティストになるためのロードマップを教えてください", True),
+    ("フロントエンドエンジニアとしてReactとVueのどちらを身につけるべきでしょう", True),
+    ("機械学習エンジニアに必要な数学の知識はどのくらいですか", True),
+    ("インフラエンジニアからSREにキャリアチェンジしたいです", True),
+    ("プログラミングスクールに通うべきか独学で続けるべきか悩んでいます", True),
+    ("社内SEから開発職に移るには何をアピールすればいいですか", True),
+    ("基本情報技術者試験は取っておいたほうがいいですか", True),
+    ("Kubernetesを実務で使ったことがないのですが学ぶ価値はありますか", True),
+    ("生成AIの登場でプログラマーの仕事はなくなりますか？", True),
+    ("ポートフォリオにどんなアプリを作ればエンジニア転職で評価されますか", True),
+    ("テックリードになるために必要な技術力とは何でしょうか", True),
+    ("クラウドエンジニアの将来性について知りたいです", True),
+    ("SQLしか書けないのですがデータエンジニアを目指せますか", True),
+    ("セキュリティエンジニアになるにはどんな勉強をすればいいですか", True),
+    ("iOSアプリ開発のスキルを活かせる仕事を探しています", True),
+    ("TypeScriptを覚えると年収は上がりますか", True),
+    ("COBOLのエンジニアですがモダンな技術に移行したいです", True),
+    ("LinuxとネットワークのスキルはIT業界でどのくらい重要ですか", True),
+    ("QAエンジニアからソフトウェアエンジニアに転向できますか", True),
+    ("GitHubのコントリビューションは採用で見られますか", True),
+    ("バックエンドの設計力を伸ばすにはどうしたらいいですか", True),
+    ("DockerやCI/CDの経験がないと転職は難しいですか", True),
+    ("RPAやノーコードツールのスキルは評価されますか", True),
+    ("ゲームプログラマーになりたいのですがC++は必須ですか", True),
+    ("プロジェクトマネージャーとしてITの技術知識はどこまで必要ですか", True),
+    ("AIエンジニアとしてLLMのファインチューニングを学ぶべきですか", True),
+    ("情報系の学部ではないのですがソフトウェア開発の仕事に就けますか", True),
+    ("SIerから自社開発のWeb系企業に転職したいです", True),
+    ("Excel VBAのマクロ作成の経験はプログラミング経験として書けますか", True),
+    ("データ分析の仕事に就くためにPythonとRどちらを学ぶべき？", True),
+    ("サーバーサイドの言語は何から始めればいいですか", True),
+    ("エンジニアとしての技術ブログはキャリアに役立ちますか", True),
+    ("ITパスポートを取ったのですが次はどの資格がおすすめですか", True),
+    ("組み込みエンジニアからWeb開発へのキャリアパスを教えてください", True),
+    ("フルスタックエンジニアを目指すのは現実的でしょうか", True),
+    ("アルゴリズムの勉強はコーディング面接対策に必要ですか", True),
+    ("mlops", True),
+    ("プログラミング", True),
+    ("エンジニアになりたい", True),
+    # 一般的なキャリア相談
+    ("上司との人間関係がうまくいかず悩んでいます", False),
+    ("転職するべきか今の会社に残るべきか迷っています", False),
+    ("面接で緊張してしまい、うまく話せません", False),
+    ("履歴書の自己PRの書き方を教えてください", False),
+    ("年収交渉はどのタイミングでするべきですか", False),
+    ("育休から復帰した後の働き方に不安があります", False),
+    ("ワークライフバランスを重視して仕事を選びたいです", False),
+    ("営業職から人事職にキャリアチェンジしたいです", False),
+    ("やりたいことが見つからず将来が不安です", False),
+    ("管理職になるべきか専門職を続けるべきか悩んでいます", False),
+    ("40代での転職は難しいでしょうか", False),
+    ("退職を上司にどう伝えればいいですか", False),
+    ("職場でパワハラを受けています。どうすればいいですか", False),
+    ("看護師から別の職種に転職することはできますか", False),
+    ("公務員から民間企業への転職を考えています", False),
+    ("副業を始めたいのですが本業との両立が心配です", False),
+    ("自分の強みがわからず自己分析に困っています", False),
+    ("新卒で入った会社を1年で辞めるのは早すぎますか", False),
+    ("職務経歴書にブランク期間をどう書けばいいですか", False),
+    ("キャリアアップのためにMBAを取るべきでしょうか", False),
+    ("同僚とのコミュニケーションが苦手です", False),
+    ("残業が多くて体調を崩しそうです", False),
+    ("フリーランスとして独立するべきか悩んでいます", False),
+    ("転勤の打診を受けましたが家族のことが心配です", False),
+    ("就職活動でどの業界を選べばいいかわかりません", False),
+    ("昇進試験に向けて何を準備すればいいですか", False),
+    ("介護と仕事の両立に悩んでいます", False),
+    ("モチベーションが上がらず仕事に行くのがつらいです", False),
+    ("内定を2社からもらいどちらにするか迷っています", False),
+    ("接客業から事務職に転職したいです", False),
+    ("評価面談で何を話せばいいですか", False),
+    ("部下の育成がうまくいきません", False),
+    ("契約社員から正社員になるにはどうしたらいいですか", False),
+    ("留学経験をキャリアにどう活かせばいいですか", False),
+    ("会社の将来性が不安で転職を考えています", False),
+    ("人前で話すのが苦手でプレゼンが憂鬱です", False),
+    ("経理の仕事を続けながら簿記1級を目指すべきですか", False),
+    ("飲食店の店長からキャリアを変えたいです", False),
+    ("定年後も働き続けるための準備を知りたいです", False),
+    ("第二新卒として転職活動を始めたいです", False),
+    ("こんにちは", False),
+    ("キャリア相談をお願いします", False),
+    ("転職したい", False),
+]
@@ -0,0 +1,48 @@
+"""
+会話の全文検索
+
+メッセージ本文を文字bigram（英数字は単語）に分割した転置インデックスで検索し、BM25でランク付けする。
+インデックスはプロセス内のメモリに持ち、起動時に会話ストアから作り直す（SEARCH_ENABLED で有効にする。既定は無効）
+"""
+from typing import Optional
+from app.core.config import settings
+from app.services.search.index import InvertedIndex
+from app.services.search.service import ConversationSearch
+from app.services.store import get_conversation_store
+
+_search: Optional[ConversationSearch] = None
+
+
+def get_conversation_search() -> Optional[ConversationSearch]:
+    """
+    共有の全文検索を取得する（SEARCH_ENABLED が無効な場合はNone）
+    """
+    global _search
+    if not settings.SEARCH_ENABLED:
+        return None
+    if _search is None:
+        _search = ConversationSearch(
+            get_conversation_store(),
+            InvertedIndex(k1=settings.SEARCH_BM25_K1, b=settings.SEARCH_BM25_B),
+            shared=settings.WORKERS > 1,
+            sync_interval=settings.SEARCH_SYNC_INTERVAL_SECONDS,
+        )
+    return _search
+
+
+async def close_conversation_search() -> None:
+    """
+    共有の全文検索の取り込みを止めて破棄する
+    """
+    global _search
+    if _search is not None:
+        await _search.close()
+        _search = None
+
+
+__all__ = [
+    "ConversationSearch",
+    "InvertedIndex",
+    "get_conversation_search",
+    "close_conversation_search",
+]
@@ -0,0 +1,381 @@
+"""
+メッセージ本文の転置インデックス
+
+トークン（tokenizer.py）ごとに、そのトークンを含むメッセージの文書番号と出現回数の列（ポスティングリスト）を持つ。
+文書番号は追加順に振るため、ポスティングリストへの追加は常に末尾への追記になる。
+
+- ポスティングリストは BLOCK_SIZE 件ごとのブロックに圧縮し、トークンごとに1つのバイト列に連結する。
+  文書番号は直前との差分を、ブロック内の最大値が収まる最小のバイト幅（1・2・4バイト）で、出現回数は1バイトで保存する
+- 末尾の BLOCK_SIZE 件未満は圧縮せずに配列に追記し、満杯になった時点でブロックにする
+- 会話・メッセージID・ロール・タイムスタンプ・トークン数は文書番号で引くNumPyの列に持ち、
+  期間・ロールでの絞り込みとBM25のスコア計算はNumPyでまとめて行う
+
+複数のトークンを指定した検索は、すべてのトークンを含むメッセージ（AND）をBM25のスコア順に返す。
+"""
+import math
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple, Union
+from uuid import UUID
+import numpy as np
+from app.services.search.tokenizer import tokenize
+
+# 圧縮の単位（件）
+BLOCK_SIZE = 128
+# 出現回数の上限（1バイトに収める）
+_MAX_TERM_FREQUENCY = 255
+
+# タイムスタンプはこの時刻からのマイクロ秒数（ローカル時刻のまま）で保持する
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_micros(timestamp: datetime) -> int:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def _encode_block(docs: array, frequencies: array) -> Tuple[int, bytes]:
+    """文書番号の差分（先頭は0）をバイト幅を揃えて並べ、出現回数を続けたバイト列とバイト幅を返す"""
+    deltas = np.diff(np.frombuffer(docs, dtype=np.uint32), prepend=docs[0])
+    largest = int(deltas.max())
+    width = 1 if largest < 1 << 8 else 2 if largest < 1 << 16 else 4
+    return width, deltas.astype(f"<u{width}").tobytes() + frequencies.tobytes()
+
+
+class _Postings:
+    """1つのトークンのポスティングリスト"""
+
+    __slots__ = ("data", "offsets", "widths", "firsts", "docs", "frequencies", "count")
+
+    def __init__(self):
+        # 圧縮済みのブロックを連結したバイト列と、各ブロックの開始位置・バイト幅・先頭の文書番号
+        self.data = bytearray()
+        self.offsets = array("I")
+        self.widths = array("B")
+        self.firsts = array("I")
+        # 圧縮前の末尾
+        self.docs = array("I")
+        self.frequencies = array("B")
+        self.count = 0
+
+    def add(self, doc: int, frequency: int) -> None:
+        self.docs.append(doc)
+        self.frequencies.append(min(frequency, _MAX_TERM_FREQUENCY))
+        self.count += 1
+        if len(self.docs) == BLOCK_SIZE:
+            width, block = _encode_block(self.docs, self.frequencies)
+            self.offsets.append(len(self.data))
+            self.widths.append(width)
+            self.firsts.append(self.docs[0])
+            self.data += block
+            self.docs = array("I")
+            self.frequencies = array("B")
+
+    def decode(self, candidates: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        文書番号と出現回数の配列を返す。candidates（昇順の文書番号）を指定した場合は、
+        候補を1件も含まないブロックを読まない（候補以外の文書番号も含まれうる）
+        """
+        docs: List[np.ndarray] = []
+        frequencies: List[np.ndarray] = []
+        if self.firsts:
+            firsts = np.array(self.firsts, dtype=np.int64)
+            widths = np.array(self.widths, dtype=np.uint8)
+            offsets = np.array(self.offsets, dtype=np.int64)
+            if candidates is not None:
+                # ブロック i は [firsts[i], firsts[i + 1]) の文書番号を持つ
+                ends = np.append(firsts[1:], self.docs[0] if self.docs else np.iinfo(np.int64).max)
+                needed = np.searchsorted(candidates, ends) > np.searchsorted(candidates, firsts)
+                firsts, widths, offsets = firsts[needed], widths[needed], offsets[needed]
+            if len(firsts):
+                block_docs, block_frequencies = self._decode_blocks(firsts, widths, offsets)
+                docs.append(block_docs)
+                frequencies.append(block_frequencies)
+        if self.docs:
+            docs.append(np.array(self.docs, dtype=np.int64))
+            frequencies.append(np.array(self.frequencies, dtype=np.uint8))
+        if not docs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        return np.concatenate(docs), np.concatenate(frequencies)
+
+    def _decode_blocks(
+        self, firsts: np.ndarray, widths: np.ndarray, offsets: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """ブロックをバイト幅ごとにまとめてデコードする（ブロック数によらずNumPyの呼び出し回数は一定）"""
+        docs = np.empty((len(firsts), BLOCK_SIZE), dtype=np.int64)
+        frequencies = np.empty((len(firsts), BLOCK_SIZE), dtype=np.uint8)
+        # data のビューはこの関数の中だけで使う（ビューがある間は data に追記できない）
+        data = np.frombuffer(self.data, dtype=np.uint8)
+        for width in (1, 2, 4):
+            selected = widths == width
+            if not selected.any():
+                continue
+            starts = offsets[selected][:, None]
+            deltas = data[starts + np.arange(BLOCK_SIZE * width)].view(f"<u{width}")
+            docs[selected] = np.cumsum(deltas, axis=1, dtype=np.int64) + firsts[selected][:, None]
+            frequencies[selected] = data[starts + BLOCK_SIZE * width + np.arange(BLOCK_SIZE)]
+        del data
+        return docs.ravel(), frequencies.ravel()
+
+    def nbytes(self) -> int:
+        return (
+            len(self.data)
+            + self.offsets.itemsize * len(self.offsets)
+            + len(self.widths)
+            + self.firsts.itemsize * len(self.firsts)
+            + self.docs.itemsize * len(self.docs)
+            + len(self.frequencies)
+        )
+
+
+class _Decoded:
+    """デコード済みのポスティングリスト（1文字のクエリで複数のトークンをまとめたもの）"""
+
+    __slots__ = ("docs", "frequencies", "count")
+
+    def __init__(self, docs: np.ndarray, frequencies: np.ndarray):
+        self.docs = docs
+        self.frequencies = frequencies
+        self.count = len(docs)
+
+    def decode(self, candidates: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.docs, self.frequencies
+
+
+_EMPTY = _Decoded(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8))
+
+
+class _Columns:
+    """文書番号で引く列（容量を倍々に増やす）"""
+
+    def __init__(self, capacity: int = 1024):
+        self.conversations = np.zeros(capacity, dtype=np.int32)
+        self.message_ids = np.zeros((capacity, 16), dtype=np.uint8)
+        self.roles = np.zeros(capacity, dtype=np.uint8)
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.lengths = np.zeros(capacity, dtype=np.int32)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.conversations)
+
+    def grow(self) -> None:
+        capacity = self.capacity * 2
+        for name in ("conversations", "message_ids", "roles", "timestamps", "lengths"):
+            current = getattr(self, name)
+            grown = np.zeros((capacity,) + current.shape[1:], dtype=current.dtype)
+            grown[:len(current)] = current
+            setattr(self, name, grown)
+
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in vars(self).values())
+
+
+class SearchMatch:
+    """検索に一致したメッセージ"""
+
+    __slots__ = ("conversation_id", "message_id", "role", "timestamp", "score")
+
+    def __init__(self, conversation_id: UUID, message_id: UUID, role: str, timestamp: datetime, score: float):
+        self.conversation_id = conversation_id
+        self.message_id = message_id
+        self.role = role
+        self.timestamp = timestamp
+        self.score = score
+
+
+class InvertedIndex:
+    """
+    メッセージ本文の転置インデックス（BM25でランク付けする）
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._terms: Dict[str, _Postings] = {}
+        # 日本語の1文字 → その文字を含む2文字以下のトークンのポスティングリスト（1文字のクエリで使う）
+        self._char_terms: Dict[str, List[_Postings]] = {}
+        self._columns = _Columns()
+        self._size = 0
+        self._total_length = 0
+        # 会話ID ↔ 会話の番号と、会話ごとの登録済みメッセージ数
+        self._conversation_ids: List[UUID] = []
+        self._conversation_numbers: Dict[UUID, int] = {}
+        self._conversation_counts = array("I")
+        self._roles: List[str] = []
+        self._role_codes: Dict[str, int] = {}
+
+    @property
+    def document_count(self) -> int:
+        """登録済みのメッセージ数"""
+        # __len__ にすると空のインデックスが偽と評価されるため、プロパティにする
+        return self._size
+
+    @property
+    def term_count(self) -> int:
+        """トークンの種類数"""
+        return len(self._terms)
+
+    def nbytes(self) -> int:
+        """ポスティングリストと列のおおよそのバイト数（辞書のキーなどのPythonオブジェクトを除く）"""
+        return sum(postings.nbytes() for postings in self._terms.values()) + self._columns.nbytes()
+
+    def indexed_count(self, conversation_id: UUID) -> int:
+        """会話の登録済みメッセージ数"""
+        number = self._conversation_numbers.get(conversation_id)
+        return 0 if number is None else self._conversation_counts[number]
+
+    def message_ids(self, conversation_id: UUID) -> Set[UUID]:
+        """会話の登録済みメッセージID"""
+        number = self._conversation_numbers.get(conversation_id)
+        if number is None:
+            return set()
+        docs = np.flatnonzero(self._columns.conversations[:self._size] == number)
+        return {UUID(bytes=row.tobytes()) for row in self._columns.message_ids[docs]}
+
+    def add(self, conversation_id: UUID, message_id: UUID, role: str, timestamp: datetime, content: str) -> None:
+        """メッセージを登録する（同じメッセージの重複登録は呼び出し側で避ける）"""
+        number = self._conversation_numbers.get(conversation_id)
+        if number is None:
+            number = self._conversation_numbers[conversation_id] = len(self._conversation_ids)
+            self._conversation_ids.append(conversation_id)
+            self._conversation_counts.append(0)
+        self._conversation_counts[number] += 1
+        role_code = self._role_codes.get(role)
+        if role_code is None:
+            role_code = self._role_codes[role] = len(self._roles)
+            self._roles.append(role)
+
+        doc = self._size
+        tokens = tokenize(content)
+        frequencies: Dict[str, int] = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        terms = self._terms
+        for token, frequency in frequencies.items():
+            postings = terms.get(token)
+            if postings is None:
+                postings = terms[token] = _Postings()
+                if len(token) <= 2:
+                    for char in set(token):
+                        if not char.isascii():
+                            self._char_terms.setdefault(char, []).append(postings)
+            postings.add(doc, frequency)
+
+        columns = self._columns
+        if doc == columns.capacity:
+            columns.grow()
+        columns.conversations[doc] = number
+        columns.message_ids[doc] = np.frombuffer(message_id.bytes, dtype=np.uint8)
+        columns.roles[doc] = role_code
+        columns.timestamps[doc] = _to_micros(timestamp)
+        columns.lengths[doc] = len(tokens)
+        self._size += 1
+        self._total_length += len(tokens)
+
+    def _query_postings(self, token: str) -> Union[_Postings, _Decoded]:
+        """クエリのトークンのポスティングリスト。1文字の日本語はその文字を含むbigramをまとめる"""
+        if len(token) != 1 or token.isascii():
+            return self._terms.get(token, _EMPTY)
+        matched = self._char_terms.get(token)
+        if not matched:
+            return _EMPTY
+        if len(matched) == 1:
+            return matched[0]
+        decoded = [postings.decode() for postings in matched]
+        docs = np.concatenate([docs for docs, _ in decoded])
+        frequencies = np.concatenate([frequencies for _, frequencies in decoded]).astype(np.int64)
+        docs, inverse = np.unique(docs, return_inverse=True)
+        frequencies = np.minimum(np.bincount(inverse, weights=frequencies), _MAX_TERM_FREQUENCY)
+        return _Decoded(docs, frequencies.astype(np.uint8))
+
+    def search(
+        self,
+        query: str,
+        limit: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        role: Optional[str] = None,
+        group_by_conversation: bool = False,
+    ) -> Tuple[int, List[SearchMatch]]:
+        """
+        クエリのトークンをすべて含むメッセージをBM25のスコアの高い順に limit 件返す
+
+        since <= timestamp < until のメッセージのみを対象とする。
+        group_by_conversation の場合は会話ごとに最もスコアの高いメッセージだけを返す。
+        一致した件数（group_by_conversation の場合は会話数）と一致したメッセージを返す
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or self._size == 0:
+            return 0, []
+        role_code = None
+        if role is not None:
+            role_code = self._role_codes.get(role)
+            if role_code is None:
+                return 0, []
+        columns = self._columns
+
+        # 文書数の少ないトークンから絞り込み、以降のトークンは候補を含むブロックだけを読む
+        postings = sorted((self._query_postings(token) for token in tokens), key=lambda item: item.count)
+        candidates, first_frequencies = postings[0].decode()
+        keep = np.ones(len(candidates), dtype=bool)
+        if since is not None:
+            keep &= columns.timestamps[candidates] >= _to_micros(since)
+        if until is not None:
+            keep &= columns.timestamps[candidates] < _to_micros(until)
+        if role_code is not None:
+            keep &= columns.roles[candidates] == role_code
+        candidates = candidates[keep]
+        frequencies = [first_frequencies[keep]]
+        document_frequencies = [postings[0].count]
+        for term_postings in postings[1:]:
+            document_frequencies.append(term_postings.count)
+            if len(candidates) == 0:
+                break
+            docs, term_frequencies = term_postings.decode(candidates)
+            if len(docs) == 0:
+                candidates = docs
+                break
+            # どちらも昇順のため、候補ごとに二分探索で一致を確かめる（全体を並べ替えない）
+            positions = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+            found = docs[positions] == candidates
+            candidates = candidates[found]
+            frequencies = [previous[found] for previous in frequencies] + [term_frequencies[positions[found]]]
+        if len(candidates) == 0:
+            return 0, []
+
+        # BM25
+        lengths = columns.lengths[candidates].astype(np.float64)
+        average_length = self._total_length / self._size or 1.0
+        normalizer = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for term_frequencies, document_frequency in zip(frequencies, document_frequencies):
+            idf = math.log(1 + (self._size - document_frequency + 0.5) / (document_frequency + 0.5))
+            term_frequencies = term_frequencies.astype(np.float64)
+            scores += idf * term_frequencies * (self.k1 + 1) / (term_frequencies + normalizer)
+
+        timestamps = columns.timestamps[candidates]
+        if group_by_conversation:
+            # スコア順（同点は新しい順）に並べ、各会話の先頭のメッセージを残す
+            order = np.lexsort((-timestamps, -scores))
+            _, firsts = np.unique(columns.conversations[candidates[order]], return_index=True)
+            total = len(firsts)
+            selected = order[np.sort(firsts)[:limit]]
+        else:
+            total = len(candidates)
+            selected = np.argpartition(-scores, limit - 1)[:limit] if total > limit else np.arange(total)
+            selected = selected[np.lexsort((-timestamps[selected], -scores[selected]))]
+
+        matches = []
+        for position in selected:
+            doc = candidates[position]
+            matches.append(SearchMatch(
+                self._conversation_ids[columns.conversations[doc]],
+                UUID(bytes=columns.message_ids[doc].tobytes()),
+                self._roles[columns.roles[doc]],
+                _EPOCH + timedelta(microseconds=int(columns.timestamps[doc])),
+                float(scores[position]),
+            ))
+        return total, matches
@@ -0,0 +1,208 @@
+"""
+会話の全文検索
+
+会話に追加されたメッセージを InvertedIndex に登録し、検索結果に本文の抜粋を付けて返す。
+
+- 起動時に会話ストアの全会話を更新日時の古い順に読み、インデックスを作る（バックグラウンド）
+- 以降は add_message_to_conversation で追加されたメッセージをその場で登録する
+- WORKERS が2以上の場合は他のワーカーが追加したメッセージを登録できないため、検索の前に
+  更新日時が前回の取り込み以降の会話を会話ストアから読み、登録済みのメッセージ数より多い会話を取り込む
+
+取り込み中に追加されたメッセージは取り込みの完了後に登録し、取り込みで登録済みのものは飛ばす。
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+from app.schemas.search import SearchHit, SearchResponse
+from app.services.metrics import SEARCH_SECONDS, stage
+from app.services.search.index import InvertedIndex, SearchMatch
+from app.services.search.tokenizer import normalize, tokenize
+from app.services.store import ConversationStore
+from app.services.store.message_log import MessageRecord
+from app.services.store.ordering import ListCursor
+
+logger = logging.getLogger(__name__)
+
+# 取り込みで1回に読み出す会話数・メッセージ数
+_SYNC_CONVERSATION_PAGE_SIZE = 500
+_SYNC_MESSAGE_PAGE_SIZE = 1000
+# 前回の取り込みの開始時刻からさらに遡って確認する時間（書き込みのコミットの遅れを見込む）
+_SYNC_MARGIN = timedelta(seconds=60)
+# 抜粋の一致箇所の前・後の文字数
+_SNIPPET_BEFORE = 20
+_SNIPPET_AFTER = 60
+
+
+def make_snippet(content: str, tokens: List[str]) -> str:
+    """本文から最初に一致したトークンの前後を切り出す"""
+    normalized = normalize(content)
+    positions = [position for position in (normalized.find(token) for token in tokens) if position >= 0]
+    start = max(0, min(positions) - _SNIPPET_BEFORE) if positions else 0
+    end = start + _SNIPPET_BEFORE + _SNIPPET_AFTER
+    snippet = content[start:end]
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(content) else "")
+
+
+class ConversationSearch:
+    """
+    会話ストアのメッセージを対象とした全文検索
+    """
+
+    def __init__(self, store: ConversationStore, index: InvertedIndex, shared: bool = False, sync_interval: float = 5.0):
+        self.store = store
+        self.index = index
+        self.shared = shared
+        self.sync_interval = sync_interval
+        # 起動時の取り込みが終わったかどうか
+        self.ready = False
+        self._synced_at: Optional[datetime] = None
+        self._last_sync = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._syncing = False
+        # 取り込み中に追加されたメッセージ
+        self._deferred: List[Tuple[UUID, MessageRecord]] = []
+
+    def start(self) -> None:
+        """起動時の取り込みをバックグラウンドで始める"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.sync())
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def add_message(self, conversation_id: UUID, message: MessageRecord) -> None:
+        """会話に追加されたメッセージを登録する"""
+        if self._syncing:
+            self._deferred.append((conversation_id, message))
+            return
+        self.index.add(conversation_id, message.id, message.role, message.timestamp, message.content)
+
+    async def sync(self) -> None:
+        """更新日時が前回の取り込み以降の会話のうち、未登録のメッセージがある会話を取り込む"""
+        if self._syncing:
+            return
+        self._syncing = True
+        started = datetime.now()
+        updated_since = self._synced_at - _SYNC_MARGIN if self._synced_at is not None else None
+        imported = 0
+        try:
+            after: Optional[ListCursor] = None
+            while True:
+                infos = await self.store.list_conversations(
+                    _SYNC_CONVERSATION_PAGE_SIZE, after=after, newest_first=False, updated_since=updated_since
+                )
+                for info in infos:
+                    if self.index.indexed_count(info.id) < info.message_count:
+                        imported += await self._import(info.id)
+                if len(infos) < _SYNC_CONVERSATION_PAGE_SIZE:
+                    break
+                after = infos[-1].cursor
+            self._synced_at = started
+            if not self.ready:
+                logger.info(
+                    "検索インデックスを作成しました（%d件のメッセージ, %.1f秒）",
+                    self.index.document_count, (datetime.now() - started).total_seconds(),
+                )
+            self.ready = True
+        except Exception as e:
+            logger.error("検索インデックスへの取り込みに失敗しました: %s", e)
+        finally:
+            self._last_sync = time.monotonic()
+            self._syncing = False
+            self._flush_deferred()
+        if imported and self.shared:
+            logger.debug("他のワーカーが追加した %d 件のメッセージを検索インデックスに取り込みました", imported)
+
+    async def _import(self, conversation_id: UUID) -> int:
+        """会話の未登録のメッセージを登録する"""
+        messages: List[MessageRecord] = []
+        while True:
+            page = await self.store.get_messages(
+                conversation_id, after=messages[-1].id if messages else None, limit=_SYNC_MESSAGE_PAGE_SIZE
+            )
+            messages += page
+            if len(page) < _SYNC_MESSAGE_PAGE_SIZE:
+                break
+        # 読み出しの後に登録済みのメッセージを確かめる（読み出し中に追加されたメッセージは取り込み後に登録する）
+        indexed = self.index.message_ids(conversation_id)
+        added = 0
+        for message in messages:
+            if message.id not in indexed:
+                self.index.add(conversation_id, message.id, message.role, message.timestamp, message.content)
+                added += 1
+        return added
+
+    def _flush_deferred(self) -> None:
+        deferred, self._deferred = self._deferred, []
+        indexed: Dict[UUID, Set[UUID]] = {}
+        for conversation_id, message in deferred:
+            if conversation_id not in indexed:
+                indexed[conversation_id] = self.index.message_ids(conversation_id)
+            if message.id not in indexed[conversation_id]:
+                self.index.add(conversation_id, message.id, message.role, message.timestamp, message.content)
+
+    async def _refresh(self) -> None:
+        """他のワーカーと共有するストアの場合、前回の取り込みから sync_interval 秒以上経っていれば取り込む"""
+        running = self._task is not None and not self._task.done()
+        if not self.ready:
+            # 起動時の取り込みが失敗していればやり直す（完了は待たない）
+            if not running:
+                self._task = asyncio.create_task(self.sync())
+            return
+        if not self.shared:
+            return
+        if running:
+            await asyncio.shield(self._task)
+            return
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self._task = asyncio.create_task(self.sync())
+            await asyncio.shield(self._task)
+
+    async def search(
+        self,
+        query: str,
+        limit: int = 20,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        role: Optional[str] = None,
+        group_by_conversation: bool = False,
+    ) -> SearchResponse:
+        """
+        クエリのトークンをすべて含むメッセージをBM25のスコア順に返す
+        """
+        await self._refresh()
+        with stage(SEARCH_SECONDS, "search.query"):
+            total, matches = self.index.search(query, limit, since, until, role, group_by_conversation)
+        return SearchResponse(
+            query=query,
+            total=total,
+            hits=await self._hits(matches, list(dict.fromkeys(tokenize(query)))),
+            complete=self.ready,
+        )
+
+    async def _hits(self, matches: List[SearchMatch], tokens: List[str]) -> List[SearchHit]:
+        """一致したメッセージの本文を会話ストアから読み、抜粋を付ける"""
+        wanted = {match.message_id for match in matches}
+        contents: Dict[UUID, str] = {}
+        for conversation_id in dict.fromkeys(match.conversation_id for match in matches):
+            for message in await self.store.get_messages(conversation_id):
+                if message.id in wanted:
+                    contents[message.id] = message.content
+        hits = []
+        for match in matches:
+            content = contents.get(match.message_id)
+            hits.append(SearchHit(
+                conversation_id=match.conversation_id,
+                message_id=match.message_id,
+                role=match.role,
+                timestamp=match.timestamp,
+                score=round(match.score, 4),
+                snippet=make_snippet(content, tokens) if content is not None else None,
+            ))
+        return hits
@@ -0,0 +1,36 @@
+"""
+検索用のトークン分割
+
+形態素解析の辞書を使わず、日本語の文字列は文字bigramに分割する。
+英数字の連続は単語として1トークンにする（"Python" → "python"）。
+全角・半角と大文字・小文字は NFKC と小文字化で揃える。
+
+    "Pythonで転職したい" → ["python", "転職", "職し", "した", "たい"]
+
+1文字だけの日本語の文字列（前後が記号・空白）は1文字のトークンにする。
+"""
+import re
+import unicodedata
+from typing import List
+
+# 英数字の単語と、それ以外の文字（かな・漢字など）の連続
+_RUNS = re.compile(r"[0-9a-z_]+|[^\W0-9a-z_]+")
+_WORD = re.compile(r"[0-9a-z_]")
+
+
+def normalize(text: str) -> str:
+    """全角・半角を統一し、小文字にする"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    本文をトークンの列に分割する（同じトークンが複数回現れる）
+    """
+    tokens: List[str] = []
+    for run in _RUNS.findall(normalize(text)):
+        if len(run) <= 2 or _WORD.match(run):
+            tokens.append(run)
+        else:
+            tokens += [run[i:i + 2] for i in range(len(run) - 1)]
+    return tokens
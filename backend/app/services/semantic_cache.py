@@ -0,0 +1,347 @@
+"""
+セマンティック応答キャッシュ
+
+質問文を埋め込みベクトルに変換し、過去の質問の中からコサイン類似度が閾値以上のものを
+探して、その回答を再利用する。言い換えられた質問にもヒットさせるためのキャッシュ。
+
+- 埋め込みは差し替え可能（HashingEmbedder はオフラインで動作する）
+- ベクトルはNumPy配列のインデックスに保存し、容量を超えた場合は最も長く使われていないものを上書きする
+- パスを指定した場合はベクトルをメモリマップファイルに保存し、再起動後も再利用する
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.core.config import settings
+from app.services.response_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+
+class Embedder(ABC):
+    """
+    テキストを埋め込みベクトルに変換する
+    """
+
+    dim: int
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """L2正規化済みの (len(texts), dim) のfloat32配列を返す"""
+
+
+class HashingEmbedder(Embedder):
+    """
+    文字n-gramをハッシュで固定長のベクトルに写像する埋め込み
+
+    単語分割を必要としないため日本語でもそのまま使え、外部APIも学習も不要
+    """
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _bucket(self, gram: str) -> Tuple[int, float]:
+        digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        # 衝突の影響を打ち消し合うよう、符号もハッシュから決める
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = normalize_prompt(text)
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                index, sign = self._bucket(text[i:i + n])
+                vector[index] += sign
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.embed_one(text) for text in texts])
+
+
+class OpenAIEmbedder(Embedder):
+    """
+    OpenAIのEmbeddings APIを使う埋め込み
+    """
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 1536):
+        from langchain_openai import OpenAIEmbeddings
+        from app.services.llm_registry import get_llm_registry
+
+        self.dim = dim
+        self._embeddings = OpenAIEmbeddings(
+            model=model,
+            base_url=settings.OPENAI_API_BASE,
+            http_async_client=get_llm_registry().http_client,
+        )
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(await self._embeddings.aembed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorIndex:
+    """
+    固定容量のNumPyベクトルインデックス
+
+    各スロットにベクトル・スコープ（ロールとモデルの組）・回答・挿入時刻・最終使用時刻を持つ。
+    検索は全スロットとの内積（総当たり）で行う。
+    """
+
+    def __init__(self, dim: int, capacity: int, path: Optional[str] = None):
+        self.dim = dim
+        self.capacity = capacity
+        self.path = path
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            mode = "r+" if os.path.exists(self._vectors_path) else "w+"
+            self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        else:
+            self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.scopes = np.full(capacity, -1, dtype=np.int32)
+        self.inserted_at = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.answers: List[Optional[str]] = [None] * capacity
+        self._scope_ids: Dict[str, int] = {}
+        self._size = 0
+        if path:
+            self._load_metadata()
+
+    @property
+    def _vectors_path(self) -> str:
+        return f"{self.path}.vectors"
+
+    @property
+    def _metadata_path(self) -> str:
+        return f"{self.path}.json"
+
+    def __len__(self) -> int:
+        return int(self.valid.sum())
+
+    def scope_id(self, scope: str) -> int:
+        if scope not in self._scope_ids:
+            self._scope_ids[scope] = len(self._scope_ids)
+        return self._scope_ids[scope]
+
+    def search(self, query: np.ndarray, scope: str, min_inserted_at: float = 0.0) -> Tuple[int, float]:
+        """
+        スコープ内で最も類似したスロットと類似度を返す（候補が無い場合は (-1, -1.0)）
+        """
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None or self._size == 0:
+            return -1, -1.0
+        candidates = self.valid[:self._size] & (self.scopes[:self._size] == scope_id)
+        candidates &= self.inserted_at[:self._size] >= min_inserted_at
+        if not candidates.any():
+            return -1, -1.0
+        scores = self.vectors[:self._size] @ query
+        scores[~candidates] = -np.inf
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+
+    def insert(self, vector: np.ndarray, scope: str, answer: str) -> int:
+        """
+        ベクトルを追加する。満杯の場合は最も長く使われていないスロットを上書きする
+        """
+        if self._size < self.capacity:
+            slot = self._size
+            self._size += 1
+        else:
+            invalid = np.flatnonzero(~self.valid)
+            slot = int(invalid[0]) if invalid.size else int(np.argmin(self.last_used))
+        now = time.time()
+        self.vectors[slot] = vector
+        self.valid[slot] = True
+        self.scopes[slot] = self.scope_id(scope)
+        self.inserted_at[slot] = now
+        self.last_used[slot] = now
+        self.answers[slot] = answer
+        return slot
+
+    def touch(self, slot: int) -> None:
+        self.last_used[slot] = time.time()
+
+    def evict_expired(self, min_inserted_at: float) -> int:
+        """挿入時刻が min_inserted_at より古いスロットを無効にし、その件数を返す"""
+        expired = self.valid & (self.inserted_at < min_inserted_at)
+        count = int(expired.sum())
+        if count:
+            self.valid[expired] = False
+            for slot in np.flatnonzero(expired):
+                self.answers[slot] = None
+        return count
+
+    def save(self) -> None:
+        """ベクトルとメタデータをファイルに書き込む"""
+        if not self.path:
+            return
+        self.vectors.flush()
+        slots = np.flatnonzero(self.valid[:self._size])
+        metadata = {
+            "dim": self.dim,
+            "size": self._size,
+            "scopes": self._scope_ids,
+            "entries": [
+                {
+                    "slot": int(slot),
+                    "scope": int(self.scopes[slot]),
+                    "inserted_at": float(self.inserted_at[slot]),
+                    "last_used": float(self.last_used[slot]),
+                    "answer": self.answers[slot],
+                }
+                for slot in slots
+            ],
+        }
+        temporary_path = f"{self._metadata_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(temporary_path, self._metadata_path)
+
+    def _load_metadata(self) -> None:
+        if not os.path.exists(self._metadata_path):
+            return
+        with open(self._metadata_path, encoding="utf-8") as f:
+            metadata = json.load(f)
+        if metadata.get("dim") != self.dim:
+            # 次元数が変わった場合は再利用しない
+            return
+        self._scope_ids = metadata["scopes"]
+        self._size = min(metadata["size"], self.capacity)
+        for entry in metadata["entries"]:
+            slot = entry["slot"]
+            if slot >= self.capacity:
+                continue
+            self.valid[slot] = True
+            self.scopes[slot] = entry["scope"]
+            self.inserted_at[slot] = entry["inserted_at"]
+            self.last_used[slot] = entry["last_used"]
+            self.answers[slot] = entry["answer"]
+
+
+@dataclass
+class SemanticCacheStats:
+    """セマンティックキャッシュの統計情報"""
+    hits: int = 0
+    misses: int = 0
+    inserts: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SemanticCache:
+    """
+    埋め込みの類似度で回答を再利用するキャッシュ
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        index: VectorIndex,
+        threshold: float,
+        ttl_seconds: Optional[float] = None,
+        save_interval: int = 100,
+    ):
+        self.embedder = embedder
+        self.index = index
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.save_interval = save_interval
+        self.stats = SemanticCacheStats()
+        self._inserts_since_save = 0
+
+    @staticmethod
+    def _scope(role: str, model: str) -> str:
+        return f"{role}:{model}"
+
+    def _min_inserted_at(self) -> float:
+        return time.time() - self.ttl_seconds if self.ttl_seconds else 0.0
+
+    async def lookup(self, question: str, role: str, model: str) -> Optional[Tuple[str, float]]:
+        """
+        類似した質問の回答と類似度を返す（閾値未満の場合はNone）
+        """
+        query = (await self.embedder.embed([question]))[0]
+        slot, score = self.index.search(query, self._scope(role, model), self._min_inserted_at())
+        if slot < 0 or score < self.threshold:
+            self.stats.misses += 1
+            return None
+        self.index.touch(slot)
+        self.stats.hits += 1
+        return self.index.answers[slot], score
+
+    async def insert(self, question: str, role: str, model: str, answer: str) -> None:
+        """質問と回答を追加する"""
+        vector = (await self.embedder.embed([question]))[0]
+        if self.ttl_seconds:
+            self.stats.expirations += self.index.evict_expired(self._min_inserted_at())
+        self.index.insert(vector, self._scope(role, model), answer)
+        self.stats.inserts += 1
+        self._inserts_since_save += 1
+        if self.index.path and self._inserts_since_save >= self.save_interval:
+            self._inserts_since_save = 0
+            await asyncio.to_thread(self.index.save)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self.index.save)
+
+
+_semantic_cache: Optional[SemanticCache] = None
+
+
+def create_embedder(name: str) -> Embedder:
+    """名前から埋め込みを作成する"""
+    if name == "hashing":
+        return HashingEmbedder(dim=settings.SEMANTIC_CACHE_DIM)
+    if name == "openai":
+        return OpenAIEmbedder()
+    raise ValueError(f"未対応の埋め込みです: {name}")
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """
+    共有のセマンティックキャッシュを取得する（SEMANTIC_CACHE_ENABLED が無効な場合はNone）
+    """
+    global _semantic_cache
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return None
+    if _semantic_cache is None:
+        embedder = create_embedder(settings.SEMANTIC_CACHE_EMBEDDER)
+        path = settings.SEMANTIC_CACHE_PATH
+        if path and settings.WORKERS > 1:
+            # 同じファイルを複数のプロセスから書き換えないよう、ワーカーごとにメモリ上に持つ
+            logger.warning("WORKERS=%d のため SEMANTIC_CACHE_PATH を使わずにメモリ上に保持します", settings.WORKERS)
+            path = None
+        _semantic_cache = SemanticCache(
+            embedder,
+            VectorIndex(embedder.dim, settings.SEMANTIC_CACHE_CAPACITY, path),
+            threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+            ttl_seconds=settings.SEMANTIC_CACHE_TTL_SECONDS,
+        )
+    return _semantic_cache
+
+
+async def close_semantic_cache() -> None:
+    """
+    共有のセマンティックキャッシュをファイルに保存して閉じる
+    """
+    global _semantic_cache
+    if _semantic_cache is not None:
+        await _semantic_cache.close()
+        _semantic_cache = None
@@ -0,0 +1,181 @@
+"""
+同一リクエストの合流（single-flight）
+
+同じキーの処理が実行中であれば、後から来た呼び出しは新たに実行せずに実行中の結果を待つ。
+キャンペーンなどで同じ最初のメッセージが短時間に大量に届いた場合に、LLM呼び出しを1回にまとめる。
+
+- do(): 結果を1つ返す処理を合流させる。例外は待っている全員に伝わる
+- stream(): トークン列を返す処理を合流させる。途中から合流した購読者にはそれまでのトークンを先に返す
+- 呼び出し側がキャンセルされても他に待っている呼び出しがあれば処理は続け、
+  最後の1人がキャンセルされた時点で処理もキャンセルする。キャンセルした処理のキーはすぐに外すため、
+  その後に来た同じキーの呼び出しは新しく実行する
+- 処理がキャンセルされた時点で購読しているトークン列には SingleFlightCancelled を送出する
+  （空の応答として正常に終わらせない）
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, Generic, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlightCancelled(Exception):
+    """合流していた処理がキャンセルされたため、結果を返せない場合のエラー"""
+
+
+@dataclass
+class SingleFlightStats:
+    """合流の統計情報"""
+    # 実際に処理を実行した回数
+    leaders: int = 0
+    # 実行中の処理に合流した回数
+    coalesced: int = 0
+    errors: int = 0
+    cancelled: int = 0
+    in_flight: int = 0
+
+    @property
+    def coalesce_rate(self) -> float:
+        total = self.leaders + self.coalesced
+        return self.coalesced / total if total else 0.0
+
+
+class _Call(Generic[T]):
+    """実行中の処理と、その結果を待っている呼び出しの数"""
+
+    def __init__(self, task: "asyncio.Task[T]"):
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """1つの上流のトークン列を複数の購読者に配る"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    キーごとに実行中の処理を1つにまとめる
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._broadcasts: Dict[str, _Broadcast] = {}
+        self.stats = SingleFlightStats()
+
+    def snapshot(self) -> SingleFlightStats:
+        """現在の統計情報を返す"""
+        self.stats.in_flight = len(self._calls) + len(self._broadcasts)
+        return SingleFlightStats(**vars(self.stats))
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        key の処理が実行中であればその結果を待ち、なければ fn() を実行する
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._finish_call(key, call))
+            self.stats.leaders += 1
+        else:
+            self.stats.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # 1人がキャンセルされても処理自体は止めない
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # 最後の1人がキャンセルされたら処理もキャンセルし、キャンセル中の処理に合流させない
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _finish_call(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if call.task.cancelled():
+            self.stats.cancelled += 1
+        elif call.task.exception() is not None:
+            self.stats.errors += 1
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        key のトークン列が配信中であれば合流し、なければ fn() のトークン列の配信を始める
+        """
+        broadcast = self._broadcasts.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._broadcasts[key] = broadcast
+            broadcast.task = asyncio.create_task(self._produce(key, broadcast, fn))
+            self.stats.leaders += 1
+        else:
+            self.stats.coalesced += 1
+
+        broadcast.subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with broadcast.changed:
+                    await broadcast.changed.wait_for(lambda: len(broadcast.chunks) > index or broadcast.done)
+                    chunks = broadcast.chunks[index:]
+                    done = broadcast.done
+                for chunk in chunks:
+                    yield chunk
+                index += len(chunks)
+                if done and index >= len(broadcast.chunks):
+                    break
+            if broadcast.error is not None:
+                raise broadcast.error
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                # 購読者がいなくなったら上流の処理もキャンセルし、キャンセル中の配信に合流させない
+                if self._broadcasts.get(key) is broadcast:
+                    del self._broadcasts[key]
+                broadcast.task.cancel()
+
+    async def _produce(self, key: str, broadcast: _Broadcast, fn: Callable[[], AsyncIterator[str]]) -> None:
+        try:
+            async for chunk in fn():
+                async with broadcast.changed:
+                    broadcast.chunks.append(chunk)
+                    broadcast.changed.notify_all()
+        except asyncio.CancelledError:
+            self.stats.cancelled += 1
+            broadcast.error = SingleFlightCancelled(f"{key} の配信はキャンセルされました")
+            raise
+        except Exception as e:
+            broadcast.error = e
+            self.stats.errors += 1
+        finally:
+            # 完了後に来た呼び出しは新しく実行する
+            if self._broadcasts.get(key) is broadcast:
+                del self._broadcasts[key]
+            broadcast.done = True
+            async with broadcast.changed:
+                broadcast.changed.notify_all()
+
+
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    共有のsingle-flightを取得する
+    """
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,114 @@
+"""
+会話ストア
+
+CONVERSATION_STORE_BACKEND の設定に応じてバックエンドを選択する
+- memory: プロセス内の辞書（再起動で消える）
+- sqlite: WALモードのSQLiteファイル
+- jsonl: 追記専用のJSONLセグメントファイル
+
+CONVERSATION_CACHE_ENABLED が有効な場合は前段にLRU/TTLキャッシュを置く。
+memoryバックエンドではキャッシュ自体が保存先となり、上限を超えた会話は破棄される
+
+WORKERS が2以上の場合は複数のワーカープロセスでストアを共有するため、sqliteバックエンドのみ使える。
+書き込みはコミットまで待ち、キャッシュは使う前に他のプロセスによる更新がないか確かめる
+"""
+from typing import Optional
+from app.core.config import settings
+from app.services.store.base import ConversationStore
+from app.services.store.cache import CacheStats, CachedConversationStore, ConversationCache
+from app.services.store.memory import InMemoryConversationStore
+
+_store: Optional[ConversationStore] = None
+
+
+def create_conversation_store(backend: Optional[str] = None) -> ConversationStore:
+    """
+    設定に応じた会話ストアを作成する（キャッシュが有効な場合はキャッシュ付き）
+    """
+    backend = backend or settings.CONVERSATION_STORE_BACKEND
+    shared = settings.WORKERS > 1
+    if shared and backend != "sqlite":
+        raise ValueError(
+            f"WORKERS={settings.WORKERS} では会話ストアをワーカー間で共有するため、"
+            f"CONVERSATION_STORE_BACKEND=sqlite を指定してください（現在: {backend}）"
+        )
+    if not settings.CONVERSATION_CACHE_ENABLED:
+        return _create_backend(backend)
+
+    cache = ConversationCache(
+        max_entries=settings.CONVERSATION_CACHE_MAX_ENTRIES,
+        max_bytes=settings.CONVERSATION_CACHE_MAX_BYTES,
+        ttl_seconds=settings.CONVERSATION_CACHE_TTL_SECONDS,
+    )
+    if backend == "memory":
+        return CachedConversationStore(cache)
+    return CachedConversationStore(
+        cache, _create_backend(backend), write_back=settings.CONVERSATION_CACHE_WRITE_BACK, validate=shared
+    )
+
+
+def _create_backend(backend: str) -> ConversationStore:
+    if backend == "memory":
+        return InMemoryConversationStore()
+    if backend == "sqlite":
+        from app.services.store.sqlite import SQLiteConversationStore
+
+        return SQLiteConversationStore(
+            settings.CONVERSATION_SQLITE_PATH,
+            batch_size=settings.CONVERSATION_STORE_BATCH_SIZE,
+            batch_interval=settings.CONVERSATION_STORE_BATCH_INTERVAL,
+            sync_writes=settings.WORKERS > 1,
+        )
+    if backend == "jsonl":
+        from app.services.store.jsonl import JSONLConversationStore
+
+        return JSONLConversationStore(
+            settings.CONVERSATION_JSONL_DIR,
+            segment_max_bytes=settings.CONVERSATION_JSONL_SEGMENT_MAX_BYTES,
+            batch_size=settings.CONVERSATION_STORE_BATCH_SIZE,
+            batch_interval=settings.CONVERSATION_STORE_BATCH_INTERVAL,
+        )
+    raise ValueError(f"未対応の会話ストアです: {backend}")
+
+
+def get_conversation_store() -> ConversationStore:
+    """
+    アプリケーション全体で共有する会話ストアを取得する
+    """
+    global _store
+    if _store is None:
+        _store = create_conversation_store()
+    return _store
+
+
+def get_conversation_cache_stats() -> Optional[CacheStats]:
+    """
+    共有の会話ストアのキャッシュ統計を取得する（キャッシュが無効な場合はNone）
+    """
+    store = get_conversation_store()
+    if isinstance(store, CachedConversationStore):
+        return store.cache.snapshot()
+    return None
+
+
+async def close_conversation_store() -> None:
+    """
+    共有の会話ストアを閉じる
+    """
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+__all__ = [
+    "CacheStats",
+    "CachedConversationStore",
+    "ConversationCache",
+    "ConversationStore",
+    "InMemoryConversationStore",
+    "create_conversation_store",
+    "get_conversation_store",
+    "get_conversation_cache_stats",
+    "close_conversation_store",
+]
@@ -0,0 +1,180 @@
+"""
+会話ストアのインターフェース
+
+メッセージは軽量な MessageRecord で受け渡し、APIのスキーマ（ChatMessage）への変換は呼び出し側が
+レスポンスを返す時に行う。会話全体を返す get_conversation のみ ChatMessage を含む Conversation を返す。
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+from app.schemas.chat import Conversation, ConversationSummary
+from app.services.store.message_log import MessageRecord
+from app.services.store.ordering import ListCursor
+
+
+def resolve_range(
+    positions: Dict[UUID, int],
+    count: int,
+    after: Optional[UUID] = None,
+    before: Optional[UUID] = None,
+    limit: Optional[int] = None,
+) -> Optional[Tuple[int, int]]:
+    """
+    カーソル（メッセージID）から取得するメッセージの範囲 [start, end) を求める
+
+    before のみ指定された場合は before の直前から遡って limit 件、
+    それ以外は after の直後から limit 件を対象とする。カーソルが見つからない場合はNone
+    """
+    after_position = before_position = None
+    if after is not None:
+        after_position = positions.get(after)
+        if after_position is None:
+            return None
+    if before is not None:
+        before_position = positions.get(before)
+        if before_position is None:
+            return None
+
+    start = 0 if after_position is None else after_position + 1
+    end = count if before_position is None else before_position
+    if limit is not None:
+        if before_position is not None and after_position is None:
+            start = max(start, end - limit)
+        else:
+            end = min(end, start + limit)
+    return start, max(start, end)
+
+
+class ConversationInfo:
+    """
+    会話一覧の1件（メッセージを除いた会話の情報）
+    """
+
+    __slots__ = ("id", "created_at", "updated_at", "message_count", "metadata")
+
+    def __init__(
+        self,
+        id: UUID,
+        created_at: datetime,
+        updated_at: datetime,
+        message_count: int,
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        self.id = id
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.message_count = message_count
+        self.metadata = metadata
+
+    @classmethod
+    def from_conversation(cls, conversation: Conversation, message_count: int) -> "ConversationInfo":
+        return cls(
+            conversation.id, conversation.created_at, conversation.updated_at, message_count, conversation.metadata
+        )
+
+    @property
+    def cursor(self) -> ListCursor:
+        """この会話の次から一覧を続けるためのカーソル"""
+        return self.updated_at, self.id
+
+    def to_summary(self) -> ConversationSummary:
+        """APIのスキーマに変換する"""
+        return ConversationSummary.model_construct(
+            id=self.id,
+            created_at=self.created_at,
+            updated_at=self.updated_at,
+            message_count=self.message_count,
+            metadata=self.metadata,
+        )
+
+
+class ConversationStore(ABC):
+    """
+    会話とメッセージを保存するストアの基底クラス
+
+    メッセージは会話ごとに (timestamp, 追加順) で並べて扱う
+    """
+
+    async def start(self) -> None:
+        """ストアを使用可能な状態にする（接続の確立やインデックスの読み込み）"""
+
+    async def flush(self) -> None:
+        """未書き込みの変更をすべて永続化する"""
+
+    async def close(self) -> None:
+        """未書き込みの変更を永続化し、リソースを解放する"""
+        await self.flush()
+
+    @abstractmethod
+    async def create_conversation(self, conversation: Conversation) -> None:
+        """会話を作成する（同じIDの会話が既にある場合は何もしない）"""
+
+    @abstractmethod
+    async def get_conversation(self, conversation_id: UUID) -> Optional[Conversation]:
+        """メッセージを含む会話全体を取得する"""
+
+    @abstractmethod
+    async def has_conversation(self, conversation_id: UUID) -> bool:
+        """会話が存在するかどうかを返す"""
+
+    @abstractmethod
+    async def append_message(self, conversation_id: UUID, message: MessageRecord) -> None:
+        """会話の末尾にメッセージを追加する（会話がなければ作成する）"""
+
+    @abstractmethod
+    async def get_messages(
+        self,
+        conversation_id: UUID,
+        after: Optional[UUID] = None,
+        limit: Optional[int] = None,
+        before: Optional[UUID] = None,
+    ) -> List[MessageRecord]:
+        """
+        会話のメッセージを古い順に取得する
+
+        after が指定された場合はそのメッセージより後、before が指定された場合は
+        そのメッセージより前のメッセージのみを返す（範囲の決め方は resolve_range を参照）
+        """
+
+    @abstractmethod
+    async def get_recent_messages(self, conversation_id: UUID, limit: int) -> List[MessageRecord]:
+        """会話の最新 limit 件のメッセージを古い順に取得する"""
+
+    @abstractmethod
+    async def list_conversation_ids(self) -> List[UUID]:
+        """全ての会話IDを取得する"""
+
+    @abstractmethod
+    async def list_conversations(
+        self,
+        limit: int,
+        after: Optional[ListCursor] = None,
+        newest_first: bool = True,
+        updated_since: Optional[datetime] = None,
+        updated_until: Optional[datetime] = None,
+    ) -> List[ConversationInfo]:
+        """
+        会話を (updated_at, 会話ID) の順に limit 件取得する
+
+        newest_first の場合は新しい順、それ以外は古い順。after には直前のページの最後の会話の
+        cursor を指定する。updated_since / updated_until を指定した場合は
+        updated_since <= updated_at < updated_until の会話のみを返す
+        """
+
+    @abstractmethod
+    async def get_summary(self, conversation_id: UUID) -> Tuple[Optional[str], Optional[UUID]]:
+        """会話の要約と、要約に含めた最後のメッセージIDを取得する"""
+
+    @abstractmethod
+    async def update_summary(self, conversation_id: UUID, summary: str, summary_until: UUID) -> None:
+        """会話の要約を更新する"""
+
+    async def get_version(self, conversation_id: UUID) -> Optional[Tuple[int, Optional[UUID]]]:
+        """
+        会話のメッセージ数と要約に含めた最後のメッセージID
+
+        他のプロセスによる変更の検知に使う。会話がない場合と、変更を検知できないストア（既定の実装）はNone。
+        複数のプロセスで共有するストアのみ実装する
+        """
+        return None
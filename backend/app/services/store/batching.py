@@ -0,0 +1,79 @@
+"""
+書き込みのバッチ処理
+
+書き込み要求をキューに溜め、一定件数または一定時間ごとにまとめて書き込む。
+呼び出し側は書き込みの完了を待たずに処理を続けられる（submit）。
+他のプロセスから読まれる場合など、コミットまで待つ必要があるときは write を使う。
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from app.services.metrics import STORE_SECONDS, stage
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """
+    書き込み要求をまとめて write_batch に渡すライター
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[Any]], Awaitable[None]],
+        max_batch_size: int = 100,
+        max_interval: float = 0.01,
+    ):
+        self._write_batch = write_batch
+        self.max_batch_size = max_batch_size
+        self.max_interval = max_interval
+        # (書き込み要求, 完了を待つFuture または None)
+        self._pending: List[Tuple[Any, Optional[asyncio.Future]]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.last_error: Optional[Exception] = None
+
+    @property
+    def pending(self) -> int:
+        """未書き込みの要求数"""
+        return len(self._pending)
+
+    def submit(self, operation: Any) -> None:
+        """書き込み要求を追加する"""
+        self._enqueue(operation, None)
+
+    async def write(self, operation: Any) -> None:
+        """書き込み要求を追加し、その要求を含むバッチがコミットされるまで待つ"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(operation, future)
+        await future
+
+    def _enqueue(self, operation: Any, future: Optional[asyncio.Future]) -> None:
+        self._pending.append((operation, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._pending:
+            # バッチが埋まるまで少し待って後続の書き込みをまとめる
+            if len(self._pending) < self.max_batch_size:
+                await asyncio.sleep(self.max_interval)
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            try:
+                with stage(STORE_SECONDS, "store.write_batch", operation="write_batch"):
+                    await self._write_batch([operation for operation, _ in batch])
+            except Exception as e:
+                self.last_error = e
+                logger.error("会話ストアへの書き込みに失敗しました（%d件）: %s", len(batch), e)
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_result(None)
+
+    async def flush(self) -> None:
+        """未書き込みの要求がすべて書き込まれるまで待つ"""
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
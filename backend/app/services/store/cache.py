@@ -0,0 +1,395 @@
+"""
+会話キャッシュ
+
+会話ストアの前段に置くLRUキャッシュ。会話数とおおよそのメモリ使用量に上限を設け、
+`Conversation.updated_at` から一定時間更新のない会話は期限切れとして追い出す。
+
+永続ストアが設定されている場合はキャッシュに無い会話をストアから読み込む（read-through）。
+書き込みはストアへ即座に転送する（write-through）か、キャッシュに溜めて
+追い出し時・flush時にまとめて書き込む（write-back）かを選べる。
+永続ストアがない場合（memoryバックエンド）はキャッシュ自体が保存先となり、
+追い出された会話は破棄される。
+複数のワーカープロセスでストアを共有する場合（validate=True）は、キャッシュ内の会話を使う前に
+ストアのメッセージ数・要約の位置と比べ、他のプロセスが更新していれば読み込み直す。
+キャッシュ内のメッセージは会話ごとの MessageLog に保持する。
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from uuid import UUID
+from app.schemas.chat import Conversation
+from app.services.store.base import ConversationInfo, ConversationStore, resolve_range
+from app.services.store.message_log import MessageLog, MessageRecord
+from app.services.store.ordering import ListCursor, UpdatedAtIndex
+
+# Conversation 1件あたりのおおよそのサイズ
+CONVERSATION_OVERHEAD_BYTES = 800
+
+
+@dataclass
+class _CacheEntry:
+    """キャッシュ内の会話（conversation はメッセージを含まない）"""
+    conversation: Conversation
+    log: MessageLog
+    size: int
+    # write-back時にまだストアへ書き込んでいない変更
+    pending_create: bool = False
+    pending_messages: List[MessageRecord] = field(default_factory=list)
+
+    @classmethod
+    def from_conversation(cls, conversation: Conversation) -> "_CacheEntry":
+        log = MessageLog.from_chat_messages(conversation.messages)
+        return cls(
+            conversation=conversation.model_copy(update={"messages": []}),
+            log=log,
+            size=CONVERSATION_OVERHEAD_BYTES + log.nbytes,
+        )
+
+    @property
+    def dirty(self) -> bool:
+        return self.pending_create or bool(self.pending_messages)
+
+
+@dataclass
+class CacheStats:
+    """キャッシュの統計情報"""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    # 他のプロセスによる更新を検知して破棄した件数
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+class ConversationCache:
+    """
+    会話数・メモリ使用量・TTLで上限を設けたLRUキャッシュ
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = timedelta(seconds=ttl_seconds) if ttl_seconds else None
+        self._entries: "OrderedDict[UUID, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        # 一覧用の更新日時順のインデックス（保存先がキャッシュ自体の場合に使う）
+        self.ordering = UpdatedAtIndex()
+        self.stats = CacheStats()
+
+    def __contains__(self, conversation_id: UUID) -> bool:
+        return conversation_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self) -> List[UUID]:
+        return list(self._entries.keys())
+
+    def _is_expired(self, entry: _CacheEntry, now: datetime) -> bool:
+        return self.ttl is not None and now - entry.conversation.updated_at > self.ttl
+
+    def get(self, conversation_id: UUID) -> Optional[_CacheEntry]:
+        """
+        会話を取得する。期限切れの会話は取得できない（追い出しは evict で行う）
+        """
+        entry = self._entries.get(conversation_id)
+        if entry is None or self._is_expired(entry, datetime.now()):
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(conversation_id)
+        self.stats.hits += 1
+        return entry
+
+    def peek(self, conversation_id: UUID) -> Optional[_CacheEntry]:
+        """LRUの順序と統計を変えずに会話を取得する"""
+        return self._entries.get(conversation_id)
+
+    def contains(self, conversation_id: UUID) -> bool:
+        """LRUの順序と統計を変えずに、期限切れでない会話があるかどうかを返す"""
+        entry = self._entries.get(conversation_id)
+        return entry is not None and not self._is_expired(entry, datetime.now())
+
+    def put(self, entry: _CacheEntry) -> None:
+        """会話を追加する（既にあれば置き換える）"""
+        conversation_id = entry.conversation.id
+        previous = self._entries.pop(conversation_id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        self._entries[conversation_id] = entry
+        self._bytes += entry.size
+        self.ordering.update(conversation_id, entry.conversation.updated_at)
+
+    def add_message(self, entry: _CacheEntry, message: MessageRecord) -> None:
+        """キャッシュ内の会話にメッセージを追加する"""
+        before = entry.log.nbytes
+        entry.log.append(message)
+        entry.conversation.updated_at = datetime.now()
+        self.ordering.update(entry.conversation.id, entry.conversation.updated_at)
+        size = entry.log.nbytes - before
+        entry.size += size
+        self._bytes += size
+        self._entries.move_to_end(entry.conversation.id)
+
+    def evict(self) -> List[_CacheEntry]:
+        """
+        期限切れの会話と、上限を超えた分の最も古く使われた会話を取り除いて返す
+        """
+        evicted: List[_CacheEntry] = []
+        now = datetime.now()
+
+        # LRUの古い側から期限切れの会話を取り除く（期限内の会話に達したら止め、全件を走査しない）
+        while self._entries:
+            conversation_id, entry = next(iter(self._entries.items()))
+            if not self._is_expired(entry, now):
+                break
+            evicted.append(self._remove(conversation_id))
+            self.stats.expirations += 1
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            conversation_id = next(iter(self._entries))
+            evicted.append(self._remove(conversation_id))
+            self.stats.evictions += 1
+
+        return evicted
+
+    def expire(self, conversation_id: UUID) -> Optional[_CacheEntry]:
+        """期限切れの会話を取り除いて返す（期限内、またはキャッシュに無い場合はNone）"""
+        entry = self._entries.get(conversation_id)
+        if entry is None or not self._is_expired(entry, datetime.now()):
+            return None
+        self.stats.expirations += 1
+        return self._remove(conversation_id)
+
+    def invalidate(self, conversation_id: UUID) -> None:
+        """他のプロセスが更新した会話を取り除く"""
+        if conversation_id in self._entries:
+            self.stats.invalidations += 1
+            self._remove(conversation_id)
+
+    def dirty_entries(self) -> List[_CacheEntry]:
+        """ストアへ書き込んでいない変更を持つ会話を返す"""
+        return [entry for entry in self._entries.values() if entry.dirty]
+
+    def _remove(self, conversation_id: UUID) -> _CacheEntry:
+        entry = self._entries.pop(conversation_id)
+        self._bytes -= entry.size
+        self.ordering.remove(conversation_id)
+        return entry
+
+    def snapshot(self) -> CacheStats:
+        """現在の統計情報を返す"""
+        self.stats.entries = len(self._entries)
+        self.stats.bytes = self._bytes
+        return CacheStats(**vars(self.stats))
+
+
+class CachedConversationStore(ConversationStore):
+    """
+    ConversationCache を前段に置いた会話ストア
+    """
+
+    def __init__(
+        self,
+        cache: ConversationCache,
+        backend: Optional[ConversationStore] = None,
+        write_back: bool = False,
+        validate: bool = False,
+    ):
+        self.cache = cache
+        self.backend = backend
+        self.write_back = write_back and backend is not None
+        self.validate = validate and backend is not None
+        if self.write_back and self.validate:
+            raise ValueError("他のプロセスと共有するストアではwrite-backを使えません")
+
+    async def start(self) -> None:
+        if self.backend is not None:
+            await self.backend.start()
+
+    async def _persist(self, entries: List[_CacheEntry]) -> None:
+        """write-backで溜めていた変更をストアへ書き込む"""
+        if self.backend is None:
+            return
+        for entry in entries:
+            if entry.pending_create:
+                await self.backend.create_conversation(entry.conversation)
+                entry.pending_create = False
+            pending, entry.pending_messages = entry.pending_messages, []
+            for message in pending:
+                await self.backend.append_message(entry.conversation.id, message)
+
+    async def _evict(self) -> None:
+        evicted = self.cache.evict()
+        if evicted:
+            await self._persist([entry for entry in evicted if entry.dirty])
+
+    async def flush(self) -> None:
+        if self.backend is None:
+            return
+        await self._persist(self.cache.dirty_entries())
+        await self.backend.flush()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self.backend is not None:
+            await self.backend.close()
+
+    async def _cached(self, conversation_id: UUID) -> Optional[_CacheEntry]:
+        """キャッシュから会話を取得する（validate=True の場合はストアと一致するもののみ）"""
+        entry = self.cache.get(conversation_id)
+        if entry is None or not self.validate:
+            return entry
+        conversation = entry.conversation
+        version = await self.backend.get_version(conversation_id)
+        # None（会話がない・ストアが変更を検知できない）の場合もキャッシュの内容は確かめられないため読み込み直す
+        if version is None or version != (len(entry.log), conversation.summary_until):
+            self.cache.invalidate(conversation_id)
+            return None
+        return entry
+
+    async def _get(self, conversation_id: UUID) -> Optional[_CacheEntry]:
+        """キャッシュから会話を取得する。なければ期限切れの会話を先に追い出しておく"""
+        entry = await self._cached(conversation_id)
+        if entry is None:
+            expired = self.cache.expire(conversation_id)
+            if expired is not None and expired.dirty:
+                await self._persist([expired])
+            await self._evict()
+        return entry
+
+    async def _load(self, conversation_id: UUID) -> Optional[_CacheEntry]:
+        """キャッシュから会話を取得し、なければストアから読み込む"""
+        entry = await self._get(conversation_id)
+        if entry is not None or self.backend is None:
+            return entry
+        conversation = await self.backend.get_conversation(conversation_id)
+        if conversation is None:
+            return None
+        entry = _CacheEntry.from_conversation(conversation)
+        self.cache.put(entry)
+        await self._evict()
+        return entry
+
+    async def create_conversation(self, conversation: Conversation) -> None:
+        if await self._get(conversation.id) is not None:
+            return
+        entry = _CacheEntry.from_conversation(conversation)
+        if self.backend is not None:
+            if self.write_back:
+                entry.pending_create = True
+            else:
+                await self.backend.create_conversation(conversation)
+        self.cache.put(entry)
+        await self._evict()
+
+    async def get_conversation(self, conversation_id: UUID) -> Optional[Conversation]:
+        entry = await self._load(conversation_id)
+        if entry is None:
+            return None
+        return entry.conversation.model_copy(update={"messages": entry.log.chat_messages()})
+
+    async def has_conversation(self, conversation_id: UUID) -> bool:
+        # 存在の確認はヒット・ミスに数えない（続く読み出しで数える）
+        if self.cache.contains(conversation_id):
+            return True
+        return self.backend is not None and await self.backend.has_conversation(conversation_id)
+
+    async def append_message(self, conversation_id: UUID, message: MessageRecord) -> None:
+        entry = await self._get(conversation_id)
+        if entry is None:
+            if self.backend is not None:
+                # キャッシュに無い会話は読み込まずにストアへ直接書き込む
+                await self.backend.append_message(conversation_id, message)
+                return
+            await self.create_conversation(Conversation(id=conversation_id))
+            entry = self.cache.get(conversation_id)
+
+        self.cache.add_message(entry, message)
+        if self.write_back:
+            entry.pending_messages.append(message)
+        elif self.backend is not None:
+            await self.backend.append_message(conversation_id, message)
+        await self._evict()
+
+    async def get_messages(
+        self,
+        conversation_id: UUID,
+        after: Optional[UUID] = None,
+        limit: Optional[int] = None,
+        before: Optional[UUID] = None,
+    ) -> List[MessageRecord]:
+        entry = await self._cached(conversation_id)
+        if entry is None:
+            if self.backend is None:
+                return []
+            return await self.backend.get_messages(conversation_id, after=after, limit=limit, before=before)
+        selected = resolve_range(entry.log.positions, len(entry.log), after, before, limit)
+        if selected is None:
+            return []
+        start, end = selected
+        return entry.log.records(start, end)
+
+    async def get_recent_messages(self, conversation_id: UUID, limit: int) -> List[MessageRecord]:
+        entry = await self._cached(conversation_id)
+        if entry is None:
+            if self.backend is None:
+                return []
+            return await self.backend.get_recent_messages(conversation_id, limit)
+        if limit <= 0:
+            return []
+        return entry.log.records(-limit)
+
+    async def list_conversation_ids(self) -> List[UUID]:
+        if self.backend is None:
+            return self.cache.keys()
+        ids = await self.backend.list_conversation_ids()
+        if self.write_back:
+            # まだストアに書き込んでいない会話も含める
+            known = set(ids)
+            ids += [conversation_id for conversation_id in self.cache.keys() if conversation_id not in known]
+        return ids
+
+    async def list_conversations(
+        self,
+        limit: int,
+        after: Optional[ListCursor] = None,
+        newest_first: bool = True,
+        updated_since: Optional[datetime] = None,
+        updated_until: Optional[datetime] = None,
+    ) -> List[ConversationInfo]:
+        if self.backend is not None:
+            if self.write_back:
+                # まだストアに書き込んでいない会話・メッセージを一覧に反映する
+                await self._persist(self.cache.dirty_entries())
+            return await self.backend.list_conversations(limit, after, newest_first, updated_since, updated_until)
+        # 期限切れの会話は取得できないため、一覧に含めないよう先に追い出す
+        await self._evict()
+        conversation_ids = self.cache.ordering.page(limit, after, newest_first, updated_since, updated_until)
+        infos = []
+        for conversation_id in conversation_ids:
+            entry = self.cache.peek(conversation_id)
+            infos.append(ConversationInfo.from_conversation(entry.conversation, len(entry.log)))
+        return infos
+
+    async def get_summary(self, conversation_id: UUID) -> Tuple[Optional[str], Optional[UUID]]:
+        entry = await self._get(conversation_id)
+        if entry is None:
+            if self.backend is None:
+                return None, None
+            return await self.backend.get_summary(conversation_id)
+        return entry.conversation.summary, entry.conversation.summary_until
+
+    async def update_summary(self, conversation_id: UUID, summary: str, summary_until: UUID) -> None:
+        entry = await self._get(conversation_id)
+        if entry is not None:
+            entry.conversation.summary = summary
+            entry.conversation.summary_until = summary_until
+        if self.backend is not None:
+            if entry is not None and entry.pending_create:
+                # write-backでストアに会話がまだ無い場合は先に作成する
+                await self._persist([entry])
+            # 要約の更新は頻度が低いため、write-backでも即座に書き込む
+            await self.backend.update_summary(conversation_id, summary, summary_until)
@@ -0,0 +1,303 @@
+"""
+追記専用のJSONLセグメントストア
+
+会話の作成とメッセージの追加を1行1レコードのJSONLとしてセグメントファイルに追記する。
+セグメントが一定サイズを超えると次のセグメントに切り替える。
+起動時に全セグメントを走査し、メッセージの位置（セグメント番号・オフセット・長さ）の
+インデックスをメモリ上に構築する。メッセージ本文は必要な時にファイルから読み出す。
+一覧用の更新日時順のインデックスは走査後にまとめて作り、以降は書き込みのたびに更新する。
+"""
+import asyncio
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+from app.schemas.chat import Conversation
+from app.services.store.base import ConversationInfo, ConversationStore, resolve_range
+from app.services.store.batching import BatchWriter
+from app.services.store.message_log import MessageRecord
+from app.services.store.ordering import ListCursor, UpdatedAtIndex
+
+_SEGMENT_PATTERN = re.compile(r"^segment-(\d{6})\.jsonl$")
+
+# (セグメント番号, オフセット, 長さ)
+Location = Tuple[int, int, int]
+
+
+@dataclass
+class _ConversationEntry:
+    """会話ごとのインデックス"""
+    created_at: datetime
+    updated_at: datetime
+    metadata: Optional[Dict[str, Any]] = None
+    summary: Optional[str] = None
+    summary_until: Optional[UUID] = None
+    message_ids: List[UUID] = field(default_factory=list)
+    locations: List[Location] = field(default_factory=list)
+    positions: Dict[UUID, int] = field(default_factory=dict)
+
+    def add_message(self, message_id: UUID, location: Location, timestamp: datetime) -> None:
+        if message_id in self.positions:
+            return
+        self.positions[message_id] = len(self.message_ids)
+        self.message_ids.append(message_id)
+        self.locations.append(location)
+        self.updated_at = timestamp
+
+
+class JSONLConversationStore(ConversationStore):
+    """
+    追記専用のJSONLセグメントファイルを使った会話ストア
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_max_bytes: int = 64 * 1024 * 1024,
+        batch_size: int = 100,
+        batch_interval: float = 0.01,
+    ):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self._index: Dict[UUID, _ConversationEntry] = {}
+        self._ordering = UpdatedAtIndex()
+        self._segment = 0
+        self._segment_size = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._writer = BatchWriter(self._write_batch, batch_size, batch_interval)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.jsonl")
+
+    async def start(self) -> None:
+        await self._load()
+
+    async def _load(self) -> None:
+        if self._loaded:
+            return
+        async with self._lock:
+            if not self._loaded:
+                await asyncio.to_thread(self._load_segments)
+                self._loaded = True
+
+    def _load_segments(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        segments = sorted(
+            int(match.group(1))
+            for match in (_SEGMENT_PATTERN.match(name) for name in os.listdir(self.directory))
+            if match
+        )
+        for segment in segments:
+            with open(self._segment_path(segment), "rb") as f:
+                offset = 0
+                for line in f:
+                    length = len(line)
+                    if line.endswith(b"\n"):
+                        # 書き込み途中で終了した末尾の不完全な行は無視する
+                        self._apply(json.loads(line), (segment, offset, length))
+                    offset += length
+            self._segment = segment
+            self._segment_size = os.path.getsize(self._segment_path(segment))
+        if not segments:
+            self._segment = 1
+            self._segment_size = 0
+        self._ordering.rebuild((conversation_id, entry.updated_at) for conversation_id, entry in self._index.items())
+
+    def _apply(self, record: Dict[str, Any], location: Location) -> None:
+        """レコードをインデックスに反映する"""
+        conversation_id = UUID(record["conversation_id"])
+        if record["op"] == "summary":
+            entry = self._index.get(conversation_id)
+            if entry is not None:
+                entry.summary = record["summary"]
+                entry.summary_until = UUID(record["summary_until"])
+        elif record["op"] == "conversation":
+            if conversation_id not in self._index:
+                self._index[conversation_id] = _ConversationEntry(
+                    created_at=datetime.fromisoformat(record["created_at"]),
+                    updated_at=datetime.fromisoformat(record["updated_at"]),
+                    metadata=record.get("metadata"),
+                )
+        else:
+            message = record["message"]
+            timestamp = datetime.fromisoformat(message["timestamp"])
+            entry = self._index.get(conversation_id)
+            if entry is None:
+                entry = _ConversationEntry(created_at=timestamp, updated_at=timestamp)
+                self._index[conversation_id] = entry
+            entry.add_message(UUID(message["id"]), location, timestamp)
+
+    async def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self._append_records, batch)
+
+    def _append_records(self, records: List[Dict[str, Any]]) -> None:
+        encoded = [(json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8") for record in records]
+        if self._segment_size and self._segment_size + sum(map(len, encoded)) > self.segment_max_bytes:
+            # セグメントを切り替える
+            self._segment += 1
+            self._segment_size = 0
+        with open(self._segment_path(self._segment), "ab") as f:
+            f.write(b"".join(encoded))
+            f.flush()
+            os.fsync(f.fileno())
+        offset = self._segment_size
+        for record, line in zip(records, encoded):
+            if record["op"] == "message":
+                # インデックスには書き込み前に反映済みなので、位置だけ確定させる
+                entry = self._index[UUID(record["conversation_id"])]
+                position = entry.positions[UUID(record["message"]["id"])]
+                entry.locations[position] = (self._segment, offset, len(line))
+            offset += len(line)
+        self._segment_size = offset
+
+    def _read_locations(self, locations: List[Location]) -> List[MessageRecord]:
+        files = {}
+        try:
+            messages = []
+            for segment, offset, length in locations:
+                f = files.get(segment)
+                if f is None:
+                    f = files[segment] = open(self._segment_path(segment), "rb")
+                f.seek(offset)
+                record = json.loads(f.read(length))
+                messages.append(MessageRecord.from_dict(record["message"]))
+            return messages
+        finally:
+            for f in files.values():
+                f.close()
+
+    async def _read_messages(self, entry: _ConversationEntry, start: int = 0, end: Optional[int] = None) -> List[MessageRecord]:
+        if any(location[0] == 0 for location in entry.locations[start:end]):
+            # 未書き込みのメッセージを読めるよう、先に書き込みを反映する
+            await self._writer.flush()
+        locations = entry.locations[start:end]
+        if not locations:
+            return []
+        return await asyncio.to_thread(self._read_locations, locations)
+
+    async def flush(self) -> None:
+        await self._writer.flush()
+
+    async def create_conversation(self, conversation: Conversation) -> None:
+        await self._load()
+        if conversation.id in self._index:
+            return
+        self._index[conversation.id] = _ConversationEntry(
+            created_at=conversation.created_at,
+            updated_at=conversation.updated_at,
+            metadata=conversation.metadata,
+        )
+        self._ordering.update(conversation.id, conversation.updated_at)
+        self._writer.submit({
+            "op": "conversation",
+            "conversation_id": str(conversation.id),
+            "metadata": conversation.metadata,
+            "created_at": conversation.created_at.isoformat(),
+            "updated_at": conversation.updated_at.isoformat(),
+        })
+        for message in conversation.messages:
+            await self.append_message(conversation.id, MessageRecord.from_chat_message(message))
+
+    async def get_conversation(self, conversation_id: UUID) -> Optional[Conversation]:
+        await self._load()
+        entry = self._index.get(conversation_id)
+        if entry is None:
+            return None
+        return Conversation(
+            id=conversation_id,
+            messages=[message.to_chat_message() for message in await self._read_messages(entry)],
+            metadata=entry.metadata,
+            created_at=entry.created_at,
+            updated_at=entry.updated_at,
+            summary=entry.summary,
+            summary_until=entry.summary_until,
+        )
+
+    async def has_conversation(self, conversation_id: UUID) -> bool:
+        await self._load()
+        return conversation_id in self._index
+
+    async def append_message(self, conversation_id: UUID, message: MessageRecord) -> None:
+        await self._load()
+        entry = self._index.get(conversation_id)
+        if entry is None:
+            await self.create_conversation(Conversation(id=conversation_id))
+            entry = self._index[conversation_id]
+        # 位置は書き込み時に確定する（セグメント番号0は未書き込みを表す）
+        entry.add_message(message.id, (0, 0, 0), message.timestamp)
+        self._ordering.update(conversation_id, entry.updated_at)
+        self._writer.submit({
+            "op": "message",
+            "conversation_id": str(conversation_id),
+            "message": message.to_dict(),
+        })
+
+    async def get_messages(
+        self,
+        conversation_id: UUID,
+        after: Optional[UUID] = None,
+        limit: Optional[int] = None,
+        before: Optional[UUID] = None,
+    ) -> List[MessageRecord]:
+        await self._load()
+        entry = self._index.get(conversation_id)
+        if entry is None:
+            return []
+        selected = resolve_range(entry.positions, len(entry.locations), after, before, limit)
+        if selected is None:
+            return []
+        start, end = selected
+        return await self._read_messages(entry, start, end)
+
+    async def get_recent_messages(self, conversation_id: UUID, limit: int) -> List[MessageRecord]:
+        await self._load()
+        entry = self._index.get(conversation_id)
+        if entry is None or limit <= 0:
+            return []
+        return await self._read_messages(entry, -limit)
+
+    async def list_conversation_ids(self) -> List[UUID]:
+        await self._load()
+        return list(self._index.keys())
+
+    async def list_conversations(
+        self,
+        limit: int,
+        after: Optional[ListCursor] = None,
+        newest_first: bool = True,
+        updated_since: Optional[datetime] = None,
+        updated_until: Optional[datetime] = None,
+    ) -> List[ConversationInfo]:
+        await self._load()
+        infos = []
+        for conversation_id in self._ordering.page(limit, after, newest_first, updated_since, updated_until):
+            entry = self._index[conversation_id]
+            infos.append(ConversationInfo(
+                conversation_id, entry.created_at, entry.updated_at, len(entry.message_ids), entry.metadata
+            ))
+        return infos
+
+    async def get_summary(self, conversation_id: UUID) -> Tuple[Optional[str], Optional[UUID]]:
+        await self._load()
+        entry = self._index.get(conversation_id)
+        if entry is None:
+            return None, None
+        return entry.summary, entry.summary_until
+
+    async def update_summary(self, conversation_id: UUID, summary: str, summary_until: UUID) -> None:
+        await self._load()
+        entry = self._index.get(conversation_id)
+        if entry is None:
+            return
+        entry.summary = summary
+        entry.summary_until = summary_until
+        self._writer.submit({
+            "op": "summary",
+            "conversation_id": str(conversation_id),
+            "summary": summary,
+            "summary_until": str(summary_until),
+        })
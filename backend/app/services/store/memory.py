@@ -0,0 +1,101 @@
+"""
+インメモリの会話ストア
+
+プロセス内の辞書に会話を保存する。再起動すると履歴は失われる。
+メッセージは会話ごとの MessageLog に保持し、会話全体を取得する時のみ ChatMessage に変換する。
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+from app.schemas.chat import Conversation
+from app.services.store.base import ConversationInfo, ConversationStore, resolve_range
+from app.services.store.message_log import MessageLog, MessageRecord
+from app.services.store.ordering import ListCursor, UpdatedAtIndex
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    辞書を使った会話ストア
+    """
+
+    def __init__(self):
+        # メッセージを除いた会話の情報
+        self.conversations: Dict[UUID, Conversation] = {}
+        self._logs: Dict[UUID, MessageLog] = {}
+        # 一覧用の更新日時順のインデックス
+        self._ordering = UpdatedAtIndex()
+
+    async def create_conversation(self, conversation: Conversation) -> None:
+        if conversation.id not in self.conversations:
+            self.conversations[conversation.id] = conversation.model_copy(update={"messages": []})
+            self._logs[conversation.id] = MessageLog.from_chat_messages(conversation.messages)
+            self._ordering.update(conversation.id, conversation.updated_at)
+
+    async def get_conversation(self, conversation_id: UUID) -> Optional[Conversation]:
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            return None
+        return conversation.model_copy(update={"messages": self._logs[conversation_id].chat_messages()})
+
+    async def has_conversation(self, conversation_id: UUID) -> bool:
+        return conversation_id in self.conversations
+
+    async def append_message(self, conversation_id: UUID, message: MessageRecord) -> None:
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            await self.create_conversation(Conversation(id=conversation_id))
+            conversation = self.conversations[conversation_id]
+        self._logs[conversation_id].append(message)
+        conversation.updated_at = datetime.now()
+        self._ordering.update(conversation_id, conversation.updated_at)
+
+    async def get_messages(
+        self,
+        conversation_id: UUID,
+        after: Optional[UUID] = None,
+        limit: Optional[int] = None,
+        before: Optional[UUID] = None,
+    ) -> List[MessageRecord]:
+        log = self._logs.get(conversation_id)
+        if log is None:
+            return []
+        selected = resolve_range(log.positions, len(log), after, before, limit)
+        if selected is None:
+            return []
+        start, end = selected
+        return log.records(start, end)
+
+    async def get_recent_messages(self, conversation_id: UUID, limit: int) -> List[MessageRecord]:
+        log = self._logs.get(conversation_id)
+        if log is None or limit <= 0:
+            return []
+        return log.records(-limit)
+
+    async def list_conversation_ids(self) -> List[UUID]:
+        return list(self.conversations.keys())
+
+    async def list_conversations(
+        self,
+        limit: int,
+        after: Optional[ListCursor] = None,
+        newest_first: bool = True,
+        updated_since: Optional[datetime] = None,
+        updated_until: Optional[datetime] = None,
+    ) -> List[ConversationInfo]:
+        conversation_ids = self._ordering.page(limit, after, newest_first, updated_since, updated_until)
+        return [
+            ConversationInfo.from_conversation(self.conversations[conversation_id], len(self._logs[conversation_id]))
+            for conversation_id in conversation_ids
+        ]
+
+    async def get_summary(self, conversation_id: UUID) -> Tuple[Optional[str], Optional[UUID]]:
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            return None, None
+        return conversation.summary, conversation.summary_until
+
+    async def update_summary(self, conversation_id: UUID, summary: str, summary_until: UUID) -> None:
+        conversation = self.conversations.get(conversation_id)
+        if conversation is not None:
+            conversation.summary = summary
+            conversation.summary_until = summary_until
@@ -0,0 +1,164 @@
+"""
+会話のメッセージの軽量な表現
+
+- MessageRecord: ストアと会話履歴の構築で使うメッセージ。`__slots__` のみのクラスで、pydanticの検証を行わない
+- MessageLog: 会話のメッセージを列ごとの配列（ロール・タイムスタンプ・本文の終了位置）と
+  1つの本文バッファに追記していくログ。メッセージごとのオブジェクトを持たず、追記時に既存の要素をコピーしない
+
+API のスキーマ（ChatMessage）への変換は、レスポンスを返す時にだけ行う（to_chat_message）。
+"""
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+from uuid import UUID, uuid4
+from app.schemas.chat import ChatMessage
+
+# タイムスタンプはこの時刻からのマイクロ秒数（ローカル時刻のまま）で保持する
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# 本文バッファの文字コード（日本語の本文は1文字2バイトになる）
+CONTENT_ENCODING = "utf-16-le"
+
+# ロール名 ↔ ロールの番号（未知のロールは追加する）
+_ROLES: List[str] = ["user", "assistant", "system"]
+_ROLE_CODES: Dict[str, int] = {role: code for code, role in enumerate(_ROLES)}
+
+# 1メッセージあたりの本文以外のおおよそのサイズ（ID・位置のインデックス・各列）
+RECORD_OVERHEAD_BYTES = 180
+
+
+def _role_code(role: str) -> int:
+    code = _ROLE_CODES.get(role)
+    if code is None:
+        code = _ROLE_CODES[role] = len(_ROLES)
+        _ROLES.append(role)
+    return code
+
+
+def _to_micros(timestamp: datetime) -> int:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def _from_micros(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+class MessageRecord:
+    """
+    会話のメッセージ（ChatMessage と同じ属性を持つ）
+    """
+
+    __slots__ = ("id", "role", "content", "timestamp")
+
+    def __init__(
+        self,
+        role: str,
+        content: str,
+        id: Optional[UUID] = None,
+        timestamp: Optional[datetime] = None,
+    ):
+        self.id = id or uuid4()
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp or datetime.now()
+
+    @classmethod
+    def from_chat_message(cls, message: ChatMessage) -> "MessageRecord":
+        return cls(message.role, message.content, message.id, message.timestamp)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MessageRecord":
+        """to_dict() の結果（JSON）から作成する"""
+        return cls(data["role"], data["content"], UUID(data["id"]), datetime.fromisoformat(data["timestamp"]))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSONに変換できる辞書（ChatMessage.model_dump(mode="json") と同じ形式）"""
+        return {
+            "id": str(self.id),
+            "role": self.role,
+            "content": self.content,
+            "timestamp": self.timestamp.isoformat(),
+        }
+
+    def to_chat_message(self) -> ChatMessage:
+        """APIのスキーマに変換する（値は検証済みのため検証を省く）"""
+        return ChatMessage.model_construct(
+            id=self.id, role=self.role, content=self.content, timestamp=self.timestamp
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, MessageRecord):
+            return NotImplemented
+        return (self.id, self.role, self.content, self.timestamp) == (
+            other.id, other.role, other.content, other.timestamp
+        )
+
+    def __repr__(self) -> str:
+        return f"MessageRecord(id={self.id!r}, role={self.role!r}, content={self.content[:20]!r})"
+
+
+class MessageLog:
+    """
+    会話のメッセージを列ごとに保持する追記専用のログ
+    """
+
+    __slots__ = ("_ids", "positions", "_roles", "_timestamps", "_ends", "_content")
+
+    def __init__(self, records: Iterable[MessageRecord] = ()):
+        self._ids: List[UUID] = []
+        # メッセージID → 位置（カーソル読み出し用）
+        self.positions: Dict[UUID, int] = {}
+        self._roles = array("B")
+        self._timestamps = array("q")
+        # 各メッセージの本文の終了位置（バイト）。開始位置は1つ前の終了位置
+        self._ends = array("Q")
+        self._content = bytearray()
+        for record in records:
+            self.append(record)
+
+    @classmethod
+    def from_chat_messages(cls, messages: Iterable[ChatMessage]) -> "MessageLog":
+        return cls(MessageRecord.from_chat_message(message) for message in messages)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def append(self, record: MessageRecord) -> bool:
+        """メッセージを末尾に追加する（同じIDのメッセージが既にある場合は追加せず False を返す）"""
+        if record.id in self.positions:
+            return False
+        self.positions[record.id] = len(self._ids)
+        self._ids.append(record.id)
+        self._roles.append(_role_code(record.role))
+        self._timestamps.append(_to_micros(record.timestamp))
+        self._content += record.content.encode(CONTENT_ENCODING)
+        self._ends.append(len(self._content))
+        return True
+
+    def content(self, index: int) -> str:
+        start = self._ends[index - 1] if index > 0 else 0
+        return self._content[start:self._ends[index]].decode(CONTENT_ENCODING)
+
+    def record(self, index: int) -> MessageRecord:
+        return MessageRecord(
+            _ROLES[self._roles[index]],
+            self.content(index),
+            self._ids[index],
+            _from_micros(self._timestamps[index]),
+        )
+
+    def records(self, start: int = 0, end: Optional[int] = None) -> List[MessageRecord]:
+        """[start, end) のメッセージ（スライスと同じく負の位置も指定できる）"""
+        return [self.record(index) for index in range(len(self._ids))[start:end]]
+
+    def chat_messages(self) -> List[ChatMessage]:
+        """すべてのメッセージをAPIのスキーマで返す"""
+        return [record.to_chat_message() for record in self.records()]
+
+    @property
+    def nbytes(self) -> int:
+        """ログ全体のおおよそのメモリ使用量（バイト）"""
+        return len(self._content) + len(self._ids) * RECORD_OVERHEAD_BYTES
@@ -0,0 +1,89 @@
+"""
+会話の更新日時順のインデックス
+
+(updated_at, 会話ID) の昇順に並べたキーの配列を二分探索で保守する。
+メッセージの追加のたびに全件を並べ替えず、更新された会話のキーだけを削除・挿入する。
+一覧のページは直前のページの最後の (updated_at, 会話ID) をカーソルとして、そこから limit 件を返す。
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+# 一覧のカーソル（直前のページの最後の会話の updated_at と会話ID）
+ListCursor = Tuple[datetime, UUID]
+
+
+class UpdatedAtIndex:
+    """
+    会話IDを (updated_at, 会話ID) の順に保持するインデックス
+    """
+
+    __slots__ = ("_keys", "_updated_at")
+
+    def __init__(self):
+        # (updated_at, 会話ID) の昇順
+        self._keys: List[Tuple[datetime, UUID]] = []
+        # 会話ID → インデックス上の updated_at
+        self._updated_at: Dict[UUID, datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, conversation_id: UUID) -> bool:
+        return conversation_id in self._updated_at
+
+    def rebuild(self, items: Iterable[Tuple[UUID, datetime]]) -> None:
+        """(会話ID, updated_at) の一覧からまとめて作り直す（起動時の読み込み用）"""
+        self._updated_at = dict(items)
+        self._keys = sorted((updated_at, conversation_id) for conversation_id, updated_at in self._updated_at.items())
+
+    def update(self, conversation_id: UUID, updated_at: datetime) -> None:
+        """会話の updated_at を登録・更新する"""
+        current = self._updated_at.get(conversation_id)
+        if current == updated_at:
+            return
+        if current is not None:
+            self._discard((current, conversation_id))
+        key = (updated_at, conversation_id)
+        self._keys.insert(bisect_left(self._keys, key), key)
+        self._updated_at[conversation_id] = updated_at
+
+    def remove(self, conversation_id: UUID) -> None:
+        """会話をインデックスから削除する（登録されていなければ何もしない）"""
+        current = self._updated_at.pop(conversation_id, None)
+        if current is not None:
+            self._discard((current, conversation_id))
+
+    def _discard(self, key: Tuple[datetime, UUID]) -> None:
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def page(
+        self,
+        limit: int,
+        after: Optional[ListCursor] = None,
+        newest_first: bool = True,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[UUID]:
+        """
+        カーソルの次から limit 件の会話IDを返す
+
+        newest_first の場合は新しい順、それ以外は古い順に並べる。
+        since / until を指定した場合は since <= updated_at < until の会話のみを対象とする
+        """
+        keys = self._keys
+        # 対象範囲 [start, end)。(datetime,) は同じ時刻のどのキーよりも前に並ぶ
+        start = bisect_left(keys, (since,)) if since is not None else 0
+        end = bisect_left(keys, (until,)) if until is not None else len(keys)
+        if newest_first:
+            if after is not None:
+                end = min(end, bisect_left(keys, after))
+            start = max(start, end - limit)
+            return [conversation_id for _, conversation_id in reversed(keys[start:end])]
+        if after is not None:
+            start = max(start, bisect_right(keys, after))
+        end = min(end, start + limit)
+        return [conversation_id for _, conversation_id in keys[start:end]]
@@ -0,0 +1,323 @@
+"""
+SQLiteの会話ストア
+
+aiosqliteを使い、WALモードのSQLiteファイルに会話とメッセージを保存する。
+書き込みは BatchWriter でまとめて1つのトランザクションで実行する。
+複数のワーカープロセスで共有する場合（sync_writes=True）は、書き込みがコミットされるまで待ってから返す。
+"""
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Any, List, Optional, Tuple, Union
+from uuid import UUID
+from app.schemas.chat import ChatMessage, Conversation
+from app.services.store.base import ConversationInfo, ConversationStore
+from app.services.store.batching import BatchWriter
+from app.services.store.message_log import MessageRecord
+from app.services.store.ordering import ListCursor
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    metadata TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    summary TEXT,
+    summary_until TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    conversation_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_timestamp
+    ON messages (conversation_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_conversations_updated_at
+    ON conversations (updated_at, id);
+"""
+
+
+def _format_datetime(value: datetime) -> str:
+    # 文字列比較で時系列順に並ぶよう、常にマイクロ秒まで出力する
+    return value.isoformat(timespec="microseconds")
+
+
+def _row_to_message(row: Any) -> MessageRecord:
+    return MessageRecord(row[1], row[2], UUID(row[0]), datetime.fromisoformat(row[3]))
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    SQLiteファイルを使った会話ストア
+    """
+
+    def __init__(self, path: str, batch_size: int = 100, batch_interval: float = 0.01, sync_writes: bool = False):
+        self.path = path
+        self.sync_writes = sync_writes
+        self._connection = None
+        self._lock = asyncio.Lock()
+        self._writer = BatchWriter(self._write_batch, batch_size, batch_interval)
+
+    async def start(self) -> None:
+        await self._connect()
+
+    async def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        async with self._lock:
+            if self._connection is None:
+                import aiosqlite
+
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                connection = await aiosqlite.connect(self.path)
+                # 他のプロセスが書き込み中の場合はロックが外れるまで待つ
+                await connection.execute("PRAGMA busy_timeout=5000")
+                await connection.execute("PRAGMA journal_mode=WAL")
+                await connection.execute("PRAGMA synchronous=NORMAL")
+                await connection.executescript(_SCHEMA)
+                await self._migrate(connection)
+                await connection.commit()
+                self._connection = connection
+        return self._connection
+
+    @staticmethod
+    async def _migrate(connection) -> None:
+        """既存のデータベースに後から追加した列を追加する"""
+        async with connection.execute("PRAGMA table_info(conversations)") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        for column in ("summary", "summary_until"):
+            if column not in columns:
+                await connection.execute(f"ALTER TABLE conversations ADD COLUMN {column} TEXT")
+
+    async def _read_connection(self):
+        # 自プロセスの未書き込みの変更を読めるよう、読み出し前に書き込みを反映する
+        connection = await self._connect()
+        if self._writer.pending:
+            await self._writer.flush()
+        return connection
+
+    async def _write_batch(self, batch: List[Any]) -> None:
+        connection = await self._connect()
+        conversation_rows = []
+        message_rows = []
+        updates = {}
+        summary_rows = []
+        for operation in batch:
+            if operation[0] == "summary":
+                _, conversation_id, summary, summary_until = operation
+                summary_rows.append((summary, str(summary_until), str(conversation_id)))
+            elif operation[0] == "conversation":
+                conversation: Conversation = operation[1]
+                conversation_rows.append((
+                    str(conversation.id),
+                    json.dumps(conversation.metadata, ensure_ascii=False) if conversation.metadata is not None else None,
+                    _format_datetime(conversation.created_at),
+                    _format_datetime(conversation.updated_at),
+                ))
+                for message in conversation.messages:
+                    message_rows.append(self._message_row(conversation.id, message))
+            else:
+                _, conversation_id, message = operation
+                # 会話がまだなければ作成する
+                now = _format_datetime(message.timestamp)
+                conversation_rows.append((str(conversation_id), None, now, now))
+                message_rows.append(self._message_row(conversation_id, message))
+                updates[str(conversation_id)] = now
+
+        await connection.executemany(
+            "INSERT OR IGNORE INTO conversations (id, metadata, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            conversation_rows,
+        )
+        await connection.executemany(
+            "INSERT OR IGNORE INTO messages (id, conversation_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+            message_rows,
+        )
+        await connection.executemany(
+            "UPDATE conversations SET updated_at = ? WHERE id = ?",
+            [(updated_at, conversation_id) for conversation_id, updated_at in updates.items()],
+        )
+        await connection.executemany(
+            "UPDATE conversations SET summary = ?, summary_until = ? WHERE id = ?", summary_rows
+        )
+        await connection.commit()
+
+    @staticmethod
+    def _message_row(conversation_id: UUID, message: Union[ChatMessage, MessageRecord]) -> tuple:
+        return (
+            str(message.id),
+            str(conversation_id),
+            message.role,
+            message.content,
+            _format_datetime(message.timestamp),
+        )
+
+    async def _submit(self, operation: Any) -> None:
+        if self.sync_writes:
+            await self._writer.write(operation)
+        else:
+            self._writer.submit(operation)
+
+    async def flush(self) -> None:
+        await self._writer.flush()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    async def create_conversation(self, conversation: Conversation) -> None:
+        await self._submit(("conversation", conversation.model_copy(deep=True)))
+
+    async def get_conversation(self, conversation_id: UUID) -> Optional[Conversation]:
+        connection = await self._read_connection()
+        async with connection.execute(
+            "SELECT metadata, created_at, updated_at, summary, summary_until FROM conversations WHERE id = ?",
+            (str(conversation_id),),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        return Conversation(
+            id=conversation_id,
+            messages=[message.to_chat_message() for message in await self.get_messages(conversation_id)],
+            metadata=json.loads(row[0]) if row[0] else None,
+            created_at=datetime.fromisoformat(row[1]),
+            updated_at=datetime.fromisoformat(row[2]),
+            summary=row[3],
+            summary_until=UUID(row[4]) if row[4] else None,
+        )
+
+    async def has_conversation(self, conversation_id: UUID) -> bool:
+        connection = await self._read_connection()
+        async with connection.execute(
+            "SELECT 1 FROM conversations WHERE id = ?", (str(conversation_id),)
+        ) as cursor:
+            return await cursor.fetchone() is not None
+
+    async def append_message(self, conversation_id: UUID, message: MessageRecord) -> None:
+        await self._submit(("message", conversation_id, message))
+
+    async def get_messages(
+        self,
+        conversation_id: UUID,
+        after: Optional[UUID] = None,
+        limit: Optional[int] = None,
+        before: Optional[UUID] = None,
+    ) -> List[MessageRecord]:
+        connection = await self._read_connection()
+        query = "SELECT id, role, content, timestamp FROM messages WHERE conversation_id = ?"
+        params: List[Any] = [str(conversation_id)]
+        if after is not None:
+            # カーソルのメッセージより (timestamp, seq) が大きいものを返す
+            query += (
+                " AND (timestamp, seq) > (SELECT timestamp, seq FROM messages"
+                " WHERE id = ? AND conversation_id = ?)"
+            )
+            params += [str(after), str(conversation_id)]
+        if before is not None:
+            query += (
+                " AND (timestamp, seq) < (SELECT timestamp, seq FROM messages"
+                " WHERE id = ? AND conversation_id = ?)"
+            )
+            params += [str(before), str(conversation_id)]
+        # before のみ指定された場合は新しい側から limit 件を取得する
+        backward = before is not None and after is None and limit is not None
+        query += " ORDER BY timestamp DESC, seq DESC" if backward else " ORDER BY timestamp, seq"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        async with connection.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+        if backward:
+            rows.reverse()
+        return [_row_to_message(row) for row in rows]
+
+    async def get_recent_messages(self, conversation_id: UUID, limit: int) -> List[MessageRecord]:
+        if limit <= 0:
+            return []
+        connection = await self._read_connection()
+        async with connection.execute(
+            "SELECT id, role, content, timestamp FROM messages WHERE conversation_id = ?"
+            " ORDER BY timestamp DESC, seq DESC LIMIT ?",
+            (str(conversation_id), limit),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [_row_to_message(row) for row in reversed(rows)]
+
+    async def list_conversation_ids(self) -> List[UUID]:
+        connection = await self._read_connection()
+        async with connection.execute("SELECT id FROM conversations ORDER BY created_at") as cursor:
+            rows = await cursor.fetchall()
+        return [UUID(row[0]) for row in rows]
+
+    async def list_conversations(
+        self,
+        limit: int,
+        after: Optional[ListCursor] = None,
+        newest_first: bool = True,
+        updated_since: Optional[datetime] = None,
+        updated_until: Optional[datetime] = None,
+    ) -> List[ConversationInfo]:
+        connection = await self._read_connection()
+        query = (
+            "SELECT id, metadata, created_at, updated_at,"
+            " (SELECT COUNT(*) FROM messages WHERE conversation_id = conversations.id)"
+            " FROM conversations WHERE 1 = 1"
+        )
+        params: List[Any] = []
+        if updated_since is not None:
+            query += " AND updated_at >= ?"
+            params.append(_format_datetime(updated_since))
+        if updated_until is not None:
+            query += " AND updated_at < ?"
+            params.append(_format_datetime(updated_until))
+        if after is not None:
+            # UUIDの文字列は値と同じ順に並ぶため、(updated_at, id) のインデックスをそのまま使える
+            query += " AND (updated_at, id) < (?, ?)" if newest_first else " AND (updated_at, id) > (?, ?)"
+            params += [_format_datetime(after[0]), str(after[1])]
+        query += " ORDER BY updated_at DESC, id DESC LIMIT ?" if newest_first else " ORDER BY updated_at, id LIMIT ?"
+        params.append(limit)
+        async with connection.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+        return [
+            ConversationInfo(
+                UUID(row[0]),
+                datetime.fromisoformat(row[2]),
+                datetime.fromisoformat(row[3]),
+                row[4],
+                json.loads(row[1]) if row[1] else None,
+            )
+            for row in rows
+        ]
+
+    async def get_summary(self, conversation_id: UUID) -> Tuple[Optional[str], Optional[UUID]]:
+        connection = await self._read_connection()
+        async with connection.execute(
+            "SELECT summary, summary_until FROM conversations WHERE id = ?", (str(conversation_id),)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None, None
+        return row[0], UUID(row[1]) if row[1] else None
+
+    async def update_summary(self, conversation_id: UUID, summary: str, summary_until: UUID) -> None:
+        await self._submit(("summary", conversation_id, summary, summary_until))
+
+    async def get_version(self, conversation_id: UUID) -> Optional[Tuple[int, Optional[UUID]]]:
+        connection = await self._read_connection()
+        async with connection.execute(
+            "SELECT (SELECT COUNT(*) FROM messages WHERE conversation_id = ?), summary_until"
+            " FROM conversations WHERE id = ?",
+            (str(conversation_id), str(conversation_id)),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        return row[0], UUID(row[1]) if row[1] else None
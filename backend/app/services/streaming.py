@@ -0,0 +1,100 @@
+"""
+ストリーミングレスポンスの中継
+
+ストリームの生成を別タスクで実行し、クライアントの切断を検知したら
+そのタスクをキャンセルする。これにより上流のLLM呼び出しも中断される。
+
+リクエストの本文を読みながら結果を返す場合（バッチ処理）は、本文を iter_lines で1行ずつ読み、
+レスポンスには DuplexStreamingResponse を使う。
+"""
+import asyncio
+import codecs
+from contextlib import suppress
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, TypeVar
+import anyio
+from starlette.responses import StreamingResponse
+from starlette.types import Receive
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _StreamError:
+    """生成タスクで発生した例外を受け渡すためのラッパー"""
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+async def relay_until_disconnected(
+    source: AsyncIterator[T], wait_for_disconnect: Callable[[], Awaitable[None]]
+) -> AsyncIterator[T]:
+    """
+    sourceの要素を順に返す。wait_for_disconnect() が完了した時点でsourceの生成を打ち切る
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce() -> None:
+        try:
+            async for item in source:
+                await queue.put(item)
+            await queue.put(_DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_StreamError(e))
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(wait_for_disconnect())
+    getter = None
+    try:
+        while True:
+            getter = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({getter, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                # クライアントが切断された
+                break
+            item = getter.result()
+            if item is _DONE:
+                break
+            if isinstance(item, _StreamError):
+                raise item.exc
+            yield item
+    finally:
+        if getter is not None and not getter.done():
+            getter.cancel()
+        watcher.cancel()
+        if not producer.done():
+            producer.cancel()
+        with suppress(asyncio.CancelledError):
+            await producer
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """
+    UTF-8のバイト列のチャンクを行に分けて返す（本文全体をメモリに読み込まない）
+    不正なバイト列は置換文字に置き換える
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    リクエストの本文を読みながら返すストリーミングレスポンス
+
+    StreamingResponse は ASGI 2.4 未満のサーバー（uvicorn）では receive() で切断を待ち、その間に届いた本文を読み捨てる。
+    このレスポンスは receive() を読まないため、本文の読み込みと切断の検知はエンドポイント側で行う
+    """
+
+    async def listen_for_disconnect(self, receive: Receive) -> None:
+        await anyio.sleep_forever()
@@ -0,0 +1,73 @@
+"""
+会話の要約
+
+古いメッセージを既存の要約に畳み込み、要約を少しずつ更新する。
+要約全体を毎回作り直すのではなく、前回の要約と新しく要約対象になったメッセージだけをLLMに渡す。
+"""
+from typing import List, Optional
+from langchain_core.messages import HumanMessage, SystemMessage
+from app.core.config import settings
+from app.services.store.message_log import MessageRecord
+from app.services.concurrency import get_llm_limiter
+from app.services.llm_registry import get_llm_registry
+
+# LLMを使わない場合に1メッセージから残す文字数
+_EXTRACT_CHARS = 80
+
+_ROLE_LABELS = {"user": "ユーザー", "assistant": "カウンセラー"}
+
+
+def _format_messages(messages: List[MessageRecord]) -> str:
+    return "\n".join(f"{_ROLE_LABELS.get(m.role, m.role)}: {m.content}" for m in messages)
+
+
+class ConversationSummarizer:
+    """
+    要約にメッセージを畳み込む
+
+    OpenAIのAPIキーが設定されていない場合は、各メッセージの冒頭を並べる簡易的な要約を行う
+    """
+
+    def __init__(self, max_chars: int = 2000):
+        self.max_chars = max_chars
+        self._llm = None
+        if settings.OPENAI_API_KEY and settings.OPENAI_API_KEY != "your_openai_api_key_here":
+            self._llm = get_llm_registry().get("summary", temperature=0)
+
+    async def fold(self, summary: Optional[str], messages: List[MessageRecord]) -> str:
+        """
+        既存の要約に messages を畳み込んだ新しい要約を返す
+        """
+        if not messages:
+            return summary or ""
+        if self._llm is None:
+            return self._extract(summary, messages)
+
+        content = f"これまでの要約:\n{summary or '（なし）'}\n\n新しいやり取り:\n{_format_messages(messages)}"
+        # プロンプトのテンプレート（langchain_core.prompts）の読み込みは最初に要約する時まで遅らせる
+        from app.services.prompts import SUMMARY_PROMPT
+
+        async with get_llm_limiter(get_llm_registry().model_for("summary")).acquire():
+            result = await self._llm.ainvoke([SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=content)])
+        return str(result.content).strip()[:self.max_chars]
+
+    def _extract(self, summary: Optional[str], messages: List[MessageRecord]) -> str:
+        lines = [summary] if summary else []
+        lines += [
+            f"{_ROLE_LABELS.get(m.role, m.role)}: {m.content[:_EXTRACT_CHARS]}" for m in messages
+        ]
+        # 上限を超えた場合は古い側から削る
+        return "\n".join(lines)[-self.max_chars:]
+
+
+_summarizer: Optional[ConversationSummarizer] = None
+
+
+def get_summarizer() -> ConversationSummarizer:
+    """
+    共有の要約器を取得する
+    """
+    global _summarizer
+    if _summarizer is None:
+        _summarizer = ConversationSummarizer()
+    return _summarizer
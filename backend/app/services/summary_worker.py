@@ -0,0 +1,169 @@
+"""
+会話要約のバックグラウンド処理
+
+メッセージが追加されるたびに会話ごとの未要約メッセージ数を数え、
+SUMMARY_TRIGGER_MESSAGES 件を超えた会話の要約ジョブをキューに入れる。
+ワーカーはリクエストとは別に、直近 SUMMARY_KEEP_RECENT 件より古い未要約メッセージを
+既存の要約に畳み込んでストアに保存する。
+
+- キューは上限付きで、満杯の場合は新しいジョブを捨てる（次のメッセージ追加時に再度試みる）
+- 同じ会話のジョブはキューに1件しか入らず、処理中の会話のジョブは完了後に改めて入れ直す
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Set
+from uuid import UUID
+from app.core.config import settings
+from app.services.store import ConversationStore, get_conversation_store
+from app.services.summarizer import get_summarizer
+
+logger = logging.getLogger(__name__)
+
+# 未要約メッセージ数を数えておく会話数の上限
+_MAX_TRACKED_CONVERSATIONS = 100_000
+
+
+@dataclass
+class SummaryWorkerStats:
+    """要約ワーカーの統計情報"""
+    scheduled: int = 0
+    deduplicated: int = 0
+    dropped: int = 0
+    completed: int = 0
+    failed: int = 0
+    summarized_messages: int = 0
+
+
+class SummaryWorkerPool:
+    """
+    上限付きキューと複数のワーカーで会話の要約を更新する
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        workers: int = 2,
+        max_queue_size: int = 1000,
+        trigger_messages: int = 20,
+        keep_recent: int = 10,
+    ):
+        self.store = store
+        self.workers = workers
+        self.trigger_messages = trigger_messages
+        self.keep_recent = keep_recent
+        self.stats = SummaryWorkerStats()
+        self._queue: "asyncio.Queue[UUID]" = asyncio.Queue(maxsize=max_queue_size)
+        # キューに入っているか処理中の会話
+        self._scheduled: Set[UUID] = set()
+        self._unsummarized: "OrderedDict[UUID, int]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def pending(self) -> int:
+        """キューに入っているジョブ数"""
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """ワーカーを起動する"""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        """ワーカーを停止する（キューに残ったジョブは破棄する）"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self) -> None:
+        """キューに入っているジョブがすべて終わるまで待つ"""
+        await self._queue.join()
+
+    def notify(self, conversation_id: UUID, count: int = 1) -> None:
+        """
+        会話にメッセージが追加されたことを通知する。未要約メッセージが閾値を超えたら要約ジョブを入れる
+        """
+        unsummarized = self._unsummarized.pop(conversation_id, 0) + count
+        self._unsummarized[conversation_id] = unsummarized
+        if len(self._unsummarized) > _MAX_TRACKED_CONVERSATIONS:
+            self._unsummarized.popitem(last=False)
+        if unsummarized > self.trigger_messages:
+            self.schedule(conversation_id)
+
+    def schedule(self, conversation_id: UUID) -> bool:
+        """
+        要約ジョブをキューに入れる。既に入っているか処理中、またはキューが満杯の場合はFalseを返す
+        """
+        if conversation_id in self._scheduled:
+            self.stats.deduplicated += 1
+            return False
+        try:
+            self._queue.put_nowait(conversation_id)
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            return False
+        self._scheduled.add(conversation_id)
+        self.stats.scheduled += 1
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            conversation_id = await self._queue.get()
+            try:
+                self._unsummarized.pop(conversation_id, None)
+                self.stats.summarized_messages += await self.summarize(conversation_id)
+                self.stats.completed += 1
+            except Exception as e:
+                self.stats.failed += 1
+                logger.error("会話の要約に失敗しました（%s）: %s", conversation_id, e)
+            finally:
+                self._scheduled.discard(conversation_id)
+                self._queue.task_done()
+            # 処理中に閾値を超えた場合は入れ直す
+            if self._unsummarized.get(conversation_id, 0) > self.trigger_messages:
+                self.schedule(conversation_id)
+
+    async def summarize(self, conversation_id: UUID) -> int:
+        """
+        直近 keep_recent 件より古い未要約メッセージを要約に畳み込み、畳み込んだ件数を返す
+        """
+        summary, summary_until = await self.store.get_summary(conversation_id)
+        messages = await self.store.get_messages(conversation_id, after=summary_until)
+        overflow = messages[:-self.keep_recent] if self.keep_recent else messages
+        if not overflow:
+            return 0
+        summary = await get_summarizer().fold(summary, overflow)
+        await self.store.update_summary(conversation_id, summary, overflow[-1].id)
+        return len(overflow)
+
+
+_summary_worker: Optional[SummaryWorkerPool] = None
+
+
+def get_summary_worker() -> SummaryWorkerPool:
+    """
+    共有の要約ワーカーを取得する
+    """
+    global _summary_worker
+    if _summary_worker is None:
+        _summary_worker = SummaryWorkerPool(
+            get_conversation_store(),
+            workers=settings.SUMMARY_WORKERS,
+            max_queue_size=settings.SUMMARY_QUEUE_SIZE,
+            trigger_messages=settings.SUMMARY_TRIGGER_MESSAGES,
+            keep_recent=settings.SUMMARY_KEEP_RECENT,
+        )
+    return _summary_worker
+
+
+async def close_summary_worker() -> None:
+    """
+    共有の要約ワーカーを停止する
+    """
+    global _summary_worker
+    if _summary_worker is not None:
+        await _summary_worker.close()
+        _summary_worker = None
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+リクエストごとのグラフ・チェーン組み立てのオーバーヘッドのベンチマーク
+
+LLMの呼び出し（ネットワーク時間）を除き、以下を比較する。
+
+- 従来の方式: リクエストごとにf-stringでシステムプロンプトを作り、
+  ChatPromptTemplate.from_messages と prompt | llm | parser でチェーンを組み立てる
+- 現在の方式: グラフ作成時に組み立てたテンプレート（prompts.py）に変数を渡すだけ
+- 参考: リクエストごとにエージェントグラフをコンパイルした場合
+
+使い方:
+    python benchmarks/chain_setup.py --repeat 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from app.services.agent import create_agent_graph
+from app.services.prompts import ROLE_PROMPT_TEMPLATES
+
+QUESTION = "Webエンジニアからデータエンジニアに転職したいのですが、何から学べばよいでしょうか？"
+HISTORY = [
+    HumanMessage(content="転職を考えています。"),
+    AIMessage(content="ご相談ありがとうございます。現在のお仕事について教えてください。"),
+]
+
+
+def legacy_setup(llm, question: str):
+    """従来の方式: リクエストごとにプロンプトとチェーンを組み立てる"""
+    system_prompt = f"""
+            あなたはキャリアカウンセラーです。ユーザーのキャリア相談に対して、
+            親身に、かつ専門的な知識をもとにアドバイスを提供してください。
+            キャリア選択、転職、スキルアップ、職場の人間関係など、
+            幅広いキャリアに関する質問に対応してください。
+
+            ユーザーの質問: {question}
+            """
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder("history"),
+        ("human", question),
+    ])
+    chain = prompt | llm | StrOutputParser()
+    return prompt, chain, {"history": HISTORY}
+
+
+async def measure(label: str, repeat: int, step) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await step()
+    per_request = (time.perf_counter() - started) / repeat * 1e6
+    print(f"{label:<40} {per_request:>10.1f} µs/リクエスト")
+    return per_request
+
+
+async def main(args) -> None:
+    llm = FakeListChatModel(responses=["ok"])
+    template = ROLE_PROMPT_TEMPLATES["career_counselor"]
+
+    async def legacy_step():
+        prompt, _, variables = legacy_setup(llm, QUESTION)
+        await prompt.ainvoke(variables)
+
+    async def prebuilt_step():
+        await template.ainvoke({"history": HISTORY, "input": QUESTION})
+
+    async def legacy_chain_step():
+        _, chain, variables = legacy_setup(llm, QUESTION)
+        await chain.ainvoke(variables)
+
+    prebuilt_chain = template | llm | StrOutputParser()
+
+    async def prebuilt_chain_step():
+        await prebuilt_chain.ainvoke({"history": HISTORY, "input": QUESTION})
+
+    async def compile_step():
+        create_agent_graph()
+
+    # ウォームアップ
+    await legacy_chain_step()
+    await prebuilt_chain_step()
+
+    print("プロンプトの組み立て・整形（LLM呼び出しなし）")
+    legacy = await measure("  従来（毎回 from_messages）", args.repeat, legacy_step)
+    prebuilt = await measure("  現在（事前に組み立てたテンプレート）", args.repeat, prebuilt_step)
+    print(f"  {'差分':<38} {legacy - prebuilt:>10.1f} µs/リクエスト（{legacy / prebuilt:.1f}倍）")
+
+    print("チェーン全体（フェイクLLMで応答、ネットワークなし）")
+    legacy = await measure("  従来（毎回 prompt | llm | parser）", args.repeat, legacy_chain_step)
+    prebuilt = await measure("  現在（グラフ作成時に組み立て済み）", args.repeat, prebuilt_chain_step)
+    print(f"  {'差分':<38} {legacy - prebuilt:>10.1f} µs/リクエスト")
+
+    print("参考")
+    await measure("  エージェントグラフのコンパイル", max(1, args.repeat // 20), compile_step)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="リクエストごとのグラフ・チェーン組み立てのオーバーヘッドのベンチマーク")
+    parser.add_argument("--repeat", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
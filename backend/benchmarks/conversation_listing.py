@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+会話一覧のページングとNDJSONエクスポートのベンチマーク
+
+会話数ごとに以下を比較する。
+
+- 一覧: 全会話IDを1つのリストで返す従来の方式と、更新日時順のインデックスから1ページ（50件）を返す方式
+- メッセージ追加: インデックスの更新を含む append_message 1回あたりの時間
+- エクスポート: 全会話のメッセージを読み出して1つのJSONにする方式と、NDJSONを一定量ずつ書き出す方式の
+  ピークメモリ（tracemalloc、ストア自体が保持するデータを除く）
+
+使い方:
+    python benchmarks/conversation_listing.py --counts 1000 10000 100000 --backend memory
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import app.services.store as store_module
+from app.core.config import settings
+from app.schemas.chat import Conversation
+from app.services.conversation import export_conversations, list_conversations
+from app.services.store import create_conversation_store
+from app.services.store.message_log import MessageRecord
+
+USER_TEXT = "転職を考えています。今のスキルでどのような職種に挑戦できるでしょうか？"
+ASSISTANT_TEXT = "ご相談ありがとうございます。これまでのご経験を棚卸しし、活かせる強みを整理するところから始めましょう。" * 3
+
+
+async def populate(store, count: int, messages: int) -> float:
+    """会話を作成してメッセージを追加し、append_message 1回あたりの時間（マイクロ秒）を返す"""
+    conversation_ids = []
+    for _ in range(count):
+        conversation = Conversation()
+        conversation_ids.append(conversation.id)
+        await store.create_conversation(conversation)
+    started = time.perf_counter()
+    for index in range(messages):
+        for conversation_id in conversation_ids:
+            text = USER_TEXT if index % 2 == 0 else ASSISTANT_TEXT
+            await store.append_message(conversation_id, MessageRecord("user" if index % 2 == 0 else "assistant", text))
+    elapsed = time.perf_counter() - started
+    await store.flush()
+    return elapsed / max(1, count * messages) * 1e6
+
+
+async def legacy_list(store) -> int:
+    ids = await store.list_conversation_ids()
+    return len(json.dumps([str(conversation_id) for conversation_id in ids]))
+
+
+async def paged_list() -> int:
+    page = await list_conversations(50)
+    return len(page.model_dump_json())
+
+
+async def legacy_export(store) -> int:
+    exported = []
+    for conversation_id in await store.list_conversation_ids():
+        messages = await store.get_messages(conversation_id)
+        exported.append({"id": str(conversation_id), "messages": [message.to_dict() for message in messages]})
+    return len(json.dumps(exported, ensure_ascii=False))
+
+
+async def streamed_export() -> int:
+    total = 0
+    async for chunk in export_conversations():
+        total += len(chunk)
+    return total
+
+
+async def measure_ms(step, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await step()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def measure_peak(step) -> float:
+    tracemalloc.start()
+    try:
+        await step()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+async def run(args) -> None:
+    print(
+        f"{'会話数':>8} {'追加(us)':>9} {'全件一覧(ms)':>13} {'1ページ(ms)':>12} "
+        f"{'一括エクスポート(MB)':>20} {'NDJSON(MB)':>11} {'出力(MB)':>9}"
+    )
+    for count in args.counts:
+        with tempfile.TemporaryDirectory() as directory:
+            settings.CONVERSATION_SQLITE_PATH = os.path.join(directory, "conversations.db")
+            settings.CONVERSATION_JSONL_DIR = os.path.join(directory, "jsonl")
+            # memoryバックエンドではキャッシュが保存先のため、全会話が収まる大きさにする
+            settings.CONVERSATION_CACHE_MAX_ENTRIES = max(settings.CONVERSATION_CACHE_MAX_ENTRIES, count)
+            settings.CONVERSATION_CACHE_MAX_BYTES = max(settings.CONVERSATION_CACHE_MAX_BYTES, count * 64 * 1024)
+            store = create_conversation_store(args.backend)
+            await store.start()
+            store_module._store = store
+            try:
+                append_us = await populate(store, count, args.messages)
+                legacy_ms = await measure_ms(lambda: legacy_list(store), args.repeat)
+                page_ms = await measure_ms(paged_list, args.repeat)
+                legacy_mb = await measure_peak(lambda: legacy_export(store))
+                streamed_mb = await measure_peak(streamed_export)
+                output_mb = await streamed_export() / 1e6
+            finally:
+                await store_module.close_conversation_store()
+        print(
+            f"{count:>8} {append_us:>9.1f} {legacy_ms:>13.2f} {page_ms:>12.3f} "
+            f"{legacy_mb:>20.1f} {streamed_mb:>11.2f} {output_mb:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会話一覧のページングとNDJSONエクスポートのベンチマーク")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--messages", type=int, default=4, help="会話ごとのメッセージ数")
+    parser.add_argument("--backend", choices=["memory", "sqlite", "jsonl"], default="memory")
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
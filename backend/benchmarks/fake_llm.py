@@ -0,0 +1,227 @@
+"""
+ベンチマーク用の決定的な偽のチャットモデル
+
+同じ質問には常に同じ応答を返し、最初のトークンまでの時間（ttft）・1秒あたりのトークン数・
+エラー率・遅い応答（テールレイテンシ）の割合と最初のトークンまでの時間を指定できる。エラーの発生は seed から決まる乱数列に従うため、同じ設定であれば
+何回目の呼び出しが失敗するかも再現する。トークンは1文字を1トークンとして扱う。
+
+- FakeChatModel: プロセス内で使う LangChain のチャットモデル（LLMレジストリの factory に渡す）
+- FakeLLM: 応答の内容・遅延・エラーを決める本体。スタブサーバー（fake_openai_server.py）と共有する
+"""
+import asyncio
+import random
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+FAKE_RESPONSES = (
+    "キャリアについてのご相談ありがとうございます。まずは現在の状況を詳しく教えてください。",
+    "転職を考える際は、これまでの経験の棚卸しから始めるのがおすすめです。得意なことは何ですか？",
+    "スキルアップには目標を決めて少しずつ学ぶことが大切です。興味のある分野を教えてください。",
+    "働き方の希望を整理すると、選ぶべき職場が見えてきます。大切にしたい条件は何でしょうか？",
+)
+# ITスキル専門家への相談の要否の判断（システムプロンプトに it_consultation を含む要求）への応答
+FAKE_ROUTING_RESPONSE = '{"it_consultation": true, "reason": "IT分野のキャリアに関する相談のため"}'
+
+
+@dataclass
+class FakeLLMConfig:
+    """偽のLLMの振る舞い"""
+    # 最初のトークンまでの時間（秒）
+    ttft: float = 0.2
+    # 1秒あたりのトークン数（0以下の場合は待たずにすべて返す）
+    tokens_per_second: float = 100.0
+    # 呼び出しが失敗する割合（0〜1）
+    error_rate: float = 0.0
+    # 応答のトークン数（文字数）。0の場合は定型文をそのまま返す
+    response_tokens: int = 0
+    # 最初のトークンまでに ttft の代わりに slow_ttft 秒かかる呼び出しの割合（0〜1）
+    slow_rate: float = 0.0
+    slow_ttft: float = 2.0
+    seed: int = 0
+
+
+class FakeLLMError(Exception):
+    """偽のLLMが発生させたエラー"""
+
+
+class FakeLLM:
+    """
+    偽のLLMの応答・遅延・エラーを決める
+    """
+
+    def __init__(self, config: Optional[FakeLLMConfig] = None):
+        self.config = config or FakeLLMConfig()
+        self._random = random.Random(self.config.seed)
+        # 遅延はエラーとは別の乱数列で決める（slow_rate を変えても失敗する呼び出しは変わらない）
+        self._latency_random = random.Random(self.config.seed + 1)
+        self.calls = 0
+        self.errors = 0
+
+    def should_fail(self) -> bool:
+        """今回の呼び出しを失敗させるかどうか（seed から決まる乱数列に従う）"""
+        self.calls += 1
+        failed = self._random.random() < self.config.error_rate
+        self.errors += failed
+        return failed
+
+    def first_token_delay(self) -> float:
+        """今回の呼び出しの最初のトークンまでの時間（seed から決まる乱数列に従う）"""
+        if self.config.slow_rate > 0 and self._latency_random.random() < self.config.slow_rate:
+            return self.config.slow_ttft
+        return self.config.ttft
+
+    def reply(self, messages: Sequence[Tuple[str, str]]) -> str:
+        """(ロール, 内容) のメッセージ列に対する応答。同じ質問には同じ応答を返す"""
+        system_prompt = next((content for role, content in messages if role == "system"), "")
+        if "it_consultation" in system_prompt:
+            return FAKE_ROUTING_RESPONSE
+        question = next((content for role, content in reversed(messages) if role in ("user", "human")), "")
+        content = FAKE_RESPONSES[zlib.crc32(question.encode("utf-8")) % len(FAKE_RESPONSES)]
+        if self.config.response_tokens > 0:
+            content = (content * (self.config.response_tokens // len(content) + 1))[: self.config.response_tokens]
+        return content
+
+    def tokens(self, content: str) -> List[str]:
+        return list(content)
+
+    @property
+    def token_interval(self) -> float:
+        return 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+
+    @staticmethod
+    def count_prompt_tokens(messages: Sequence[Tuple[str, str]]) -> int:
+        return sum(len(content) for _, content in messages)
+
+
+def _as_pairs(messages: Sequence[BaseMessage]) -> List[Tuple[str, str]]:
+    pairs = []
+    for message in messages:
+        role = "system" if isinstance(message, SystemMessage) else message.type
+        pairs.append((role, message.content if isinstance(message.content, str) else str(message.content)))
+    return pairs
+
+
+def _server_error(model: str) -> Exception:
+    """HTTP経由の場合と同じくリトライ対象になる openai のサーバーエラー"""
+    try:
+        import httpx
+        import openai
+    except ImportError:
+        return FakeLLMError("fake LLM error")
+    request = httpx.Request("POST", "http://fake-llm/v1/chat/completions")
+    response = httpx.Response(500, request=request)
+    return openai.InternalServerError(f"fake LLM error ({model})", response=response, body=None)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    FakeLLM を使う LangChain のチャットモデル
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    fake: FakeLLM
+    model_name: str = "fake-model"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _result(self, pairs: List[Tuple[str, str]], content: str) -> ChatResult:
+        message = AIMessage(content=content, usage_metadata=self._usage(pairs, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _usage(self, pairs: List[Tuple[str, str]], content: str) -> dict:
+        input_tokens = FakeLLM.count_prompt_tokens(pairs)
+        return {"input_tokens": input_tokens, "output_tokens": len(content), "total_tokens": input_tokens + len(content)}
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.fake.should_fail():
+            raise _server_error(self.model_name)
+        pairs = _as_pairs(messages)
+        content = self.fake.reply(pairs)
+        time.sleep(self.fake.first_token_delay() + self.fake.token_interval * len(content))
+        return self._result(pairs, content)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.fake.should_fail():
+            raise _server_error(self.model_name)
+        pairs = _as_pairs(messages)
+        content = self.fake.reply(pairs)
+        await asyncio.sleep(self.fake.first_token_delay() + self.fake.token_interval * len(content))
+        return self._result(pairs, content)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if self.fake.should_fail():
+            raise _server_error(self.model_name)
+        pairs = _as_pairs(messages)
+        content = self.fake.reply(pairs)
+        time.sleep(self.fake.first_token_delay())
+        for token in self.fake.tokens(content):
+            if self.fake.token_interval:
+                time.sleep(self.fake.token_interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(pairs, content)))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if self.fake.should_fail():
+            raise _server_error(self.model_name)
+        pairs = _as_pairs(messages)
+        content = self.fake.reply(pairs)
+        await asyncio.sleep(self.fake.first_token_delay())
+        for token in self.fake.tokens(content):
+            if self.fake.token_interval:
+                await asyncio.sleep(self.fake.token_interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(pairs, content)))
+
+
+def fake_llm_factory(config: Optional[FakeLLMConfig] = None):
+    """
+    LLMレジストリの factory に渡す関数を作成する（すべてのモデルで1つの FakeLLM を共有する）
+    """
+    fake = FakeLLM(config)
+
+    def factory(model: str, temperature: float, callbacks=None) -> FakeChatModel:
+        return FakeChatModel(fake=fake, model_name=model, callbacks=callbacks)
+
+    factory.fake = fake
+    return factory
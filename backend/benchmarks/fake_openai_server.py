@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ベンチマーク用のOpenAI互換スタブサーバー
+
+`/v1/chat/completions` を実装し、偽のLLM（fake_llm.py の FakeLLM）の応答を返す。
+最初のトークンまでの遅延の後、`stream=true` の場合はSSEでトークンを1つずつ返し、
+そうでない場合は全トークンの生成時間を待ってからまとめて返す。
+ITスキル専門家への相談の要否を判断する要求にはJSONの判断結果を返す。
+エラー率を指定した場合は、その割合の要求に500エラーを返す。
+`/stats` では受け付けたリクエスト数とTCP接続数（クライアントのポート数）を返す。
+
+使い方:
+    python benchmarks/fake_openai_server.py --port 9000 --latency 0.2 --tokens-per-second 50 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_llm import FakeLLM, FakeLLMConfig
+
+
+def create_app(
+    latency: float = 0.2, token_interval: float = 0.01, config: Optional[FakeLLMConfig] = None
+) -> FastAPI:
+    """
+    スタブサーバーのアプリケーションを作成する
+    config を省略した場合は latency（最初のトークンまでの遅延）と token_interval（トークン間隔）から作る
+    """
+    if config is None:
+        config = FakeLLMConfig(ttft=latency, tokens_per_second=1.0 / token_interval if token_interval > 0 else 0.0)
+    fake = FakeLLM(config)
+    app = FastAPI()
+    stats = {"requests": 0, "client_ports": set()}
+
+    @app.middleware("http")
+    async def count_connections(request: Request, call_next):
+        # keep-aliveで再利用された接続は同じクライアントポートになる
+        if request.url.path != "/stats":
+            stats["requests"] += 1
+            stats["client_ports"].add((request.client.host, request.client.port))
+        return await call_next(request)
+
+    @app.get("/stats")
+    async def get_stats():
+        return {
+            "requests": stats["requests"],
+            "connections": len(stats["client_ports"]),
+            "llm_calls": fake.calls,
+            "llm_errors": fake.errors,
+        }
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        stats["requests"] = 0
+        stats["client_ports"] = set()
+        return {"requests": 0, "connections": 0}
+
+    def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-model")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        messages = [(m.get("role", ""), m.get("content") or "") for m in body.get("messages", [])]
+        if fake.should_fail():
+            return JSONResponse(
+                {"error": {"message": "fake LLM error", "type": "server_error", "code": None}}, status_code=500
+            )
+        content = fake.reply(messages)
+        prompt_tokens = fake.count_prompt_tokens(messages)
+
+        # 最初のトークンまでの遅延
+        await asyncio.sleep(fake.first_token_delay())
+
+        if body.get("stream"):
+            async def event_stream():
+                yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+                for token in fake.tokens(content):
+                    if fake.token_interval:
+                        await asyncio.sleep(fake.token_interval)
+                    yield _chunk(completion_id, model, {"content": token})
+                yield _chunk(completion_id, model, {}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        # 全トークンの生成時間
+        await asyncio.sleep(fake.token_interval * len(content))
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content),
+                "total_tokens": prompt_tokens + len(content),
+            },
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI互換スタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.2, help="最初のトークンまでの遅延（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="1秒あたりのトークン数（0で待たない）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500エラーを返す割合")
+    parser.add_argument("--response-tokens", type=int, default=0, help="応答のトークン数（0で定型文）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(
+        ttft=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        response_tokens=args.response_tokens,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config=config), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+LLM呼び出しのHTTP接続プールのベンチマーク
+
+ローカルのOpenAI互換スタブサーバーに対して、以下の方式で同じ数のLLM呼び出しを行い、
+開いたTCP接続数と p50/p99 レイテンシを比較する。
+
+- 呼び出しごとにクライアントを作成: keep-aliveの接続を再利用できない
+- SDKのデフォルト: ChatOpenAI を1つ作成し、SDKが作るクライアントを使う
+- レジストリ: LLMRegistry の共有クライアント（LLM_HTTP_* の接続プール設定）
+
+使い方:
+    python benchmarks/llm_pool.py --concurrency 50 --requests 1000 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_agent import percentile, start_stub_server
+
+PROMPT = "キャリアについて相談したいです"
+
+
+async def run(label: str, get_llm, base_url: str, concurrency: int, total: int) -> None:
+    import httpx
+
+    async with httpx.AsyncClient() as admin:
+        await admin.post(f"{base_url.removesuffix('/v1')}/stats/reset")
+
+    latencies = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            llm, cleanup = await get_llm()
+            started = time.perf_counter()
+            await llm.ainvoke(PROMPT)
+            latencies.append(time.perf_counter() - started)
+            await cleanup()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    async with httpx.AsyncClient() as admin:
+        stats = (await admin.get(f"{base_url.removesuffix('/v1')}/stats")).json()
+
+    print(
+        f"{label:<28} {stats['requests']:>8} {stats['connections']:>8} "
+        f"{percentile(latencies, 0.5) * 1000:>10.1f} {percentile(latencies, 0.99) * 1000:>10.1f} "
+        f"{len(latencies) / elapsed:>10.1f}"
+    )
+
+
+async def main(args, base_url: str) -> None:
+    import httpx
+    from langchain_openai import ChatOpenAI
+    from app.services.llm_registry import get_llm_registry, close_llm_registry
+
+    async def noop():
+        pass
+
+    async def per_call():
+        client = httpx.AsyncClient()
+        llm = ChatOpenAI(model="fake-model", base_url=base_url, max_retries=0, http_async_client=client)
+        return llm, client.aclose
+
+    default_llm = ChatOpenAI(model="fake-model", base_url=base_url, max_retries=0)
+
+    async def sdk_default():
+        return default_llm, noop
+
+    async def registry():
+        return get_llm_registry().get("benchmark", model="fake-model"), noop
+
+    print(f"{'方式':<26} {'件数':>8} {'接続数':>6} {'p50(ms)':>10} {'p99(ms)':>10} {'req/s':>10}")
+    await run("呼び出しごとにクライアント作成", per_call, base_url, args.concurrency, args.requests)
+    await run("SDKのデフォルト", sdk_default, base_url, args.concurrency, args.requests)
+    await run("レジストリの共有クライアント", registry, base_url, args.concurrency, args.requests)
+    await close_llm_registry()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM呼び出しのHTTP接続プールのベンチマーク")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05, help="スタブサーバーの応答遅延（秒）")
+    args = parser.parse_args()
+
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    base_url = start_stub_server(args.latency)
+    os.environ["OPENAI_API_BASE"] = base_url
+
+    asyncio.run(main(args, base_url))
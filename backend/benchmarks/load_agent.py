@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+エージェントの負荷ベンチマーク
+
+ローカルのOpenAI互換スタブサーバーを起動し、`process_message` を
+同時実行数を変えながら呼び出して p50/p99 レイテンシとスループットを計測する。
+
+使い方:
+    python benchmarks/load_agent.py --concurrency 1 10 50 100 500 --latency 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(latency: float, llm_config=None) -> str:
+    """
+    スタブサーバーを別スレッドで起動し、ベースURLを返す
+    llm_config（FakeLLMConfig）を省略した場合は latency 秒後に応答をまとめて返す
+    """
+    import uvicorn
+    from benchmarks.fake_llm import FakeLLMConfig
+    from benchmarks.fake_openai_server import create_app
+
+    llm_config = llm_config or FakeLLMConfig(ttft=latency, tokens_per_second=0.0)
+    port = free_port()
+    config = uvicorn.Config(create_app(config=llm_config), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+async def run_level(process_message, concurrency: int, requests_per_worker: int) -> dict:
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in range(requests_per_worker):
+            started = time.perf_counter()
+            result = await process_message("キャリアについて相談したいです", None, {})
+            latencies.append(time.perf_counter() - started)
+            if result.get("error"):
+                errors += 1
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "rps": len(latencies) / elapsed,
+    }
+
+
+async def main(args) -> None:
+    from app.services.agent import process_message
+
+    print(f"{'並列数':>8} {'件数':>8} {'エラー':>8} {'p50(ms)':>10} {'p99(ms)':>10} {'req/s':>10}")
+    for concurrency in args.concurrency:
+        row = await run_level(process_message, concurrency, args.requests_per_worker)
+        print(
+            f"{row['concurrency']:>8} {row['requests']:>8} {row['errors']:>8} "
+            f"{row['p50_ms']:>10.1f} {row['p99_ms']:>10.1f} {row['rps']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="エージェントの負荷ベンチマーク")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100, 500])
+    parser.add_argument("--requests-per-worker", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2, help="スタブサーバーの応答遅延（秒）")
+    args = parser.parse_args()
+
+    # アプリのインポート前にスタブサーバーを向くよう環境変数を設定する
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    os.environ["OPENAI_API_BASE"] = start_stub_server(args.latency)
+
+    asyncio.run(main(args))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+モデルの階層化（ヘッジ要求）のベンチマーク
+
+速さを指定できる偽のチャットモデルを主モデル・予備モデルとしてLLMレジストリに登録し、
+同じ要求を以下の構成で送って、最初のトークンまでの時間と応答全体の時間の p50 / p99 を比較する。
+
+- 主モデルのみ（階層化なし）
+- 主モデル + 予備モデル（first_token_budget_ms ごと）
+- 主モデルの一部の呼び出しが失敗する場合（予備モデルへの切り替え）
+
+主モデルは slow_rate の割合で最初のトークンまでに slow_ttft 秒かかる（プロバイダーの遅延のテールを模す）。
+ヘッジ要求を送った割合（追加の負荷）と、主モデル・予備モデルの勝率も表示する。
+
+使い方:
+    python benchmarks/model_tiering.py --requests 400 --concurrency 50
+    python benchmarks/model_tiering.py --slow-rate 0.1 --slow-ttft 5 --budgets 500 1000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.services.llm_registry import LLMRegistry
+from app.services.model_tiering import all_tier_stats, reset_tier_stats
+from benchmarks.fake_llm import FakeChatModel, FakeLLM, FakeLLMConfig
+from benchmarks.load_agent import percentile
+
+ROLE = "response_generation"
+PRIMARY_MODEL = "fake-primary"
+FALLBACK_MODEL = "fake-fallback"
+
+
+def make_registry(primary: FakeLLMConfig, fallback: FakeLLMConfig) -> LLMRegistry:
+    """モデル名ごとに別の偽のLLMを使うレジストリ"""
+    fakes = {PRIMARY_MODEL: FakeLLM(primary), FALLBACK_MODEL: FakeLLM(fallback)}
+
+    def factory(model: str, temperature: float, callbacks=None) -> FakeChatModel:
+        return FakeChatModel(fake=fakes[model], model_name=model, callbacks=callbacks)
+
+    return LLMRegistry(factory=factory)
+
+
+async def run(registry: LLMRegistry, requests: int, concurrency: int) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    llm = registry.get(ROLE, 0.7)
+    semaphore = asyncio.Semaphore(concurrency)
+    first_tokens, totals, errors = [], [], 0
+
+    async def one(index: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            first_token = None
+            try:
+                async for chunk in llm.astream([HumanMessage(content=f"転職の相談です（{index}）")]):
+                    if first_token is None and chunk.content:
+                        first_token = time.perf_counter() - started
+            except Exception:
+                errors += 1
+                return
+            first_tokens.append(first_token)
+            totals.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return {
+        "elapsed": time.perf_counter() - started,
+        "first_token": first_tokens,
+        "total": totals,
+        "errors": errors,
+    }
+
+
+def report(label: str, result: dict) -> None:
+    stats = all_tier_stats()
+    if stats:
+        tier = stats[0]
+        extra = (
+            f"{tier.hedge_rate * 100:>6.1f}% {tier.failovers:>6} "
+            f"{tier.primary_win_rate * 100:>6.1f}% {tier.fallback_win_rate * 100:>6.1f}%"
+        )
+    else:
+        extra = f"{'-':>7} {'-':>6} {'-':>7} {'-':>7}"
+    first_token = [value * 1000 for value in result["first_token"]] or [0.0]
+    total = [value * 1000 for value in result["total"]] or [0.0]
+    print(
+        f"{label:<28} {percentile(first_token, 0.5):>8.0f} {percentile(first_token, 0.99):>8.0f} "
+        f"{percentile(total, 0.5):>8.0f} {percentile(total, 0.99):>8.0f} {result['errors']:>6} {extra}"
+    )
+
+
+async def main(args) -> None:
+    primary = FakeLLMConfig(
+        ttft=args.primary_ttft, tokens_per_second=args.tokens_per_second, response_tokens=args.response_tokens,
+        slow_rate=args.slow_rate, slow_ttft=args.slow_ttft, seed=args.seed,
+    )
+    fallback = FakeLLMConfig(
+        ttft=args.fallback_ttft, tokens_per_second=args.tokens_per_second * 2, response_tokens=args.response_tokens,
+        seed=args.seed + 100,
+    )
+    failing = FakeLLMConfig(**{**vars(primary), "error_rate": args.error_rate})
+    # 階層化の効果だけを比べるため、レジストリのリトライは使わない
+    settings.LLM_MAX_RETRIES = 0
+    settings.LLM_ROLE_MODELS = {ROLE: PRIMARY_MODEL}
+    # 主モデルの失敗ごとの警告は表示しない
+    logging.getLogger("app.services.hedged_model").setLevel(logging.ERROR)
+
+    print(
+        f"主モデル: ttft {args.primary_ttft * 1000:.0f}ms（{args.slow_rate * 100:.0f}% は {args.slow_ttft * 1000:.0f}ms）, "
+        f"予備モデル: ttft {args.fallback_ttft * 1000:.0f}ms, 応答 {args.response_tokens} トークン, "
+        f"{args.requests}件（同時 {args.concurrency}）"
+    )
+    print(
+        f"\n{'構成':<28} {'初回p50':>8} {'初回p99':>8} {'全体p50':>8} {'全体p99':>8} {'失敗':>6} "
+        f"{'ヘッジ率':>7} {'切替':>6} {'主勝率':>7} {'予備勝率':>7}"
+    )
+    print(f"{'':<28} {'(ms)':>8} {'(ms)':>8} {'(ms)':>8} {'(ms)':>8}")
+
+    scenarios = [("主モデルのみ", primary, None)]
+    scenarios += [(f"ヘッジ（予算 {budget}ms）", primary, budget) for budget in args.budgets]
+    scenarios += [
+        (f"主モデル失敗 {args.error_rate * 100:.0f}%・階層化なし", failing, None),
+        (f"主モデル失敗 {args.error_rate * 100:.0f}%・予算 {args.budgets[-1]}ms", failing, args.budgets[-1]),
+    ]
+    for label, primary_config, budget in scenarios:
+        reset_tier_stats()
+        settings.LLM_MODEL_TIERS = (
+            {ROLE: {"fallback": FALLBACK_MODEL, "first_token_budget_ms": budget}} if budget is not None else {}
+        )
+        registry = make_registry(primary_config, fallback)
+        report(label, await run(registry, args.requests, args.concurrency))
+        await registry.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="モデルの階層化（ヘッジ要求）のベンチマーク")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--primary-ttft", type=float, default=0.3, help="主モデルの通常の最初のトークンまでの時間（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="主モデルの呼び出しが遅くなる割合")
+    parser.add_argument("--slow-ttft", type=float, default=3.0, help="遅い呼び出しの最初のトークンまでの時間（秒）")
+    parser.add_argument("--fallback-ttft", type=float, default=0.15, help="予備モデルの最初のトークンまでの時間（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="主モデルの生成速度（予備モデルはこの2倍）")
+    parser.add_argument("--response-tokens", type=int, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.1, help="失敗のシナリオでの主モデルの失敗率")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[500, 1000], help="first_token_budget_ms の値")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+マルチエキスパート構成のベンチマーク
+
+ローカルのOpenAI互換スタブサーバーを起動し、相談の要否の判断・ITスキル専門家・回答生成を
+順に実行するグラフと、判断と専門家を並列に実行するグラフの所要時間（wall-clock）を比較する。
+スタブは常に相談が必要と判断するため、順次実行のグラフも判断の後に専門家を呼び出す（判断・専門家・回答生成の3回）。
+ブランチのタイムアウトをスタブの遅延より短くした場合は、遅い専門家を待たずに回答することを確認できる。
+
+使い方:
+    python benchmarks/parallel_experts.py --latency 0.3 --requests 20
+    python benchmarks/parallel_experts.py --latency 0.3 --branch-timeout 0.1
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_agent import percentile, start_stub_server
+
+
+async def measure(graph, requests: int) -> dict:
+    from langchain_core.messages import HumanMessage
+    from app.services.agent import AgentState
+
+    latencies = []
+    degraded = 0
+    for _ in range(requests):
+        state = AgentState(messages=[HumanMessage(content="Webエンジニアからデータエンジニアに転職したいです")])
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await graph.ainvoke(state)
+        latencies.append(time.perf_counter() - started)
+        degraded += bool(result.get("degraded"))
+    return {
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "degraded": degraded,
+    }
+
+
+async def main(args) -> None:
+    from app.services.agent import create_agent_graph
+    from app.services.llm_registry import close_llm_registry
+
+    print(f"{'構成':<12} {'p50(ms)':>10} {'p99(ms)':>10} {'縮退':>6}")
+    for label, parallel in (("順次実行", False), ("並列実行", True)):
+        row = await measure(create_agent_graph(multi_expert=True, parallel_experts=parallel), args.requests)
+        print(f"{label:<12} {row['p50_ms']:>10.1f} {row['p99_ms']:>10.1f} {row['degraded']:>6}")
+    await close_llm_registry()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="マルチエキスパート構成のベンチマーク")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3, help="スタブサーバーの応答遅延（秒）")
+    parser.add_argument("--branch-timeout", type=float, default=None, help="専門家のブランチのタイムアウト（秒）")
+    parser.add_argument("--pre-router", action="store_true", help="ローカル分類器で相談の要否を判断する")
+    args = parser.parse_args()
+
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    os.environ["OPENAI_API_BASE"] = start_stub_server(args.latency)
+    # デフォルトでは常にLLMで判断させ、判断と専門家の並列実行の効果を計測する
+    os.environ["PRE_ROUTER_ENABLED"] = "true" if args.pre_router else "false"
+    if args.branch_timeout is not None:
+        os.environ["AGENT_BRANCH_TIMEOUT"] = str(args.branch_timeout)
+
+    asyncio.run(main(args))
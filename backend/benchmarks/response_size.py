@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+チャットレスポンスのサイズとシリアライズ時間のベンチマーク
+
+会話全体を返す場合（include_history=true）と、今回追加されたメッセージのみを返す
+差分レスポンス（include_history=false / since_message_id）を、会話の長さごとに比較する。
+
+使い方:
+    python benchmarks/response_size.py --lengths 10 100 1000
+"""
+import argparse
+import os
+import sys
+import time
+from uuid import uuid4
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.schemas.chat import ChatMessage, ChatResponse
+
+USER_TEXT = "転職を考えています。今のスキルでどのような職種に挑戦できるでしょうか？"
+ASSISTANT_TEXT = "ご相談ありがとうございます。これまでのご経験を棚卸しし、活かせる強みを整理するところから始めましょう。" * 3
+
+
+def build_messages(count: int):
+    return [
+        ChatMessage(role="user" if i % 2 == 0 else "assistant", content=USER_TEXT if i % 2 == 0 else ASSISTANT_TEXT)
+        for i in range(count)
+    ]
+
+
+def measure(response: ChatResponse, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = response.model_dump_json()
+    elapsed = (time.perf_counter() - started) / repeat
+    return len(body.encode("utf-8")), elapsed * 1000
+
+
+def main(args) -> None:
+    conversation_id = uuid4()
+    print(f"{'メッセージ数':>10} {'全体(bytes)':>12} {'全体(ms)':>10} {'差分(bytes)':>12} {'差分(ms)':>10} {'セッション累計 全体/差分(MB)':>28}")
+    for length in args.lengths:
+        messages = build_messages(length)
+        full = ChatResponse(
+            message=ASSISTANT_TEXT, conversation_id=conversation_id, messages=messages, cursor=messages[-1].id
+        )
+        delta = ChatResponse(
+            message=ASSISTANT_TEXT, conversation_id=conversation_id, messages=messages[-2:], cursor=messages[-1].id
+        )
+        full_bytes, full_ms = measure(full, args.repeat)
+        delta_bytes, delta_ms = measure(delta, args.repeat)
+
+        # 1ターン（2メッセージ）ごとに全体を返した場合と差分のみを返した場合のセッション累計
+        per_message = full_bytes / length
+        session_full = sum(per_message * turn * 2 for turn in range(1, length // 2 + 1))
+        session_delta = delta_bytes * (length // 2)
+
+        print(
+            f"{length:>10} {full_bytes:>12} {full_ms:>10.3f} {delta_bytes:>12} {delta_ms:>10.3f} "
+            f"{session_full / 1e6:>16.2f} / {session_delta / 1e6:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="チャットレスポンスのサイズとシリアライズ時間のベンチマーク")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=50)
+    main(parser.parse_args())
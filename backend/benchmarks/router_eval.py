@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ローカル分類器（app/services/pre_router.py）のオフライン評価
+
+評価データ（学習データとは別の質問）に対して、閾値ごとに以下を計測する。
+
+- ローカルで判断できた割合（残りはLLMに判断させる）
+- ローカルで判断した質問の正解率と、判断の内訳（キーワード表 / 線形モデル）
+- 線形モデルのみで全件を判断した場合の正解率
+- 1回の判断にかかる時間
+
+使い方:
+    python benchmarks/router_eval.py --thresholds 0.6 0.7 0.8 0.9
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.pre_router import PreRouter
+
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "routing_eval.jsonl")
+
+
+def load_examples(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [(row["text"], row["it_consultation"]) for row in map(json.loads, f) if row]
+
+
+def main(args) -> None:
+    examples = load_examples(args.data)
+    started = time.perf_counter()
+    router = PreRouter()
+    print(f"学習時間: {(time.perf_counter() - started) * 1000:.1f} ms / 評価データ: {len(examples)}件")
+
+    model_correct = sum((router.predict_proba(text) >= 0.5) == label for text, label in examples)
+    print(f"線形モデルのみ（閾値なし）の正解率: {model_correct / len(examples):.1%}")
+    print()
+    print(f"{'閾値':>6} {'ローカル判断':>10} {'正解率':>8} {'キーワード':>10} {'モデル':>8} {'LLMへ':>8} {'µs/判断':>10}")
+
+    for threshold in args.thresholds:
+        router.threshold = threshold
+        decided = correct = keyword = model = 0
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            decisions = [(router.decide(text), label) for text, label in examples]
+        per_decision = (time.perf_counter() - started) / (args.repeat * len(examples)) * 1e6
+        for decision, label in decisions:
+            if decision.it_consultation is None:
+                continue
+            decided += 1
+            correct += decision.it_consultation == label
+            keyword += decision.source == "keyword"
+            model += decision.source == "model"
+        print(
+            f"{threshold:>6.2f} {decided / len(examples):>10.1%} {correct / max(decided, 1):>8.1%} "
+            f"{keyword:>10} {model:>8} {len(examples) - decided:>8} {per_decision:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ローカル分類器のオフライン評価")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="評価データ（JSONL: text, it_consultation）")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.6, 0.7, 0.8, 0.9])
+    parser.add_argument("--repeat", type=int, default=20, help="時間計測のための繰り返し回数")
+    main(parser.parse_args())
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+シナリオ負荷テスト
+
+偽のLLM（fake_llm.py）を使ってFastAPIアプリケーションをローカルで起動し、
+決められたシナリオでHTTPリクエストを送ってスループット・レイテンシのパーセンタイル・メモリ使用量を
+JSONのレポートに出力する。同じ引数であれば同じ負荷になるため、コミット間で結果を比較できる。
+
+シナリオ:
+- single_turn: 新しい会話で1回だけ質問する
+- long_session: 同じ会話で続けて質問する（会話履歴が伸びる）
+- streaming: SSEで応答を受け取り、最初のトークンまでの時間も計測する
+- burst: 一斉にリクエストを送り、間を空けて繰り返す
+
+偽のLLMはプロセス内（--llm inprocess: LLMレジストリの factory）か、
+OpenAI互換のスタブサーバー（--llm http: fake_openai_server.py）で動かす。
+メモリ使用量はアプリケーションとクライアントを含むこのプロセスのRSS。
+
+使い方:
+    python benchmarks/scenarios.py --output report.json
+    python benchmarks/scenarios.py --llm http --ttft 0.2 --tokens-per-second 50 --error-rate 0.01
+    python benchmarks/scenarios.py --compare baseline.json --output report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_llm import FakeLLMConfig, fake_llm_factory
+from benchmarks.load_agent import free_port, percentile, start_stub_server
+
+SCENARIOS = ("single_turn", "long_session", "streaming", "burst")
+
+CHAT_PATH = "/api/v1/chat/chat"
+STREAM_PATH = "/api/v1/chat/chat/stream"
+
+# 比較時に「悪化」とみなす変化率
+REGRESSION_THRESHOLD = 0.10
+
+
+def rss_mb() -> float:
+    """現在のRSS（MB）"""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """最大RSS（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def summarize_latencies(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "p50": percentile(values, 0.5) * 1000,
+        "p90": percentile(values, 0.9) * 1000,
+        "p99": percentile(values, 0.99) * 1000,
+        "max": max(values) * 1000,
+        "mean": statistics.mean(values) * 1000,
+    }
+
+
+class ScenarioResult:
+    """1つのシナリオの計測結果"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.first_token: List[float] = []
+        self.errors = 0
+        self.elapsed = 0.0
+        self.rss_before = 0.0
+        self.rss_after = 0.0
+
+    def report(self) -> Dict[str, Any]:
+        requests = len(self.latencies) + self.errors
+        row = {
+            "requests": requests,
+            "errors": self.errors,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "throughput_rps": round(len(self.latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            "latency_ms": {k: round(v, 2) for k, v in summarize_latencies(self.latencies).items()},
+            "rss_mb_before": round(self.rss_before, 1),
+            "rss_mb_after": round(self.rss_after, 1),
+        }
+        if self.first_token:
+            row["first_token_ms"] = {k: round(v, 2) for k, v in summarize_latencies(self.first_token).items()}
+        return row
+
+
+async def post_chat(client, result: ScenarioResult, message: str, conversation_id: Optional[str] = None):
+    body = {"message": message, "include_history": False}
+    if conversation_id:
+        body["conversation_id"] = conversation_id
+    started = time.perf_counter()
+    response = await client.post(CHAT_PATH, json=body)
+    if response.status_code != 200:
+        result.errors += 1
+        return None
+    result.latencies.append(time.perf_counter() - started)
+    return response.json()["conversation_id"]
+
+
+async def post_stream(client, result: ScenarioResult, message: str) -> None:
+    started = time.perf_counter()
+    first_token = None
+    failed = False
+    async with client.stream("POST", STREAM_PATH, json={"message": message}) as response:
+        if response.status_code != 200:
+            failed = True
+        else:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event_type = json.loads(line[len("data: "):])["type"]
+                if event_type == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event_type == "error":
+                    failed = True
+    if failed:
+        result.errors += 1
+        return
+    result.latencies.append(time.perf_counter() - started)
+    if first_token is not None:
+        result.first_token.append(first_token)
+
+
+async def run_pool(concurrency: int, jobs) -> None:
+    """jobs（コルーチン関数のリスト）を最大 concurrency 件ずつ実行する"""
+    remaining = iter(jobs)
+
+    async def worker():
+        for job in remaining:
+            await job()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def scenario_single_turn(client, result: ScenarioResult, args) -> None:
+    jobs = [lambda i=i: post_chat(client, result, f"質問{i}: 転職するべきか迷っています") for i in range(args.requests)]
+    await run_pool(args.concurrency, jobs)
+
+
+async def scenario_long_session(client, result: ScenarioResult, args) -> None:
+    async def session(index: int) -> None:
+        conversation_id = None
+        for turn in range(args.turns):
+            conversation_id = await post_chat(
+                client, result, f"会話{index}の{turn}回目の質問: 次は何をすればいいですか", conversation_id
+            ) or conversation_id
+
+    await asyncio.gather(*(session(i) for i in range(args.sessions)))
+
+
+async def scenario_streaming(client, result: ScenarioResult, args) -> None:
+    jobs = [lambda i=i: post_stream(client, result, f"質問{i}: 面接の準備を教えてください") for i in range(args.requests)]
+    await run_pool(args.concurrency, jobs)
+
+
+async def scenario_burst(client, result: ScenarioResult, args) -> None:
+    for burst in range(args.bursts):
+        await asyncio.gather(*(
+            post_chat(client, result, f"一斉{burst}-{i}: キャリアについて相談したいです") for i in range(args.burst_size)
+        ))
+        if burst < args.bursts - 1:
+            await asyncio.sleep(args.burst_interval)
+
+
+SCENARIO_FUNCTIONS = {
+    "single_turn": scenario_single_turn,
+    "long_session": scenario_long_session,
+    "streaming": scenario_streaming,
+    "burst": scenario_burst,
+}
+
+
+def start_app_server() -> str:
+    """
+    アプリケーションを別スレッドで起動し、ベースURLを返す
+    """
+    import uvicorn
+    from app.main import app
+
+    port = free_port()
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+async def run_scenarios(base_url: str, args) -> Dict[str, Any]:
+    import httpx
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    reports = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=httpx.Timeout(300.0)) as client:
+        # 初回のみの準備（接続・キャッシュの初期化など）を計測から外す
+        await client.post(CHAT_PATH, json={"message": "ウォームアップ", "include_history": False})
+        for name in args.scenarios:
+            result = ScenarioResult(name)
+            result.rss_before = rss_mb()
+            started = time.perf_counter()
+            await SCENARIO_FUNCTIONS[name](client, result, args)
+            result.elapsed = time.perf_counter() - started
+            result.rss_after = rss_mb()
+            reports[name] = result.report()
+            print(f"{name:<14} {json.dumps(reports[name], ensure_ascii=False)}", file=sys.stderr)
+    return reports
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """ベースラインとの比較結果（p50/p99・スループット・メモリの変化率）の行を返す"""
+    lines = [f"{'シナリオ':<14} {'指標':<16} {'ベースライン':>12} {'今回':>12} {'変化':>8}"]
+    for name, row in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        metrics = [
+            ("p50_ms", base["latency_ms"].get("p50"), row["latency_ms"].get("p50"), False),
+            ("p99_ms", base["latency_ms"].get("p99"), row["latency_ms"].get("p99"), False),
+            ("throughput_rps", base["throughput_rps"], row["throughput_rps"], True),
+            ("rss_mb_after", base["rss_mb_after"], row["rss_mb_after"], False),
+        ]
+        for label, before, after, higher_is_better in metrics:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            mark = " !" if worse > REGRESSION_THRESHOLD else ""
+            lines.append(f"{name:<14} {label:<16} {before:>12.1f} {after:>12.1f} {change:>+7.1%}{mark}")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="シナリオ負荷テスト")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--llm", choices=("inprocess", "http"), default="inprocess", help="偽のLLMの動かし方")
+    parser.add_argument("--ttft", type=float, default=0.2, help="偽のLLMの最初のトークンまでの時間（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--response-tokens", type=int, default=0, help="応答のトークン数（0で定型文）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=200, help="single_turn / streaming のリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=20, help="single_turn / streaming の同時実行数")
+    parser.add_argument("--sessions", type=int, default=10, help="long_session の会話数")
+    parser.add_argument("--turns", type=int, default=20, help="long_session の1会話あたりの質問数")
+    parser.add_argument("--burst-size", type=int, default=100)
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--burst-interval", type=float, default=1.0)
+    parser.add_argument("--output", help="レポートのJSONファイル（省略時は標準出力）")
+    parser.add_argument("--compare", help="比較するベースラインのレポート")
+    args = parser.parse_args()
+
+    llm_config = FakeLLMConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        response_tokens=args.response_tokens,
+        seed=args.seed,
+    )
+
+    # アプリケーションのインポート前に設定する（エージェントグラフはアプリケーションの起動時に作成される）
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # 負荷は1つのクライアントから送るため、利用者ごとのレート制限で断られないようにする
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    fake = None
+    if args.llm == "http":
+        os.environ["OPENAI_API_BASE"] = start_stub_server(args.ttft, llm_config)
+    else:
+        from app.services.llm_registry import get_llm_registry
+
+        factory = fake_llm_factory(llm_config)
+        get_llm_registry().factory = factory
+        fake = factory.fake
+
+    base_url = start_app_server()
+    scenarios = asyncio.run(run_scenarios(base_url, args))
+
+    llm_stats = {"calls": fake.calls, "errors": fake.errors} if fake is not None else None
+    if llm_stats is None:
+        import httpx
+
+        stats = httpx.get(f"{os.environ['OPENAI_API_BASE'].removesuffix('/v1')}/stats").json()
+        llm_stats = {"calls": stats["llm_calls"], "errors": stats["llm_errors"]}
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "llm": llm_stats,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "scenarios": scenarios,
+    }
+    body = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(body + "\n")
+    else:
+        print(body)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            for line in compare(report, json.load(baseline)):
+                print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
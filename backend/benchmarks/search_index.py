@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+会話の全文検索インデックスのベンチマーク
+
+合成したキャリア相談のメッセージを InvertedIndex に登録し、以下を計測する。
+
+- 登録のスループット（メッセージ/秒）とインデックスのサイズ（圧縮後のポスティングリストと列）
+- クエリごとの p50 / p99 レイテンシと一致件数
+- 比較: 全メッセージの本文を走査して部分一致を探す方式（従来の Conversation.messages の走査に相当）
+
+使い方:
+    python benchmarks/search_index.py --messages 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.search.index import InvertedIndex
+from app.services.search.tokenizer import normalize, tokenize
+
+SUBJECTS = ["営業職", "エンジニア", "デザイナー", "看護師", "事務職", "データサイエンティスト", "教師", "マーケター", "経理", "販売員"]
+TOPICS = [
+    "転職", "キャリアチェンジ", "昇進", "年収アップ", "資格取得", "副業", "リモートワーク", "育児との両立",
+    "職場の人間関係", "面接対策", "履歴書の書き方", "独立", "留学", "管理職への挑戦",
+]
+SKILLS = ["Python", "Java", "SQL", "英語", "簿記", "AWS", "Excel", "プレゼン", "マネジメント", "統計"]
+USER_TEMPLATES = [
+    "{subject}として働いていますが、{topic}を考えています。{skill}の経験は活かせるでしょうか？",
+    "{topic}について相談したいです。今は{subject}で、{skill}を勉強中です。",
+    "{skill}を学んで{topic}したいのですが、{subject}からでも可能ですか？",
+]
+ASSISTANT_TEMPLATES = [
+    "ご相談ありがとうございます。{subject}としての経験は{topic}でも強みになります。まずは{skill}の実績を整理しましょう。",
+    "{topic}を成功させるには、{skill}のスキルを具体的な成果で示すことが大切です。{subject}での経験も棚卸ししてみましょう。",
+    "{subject}から{topic}を目指す方は多いです。{skill}の学習計画を一緒に立てましょう。",
+]
+QUERIES = [
+    ("1語（頻出）", dict(query="転職")),
+    ("1語（英単語）", dict(query="Python")),
+    ("2語 AND", dict(query="転職 Python")),
+    ("3語 AND（まれ）", dict(query="看護師 留学 AWS")),
+    ("長い語", dict(query="データサイエンティスト")),
+    ("2語 + 直近7日", dict(query="副業 英語", days=7)),
+    ("1語 + 会話ごと", dict(query="面接対策", group_by_conversation=True)),
+    ("1語 + ユーザーのみ", dict(query="年収アップ", role="user")),
+]
+
+
+def generate(count: int, messages_per_conversation: int, days: int, seed: int):
+    """(会話ID, メッセージID, ロール, タイムスタンプ, 本文) を生成する"""
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=days)
+    step = timedelta(days=days) / count
+    conversation_id = uuid4()
+    for index in range(count):
+        if index % messages_per_conversation == 0:
+            conversation_id = uuid4()
+        role = "user" if index % 2 == 0 else "assistant"
+        template = rng.choice(USER_TEMPLATES if role == "user" else ASSISTANT_TEMPLATES)
+        content = template.format(subject=rng.choice(SUBJECTS), topic=rng.choice(TOPICS), skill=rng.choice(SKILLS))
+        yield conversation_id, uuid4(), role, start + step * index, content
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def scan(rows, query: str, since=None, role=None) -> int:
+    """本文を全件走査して、すべての語を含むメッセージを数える"""
+    words = [normalize(word) for word in query.split()]
+    return sum(
+        1 for _, _, row_role, timestamp, content in rows
+        if (since is None or timestamp >= since) and (role is None or row_role == role)
+        and all(word in normalize(content) for word in words)
+    )
+
+
+def main(args) -> None:
+    rows = list(generate(args.messages, args.messages_per_conversation, args.days, args.seed))
+    tokens = sum(len(tokenize(row[4])) for row in rows[:10000]) / min(len(rows), 10000)
+    print(f"メッセージ数: {len(rows):,}（会話あたり {args.messages_per_conversation}件, 平均 {tokens:.1f} トークン）")
+
+    index = InvertedIndex()
+    started = time.perf_counter()
+    for conversation_id, message_id, role, timestamp, content in rows:
+        index.add(conversation_id, message_id, role, timestamp, content)
+    elapsed = time.perf_counter() - started
+    print(
+        f"登録: {elapsed:.1f}秒（{len(rows) / elapsed:,.0f} メッセージ/秒）, "
+        f"トークンの種類 {index.term_count:,}, インデックス {index.nbytes() / 1e6:.1f} MB"
+    )
+
+    print(f"\n{'クエリ':<22} {'一致件数':>10} {'p50(ms)':>9} {'p99(ms)':>9} {'走査(ms)':>10}")
+    now = datetime.now()
+    for label, options in QUERIES:
+        options = dict(options)
+        days = options.pop("days", None)
+        since = now - timedelta(days=days) if days else None
+        latencies = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            total, _ = index.search(limit=20, since=since, **options)
+            latencies.append((time.perf_counter() - started) * 1000)
+        scan_ms = ""
+        if args.scan and not options.get("group_by_conversation"):
+            started = time.perf_counter()
+            scanned = scan(rows, options["query"], since, options.get("role"))
+            scan_ms = f"{(time.perf_counter() - started) * 1000:.0f}"
+            if scanned != total:
+                scan_ms += f"（走査 {scanned}件）"
+        print(
+            f"{label:<22} {total:>10,} {statistics.median(latencies):>9.2f} "
+            f"{percentile(latencies, 0.99):>9.2f} {scan_ms:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会話の全文検索インデックスのベンチマーク")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--messages-per-conversation", type=int, default=10)
+    parser.add_argument("--days", type=int, default=90, help="メッセージのタイムスタンプを分布させる日数")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-scan", dest="scan", action="store_false", help="全件走査との比較を省く")
+    main(parser.parse_args())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+起動時間のベンチマーク
+
+- import: `python -X importtime -c "import app.main"` を別プロセスで繰り返し、アプリケーションの
+  インポート時間の中央値と、時間のかかっているモジュール（自身のインポートを含む累計）を出力する
+- startup: `uvicorn app.main:app` を別プロセスで起動し、プロセスの起動から
+  `/api/v1/health/live`（リクエストに応答できる）と `/api/v1/health/ready`（エージェントグラフの作成とトークンカウンターの読み込みが完了）が
+  200を返すまでの時間を計測する
+
+LLMは呼び出さない（グラフの作成はAPIキーを設定した場合と同じ処理を行うが、通信はしない）。
+結果はJSONのレポートに出力し、`--compare` でベースラインと比べる。`--max-import-ms` を指定すると、
+インポート時間の中央値が超えた場合に終了コード1で終わる（CIでの回帰の検出用）。
+
+使い方:
+    python benchmarks/startup_time.py --output baseline.json
+    python benchmarks/startup_time.py --compare baseline.json --max-import-ms 800
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_agent import free_port
+from benchmarks.scenarios import REGRESSION_THRESHOLD, git_commit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIVE_PATH = "/api/v1/health/live"
+READY_PATH = "/api/v1/health/ready"
+
+
+def app_env() -> Dict[str, str]:
+    return dict(
+        os.environ,
+        OPENAI_API_KEY="sk-benchmark",
+        LOG_LEVEL="WARNING",
+        # 前回の実行の会話を読み込まないよう、メモリ上のストアで起動する
+        CONVERSATION_STORE_BACKEND="memory",
+    )
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """-X importtime の出力を (モジュール名, 自身の時間(us), 累計(us)) のリストにする"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        self_us, cumulative_us, name = fields
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure_import(runs: int, top: int) -> Dict[str, Any]:
+    totals = []
+    rows: List[Tuple[str, int, int]] = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app.main"],
+            cwd=BACKEND_DIR, env=app_env(), capture_output=True, text=True, check=True,
+        )
+        rows = parse_importtime(result.stderr)
+        totals.append(next(cumulative for name, _, cumulative in rows if name == "app.main") / 1000)
+
+    # 最後の実行の結果から、app 以外のパッケージを累計のインポート時間の長い順に出す
+    heaviest = sorted(
+        ((name, cumulative) for name, _, cumulative in rows if name != "app" and not name.startswith("app.")),
+        key=lambda row: row[1], reverse=True,
+    )
+    seen, top_modules = set(), []
+    for name, cumulative in heaviest:
+        root = name.split(".")[0]
+        if root in seen:
+            continue
+        seen.add(root)
+        top_modules.append({"module": root, "cumulative_ms": round(cumulative / 1000, 1)})
+        if len(top_modules) >= top:
+            break
+    return {
+        "median_ms": round(statistics.median(totals), 1),
+        "min_ms": round(min(totals), 1),
+        "runs_ms": [round(total, 1) for total in totals],
+        "top_packages": top_modules,
+    }
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float) -> float:
+    """url が200を返した時刻（time.perf_counter）"""
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("アプリケーションの起動に失敗しました")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f"{url} が{timeout}秒以内に200を返しませんでした")
+
+
+def measure_startup(timeout: float) -> Dict[str, float]:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=app_env(),
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        live = wait_for(base_url + LIVE_PATH, process, timeout)
+        ready = wait_for(base_url + READY_PATH, process, timeout)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {"live_ms": (live - started) * 1000, "ready_ms": (ready - started) * 1000}
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """ベースラインとの比較結果（インポート時間・起動時間の変化率）の行を返す"""
+    lines = [f"{'指標':<18} {'ベースライン':>12} {'今回':>12} {'変化':>8}"]
+    metrics = [
+        ("import_median_ms", baseline["import"]["median_ms"], report["import"]["median_ms"]),
+        ("live_median_ms", baseline["startup"]["live_median_ms"], report["startup"]["live_median_ms"]),
+        ("ready_median_ms", baseline["startup"]["ready_median_ms"], report["startup"]["ready_median_ms"]),
+    ]
+    for label, before, after in metrics:
+        if not before:
+            continue
+        change = (after - before) / before
+        mark = " !" if change > REGRESSION_THRESHOLD else ""
+        lines.append(f"{label:<18} {before:>12.1f} {after:>12.1f} {change:>+7.1%}{mark}")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="起動時間のベンチマーク")
+    parser.add_argument("--runs", type=int, default=5, help="インポート時間・起動時間それぞれの計測回数")
+    parser.add_argument("--top", type=int, default=10, help="出力するインポートの重いパッケージの数")
+    parser.add_argument("--timeout", type=float, default=60.0, help="起動を待つ時間（秒）")
+    parser.add_argument("--output", help="レポートのJSONファイル（省略時は標準出力）")
+    parser.add_argument("--compare", help="比較するベースラインのレポート")
+    parser.add_argument("--max-import-ms", type=float, help="インポート時間の中央値の上限（超えると終了コード1）")
+    args = parser.parse_args()
+
+    import_report = measure_import(args.runs, args.top)
+    print(f"import         {json.dumps(import_report, ensure_ascii=False)}", file=sys.stderr)
+    startups = [measure_startup(args.timeout) for _ in range(args.runs)]
+    startup_report = {
+        "live_median_ms": round(statistics.median(run["live_ms"] for run in startups), 1),
+        "ready_median_ms": round(statistics.median(run["ready_ms"] for run in startups), 1),
+        "runs": [{key: round(value, 1) for key, value in run.items()} for run in startups],
+    }
+    print(f"startup        {json.dumps(startup_report, ensure_ascii=False)}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "import": import_report,
+        "startup": startup_report,
+    }
+    body = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(body + "\n")
+    else:
+        print(body)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            for line in compare(report, json.load(baseline)):
+                print(line, file=sys.stderr)
+
+    if args.max_import_ms is not None and import_report["median_ms"] > args.max_import_ms:
+        print(
+            f"インポート時間の中央値 {import_report['median_ms']:.1f}ms が上限 {args.max_import_ms:.1f}ms を超えています",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
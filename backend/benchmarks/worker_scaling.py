@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ワーカープロセス数ごとのスループットのベンチマーク
+
+OpenAI互換のスタブサーバー（偽のLLM）と、`run.py --workers N` のアプリケーションを別プロセスで起動し、
+ワーカー数を変えながら同じ負荷をかけて req/s と p50/p99 レイテンシ、1ワーカーに対するスケーリング効率を比べる。
+会話ストアはワーカー間で共有するSQLiteファイルを使う。
+
+負荷をかけた後、同じ会話で続けて質問した結果（リクエストごとに別のワーカーが処理しうる）の
+メッセージ数が揃っているかを確認し、ワーカー間で会話が正しく共有されていることも検証する。
+スケーリングを計測するには、ワーカー数と負荷生成のプロセスに足りるCPUコアが必要。
+
+使い方:
+    python benchmarks/worker_scaling.py --workers 1 2 4 --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_agent import free_port, percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAT_URL = "/api/v1/chat/chat"
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"起動に失敗しました: {' '.join(process.args)}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} が起動しませんでした")
+
+
+def start_stub(args) -> tuple:
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(BACKEND_DIR, "benchmarks", "fake_openai_server.py"),
+            "--port", str(port), "--latency", str(args.latency), "--tokens-per-second", "0",
+        ],
+        cwd=BACKEND_DIR,
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/stats", process)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def start_app(workers: int, llm_base_url: str, data_dir: str) -> tuple:
+    port = free_port()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-benchmark",
+        OPENAI_API_BASE=llm_base_url,
+        CONVERSATION_STORE_BACKEND="sqlite",
+        CONVERSATION_SQLITE_PATH=os.path.join(data_dir, f"conversations-{workers}.db"),
+        # 同じ質問の合流はワーカーごとに行われるため、ワーカー数による差が出ないよう無効にする
+        SINGLE_FLIGHT_ENABLED="false",
+        HISTORY_SUMMARY_ENABLED="false",
+        # 負荷は1つのクライアントから送るため、利用者ごとのレート制限で断られないようにする
+        ADMISSION_ENABLED="false",
+        LOG_LEVEL="WARNING",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "run.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_until_ready(f"{base_url}/api/v1/health/ready", process)
+    return process, base_url
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def run_load(base_url: str, args) -> dict:
+    import httpx
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(args.requests))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        async def worker():
+            nonlocal errors
+            for index in remaining:
+                started = time.perf_counter()
+                response = await client.post(
+                    CHAT_URL, json={"message": f"質問{index}: キャリアについて相談したいです", "include_history": False}
+                )
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        # 接続の確立とワーカーの初回の準備を計測から外す
+        await asyncio.gather(*(
+            client.post(CHAT_URL, json={"message": "ウォームアップ", "include_history": False})
+            for _ in range(args.concurrency)
+        ))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def check_sessions(base_url: str, args) -> int:
+    """
+    同じ会話で続けて質問し、最後に取得した会話のメッセージ数が質問数の2倍でない会話の数を返す
+    接続を使い回さないため、質問ごとに別のワーカーが処理しうる
+    """
+    import httpx
+
+    async def session(index: int) -> bool:
+        conversation_id = None
+        for turn in range(args.turns):
+            async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+                body = {"message": f"会話{index}の{turn}回目の質問", "include_history": False}
+                if conversation_id:
+                    body["conversation_id"] = conversation_id
+                response = await client.post(CHAT_URL, json=body)
+                response.raise_for_status()
+                conversation_id = response.json()["conversation_id"]
+        async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+            response = await client.get(f"/api/v1/chat/conversations/{conversation_id}/messages")
+            response.raise_for_status()
+            return len(response.json()) == args.turns * 2
+
+    results = await asyncio.gather(*(session(i) for i in range(args.sessions)))
+    return results.count(False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ワーカープロセス数ごとのスループットのベンチマーク")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.05, help="偽のLLMの応答遅延（秒）")
+    parser.add_argument("--sessions", type=int, default=10, help="ワーカー間の共有を確認する会話数")
+    parser.add_argument("--turns", type=int, default=5, help="確認する会話ごとの質問数")
+    args = parser.parse_args()
+
+    print(f"CPUコア数: {os.cpu_count()}")
+    stub, llm_base_url = start_stub(args)
+    baseline = None
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            print(f"{'ワーカー':>8} {'件数':>8} {'エラー':>6} {'req/s':>10} {'p50(ms)':>10} {'p99(ms)':>10} {'効率':>6} {'不整合':>6}")
+            for workers in args.workers:
+                app, base_url = start_app(workers, llm_base_url, data_dir)
+                try:
+                    row = asyncio.run(run_load(base_url, args))
+                    inconsistent = asyncio.run(check_sessions(base_url, args))
+                finally:
+                    stop(app)
+                if baseline is None:
+                    baseline = row["rps"] / workers
+                efficiency = row["rps"] / (baseline * workers)
+                print(
+                    f"{workers:>8} {row['requests']:>8} {row['errors']:>6} {row['rps']:>10.1f} "
+                    f"{row['p50_ms']:>10.1f} {row['p99_ms']:>10.1f} {efficiency:>6.0%} {inconsistent:>6}"
+                )
+    finally:
+        stop(stub)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,24 @@
+import argparse
+import os
 import uvicorn
+from dotenv import load_dotenv
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="APIサーバーを起動する")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="ワーカープロセス数（指定すると自動リロードなしの本番モードで起動する。省略時は WORKERS）",
+    )
+    args = parser.parse_args()
+
+    if args.workers is None and int(os.environ.get("WORKERS", "1")) <= 1:
+        # 開発モード: 1プロセスでコードの変更を自動リロードする
+        uvicorn.run("app.main:app", host=args.host, port=args.port, reload=True)
+    else:
+        workers = args.workers or int(os.environ["WORKERS"])
+        # 各ワーカーが同じ設定（会話ストアを共有するかどうか）で動くよう、環境変数で引き継ぐ
+        os.environ["WORKERS"] = str(workers)
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=workers)
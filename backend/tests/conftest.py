@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    # 非同期のテストは anyio のプラグインで asyncio のイベントループ上で実行する
+    return "asyncio"
@@ -0,0 +1,102 @@
+"""
+受付制御の利用者の識別
+"""
+import re
+from pathlib import Path
+from uuid import uuid4
+import pytest
+from pydantic import TypeAdapter
+from starlette.requests import HTTPConnection
+from app.api.v1.endpoints.chat import _admit
+from app.core.config import settings
+from app.schemas.chat import ChatRequest
+from app.services.admission import AdmissionRejected, client_address, close_admission_controller
+
+pytestmark = pytest.mark.anyio
+
+
+def connection(client_host: str = "10.0.0.1", **headers: str) -> HTTPConnection:
+    return HTTPConnection({
+        "type": "http",
+        "client": (client_host, 50000),
+        "headers": [(name.replace("_", "-").lower().encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+@pytest.fixture
+async def admission(monkeypatch):
+    # 1件だけ受け付け、補充はほぼされない設定
+    monkeypatch.setattr(settings, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(settings, "ADMISSION_USER_BURST", 1)
+    monkeypatch.setattr(settings, "ADMISSION_USER_RATE_PER_MINUTE", 0.001)
+    monkeypatch.setattr(settings, "ADMISSION_TOKENS_PER_MINUTE", 0)
+    monkeypatch.setattr(settings, "ADMISSION_USER_HEADER", "")
+    monkeypatch.setattr(settings, "ADMISSION_TRUSTED_PROXY_HOPS", 0)
+    await close_admission_controller()
+    yield
+    await close_admission_controller()
+
+
+async def test_client_chosen_values_do_not_reset_limit(admission):
+    await _admit(ChatRequest(message="相談です"), connection(X_User_Id="a"))
+    # ヘッダー・会話ID・メタデータを変えても同じクライアントとして数える
+    for request, conn in [
+        (ChatRequest(message="相談です"), connection(X_User_Id="b")),
+        (ChatRequest(message="相談です", conversation_id=uuid4()), connection()),
+        (ChatRequest(message="相談です", metadata={"user_id": "c"}), connection()),
+        (ChatRequest(message="相談です"), connection(X_Forwarded_For="192.0.2.10")),
+    ]:
+        with pytest.raises(AdmissionRejected):
+            await _admit(request, conn)
+    # 別のクライアントは制限されない
+    await _admit(ChatRequest(message="相談です"), connection("10.0.0.2"))
+
+
+async def test_trusted_proxy_hop_identifies_client(admission, monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_TRUSTED_PROXY_HOPS", 1)
+    proxy = "172.18.0.3"
+    await _admit(ChatRequest(message="相談です"), connection(proxy, X_Forwarded_For="192.0.2.10"))
+    # 同じプロキシを経由する別のブラウザは別の利用者として数える
+    await _admit(ChatRequest(message="相談です"), connection(proxy, X_Forwarded_For="192.0.2.11"))
+    # クライアントが左側に追加した値では別の利用者にならない
+    with pytest.raises(AdmissionRejected):
+        await _admit(ChatRequest(message="相談です"), connection(proxy, X_Forwarded_For="198.51.100.1, 192.0.2.10"))
+
+
+async def test_user_header_only_when_configured(admission, monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_USER_HEADER", "X-Authenticated-User")
+    await _admit(ChatRequest(message="相談です"), connection(X_Authenticated_User="alice"))
+    await _admit(ChatRequest(message="相談です"), connection(X_Authenticated_User="bob"))
+    with pytest.raises(AdmissionRejected):
+        await _admit(ChatRequest(message="相談です"), connection(X_Authenticated_User="alice"))
+
+
+def test_client_address():
+    assert client_address("10.0.0.1", "192.0.2.10") == "10.0.0.1"
+    assert client_address("10.0.0.1", "198.51.100.1, 192.0.2.10, 172.18.0.2", trusted_hops=2) == "192.0.2.10"
+    # 信頼するプロキシの段数より短い場合は最も左の値
+    assert client_address("10.0.0.1", "192.0.2.10", trusted_hops=3) == "192.0.2.10"
+    assert client_address("10.0.0.1", " , ", trusted_hops=1) == "10.0.0.1"
+
+
+# フロントエンドとバックエンドを起動する構成
+COMPOSE_FILE = Path(__file__).resolve().parents[2] / "docker-compose.yml"
+
+
+def compose_admission_settings() -> dict:
+    """docker-compose.yml でバックエンドに渡す受付制御の設定"""
+    values = dict(re.findall(r"^\s*-\s*(ADMISSION_[A-Z_]+)=(\S*)\s*$", COMPOSE_FILE.read_text(), re.MULTILINE))
+    return {
+        name: TypeAdapter(settings.model_fields[name].annotation).validate_python(value)
+        for name, value in values.items()
+    }
+
+
+async def test_compose_proxy_does_not_share_one_bucket(admission, monkeypatch):
+    for name, value in compose_admission_settings().items():
+        monkeypatch.setattr(settings, name, value)
+    await close_admission_controller()
+    # ブラウザからのリクエストはすべてフロントエンドのコンテナから届く
+    proxy = "172.18.0.3"
+    for browser in ["192.0.2.10", "192.0.2.11", "192.0.2.12"]:
+        await _admit(ChatRequest(message="相談です"), connection(proxy, X_Forwarded_For=browser))
@@ -0,0 +1,137 @@
+"""
+マルチエキスパート構成のエージェントグラフ
+"""
+import asyncio
+import time
+from uuid import uuid4
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from app.core.config import settings
+from app.services import agent, checkpoint, llm_registry
+from app.services import pre_router as pre_router_module
+from app.services.agent import AgentState, create_agent_graph, get_checkpointed_messages, process_message
+from app.services.checkpoint.memory import MemoryCheckpointSaver
+from app.services.llm_registry import LLMRegistry
+from app.services.pre_router import PreRouter
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingModel(BaseChatModel):
+    """決まった応答を返し、呼び出された回数を数えるモデル"""
+
+    reply: str
+    calls: int = 0
+    # 応答までの秒数（並行したリクエストを重ねるため）
+    delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        time.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+
+@pytest.fixture
+def models(monkeypatch):
+    models = {
+        "routing-model": RecordingModel(reply='{"it_consultation": false}'),
+        "specialist-model": RecordingModel(reply="Pythonを学びましょう"),
+        "response-model": RecordingModel(reply="回答です"),
+    }
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(settings, "PRE_ROUTER_ENABLED", False)
+    monkeypatch.setattr(settings, "LLM_ROLE_MODELS", {
+        "counselor_routing": "routing-model",
+        "it_specialist": "specialist-model",
+        "response_generation": "response-model",
+    })
+    # マルチエキスパート構成で使わないロール（career_counselor など）のモデル
+    unused = RecordingModel(reply="")
+    registry = LLMRegistry(factory=lambda model, temperature, callbacks=None: models.get(model, unused))
+    monkeypatch.setattr(llm_registry, "_llm_registry", registry)
+    return models
+
+
+async def run(parallel_experts: bool) -> dict:
+    graph = create_agent_graph(multi_expert=True, parallel_experts=parallel_experts)
+    return await graph.ainvoke(AgentState(messages=[HumanMessage(content="転職したいです")]))
+
+
+async def test_sequential_skips_specialist_when_not_needed(models):
+    result = await run(parallel_experts=False)
+    assert models["specialist-model"].calls == 0
+    assert models["response-model"].calls == 1
+    assert result["messages"][-1].content == "回答です"
+    assert result["it_consultation"] is False
+
+
+async def test_sequential_consults_specialist_when_needed(models):
+    models["routing-model"].reply = '{"it_consultation": true}'
+    result = await run(parallel_experts=False)
+    assert models["specialist-model"].calls == 1
+    assert result["it_advice"] == "Pythonを学びましょう"
+    assert result["it_consultation"] is True
+
+
+@pytest.mark.parametrize("it_consultation", [False, True])
+async def test_parallel_runs_specialist_alongside_routing(models, it_consultation):
+    models["routing-model"].reply = f'{{"it_consultation": {str(it_consultation).lower()}}}'
+    result = await run(parallel_experts=True)
+    assert models["routing-model"].calls == 1
+    assert models["specialist-model"].calls == 1
+    assert models["response-model"].calls == 1
+    # 相談が不要と判断した場合は専門家の回答を使わない
+    assert result["it_consultation"] is it_consultation
+
+
+async def test_pre_router_falls_back_to_llm_when_undecided(models, monkeypatch):
+    monkeypatch.setattr(settings, "PRE_ROUTER_ENABLED", True)
+    monkeypatch.setattr(pre_router_module, "_pre_router", PreRouter(threshold=1.01))
+    result = await run(parallel_experts=False)
+    assert models["routing-model"].calls == 1
+    assert result["routing_source"] == "llm"
+
+
+async def test_pre_router_skips_llm_routing_when_decided(models, monkeypatch):
+    monkeypatch.setattr(settings, "PRE_ROUTER_ENABLED", True)
+    monkeypatch.setattr(pre_router_module, "_pre_router", PreRouter(threshold=0.5))
+    graph = create_agent_graph(multi_expert=True, parallel_experts=False)
+    result = await graph.ainvoke(AgentState(messages=[HumanMessage(content="Pythonを勉強したい")]))
+    assert models["routing-model"].calls == 0
+    assert models["specialist-model"].calls == 1
+    assert result["routing_source"] == "keyword"
+
+
+def test_single_expert_graph_does_not_build_pre_router(models, monkeypatch):
+    def fail():
+        raise AssertionError("単一の専門家の構成では分類器を学習しない")
+
+    monkeypatch.setattr(settings, "PRE_ROUTER_ENABLED", True)
+    monkeypatch.setattr(pre_router_module, "get_pre_router", fail)
+    create_agent_graph(multi_expert=False)
+
+
+async def test_checkpointed_turns_are_not_coalesced(models, monkeypatch):
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_ENABLED", True)
+    monkeypatch.setattr(checkpoint, "_checkpointer", MemoryCheckpointSaver())
+    monkeypatch.setattr(checkpoint, "_created", True)
+    monkeypatch.setattr(agent, "_agent_graph", create_agent_graph(multi_expert=True))
+    monkeypatch.setattr(agent, "_thread_graph", None)
+    models["response-model"].delay = 0.1
+    conversation_ids = [uuid4(), uuid4()]
+
+    # 同じ最初の質問でも、会話ごとにグラフを実行して状態を保存する
+    responses = await asyncio.gather(
+        *(process_message("転職したいです", conversation_id) for conversation_id in conversation_ids)
+    )
+    assert [response["message"] for response in responses] == ["回答です", "回答です"]
+    assert models["response-model"].calls == 2
+    for conversation_id in conversation_ids:
+        messages = await get_checkpointed_messages(conversation_id)
+        assert [message.content for message in messages] == ["転職したいです", "回答です"]
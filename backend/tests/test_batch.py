@@ -0,0 +1,87 @@
+"""
+バッチ処理のチェックポイントからの再開
+"""
+import json
+from argparse import Namespace
+import pytest
+from app.schemas.chat import BatchSummary
+from app.services import batch
+from app.services.batch import BatchCheckpoint, run_batch
+
+pytestmark = pytest.mark.anyio
+
+LINES = [
+    json.dumps({"id": "a", "message": "転職したい"}),
+    json.dumps({"id": "b", "message": "失敗する質問"}),
+    "not json",
+    json.dumps({"id": "c", "message": "資格を取りたい"}),
+]
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """process_message の呼び出し。failing に含まれるメッセージはエラーを返す"""
+    calls = {"messages": [], "failing": {"失敗する質問"}}
+
+    async def process_message(message, conversation_id=None, metadata=None):
+        calls["messages"].append(message)
+        if message in calls["failing"]:
+            return {"error": "LLMの呼び出しに失敗しました"}
+        return {"message": f"{message}への回答", "metadata": {}}
+
+    monkeypatch.setattr(batch, "process_message", process_message)
+    return calls
+
+
+async def collect(lines, checkpoint=None):
+    rows = [row async for row in run_batch(lines, concurrency=2, checkpoint=checkpoint)]
+    return rows[:-1], rows[-1]
+
+
+async def test_resume_skips_completed_and_retries_failed(tmp_path, calls):
+    path = str(tmp_path / "job.checkpoint")
+    checkpoint = BatchCheckpoint(path)
+    results, summary = await collect(LINES, checkpoint)
+    checkpoint.close()
+    assert {result.id: bool(result.error) for result in results} == {"a": False, "b": True, "3": True, "c": False}
+    assert (summary.succeeded, summary.failed, summary.invalid, summary.skipped) == (2, 1, 1, 0)
+
+    # 再開すると成功した行は飛ばし、失敗した行だけを再試行する
+    calls["messages"].clear()
+    calls["failing"].clear()
+    checkpoint = BatchCheckpoint(path)
+    assert checkpoint.completed == {"a", "c"}
+    results, summary = await collect(LINES, checkpoint)
+    checkpoint.close()
+    assert calls["messages"] == ["失敗する質問"]
+    assert (summary.succeeded, summary.failed, summary.invalid, summary.skipped) == (1, 0, 1, 2)
+    assert BatchCheckpoint(path).completed == {"a", "b", "c"}
+
+
+async def test_async_lines(calls):
+    async def lines():
+        for line in LINES:
+            yield line
+
+    results, summary = await collect(lines())
+    assert len(results) == 4
+    assert isinstance(summary, BatchSummary)
+    assert summary.total == 4
+
+
+async def test_cli_resume_writes_each_success_once(tmp_path, calls, capsys):
+    requests = tmp_path / "requests.jsonl"
+    requests.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+    output = tmp_path / "results.jsonl"
+    args = Namespace(
+        input=str(requests), output=str(output), checkpoint=str(tmp_path / "job.checkpoint"), concurrency=2
+    )
+
+    await batch._main(args)
+    calls["failing"].clear()
+    await batch._main(args)
+
+    ids = [json.loads(line)["id"] for line in output.read_text(encoding="utf-8").splitlines()]
+    # 失敗した行・不正な行は追記せず、各リクエストの成功した結果が1行ずつ残る
+    assert sorted(ids) == ["a", "b", "c"]
+    assert "LLMの呼び出しに失敗しました" in capsys.readouterr().err
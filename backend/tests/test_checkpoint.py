@@ -0,0 +1,130 @@
+"""
+エージェントのチェックポイントの保存先（差分の保存と古いチェックポイントの削除）
+"""
+import operator
+import time
+from typing import Annotated, List, TypedDict
+import pytest
+from langgraph.graph import END, START, StateGraph
+from app.services.checkpoint.memory import MemoryCheckpointSaver
+from app.services.checkpoint.sqlite import SQLiteCheckpointSaver
+
+pytestmark = pytest.mark.anyio
+
+BACKENDS = ["memory", "sqlite"]
+
+
+class State(TypedDict):
+    messages: Annotated[List[str], operator.add]
+
+
+def build_graph(saver):
+    graph = StateGraph(State)
+    graph.add_node("reply", lambda state: {"messages": [f"回答{len(state['messages'])}"]})
+    graph.add_edge(START, "reply")
+    graph.add_edge("reply", END)
+    return graph.compile(checkpointer=saver)
+
+
+def config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def open_saver(backend: str, path, **options):
+    if backend == "sqlite":
+        return SQLiteCheckpointSaver(str(path / "checkpoints.db"), **options)
+    return MemoryCheckpointSaver(**options)
+
+
+async def reopen(saver, backend: str, path, **options):
+    """保存先から読み出し直す（プロセス内に保持している最新の値を使わない）"""
+    if backend == "sqlite":
+        await saver.close()
+        return open_saver(backend, path, **options)
+    saver._latest.clear()
+    return saver
+
+
+async def run_turns(saver, thread_id: str, turns: int) -> List[str]:
+    graph = build_graph(saver)
+    result = None
+    for turn in range(turns):
+        result = await graph.ainvoke({"messages": [f"質問{turn}"]}, config(thread_id), checkpoint_during=False)
+    return result["messages"]
+
+
+async def saved_messages(saver, thread_id: str) -> List[str]:
+    saved = await saver.aget_tuple(config(thread_id))
+    return saved.checkpoint["channel_values"]["messages"] if saved is not None else None
+
+
+async def message_blobs(saver, thread_id: str):
+    return list((await saver._get_blobs(thread_id, "", ["messages"])).values())
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_messages_are_saved_as_deltas(backend, tmp_path):
+    saver = open_saver(backend, tmp_path, keep=10)
+    messages = await run_turns(saver, "thread", 3)
+    assert messages == ["質問0", "回答1", "質問1", "回答3", "質問2", "回答5"]
+
+    saved = await saver.aget_tuple(config("thread"))
+    blobs = {blob.version: blob for blob in await message_blobs(saver, "thread")}
+    latest = blobs[saved.checkpoint["channel_versions"]["messages"]]
+    assert latest.base_version in blobs
+    assert latest.depth >= 1
+    # 差分には親のチェックポイントから追加したメッセージだけを保存する
+    value = saver.serde.loads_typed(latest.value)
+    assert 0 < len(value) < len(messages)
+    assert value == messages[-len(value):]
+
+    saver = await reopen(saver, backend, tmp_path, keep=10)
+    assert await saved_messages(saver, "thread") == messages
+    await saver.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_delta_chain_is_bounded(backend, tmp_path):
+    saver = open_saver(backend, tmp_path, keep=10, max_delta_chain=1)
+    messages = await run_turns(saver, "thread", 4)
+    blobs = await message_blobs(saver, "thread")
+    assert max(blob.depth for blob in blobs) == 1
+    # 差分が続いたら全体を保存し直す
+    assert sum(blob.base_version is None for blob in blobs) > 1
+
+    saver = await reopen(saver, backend, tmp_path, keep=10, max_delta_chain=1)
+    assert await saved_messages(saver, "thread") == messages
+    await saver.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_keep_prunes_old_checkpoints(backend, tmp_path):
+    saver = open_saver(backend, tmp_path, keep=1)
+    messages = await run_turns(saver, "thread", 3)
+    checkpoints = [saved async for saved in saver.alist(config("thread"))]
+    assert len(checkpoints) == 1
+
+    # 残したチェックポイントが辿る差分の版だけが残る
+    blobs = await message_blobs(saver, "thread")
+    latest = {blob.version: blob for blob in blobs}[checkpoints[0].checkpoint["channel_versions"]["messages"]]
+    assert len(blobs) == latest.depth + 1
+
+    saver = await reopen(saver, backend, tmp_path, keep=1)
+    assert await saved_messages(saver, "thread") == messages
+    await saver.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_ttl_removes_idle_threads(backend, tmp_path, monkeypatch):
+    saver = open_saver(backend, tmp_path, ttl_seconds=60)
+    await run_turns(saver, "idle", 1)
+
+    # 期限が過ぎた後に他の会話を保存すると、次の定期削除で最後の更新が古い会話を削除する
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    saver._last_sweep = float("-inf")
+    await run_turns(saver, "active", 1)
+
+    assert await saved_messages(saver, "idle") is None
+    assert await saved_messages(saver, "active") == ["質問0", "回答1"]
+    await saver.close()
@@ -0,0 +1,118 @@
+"""
+会話一覧のページング（更新日時の新しい順、カーソルで次のページ）
+"""
+from datetime import datetime, timedelta
+from typing import List
+from uuid import UUID, uuid4
+import pytest
+from app.schemas.chat import Conversation, ConversationPage
+from app.services import conversation as conversation_service
+from app.services.conversation import decode_cursor, encode_cursor, get_all_conversation_ids, list_conversations
+from app.services.store.cache import CachedConversationStore, ConversationCache
+from app.services.store.jsonl import JSONLConversationStore
+from app.services.store.memory import InMemoryConversationStore
+from app.services.store.sqlite import SQLiteConversationStore
+
+pytestmark = pytest.mark.anyio
+
+BACKENDS = ["memory", "cached", "sqlite", "jsonl"]
+
+
+def open_store(backend: str, path):
+    if backend == "sqlite":
+        return SQLiteConversationStore(str(path / "conversations.db"))
+    if backend == "jsonl":
+        return JSONLConversationStore(str(path / "jsonl"))
+    if backend == "cached":
+        return CachedConversationStore(ConversationCache(100, 1 << 20))
+    return InMemoryConversationStore()
+
+
+@pytest.fixture(params=BACKENDS)
+async def store(request, tmp_path, monkeypatch):
+    store = open_store(request.param, tmp_path)
+    await store.start()
+    monkeypatch.setattr(conversation_service, "get_conversation_store", lambda: store)
+    yield store
+    await store.close()
+
+
+async def create(store, updated_at: datetime, conversation_id: UUID = None) -> UUID:
+    conversation = Conversation(id=conversation_id or uuid4(), created_at=updated_at, updated_at=updated_at)
+    await store.create_conversation(conversation)
+    return conversation.id
+
+
+def test_cursor_round_trip():
+    cursor = (datetime(2026, 1, 1, 9, 0, 0, 123456), uuid4())
+    encoded = encode_cursor(cursor)
+    # URLにそのまま含められる
+    assert "=" not in encoded and "/" not in encoded and "+" not in encoded
+    assert decode_cursor(encoded) == cursor
+    # マイクロ秒が0でも同じ日時に戻る
+    cursor = (datetime(2026, 1, 1, 9, 0), uuid4())
+    assert decode_cursor(encode_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize("value", ["", "not-a-cursor", "44GC", encode_cursor((datetime(2026, 1, 1), uuid4()))[:-4]])
+def test_decode_invalid_cursor(value):
+    with pytest.raises(ValueError):
+        decode_cursor(value)
+
+
+async def test_pages_newest_first_with_ties(store):
+    started = datetime(2026, 1, 1, 9, 0)
+    # 3件は同じ更新日時（会話IDの順で並ぶ）
+    tied = sorted([uuid4() for _ in range(3)], reverse=True)
+    for conversation_id in tied:
+        await create(store, started + timedelta(minutes=1), conversation_id)
+    older = await create(store, started)
+    newest = await create(store, started + timedelta(minutes=2))
+    await store.flush()
+
+    pages = []
+    cursor = None
+    while True:
+        page = await list_conversations(2, cursor)
+        pages.append([summary.id for summary in page.conversations])
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    # 同じ更新日時の会話がページをまたいでも重複・欠落しない
+    assert pages == [[newest, tied[0]], [tied[1], tied[2]], [older]]
+    assert sorted(await get_all_conversation_ids()) == sorted([newest, *tied, older])
+
+
+async def test_last_full_page_has_no_next_cursor(store):
+    for minute in range(2):
+        await create(store, datetime(2026, 1, 1, 9, minute))
+    await store.flush()
+    page = await list_conversations(2)
+    assert len(page.conversations) == 2
+    assert page.next_cursor is None
+
+
+async def test_updated_range(store):
+    started = datetime(2026, 1, 1, 9, 0)
+    ids = [await create(store, started + timedelta(minutes=minute)) for minute in range(5)]
+    await store.flush()
+    since, until = started + timedelta(minutes=1), started + timedelta(minutes=4)
+    page = await list_conversations(10, updated_since=since, updated_until=until)
+    assert [summary.id for summary in page.conversations] == [ids[3], ids[2], ids[1]]
+
+    # 次のページも同じ条件で取得する
+    first = await list_conversations(2, updated_since=since, updated_until=until)
+    second = await list_conversations(2, first.next_cursor, updated_since=since, updated_until=until)
+    assert [summary.id for summary in second.conversations] == [ids[1]]
+    assert second.next_cursor is None
+
+
+def test_conversation_routes():
+    from app.api.v1.endpoints.chat import router
+
+    response_models = {
+        route.path: route.response_model for route in router.routes if "GET" in getattr(route, "methods", ())
+    }
+    # 全会話IDのリストは従来の形のまま、ページ単位の一覧は別のパスで返す
+    assert response_models["/conversations"] == List[UUID]
+    assert response_models["/conversations/page"] is ConversationPage
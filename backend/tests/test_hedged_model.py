@@ -0,0 +1,150 @@
+"""
+ヘッジ要求を行うチャットモデル
+"""
+import asyncio
+import time
+from typing import List, Optional
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from app.services import concurrency
+from app.services.concurrency import ConcurrencyLimiter
+from app.services.hedged_model import HedgedChatModel
+from app.services.model_tiering import ModelTier, TierStats
+
+pytestmark = pytest.mark.anyio
+
+BUDGET = 0.05
+
+
+class ScriptedModel(BaseChatModel):
+    """最初のトークンまでの時間と失敗を指定できるモデル"""
+
+    text: str
+    ttft: float = 0.0
+    error: Optional[str] = None
+    calls: int = 0
+    cancelled: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        if self.error:
+            raise RuntimeError(self.error)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.text))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.ttft)
+            if self.error:
+                raise RuntimeError(self.error)
+            for token in self.text.split():
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+                await asyncio.sleep(0)
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
+
+
+@pytest.fixture(autouse=True)
+def limiters(monkeypatch):
+    # テストごとに新しいリミッターを使う
+    monkeypatch.setattr(concurrency, "_limiters", {})
+    return concurrency._limiters
+
+
+def hedged(primary: ScriptedModel, fallback: ScriptedModel) -> HedgedChatModel:
+    tier = ModelTier("test", "scripted-primary", "scripted-fallback", BUDGET)
+    return HedgedChatModel(primary=primary, fallback=fallback, tier=tier, stats=TierStats(tier))
+
+
+async def collect(model: HedgedChatModel) -> List[str]:
+    return [chunk.content async for chunk in model.astream([HumanMessage(content="相談です")])]
+
+
+async def test_primary_wins_within_budget():
+    primary, fallback = ScriptedModel(text="主 の 応答"), ScriptedModel(text="予備")
+    model = hedged(primary, fallback)
+    assert await collect(model) == ["主", "の", "応答"]
+    assert fallback.calls == 0
+    assert (model.stats.hedged, model.stats.primary_wins, model.stats.fallback_wins) == (0, 1, 0)
+
+
+async def test_hedge_after_budget_and_loser_cancelled():
+    primary, fallback = ScriptedModel(text="主", ttft=5.0), ScriptedModel(text="予備 の 応答")
+    model = hedged(primary, fallback)
+    started = time.perf_counter()
+    assert await collect(model) == ["予備", "の", "応答"]
+    # 主モデルの応答を待たずに、予算を過ぎたところで予備モデルの応答を返す
+    assert time.perf_counter() - started < 1.0
+    assert (model.stats.hedged, model.stats.fallback_wins) == (1, 1)
+    assert primary.cancelled == 1
+
+
+async def test_primary_wins_after_hedge_and_fallback_cancelled(limiters):
+    primary, fallback = ScriptedModel(text="主", ttft=BUDGET * 3), ScriptedModel(text="予備", ttft=5.0)
+    model = hedged(primary, fallback)
+    assert await collect(model) == ["主"]
+    assert (model.stats.hedged, model.stats.primary_wins) == (1, 1)
+    assert fallback.cancelled == 1
+    # 負けた予備モデルの実行枠は返している
+    assert limiters["scripted-fallback"].running == 0
+
+
+async def test_failover_on_primary_error():
+    primary, fallback = ScriptedModel(text="主", error="接続エラー"), ScriptedModel(text="予備")
+    model = hedged(primary, fallback)
+    started = time.perf_counter()
+    result = await model.ainvoke([HumanMessage(content="相談です")])
+    assert result.content == "予備"
+    # 予算を待たずに切り替える
+    assert time.perf_counter() - started < BUDGET
+    stats = model.stats
+    assert (stats.failovers, stats.hedged, stats.primary_errors, stats.fallback_wins) == (1, 0, 1, 1)
+
+
+async def test_both_fail():
+    primary = ScriptedModel(text="主", error="主モデルのエラー")
+    fallback = ScriptedModel(text="予備", error="予備モデルのエラー")
+    model = hedged(primary, fallback)
+    with pytest.raises(RuntimeError, match="予備モデルのエラー"):
+        await collect(model)
+    stats = model.stats
+    assert (stats.failures, stats.primary_errors, stats.fallback_errors) == (1, 1, 1)
+    assert stats.primary_wins + stats.fallback_wins == 0
+
+
+async def test_hedge_skipped_when_fallback_limiter_full(limiters):
+    limiter = limiters["scripted-fallback"] = ConcurrencyLimiter(max_concurrency=1, max_queue_size=10)
+    await limiter.reserve()
+    primary, fallback = ScriptedModel(text="主", ttft=BUDGET * 3), ScriptedModel(text="予備")
+    model = hedged(primary, fallback)
+    assert await collect(model) == ["主"]
+    assert fallback.calls == 0
+    assert (model.stats.hedged, model.stats.hedges_skipped, model.stats.primary_wins) == (0, 1, 1)
+    limiter.release()
+
+
+async def test_fallback_holds_limiter_until_stream_ends(limiters):
+    primary, fallback = ScriptedModel(text="主", error="接続エラー"), ScriptedModel(text="予備 の 応答")
+    model = hedged(primary, fallback)
+    stream = model.astream([HumanMessage(content="相談です")])
+    assert (await stream.__anext__()).content == "予備"
+    assert limiters["scripted-fallback"].running == 1
+    await stream.aclose()
+    # BaseChatModel.astream は内側の _astream を閉じないため、イベントループが閉じるのを待つ
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert limiters["scripted-fallback"].running == 0
+
+
+def test_sync_invoke_fails_over_without_hedging():
+    primary, fallback = ScriptedModel(text="主", error="接続エラー"), ScriptedModel(text="予備")
+    model = hedged(primary, fallback)
+    assert model.invoke([HumanMessage(content="相談です")]).content == "予備"
+    assert (model.stats.failovers, model.stats.hedged) == (1, 0)
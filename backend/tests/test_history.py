@@ -0,0 +1,112 @@
+"""
+トークン数の予算に収めた会話履歴
+"""
+import sys
+from datetime import datetime, timedelta
+from uuid import uuid4
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from app.core.config import settings
+from app.schemas.chat import Conversation
+from app.services import history
+from app.services.history import TokenCounter, build_history
+from app.services.store.memory import InMemoryConversationStore
+from app.services.store.message_log import MessageRecord
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingWorker:
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, conversation_id):
+        self.scheduled.append(conversation_id)
+        return True
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    # tiktoken を使わない概算（日本語は1文字1トークン）で数える
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    monkeypatch.setattr(history, "_token_counter", TokenCounter("gpt-4o"))
+    monkeypatch.setattr(settings, "HISTORY_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(settings, "HISTORY_MAX_MESSAGES", 50)
+    worker = RecordingWorker()
+    monkeypatch.setattr(history, "get_summary_worker", lambda: worker)
+    return worker
+
+
+async def conversation_with(contents):
+    store = InMemoryConversationStore()
+    conversation = Conversation(id=uuid4())
+    await store.create_conversation(conversation)
+    started = datetime(2026, 1, 1, 9, 0)
+    records = []
+    for index, content in enumerate(contents):
+        role = "user" if index % 2 == 0 else "assistant"
+        record = MessageRecord(role, content, timestamp=started + timedelta(seconds=index))
+        await store.append_message(conversation.id, record)
+        records.append(record)
+    return store, conversation.id, records
+
+
+def test_token_counter_estimate_and_cache(monkeypatch):
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    counter = TokenCounter("gpt-4o")
+    assert counter.count_text("転職したい") == 5
+    assert counter.count_text("abcdefgh") == 2
+    record = MessageRecord("user", "転職したい")
+    assert counter.count(record) == 5 + history.MESSAGE_OVERHEAD_TOKENS
+    # 同じメッセージIDは数え直さない
+    record.content = "転職"
+    assert counter.count(record) == 5 + history.MESSAGE_OVERHEAD_TOKENS
+
+
+async def test_token_counter_loads_off_event_loop(monkeypatch):
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    monkeypatch.setattr(history, "_token_counter", None)
+    monkeypatch.setattr(history, "_token_counter_load", None)
+    history.start_token_counter_load()
+    assert not history.is_token_counter_ready()
+    counter = await history.load_token_counter()
+    assert history.is_token_counter_ready()
+    assert history.get_token_counter() is counter
+
+
+async def test_keeps_newest_messages_within_budget(worker):
+    # 各メッセージは 10 + 4 = 14 トークン
+    store, conversation_id, records = await conversation_with(["あ" * 10] * 5)
+    result = await build_history(store, conversation_id, token_budget=30)
+    assert len(result.messages) == 2
+    assert [message.content for message in result.messages] == [records[3].content, records[4].content]
+    assert isinstance(result.messages[0], AIMessage) and isinstance(result.messages[1], HumanMessage)
+    assert (result.token_count, result.dropped_count) == (28, 3)
+    # あふれたメッセージは要約に畳み込むよう依頼する
+    assert worker.scheduled == [conversation_id]
+
+
+async def test_all_messages_fit(worker):
+    store, conversation_id, records = await conversation_with(["こんにちは", "どうしましたか"])
+    result = await build_history(store, conversation_id, token_budget=1000)
+    assert [message.content for message in result.messages] == ["こんにちは", "どうしましたか"]
+    assert result.dropped_count == 0
+    assert worker.scheduled == []
+
+
+async def test_excludes_current_message_and_caps_count(worker, monkeypatch):
+    monkeypatch.setattr(settings, "HISTORY_MAX_MESSAGES", 2)
+    store, conversation_id, records = await conversation_with(["一", "二", "三", "四"])
+    result = await build_history(store, conversation_id, exclude_message_id=records[-1].id, token_budget=1000)
+    assert [message.content for message in result.messages] == ["二", "三"]
+
+
+async def test_summary_replaces_summarized_messages(worker):
+    store, conversation_id, records = await conversation_with(["一", "二", "三", "四"])
+    await store.update_summary(conversation_id, "要約", records[1].id)
+    result = await build_history(store, conversation_id, token_budget=1000)
+    assert isinstance(result.messages[0], SystemMessage)
+    assert "要約" in result.messages[0].content
+    assert [message.content for message in result.messages[1:]] == ["三", "四"]
+    # 要約のトークン数も予算に含める
+    assert result.token_count == 2 + 2 * (1 + history.MESSAGE_OVERHEAD_TOKENS)
@@ -0,0 +1,43 @@
+"""
+ローカル分類器による相談の要否の判断
+"""
+from app.services.pre_router import PreRouter
+
+EXAMPLES = [
+    ("プログラミングを学んで転職したい", True),
+    ("エンジニアになるには何を勉強すればいいですか", True),
+    ("上司との人間関係に悩んでいます", False),
+    ("面接で話す自己PRを考えたい", False),
+]
+
+
+def test_keyword_decides_when_only_one_side_matches():
+    router = PreRouter(examples=EXAMPLES)
+    assert router.decide("Pythonを勉強したい").it_consultation is True
+    assert router.decide("上司と合わない").it_consultation is False
+    assert router.stats.keyword == 2
+
+
+def test_model_decides_when_confident():
+    # 閾値0.5では確率によらず線形モデルで決まる
+    router = PreRouter(threshold=0.5, examples=EXAMPLES)
+    decision = router.decide("将来について相談したい")
+    assert decision.source == "model"
+    assert decision.it_consultation is not None
+    assert router.stats.model == 1
+
+
+def test_falls_back_to_llm_below_threshold():
+    router = PreRouter(threshold=1.01, examples=EXAMPLES)
+    decision = router.decide("将来について相談したい")
+    assert decision.it_consultation is None
+    assert decision.source == "undecided"
+    assert decision.confidence < router.threshold
+    assert router.stats.undecided == 1
+
+
+def test_both_keywords_use_model():
+    # 両方のキーワードを含む場合はキーワード表では決めない
+    router = PreRouter(threshold=1.01, examples=EXAMPLES)
+    assert router.decide("エンジニアの面接対策").it_consultation is None
+    assert router.stats.keyword == 0
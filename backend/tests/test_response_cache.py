@@ -0,0 +1,63 @@
+"""
+LLM応答キャッシュ
+"""
+import pytest
+from app.services.response_cache import (
+    MemoryResponseCacheBackend, ResponseCache, SQLiteResponseCacheBackend, make_cache_key, normalize_prompt,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  転職したい　です。 ") == "転職したい です"
+    assert normalize_prompt("ＰＹＴＨＯＮを学ぶべき？？") == "pythonを学ぶべき"
+    assert make_cache_key("転職したい。", "career_counselor", "gpt-4o", 0.71) == make_cache_key(
+        "転職したい", "career_counselor", "gpt-4o", 0.7
+    )
+    # ロール・モデルが違えば別のキー
+    assert make_cache_key("転職したい", "career_counselor", "gpt-4o", 0.7) != make_cache_key(
+        "転職したい", "it_specialist", "gpt-4o", 0.7
+    )
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+async def backend_factory(request, tmp_path):
+    backends = []
+
+    def create(max_entries: int = 100, ttl_seconds: float = 60.0):
+        if request.param == "sqlite":
+            backend = SQLiteResponseCacheBackend(str(tmp_path / "cache.db"), max_entries, ttl_seconds)
+        else:
+            backend = MemoryResponseCacheBackend(max_entries, ttl_seconds)
+        backends.append(backend)
+        return backend
+
+    yield create
+    for backend in backends:
+        await backend.close()
+
+
+async def test_lookup_and_stats(backend_factory):
+    cache = ResponseCache(backend_factory())
+    assert await cache.lookup("転職したい", "career_counselor", "gpt-4o", 0.7) is None
+    await cache.store("転職したい", "career_counselor", "gpt-4o", 0.7, "応答", latency=2.0)
+    assert await cache.lookup("転職したい！", "career_counselor", "gpt-4o", 0.7) == "応答"
+    assert await cache.lookup("転職したい", "it_specialist", "gpt-4o", 0.7) is None
+    stats = cache.stats
+    assert (stats.hits, stats.misses, stats.stores) == (1, 2, 1)
+    assert stats.estimated_saved_seconds == 2.0
+
+
+async def test_ttl(backend_factory):
+    backend = backend_factory(ttl_seconds=-1)
+    await backend.set("key", "value")
+    assert await backend.get("key") is None
+
+
+async def test_max_entries(backend_factory):
+    backend = backend_factory(max_entries=2)
+    for key in ("a", "b", "c"):
+        await backend.set(key, key)
+    assert await backend.get("a") is None
+    assert [await backend.get(key) for key in ("b", "c")] == ["b", "c"]
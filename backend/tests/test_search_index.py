@@ -0,0 +1,118 @@
+"""
+全文検索の転置インデックス（BM25の順位・絞り込み・1文字のクエリ）
+"""
+from datetime import datetime, timedelta
+from uuid import uuid4
+import numpy as np
+from app.services.search.index import BLOCK_SIZE, InvertedIndex
+from app.services.search.tokenizer import tokenize
+
+STARTED = datetime(2026, 1, 1, 9, 0)
+
+
+def build(messages):
+    """(本文, ロール, 分) のメッセージを1つの会話に登録し、インデックスと本文 → メッセージIDを返す"""
+    index = InvertedIndex()
+    conversation_id = uuid4()
+    ids = {}
+    for content, role, minute in messages:
+        ids[content] = uuid4()
+        index.add(conversation_id, ids[content], role, STARTED + timedelta(minutes=minute), content)
+    return index, ids
+
+
+def contents(ids, matches):
+    by_id = {message_id: content for content, message_id in ids.items()}
+    return [by_id[match.message_id] for match in matches]
+
+
+def test_tokenize():
+    assert tokenize("Pythonで転職したい") == ["python", "で転", "転職", "職し", "した", "たい"]
+    assert tokenize("ＰＹＴＨＯＮ 猫") == ["python", "猫"]
+
+
+def test_bm25_orders_by_frequency_and_length():
+    index, ids = build([
+        ("転職の相談です。転職の時期と転職先について", "user", 0),
+        ("転職を考えています", "user", 1),
+        ("長い文章の中で一度だけ転職という言葉が出てくるメッセージです", "user", 2),
+        ("資格の勉強をしています", "user", 3),
+    ])
+    total, matches = index.search("転職", 10)
+    assert total == 3
+    assert contents(ids, matches) == [
+        "転職の相談です。転職の時期と転職先について",
+        "転職を考えています",
+        "長い文章の中で一度だけ転職という言葉が出てくるメッセージです",
+    ]
+    assert matches[0].score > matches[1].score > matches[2].score
+
+
+def test_all_tokens_must_match():
+    index, ids = build([
+        ("Pythonで転職したい", "user", 0),
+        ("Javaで転職したい", "user", 1),
+        ("Pythonを勉強中", "user", 2),
+    ])
+    total, matches = index.search("転職 python", 10)
+    assert (total, contents(ids, matches)) == (1, ["Pythonで転職したい"])
+    assert index.search("転職 ruby", 10) == (0, [])
+
+
+def test_since_until_and_role_filters():
+    index, ids = build([
+        ("転職の相談1", "user", 0),
+        ("転職の回答1", "assistant", 1),
+        ("転職の相談2", "user", 2),
+        ("転職の回答2", "assistant", 3),
+    ])
+    _, matches = index.search("転職", 10, since=STARTED + timedelta(minutes=1), until=STARTED + timedelta(minutes=3))
+    assert sorted(contents(ids, matches)) == ["転職の回答1", "転職の相談2"]
+    _, matches = index.search("転職", 10, role="assistant")
+    assert sorted(contents(ids, matches)) == ["転職の回答1", "転職の回答2"]
+    assert index.search("転職", 10, role="system") == (0, [])
+
+
+def test_single_cjk_character_query():
+    index, ids = build([
+        ("猫", "user", 0),
+        ("猫を飼いたい", "user", 1),
+        ("子猫", "user", 2),
+        ("犬を飼いたい", "user", 3),
+    ])
+    total, matches = index.search("猫", 10)
+    assert total == 3
+    assert sorted(contents(ids, matches)) == ["子猫", "猫", "猫を飼いたい"]
+    # 1つのトークンにしか含まれない文字
+    total, matches = index.search("犬", 10)
+    assert (total, contents(ids, matches)) == (1, ["犬を飼いたい"])
+    assert index.search("鳥", 10) == (0, [])
+
+
+def test_single_character_counts_each_document_once():
+    # 同じ文字を含む複数のトークンに現れても、文書は1回だけ数える
+    index, ids = build([("猫猫猫", "user", 0), ("猫", "user", 1)])
+    total, matches = index.search("猫", 10)
+    assert total == 2
+    assert contents(ids, matches)[0] == "猫猫猫"
+
+
+def test_compressed_blocks_and_group_by_conversation():
+    index = InvertedIndex()
+    conversations = [uuid4() for _ in range(3)]
+    count = BLOCK_SIZE * 3 + 5
+    for number in range(count):
+        content = "転職の相談" if number % 2 == 0 else "資格の相談"
+        index.add(conversations[number % 3], uuid4(), "user", STARTED + timedelta(seconds=number), content)
+    assert index.document_count == count
+    total, matches = index.search("転職 相談", 5)
+    assert total == len(range(0, count, 2))
+    assert len(matches) == 5
+    # 同点は新しい順
+    timestamps = [match.timestamp for match in matches]
+    assert timestamps == sorted(timestamps, reverse=True)
+
+    total, matches = index.search("相談", 10, group_by_conversation=True)
+    assert total == 3
+    assert sorted(match.conversation_id for match in matches) == sorted(conversations)
+    assert np.isfinite([match.score for match in matches]).all()
@@ -0,0 +1,61 @@
+"""
+セマンティック応答キャッシュ
+"""
+import numpy as np
+import pytest
+from app.services.semantic_cache import HashingEmbedder, SemanticCache, VectorIndex
+
+pytestmark = pytest.mark.anyio
+
+ROLE, MODEL = "career_counselor", "gpt-4o"
+
+
+def create_cache(capacity: int = 16, threshold: float = 0.8, ttl_seconds=None, path=None) -> SemanticCache:
+    embedder = HashingEmbedder(dim=256)
+    return SemanticCache(embedder, VectorIndex(embedder.dim, capacity, path), threshold, ttl_seconds)
+
+
+def test_hashing_embedder_is_normalized():
+    vectors = np.stack([HashingEmbedder(dim=256).embed_one(text) for text in ("転職したい", "転職したいです。")])
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert vectors[0] @ vectors[1] > 0.8
+
+
+async def test_similar_question_hits_within_scope():
+    cache = create_cache()
+    await cache.insert("エンジニアに転職したいです", ROLE, MODEL, "回答")
+    answer, score = await cache.lookup("エンジニアに転職したい", ROLE, MODEL)
+    assert answer == "回答" and score >= 0.8
+    # 別の質問・別のロールやモデルではヒットしない
+    assert await cache.lookup("年収の交渉の仕方を教えて", ROLE, MODEL) is None
+    assert await cache.lookup("エンジニアに転職したい", "it_specialist", MODEL) is None
+    assert await cache.lookup("エンジニアに転職したい", ROLE, "gpt-4o-mini") is None
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.inserts) == (1, 3, 1)
+
+
+async def test_ttl_skips_and_evicts_expired():
+    cache = create_cache(ttl_seconds=60)
+    await cache.insert("エンジニアに転職したいです", ROLE, MODEL, "古い回答")
+    cache.index.inserted_at[0] -= 120
+    assert await cache.lookup("エンジニアに転職したいです", ROLE, MODEL) is None
+    await cache.insert("年収の交渉の仕方", ROLE, MODEL, "回答")
+    assert cache.stats.expirations == 1
+    assert len(cache.index) == 1
+
+
+async def test_full_index_overwrites_least_recently_used():
+    cache = create_cache(capacity=2)
+    await cache.insert("エンジニアに転職したいです", ROLE, MODEL, "転職")
+    await cache.insert("年収の交渉の仕方を教えて", ROLE, MODEL, "年収")
+    cache.index.last_used[:] = [2.0, 1.0]
+    await cache.insert("資格の勉強の進め方", ROLE, MODEL, "資格")
+    assert sorted(cache.index.answers) == ["資格", "転職"]
+
+
+async def test_persisted_index_is_reloaded(tmp_path):
+    path = str(tmp_path / "semantic")
+    cache = create_cache(path=path)
+    await cache.insert("エンジニアに転職したいです", ROLE, MODEL, "回答")
+    await cache.close()
+    reloaded = create_cache(path=path)
+    assert (await reloaded.lookup("エンジニアに転職したいです", ROLE, MODEL))[0] == "回答"
@@ -0,0 +1,122 @@
+"""
+single-flight のキャンセルとエラーの扱い
+"""
+import asyncio
+import pytest
+from app.services.single_flight import SingleFlight, SingleFlightCancelled
+
+pytestmark = pytest.mark.anyio
+
+
+class Upstream:
+    """トークンを返す上流の処理。キャンセルされたかどうかと、後始末にかかる時間を指定できる"""
+
+    def __init__(self, tokens=("a", "b", "c"), interval=0.01, cleanup=0.0, error_after=None):
+        self.tokens = tokens
+        self.interval = interval
+        self.cleanup = cleanup
+        self.error_after = error_after
+        self.started = 0
+        self.cancelled = 0
+
+    async def stream(self):
+        self.started += 1
+        try:
+            for index, token in enumerate(self.tokens):
+                if self.error_after is not None and index == self.error_after:
+                    raise RuntimeError("upstream failed")
+                await asyncio.sleep(self.interval)
+                yield token
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            # 接続の後始末など、キャンセルの完了に時間がかかる場合
+            await asyncio.shield(asyncio.sleep(self.cleanup))
+            raise
+
+    async def call(self):
+        return "".join([token async for token in self.stream()])
+
+
+async def collect(tokens):
+    return [token async for token in tokens]
+
+
+async def test_last_subscriber_leaving_cancels_upstream():
+    flight = SingleFlight()
+    upstream = Upstream(interval=0.05)
+    tokens = flight.stream("key", upstream.stream)
+    assert await tokens.__anext__() == "a"
+    await tokens.aclose()
+    await asyncio.sleep(0.01)
+    assert upstream.cancelled == 1
+    assert flight.snapshot().in_flight == 0
+
+
+async def test_subscriber_leaving_keeps_upstream_for_others():
+    flight = SingleFlight()
+    upstream = Upstream(interval=0.02)
+    first = flight.stream("key", upstream.stream)
+    second = asyncio.create_task(collect(flight.stream("key", upstream.stream)))
+    assert await first.__anext__() == "a"
+    await first.aclose()
+    assert await second == ["a", "b", "c"]
+    assert upstream.started == 1
+    assert upstream.cancelled == 0
+
+
+async def test_joiner_during_cancellation_starts_new_upstream():
+    flight = SingleFlight()
+    # キャンセルの完了まで時間がかかる上流
+    upstream = Upstream(interval=0.05, cleanup=0.1)
+    tokens = flight.stream("key", upstream.stream)
+    assert await tokens.__anext__() == "a"
+    await tokens.aclose()
+    # 上流のキャンセルが完了する前に同じキーで合流しようとしても、キャンセル中の配信には合流しない
+    assert await collect(flight.stream("key", upstream.stream)) == ["a", "b", "c"]
+    assert upstream.started == 2
+    assert flight.stats.leaders == 2
+    assert flight.stats.coalesced == 0
+
+
+async def test_joiner_during_cancellation_of_call_starts_new_call():
+    flight = SingleFlight()
+    upstream = Upstream(interval=0.05, cleanup=0.1)
+    first = asyncio.create_task(flight.do("key", upstream.call))
+    await asyncio.sleep(0.02)
+    first.cancel()
+    await asyncio.sleep(0)
+    assert await flight.do("key", upstream.call) == "abc"
+    assert first.cancelled()
+    assert upstream.started == 2
+
+
+async def test_cancelled_upstream_raises_to_subscribers():
+    flight = SingleFlight()
+    upstream = Upstream(interval=0.05)
+    subscribers = [asyncio.create_task(collect(flight.stream("key", upstream.stream))) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    # 購読者がいるうちに上流が外部からキャンセルされた場合（シャットダウンなど）
+    flight._broadcasts["key"].task.cancel()
+    results = await asyncio.gather(*subscribers, return_exceptions=True)
+    assert all(isinstance(result, SingleFlightCancelled) for result in results)
+
+
+async def test_upstream_error_reaches_all_subscribers():
+    flight = SingleFlight()
+    upstream = Upstream(error_after=1)
+    subscribers = [asyncio.create_task(collect(flight.stream("key", upstream.stream))) for _ in range(3)]
+    results = await asyncio.gather(*subscribers, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert upstream.started == 1
+    assert flight.stats.errors == 1
+    # 失敗した配信は残らず、次の呼び出しは新しく実行する
+    assert flight.snapshot().in_flight == 0
+
+
+async def test_call_error_reaches_all_waiters():
+    flight = SingleFlight()
+    upstream = Upstream(error_after=1)
+    waiters = [asyncio.create_task(flight.do("key", upstream.call)) for _ in range(3)]
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert upstream.started == 1
@@ -0,0 +1,137 @@
+"""
+会話ストア（memory / キャッシュ / sqlite / jsonl）の保存と読み出し
+"""
+import os
+from datetime import datetime, timedelta
+from uuid import uuid4
+import pytest
+from app.schemas.chat import Conversation
+from app.services.store.cache import CachedConversationStore, ConversationCache
+from app.services.store.jsonl import JSONLConversationStore
+from app.services.store.memory import InMemoryConversationStore
+from app.services.store.message_log import MessageRecord
+from app.services.store.sqlite import SQLiteConversationStore
+
+pytestmark = pytest.mark.anyio
+
+BACKENDS = ["memory", "cached", "sqlite", "jsonl"]
+
+
+def open_store(backend: str, path):
+    if backend == "sqlite":
+        return SQLiteConversationStore(str(path / "conversations.db"))
+    if backend == "jsonl":
+        # 小さいセグメントにして、セグメントの切り替えをまたいで読み出す
+        return JSONLConversationStore(str(path / "jsonl"), segment_max_bytes=512)
+    if backend == "cached":
+        return CachedConversationStore(ConversationCache(100, 1 << 20))
+    return InMemoryConversationStore()
+
+
+@pytest.fixture(params=BACKENDS)
+async def store(request, tmp_path):
+    store = open_store(request.param, tmp_path)
+    await store.start()
+    yield store
+    await store.close()
+
+
+def messages(count: int):
+    started = datetime(2026, 1, 1, 9, 0)
+    return [
+        MessageRecord(
+            "user" if index % 2 == 0 else "assistant", f"メッセージ{index}", timestamp=started + timedelta(seconds=index)
+        )
+        for index in range(count)
+    ]
+
+
+async def test_round_trip(store):
+    conversation = Conversation(id=uuid4(), metadata={"title": "転職の相談"})
+    await store.create_conversation(conversation)
+    records = messages(4)
+    for record in records:
+        await store.append_message(conversation.id, record)
+
+    assert await store.has_conversation(conversation.id)
+    assert not await store.has_conversation(uuid4())
+    loaded = await store.get_conversation(conversation.id)
+    assert loaded.metadata == {"title": "転職の相談"}
+    assert [(message.id, message.role, message.content) for message in loaded.messages] == [
+        (record.id, record.role, record.content) for record in records
+    ]
+    assert [record.content for record in await store.get_recent_messages(conversation.id, 2)] == ["メッセージ2", "メッセージ3"]
+    assert await store.list_conversation_ids() == [conversation.id]
+    assert await store.get_conversation(uuid4()) is None
+
+
+async def test_append_creates_conversation(store):
+    conversation_id = uuid4()
+    await store.append_message(conversation_id, MessageRecord("user", "こんにちは"))
+    assert [message.content for message in (await store.get_conversation(conversation_id)).messages] == ["こんにちは"]
+
+
+async def test_summary(store):
+    conversation = Conversation(id=uuid4())
+    await store.create_conversation(conversation)
+    records = messages(2)
+    for record in records:
+        await store.append_message(conversation.id, record)
+    assert await store.get_summary(conversation.id) == (None, None)
+    await store.update_summary(conversation.id, "要約", records[0].id)
+    assert await store.get_summary(conversation.id) == ("要約", records[0].id)
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "jsonl"])
+async def test_persists_across_reopen(backend, tmp_path):
+    store = open_store(backend, tmp_path)
+    await store.start()
+    conversation = Conversation(id=uuid4(), metadata={"title": "昇進"})
+    await store.create_conversation(conversation)
+    records = messages(10)
+    for record in records:
+        await store.append_message(conversation.id, record)
+        # 書き込みのたびに反映し、JSONLのセグメントを切り替えさせる
+        await store.flush()
+    await store.update_summary(conversation.id, "要約", records[3].id)
+    await store.close()
+    if backend == "jsonl":
+        assert len(os.listdir(tmp_path / "jsonl")) > 1
+
+    reopened = open_store(backend, tmp_path)
+    await reopened.start()
+    try:
+        loaded = await reopened.get_conversation(conversation.id)
+        assert loaded.metadata == {"title": "昇進"}
+        assert [message.id for message in loaded.messages] == [record.id for record in records]
+        assert [message.timestamp for message in loaded.messages] == [record.timestamp for record in records]
+        assert await reopened.get_summary(conversation.id) == ("要約", records[3].id)
+    finally:
+        await reopened.close()
+
+
+async def test_get_messages_cursors(store):
+    conversation = Conversation(id=uuid4())
+    await store.create_conversation(conversation)
+    records = messages(6)
+    for record in records:
+        await store.append_message(conversation.id, record)
+    ids = [record.id for record in records]
+
+    async def contents(**kwargs):
+        return [record.id for record in await store.get_messages(conversation.id, **kwargs)]
+
+    assert await contents() == ids
+    assert await contents(limit=2) == ids[:2]
+    assert await contents(after=ids[1]) == ids[2:]
+    assert await contents(after=ids[1], limit=2) == ids[2:4]
+    assert await contents(after=ids[-1]) == []
+    # before のみの場合は直前から遡って limit 件
+    assert await contents(before=ids[4]) == ids[:4]
+    assert await contents(before=ids[4], limit=2) == ids[2:4]
+    assert await contents(after=ids[0], before=ids[4]) == ids[1:4]
+    assert await contents(after=ids[0], before=ids[4], limit=2) == ids[1:3]
+    # 見つからないカーソルや会話は空
+    assert await contents(after=uuid4()) == []
+    assert await contents(before=uuid4()) == []
+    assert await store.get_messages(uuid4()) == []
@@ -0,0 +1,110 @@
+"""
+会話キャッシュ（LRU/TTLの追い出し、write-back、共有ストアの変更の検知）
+"""
+from datetime import datetime, timedelta
+from uuid import uuid4
+import pytest
+from app.schemas.chat import Conversation
+from app.services.store.cache import CachedConversationStore, ConversationCache
+from app.services.store.memory import InMemoryConversationStore
+from app.services.store.message_log import MessageRecord
+
+pytestmark = pytest.mark.anyio
+
+
+class VersionedStore(InMemoryConversationStore):
+    """メッセージ数と要約の位置で変更を検知できるストア"""
+
+    async def get_version(self, conversation_id):
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            return None
+        return len(self._logs[conversation_id]), conversation.summary_until
+
+
+async def test_unversioned_backend_is_always_reloaded():
+    backend = InMemoryConversationStore()
+    store = CachedConversationStore(ConversationCache(100, 1 << 20), backend, validate=True)
+    conversation = Conversation(id=uuid4(), metadata={"title": "古い"})
+    await store.create_conversation(conversation)
+    # 他のプロセスによる変更を模して、キャッシュを通さずにストアを更新する
+    backend.conversations[conversation.id].metadata = {"title": "新しい"}
+    assert await backend.get_version(conversation.id) is None
+    assert (await store.get_conversation(conversation.id)).metadata == {"title": "新しい"}
+
+
+async def test_versioned_backend_uses_cache_until_changed():
+    backend = VersionedStore()
+    store = CachedConversationStore(ConversationCache(100, 1 << 20), backend, validate=True)
+    conversation = Conversation(id=uuid4(), metadata={"title": "古い"})
+    await store.create_conversation(conversation)
+    backend.conversations[conversation.id].metadata = {"title": "新しい"}
+    # メッセージ数・要約の位置が変わらなければキャッシュの内容を使う
+    assert (await store.get_conversation(conversation.id)).metadata == {"title": "古い"}
+    await backend.append_message(conversation.id, MessageRecord("user", "こんにちは"))
+    reloaded = await store.get_conversation(conversation.id)
+    assert reloaded.metadata == {"title": "新しい"}
+    assert [message.content for message in reloaded.messages] == ["こんにちは"]
+
+
+async def test_lru_eviction_by_entries():
+    store = CachedConversationStore(ConversationCache(max_entries=2, max_bytes=1 << 20))
+    first, second, third = (Conversation(id=uuid4()) for _ in range(3))
+    await store.create_conversation(first)
+    await store.create_conversation(second)
+    # 最初の会話を使うと、最も古く使われたのは2番目の会話になる
+    assert await store.get_conversation(first.id) is not None
+    await store.create_conversation(third)
+    assert set(store.cache.keys()) == {first.id, third.id}
+    assert await store.get_conversation(second.id) is None
+    assert store.cache.snapshot().evictions == 1
+
+
+async def test_eviction_by_bytes():
+    store = CachedConversationStore(ConversationCache(max_entries=100, max_bytes=4000))
+    conversation = Conversation(id=uuid4())
+    await store.create_conversation(conversation)
+    await store.append_message(conversation.id, MessageRecord("user", "長いメッセージ" * 200))
+    await store.create_conversation(Conversation(id=uuid4()))
+    assert conversation.id not in store.cache
+    assert store.cache.snapshot().bytes <= 4000
+
+
+async def test_ttl_expiration():
+    store = CachedConversationStore(ConversationCache(max_entries=100, max_bytes=1 << 20, ttl_seconds=60))
+    stale = Conversation(id=uuid4(), updated_at=datetime.now() - timedelta(minutes=5))
+    fresh = Conversation(id=uuid4())
+    await store.create_conversation(stale)
+    await store.create_conversation(fresh)
+    assert await store.get_conversation(stale.id) is None
+    assert not await store.has_conversation(stale.id)
+    assert await store.get_conversation(fresh.id) is not None
+    assert [info.id for info in await store.list_conversations(10)] == [fresh.id]
+    assert store.cache.snapshot().expirations == 1
+
+
+async def test_write_back_flush():
+    backend = InMemoryConversationStore()
+    store = CachedConversationStore(ConversationCache(100, 1 << 20), backend, write_back=True)
+    conversation = Conversation(id=uuid4())
+    await store.create_conversation(conversation)
+    await store.append_message(conversation.id, MessageRecord("user", "こんにちは"))
+    # flush するまではストアに書き込まない
+    assert not await backend.has_conversation(conversation.id)
+    await store.flush()
+    assert [message.content for message in (await backend.get_conversation(conversation.id)).messages] == ["こんにちは"]
+    await store.append_message(conversation.id, MessageRecord("assistant", "どうしましたか"))
+    await store.flush()
+    assert len(await backend.get_messages(conversation.id)) == 2
+
+
+async def test_write_back_persists_evicted():
+    backend = InMemoryConversationStore()
+    store = CachedConversationStore(ConversationCache(max_entries=1, max_bytes=1 << 20), backend, write_back=True)
+    evicted = Conversation(id=uuid4())
+    await store.create_conversation(evicted)
+    await store.append_message(evicted.id, MessageRecord("user", "こんにちは"))
+    await store.create_conversation(Conversation(id=uuid4()))
+    assert evicted.id not in store.cache
+    # 追い出した会話の未書き込みの変更はストアに書き込み、キャッシュに無くても読み出せる
+    assert [message.content for message in await store.get_messages(evicted.id)] == ["こんにちは"]
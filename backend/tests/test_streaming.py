@@ -0,0 +1,32 @@
+"""
+リクエストの本文の行への分割
+"""
+import pytest
+from app.services.streaming import iter_lines
+
+pytestmark = pytest.mark.anyio
+
+
+async def chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+async def collect(parts):
+    return [line async for line in iter_lines(chunks(*parts))]
+
+
+async def test_lines_split_across_chunks():
+    data = '{"message": "転職"}\r\n{"message": "昇進"}\n最後の行'.encode("utf-8")
+    # マルチバイト文字の途中を含め、1バイトずつ届いた場合も同じ行に分ける
+    expected = ['{"message": "転職"}', '{"message": "昇進"}', "最後の行"]
+    assert await collect([data]) == expected
+    assert await collect([data[i:i + 1] for i in range(len(data))]) == expected
+
+
+async def test_invalid_utf8_is_replaced():
+    assert await collect([b"ok\n\xff\xfe\n"]) == ["ok", "��"]
+
+
+async def test_trailing_newline_does_not_add_empty_line():
+    assert await collect([b"a\n", b"b\n"]) == ["a", "b"]
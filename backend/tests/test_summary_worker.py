@@ -0,0 +1,85 @@
+"""
+会話要約のバックグラウンド処理
+"""
+from datetime import datetime, timedelta
+from uuid import uuid4
+import pytest
+from app.core.config import settings
+from app.schemas.chat import Conversation
+from app.services import summarizer
+from app.services.store.memory import InMemoryConversationStore
+from app.services.store.message_log import MessageRecord
+from app.services.summarizer import ConversationSummarizer
+from app.services.summary_worker import SummaryWorkerPool
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def extractive_summarizer(monkeypatch):
+    # LLMを使わず、各メッセージの冒頭を並べる要約にする
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "")
+    monkeypatch.setattr(summarizer, "_summarizer", None)
+
+
+async def conversation_with(store, count: int):
+    conversation = Conversation(id=uuid4())
+    await store.create_conversation(conversation)
+    started = datetime(2026, 1, 1, 9, 0)
+    records = [
+        MessageRecord(
+            "user" if index % 2 == 0 else "assistant", f"メッセージ{index}", timestamp=started + timedelta(seconds=index)
+        )
+        for index in range(count)
+    ]
+    for record in records:
+        await store.append_message(conversation.id, record)
+    return conversation.id, records
+
+
+async def test_fold_appends_to_existing_summary():
+    folder = ConversationSummarizer(max_chars=2000)
+    assert await folder.fold("前の要約", []) == "前の要約"
+    messages = [MessageRecord("user", "転職したい"), MessageRecord("assistant", "理由は？")]
+    summary = await folder.fold("前の要約", messages)
+    assert summary == "前の要約\nユーザー: 転職したい\nカウンセラー: 理由は？"
+    # 上限を超えた場合は古い側から削る
+    trimmed = await ConversationSummarizer(max_chars=11).fold("前の要約", [MessageRecord("user", "転職したい")])
+    assert trimmed == "ユーザー: 転職したい"
+
+
+async def test_summarize_folds_all_but_recent():
+    store = InMemoryConversationStore()
+    conversation_id, records = await conversation_with(store, 6)
+    pool = SummaryWorkerPool(store, keep_recent=2)
+    assert await pool.summarize(conversation_id) == 4
+    summary, summary_until = await store.get_summary(conversation_id)
+    assert summary_until == records[3].id
+    assert "メッセージ0" in summary and "メッセージ3" in summary and "メッセージ4" not in summary
+
+    # 次の要約は前回の位置より後のメッセージだけを畳み込む
+    for index in range(6, 9):
+        await store.append_message(conversation_id, MessageRecord("user", f"メッセージ{index}"))
+    assert await pool.summarize(conversation_id) == 3
+    folded, summary_until = await store.get_summary(conversation_id)
+    assert folded.startswith(summary)
+    assert "メッセージ6" in folded and "メッセージ7" not in folded
+    assert await pool.summarize(conversation_id) == 0
+
+
+async def test_worker_runs_scheduled_jobs_once():
+    store = InMemoryConversationStore()
+    conversation_id, _ = await conversation_with(store, 5)
+    pool = SummaryWorkerPool(store, workers=1, trigger_messages=3, keep_recent=1)
+    pool.notify(conversation_id, 3)
+    assert pool.stats.scheduled == 0
+    pool.notify(conversation_id)
+    # 同じ会話のジョブはキューに1件しか入らない
+    assert not pool.schedule(conversation_id)
+    pool.start()
+    try:
+        await pool.join()
+    finally:
+        await pool.close()
+    assert (pool.stats.scheduled, pool.stats.deduplicated, pool.stats.completed) == (1, 1, 1)
+    assert pool.stats.summarized_messages == 4
@@ -14,21 +14,24 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 G = nx.DiGraph()
 
 # agent.pyの構造を反映したノードとエッジを追加
-G.add_nodes_from([("career_counselor", {"label": "キャリアカウンセラー"}), 
+# （マルチエキスパート構成: 相談の要否の判断とITスキル専門家を並列に実行する）
+G.add_nodes_from([("START", {"label": "開始"}),
+                  ("counselor_routing", {"label": "キャリアカウンセラー\n（相談の要否の判断）"}), 
                   ("it_specialist", {"label": "ITスキル専門家"}), 
                   ("response_generation", {"label": "レスポンス生成"}), 
                   ("END", {"label": "終了"})])
 
-G.add_edges_from([("career_counselor", "it_specialist", {"label": "it_consultation=True"}), 
-                  ("career_counselor", "response_generation", {"label": "it_consultation=False"}),
-                  ("it_specialist", "response_generation", {"label": "常に"}),
+G.add_edges_from([("START", "counselor_routing", {"label": "並列"}), 
+                  ("START", "it_specialist", {"label": "並列"}),
+                  ("counselor_routing", "response_generation", {"label": "タイムアウト時は判断なし"}),
+                  ("it_specialist", "response_generation", {"label": "タイムアウト時はアドバイスなし"}),
                   ("response_generation", "END", {"label": "常に"})])
 
 # グラフを描画して保存
 plt.figure(figsize=(10, 6))
 pos = nx.spring_layout(G, seed=42)
 nx.draw(G, pos, with_labels=True, labels=nx.get_node_attributes(G, "label"), 
-       node_color=["lightblue", "lightgreen", "lightyellow", "lightgray"], node_size=2000)
+       node_color=["lightgray", "lightblue", "lightgreen", "lightyellow", "lightgray"], node_size=2000)
 nx.draw_networkx_edge_labels(G, pos, edge_labels=nx.get_edge_attributes(G, "label"))
 plt.axis("off")
 plt.savefig("agent_graph.png", dpi=300, bbox_inches="tight")